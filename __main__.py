@@ -1,5 +1,8 @@
+import sys
+import json
 import argparse
 import qiime2_pipeline
+from typing import List, Dict, Any
 
 
 __VERSION__ = '2.12.0'
@@ -90,6 +93,13 @@ OPTIONAL = [
             'help': 'mode to combine Illumina paired end reads (default: %(default)s)',
         }
     },
+    {
+        'keys': ['--reverse-complement-r2'],
+        'properties': {
+            'action': 'store_true',
+            'help': 'in "pool" mode, reverse-complement R2 so that all pooled reads share the orientation of R1',
+        }
+    },
     {
         'keys': ['--max-expected-error-bases'],
         'properties': {
@@ -100,12 +110,67 @@ OPTIONAL = [
         }
     },
     {
-        'keys': ['--otu-identity'],
+        'keys': ['--feature-store'],
+        'properties': {
+            'type': str,
+            'required': False,
+            'default': 'None',
+            'help': 'project-level directory of denoised samples, only samples not in it yet are trimmed and denoised, then merged into it, for studies adding samples over time (default: %(default)s)',
+        }
+    },
+    {
+        'keys': ['--max-reads-per-sample'],
+        'properties': {
+            'type': int,
+            'required': False,
+            'default': 0,
+            'help': 'randomly subsample deeper samples down to this number of reads (or pairs) before trimming, 0 for no cap (default: %(default)s)',
+        }
+    },
+    {
+        'keys': ['--pilot-fraction'],
         'properties': {
             'type': float,
             'required': False,
-            'default': 0.97,
-            'help': 'sequence identity (range 0, 1) for de novo OTU clustering (default: %(default)s)',
+            'default': 1.0,
+            'help': 'randomly keep this fraction of the reads of each sample, e.g. 0.1 for a quick pilot run (default: %(default)s)',
+        }
+    },
+    {
+        'keys': ['--subsample-seed'],
+        'properties': {
+            'type': int,
+            'required': False,
+            'default': 0,
+            'help': 'random seed of --max-reads-per-sample and --pilot-fraction (default: %(default)s)',
+        }
+    },
+    {
+        'keys': ['--otu-identity'],
+        'properties': {
+            'type': str,
+            'required': False,
+            'default': '0.97',
+            'help': 'sequence identity (range 0, 1) for de novo OTU clustering, comma-separated for several identities (e.g. "0.97,0.99"), each with its downstream analyses in an "otu-<percent>" subdirectory (default: %(default)s)',
+        }
+    },
+    {
+        'keys': ['--otu-clustering'],
+        'properties': {
+            'type': str,
+            'required': False,
+            'default': 'de_novo',
+            'choices': ['de_novo', 'closed_reference', 'open_reference'],
+            'help': 'OTU clustering, "closed_reference" maps each feature to the --reference-sequence-qza and drops unmatched features, "open_reference" clusters the unmatched features de novo (default: %(default)s)',
+        }
+    },
+    {
+        'keys': ['--reference-cache-dir'],
+        'properties': {
+            'type': str,
+            'required': False,
+            'default': '~/.cache/qiime2_pipeline',
+            'help': 'directory of the cached, pre-indexed reference sequences for reference-based OTU clustering, shared across runs (default: %(default)s)',
         }
     },
     {
@@ -121,7 +186,16 @@ OPTIONAL = [
             'type': str,
             'required': False,
             'default': 'None',
-            'help': 'DNA concentration column in the sample sheet for frequency-based decontamination, "None" to skip decontamination (default: %(default)s)',
+            'help': 'DNA concentration column in the sample sheet for frequency-based decontamination, decontamination is skipped if both this and --negative-control-column are "None" (default: %(default)s)',
+        }
+    },
+    {
+        'keys': ['--negative-control-column'],
+        'properties': {
+            'type': str,
+            'required': False,
+            'default': 'None',
+            'help': 'negative control column (true/false) in the sample sheet for prevalence-based decontamination, combined with frequency-based if --dna-concentration-column is also given (default: %(default)s)',
         }
     },
     {
@@ -188,6 +262,24 @@ OPTIONAL = [
             'help': 'maximum number of hits for the consensus of "vsearch" feature-classifier (default: %(default)s)',
         }
     },
+    {
+        'keys': ['--taxonomy-cache'],
+        'properties': {
+            'type': str,
+            'required': False,
+            'default': 'None',
+            'help': 'persistent sqlite file of the taxonomy of previously classified sequences, shared across runs, only sequences not in the cache are classified, "None" for no cache (default: %(default)s)',
+        }
+    },
+    {
+        'keys': ['--taxonomy-cache-max-entries'],
+        'properties': {
+            'type': int,
+            'required': False,
+            'default': 1000000,
+            'help': 'max number of sequences in the taxonomy cache, the least recently used are evicted (default: %(default)s)',
+        }
+    },
     {
         'keys': ['--alpha-metrics'],
         'properties': {
@@ -283,6 +375,183 @@ OPTIONAL = [
             'help': 'number of CPU threads (default: %(default)s)',
         }
     },
+    {
+        'keys': ['--keep-intermediates'],
+        'properties': {
+            'action': 'store_true',
+            'help': 'keep intermediate files in the workdir instead of deleting them once consumed, always on in debug mode',
+        }
+    },
+    {
+        'keys': ['--scratch-dir'],
+        'properties': {
+            'type': str,
+            'required': False,
+            'default': 'None',
+            'help': 'directory to create the temporary workdir in, e.g. node-local NVMe or tmpfs, "None" for the current directory (default: %(default)s)',
+        }
+    },
+    {
+        'keys': ['--input-staging-workers'],
+        'properties': {
+            'type': int,
+            'required': False,
+            'default': 0,
+            'help': 'number of concurrent copies to stage input fastq files into the workdir ahead of processing, 0 to read them from --fq-dir directly (default: %(default)s)',
+        }
+    },
+    {
+        'keys': ['--command-timeout'],
+        'properties': {
+            'type': float,
+            'required': False,
+            'default': 0,
+            'help': 'seconds after which a hung external command is killed and retried, 0 for no timeout (default: %(default)s)',
+        }
+    },
+    {
+        'keys': ['--executor'],
+        'properties': {
+            'type': str,
+            'required': False,
+            'choices': ['serial', 'local', 'queue'],
+            'default': 'serial',
+            'help': 'where per-sample jobs run: "serial" in this process, "local" in a process pool, "queue" on workers polling --queue-dir, started on any node with "python qiime2_pipeline worker" (default: %(default)s)',
+        }
+    },
+    {
+        'keys': ['--executor-workers'],
+        'properties': {
+            'type': int,
+            'required': False,
+            'default': 1,
+            'help': 'number of concurrent jobs of the "local" executor, --threads are shared among them (default: %(default)s)',
+        }
+    },
+    {
+        'keys': ['--queue-dir'],
+        'properties': {
+            'type': str,
+            'required': False,
+            'default': 'None',
+            'help': 'shared directory of the "queue" executor, the workdir must also be on a shared file system (default: %(default)s)',
+        }
+    },
+    {
+        'keys': ['--intermediate-compression'],
+        'properties': {
+            'type': str,
+            'required': False,
+            'default': 'gzip',
+            'choices': ['gzip', 'gzip-1', 'zstd', 'none'],
+            'help': 'compression of intermediate fastq files in the workdir, "gzip-1" for fast gzip level 1, "zstd" requires the zstandard package (default: %(default)s)',
+        }
+    },
+    {
+        'keys': ['--trimming-engine'],
+        'properties': {
+            'type': str,
+            'required': False,
+            'default': 'trim_galore',
+            'choices': ['trim_galore', 'cutadapt', 'streaming'],
+            'help': 'Illumina read trimming, "cutadapt" runs cutadapt directly with all threads and a JSON report per sample instead of FastQC, "streaming" trims in Python with one process per sample and imports the trimmed reads without intermediate files (default: %(default)s)',
+        }
+    },
+    {
+        'keys': ['--fastqc'],
+        'properties': {
+            'action': 'store_true',
+            'help': 'run FastQC on the input reads as a separate stage, e.g. with the "cutadapt" or "streaming" trimming engine, which do not run FastQC',
+        }
+    },
+    {
+        'keys': ['--dada2-shard-column'],
+        'properties': {
+            'type': str,
+            'required': False,
+            'default': 'None',
+            'help': 'sample sheet column (e.g. sequencing run) by which samples are denoised in separate, concurrent DADA2 shards, merged afterwards (default: %(default)s)',
+        }
+    },
+    {
+        'keys': ['--dada2-shard-size'],
+        'properties': {
+            'type': int,
+            'required': False,
+            'default': 0,
+            'help': 'max number of samples per DADA2 shard, within each value of --dada2-shard-column if given, 0 for no limit (default: %(default)s)',
+        }
+    },
+    {
+        'keys': ['--dada2-truncate-length'],
+        'properties': {
+            'type': str,
+            'required': False,
+            'default': '0',
+            'help': 'DADA2 truncation length of illumina reads, "250" for both R1 and R2, "250,200" for R1 and R2, "auto" to choose from the read quality profiles and the R1-R2 overlap, 0 for no truncation (default: %(default)s)',
+        }
+    },
+    {
+        'keys': ['--decontam-engine'],
+        'properties': {
+            'type': str,
+            'required': False,
+            'default': 'qiime',
+            'choices': ['qiime', 'native'],
+            'help': 'decontamination, "native" scores all features at once in memory without qiime commands (default: %(default)s)',
+        }
+    },
+    {
+        'keys': ['--dereplication-engine'],
+        'properties': {
+            'type': str,
+            'required': False,
+            'default': 'qiime',
+            'choices': ['qiime', 'streaming'],
+            'help': 'nanopore read dereplication, "streaming" counts the reads of each sample in its own process without importing them into a qza (default: %(default)s)',
+        }
+    },
+    {
+        'keys': ['--dereplication-min-count'],
+        'properties': {
+            'type': int,
+            'required': False,
+            'default': 1,
+            'help': 'drop dereplicated nanopore sequences with fewer reads across all samples, 2 to drop singletons (default: %(default)s)',
+        }
+    },
+    {
+        'keys': ['--long-read-filter'],
+        'properties': {
+            'type': str,
+            'required': False,
+            'default': 'None',
+            'help': 'filter nanopore or pacbio reads before importing, "default" for the defaults of the platform, or overrides of the defaults, e.g. "min_length=1300,max_length=1700,min_mean_quality=12,max_error_rate=0.08,orient=true" (default: %(default)s)',
+        }
+    },
+    {
+        'keys': ['--plan'],
+        'properties': {
+            'action': 'store_true',
+            'help': 'only print the projected runtime and peak memory of each stage, without running the pipeline',
+        }
+    },
+    {
+        'keys': ['--run-profiles'],
+        'properties': {
+            'type': str,
+            'required': False,
+            'default': 'None',
+            'help': 'comma-separated run-profile.csv files of previous runs to calibrate the cost models of --plan and the time remaining in progress.json (default: %(default)s)',
+        }
+    },
+    {
+        'keys': ['--progress-bar'],
+        'properties': {
+            'action': 'store_true',
+            'help': 'also print the progress of the run, i.e. stage, items done and time remaining, to stderr',
+        }
+    },
     {
         'keys': ['-d', '--debug'],
         'properties': {
@@ -308,6 +577,308 @@ OPTIONAL = [
 ]
 
 
+WORKER_PROG = f'{PROG} worker'
+WORKER_DESCRIPTION = 'Worker of the "queue" executor, runs the jobs submitted to the queue directory'
+WORKER_ARGUMENTS = [
+    {
+        'keys': ['-q', '--queue-dir'],
+        'properties': {
+            'type': str,
+            'required': True,
+            'help': 'shared queue directory, same as --queue-dir of the pipeline',
+        }
+    },
+    {
+        'keys': ['--poll-seconds'],
+        'properties': {
+            'type': float,
+            'required': False,
+            'default': 1.,
+            'help': 'seconds between polls of the queue (default: %(default)s)',
+        }
+    },
+    {
+        'keys': ['--idle-exit-seconds'],
+        'properties': {
+            'type': float,
+            'required': False,
+            'default': 0,
+            'help': 'exit after being idle for this many seconds, 0 to run until killed (default: %(default)s)',
+        }
+    },
+]
+
+
+class WorkerEntryPoint:
+
+    parser: argparse.ArgumentParser
+
+    def main(self, argv):
+        self.parser = argparse.ArgumentParser(
+            prog=WORKER_PROG,
+            description=WORKER_DESCRIPTION,
+            formatter_class=argparse.RawTextHelpFormatter)
+        for item in WORKER_ARGUMENTS:
+            self.parser.add_argument(*item['keys'], **item['properties'])
+        args = self.parser.parse_args(argv)
+        qiime2_pipeline.worker(
+            queue_dir=args.queue_dir,
+            poll_seconds=args.poll_seconds,
+            idle_exit_seconds=args.idle_exit_seconds)
+
+
+def get_main_kwargs(args: argparse.Namespace) -> Dict[str, Any]:
+    return dict(
+        sample_sheet=args.sample_sheet,
+        fq_dir=args.fq_dir,
+        fq1_suffix=args.fq1_suffix,
+        fq2_suffix=args.fq2_suffix,
+        outdir=args.outdir,
+
+        sequencing_platform=args.sequencing_platform,
+
+        clip_r1_5_prime=args.clip_r1_5_prime,
+        clip_r2_5_prime=args.clip_r2_5_prime,
+
+        paired_end_mode=args.paired_end_mode,
+        reverse_complement_r2=args.reverse_complement_r2,
+        max_expected_error_bases=args.max_expected_error_bases,
+        feature_store=args.feature_store,
+
+        max_reads_per_sample=args.max_reads_per_sample,
+        pilot_fraction=args.pilot_fraction,
+        subsample_seed=args.subsample_seed,
+
+        otu_identity=args.otu_identity,
+        otu_clustering=args.otu_clustering,
+        skip_otu=args.skip_otu,
+
+        dna_concentration_column=args.dna_concentration_column,
+        negative_control_column=args.negative_control_column,
+        decontam_threshold=args.decontam_threshold,
+
+        feature_classifier=args.feature_classifier,
+        nb_classifier_qza=args.nb_classifier_qza,
+        classifier_reads_per_batch=args.classifier_reads_per_batch,
+        reference_sequence_qza=args.reference_sequence_qza,
+        reference_taxonomy_qza=args.reference_taxonomy_qza,
+        vsearch_classifier_max_hits=args.vsearch_classifier_max_hits,
+
+        alpha_metrics=args.alpha_metrics,
+        beta_diversity_feature_level=args.beta_diversity_feature_level,
+        heatmap_read_fraction=args.heatmap_read_fraction,
+        n_taxa_barplot=args.n_taxa_barplot,
+        colormap=args.colormap,
+        invert_colors=args.invert_colors,
+        publication_figure=args.publication_figure,
+        skip_differential_abundance=args.skip_differential_abundance,
+        differential_abundance_p_value=args.differential_abundance_p_value,
+        min_abundance_per_group=args.min_abundance_per_group,
+
+        threads=args.threads,
+        debug=args.debug,
+        keep_intermediates=args.keep_intermediates,
+        intermediate_compression=args.intermediate_compression,
+        trimming_engine=args.trimming_engine,
+        fastqc=args.fastqc,
+        dada2_shard_column=args.dada2_shard_column,
+        dada2_shard_size=args.dada2_shard_size,
+        dada2_truncate_length=args.dada2_truncate_length,
+        decontam_engine=args.decontam_engine,
+        dereplication_engine=args.dereplication_engine,
+        dereplication_min_count=args.dereplication_min_count,
+        long_read_filter=args.long_read_filter,
+        reference_cache_dir=args.reference_cache_dir,
+        taxonomy_cache=args.taxonomy_cache,
+        taxonomy_cache_max_entries=args.taxonomy_cache_max_entries,
+        scratch_dir=args.scratch_dir,
+        input_staging_workers=args.input_staging_workers,
+        command_timeout=args.command_timeout,
+        executor=args.executor,
+        executor_workers=args.executor_workers,
+        queue_dir=args.queue_dir,
+        progress_bar=args.progress_bar,
+
+        plan=args.plan,
+        run_profiles=args.run_profiles
+    )
+
+
+BATCH_PROG = f'{PROG} batch'
+BATCH_DESCRIPTION = '''Runs many projects in one process, sharing the threads, the executor and the reference artifacts
+
+The config is a JSON file, either a list of projects or {"defaults": {...}, "projects": [...]},
+each project is an object of the long options of the pipeline without the leading dashes, e.g.
+{"sample-sheet": "a.csv", "fq-dir": "a_fastqs", "outdir": "a_out", "feature-classifier": "vsearch", "skip-otu": true}
+Options shared by the batch (scratch-dir, executor, executor-workers, queue-dir) are taken from the first project'''
+BATCH_ARGUMENTS = [
+    {
+        'keys': ['-c', '--config'],
+        'properties': {
+            'type': str,
+            'required': True,
+            'help': 'path to the JSON config of projects',
+        }
+    },
+    {
+        'keys': ['-t', '--threads'],
+        'properties': {
+            'type': int,
+            'required': False,
+            'default': 4,
+            'help': 'total number of CPU threads shared by all projects (default: %(default)s)',
+        }
+    },
+    {
+        'keys': ['--concurrent-projects'],
+        'properties': {
+            'type': int,
+            'required': False,
+            'default': 2,
+            'help': 'number of projects running at the same time (default: %(default)s)',
+        }
+    },
+    {
+        'keys': ['--summary'],
+        'properties': {
+            'type': str,
+            'required': False,
+            'default': 'batch-summary.csv',
+            'help': 'path to the output CSV of the status of each project (default: %(default)s)',
+        }
+    },
+]
+
+
+class BatchEntryPoint:
+
+    parser: argparse.ArgumentParser
+
+    def main(self, argv):
+        self.parser = argparse.ArgumentParser(
+            prog=BATCH_PROG,
+            description=BATCH_DESCRIPTION,
+            formatter_class=argparse.RawTextHelpFormatter)
+        for item in BATCH_ARGUMENTS:
+            self.parser.add_argument(*item['keys'], **item['properties'])
+        args = self.parser.parse_args(argv)
+
+        print(f'Start running Qiime2 pipeline version {__VERSION__} in batch mode\n', flush=True)
+        qiime2_pipeline.batch(
+            projects=[get_main_kwargs(a) for a in parse_project_configs(args.config)],
+            threads=args.threads,
+            concurrent_projects=args.concurrent_projects,
+            summary_csv=args.summary)
+
+
+def parse_project_configs(config: str) -> List[argparse.Namespace]:
+    """
+    Each project is parsed by the parser of the pipeline, so it gets the same defaults and validation as a single run
+    """
+    with open(config) as fh:
+        data = json.load(fh)
+    if isinstance(data, list):
+        data = {'defaults': {}, 'projects': data}
+    return [parse_project_config({**data.get('defaults', {}), **project}) for project in data['projects']]
+
+
+def parse_project_config(options: Dict[str, Any]) -> argparse.Namespace:
+    entry_point = EntryPoint()
+    entry_point.set_parser()
+    entry_point.add_required_arguments()
+    entry_point.add_optional_arguments()
+
+    argv = []
+    for key, value in options.items():
+        if value is True:
+            argv.append(f'--{key}')
+        elif value is not False:
+            argv += [f'--{key}', str(value)]
+    args = entry_point.parser.parse_args(argv)
+    assert not args.plan, '--plan is not supported in batch or service mode'
+    return args
+
+
+SERVE_PROG = f'{PROG} serve'
+SERVE_DESCRIPTION = '''Runs the pipeline as a local HTTP service, jobs are project configs as in batch mode
+
+POST /jobs                  submit a job, e.g. {"sample-sheet": "a.csv", "fq-dir": "a_fastqs", "fq1-suffix": "_R1.fastq.gz", "outdir": "a_out"}
+GET  /jobs                  list jobs
+GET  /jobs/{id}             status and per-stage progress of a job
+POST /jobs/{id}/cancel      cancel a queued or running job
+GET  /jobs/{id}/outputs     files in the outdir of a job'''
+SERVE_ARGUMENTS = [
+    {
+        'keys': ['--state-dir'],
+        'properties': {
+            'type': str,
+            'required': False,
+            'default': 'qiime2_pipeline_service',
+            'help': 'directory of the persisted jobs and the staged reference artifacts (default: %(default)s)',
+        }
+    },
+    {
+        'keys': ['--host'],
+        'properties': {
+            'type': str,
+            'required': False,
+            'default': '127.0.0.1',
+            'help': 'host to listen on (default: %(default)s)',
+        }
+    },
+    {
+        'keys': ['--port'],
+        'properties': {
+            'type': int,
+            'required': False,
+            'default': 8765,
+            'help': 'port to listen on (default: %(default)s)',
+        }
+    },
+    {
+        'keys': ['--max-concurrent-jobs'],
+        'properties': {
+            'type': int,
+            'required': False,
+            'default': 2,
+            'help': 'number of jobs running at the same time, the others wait in the queue (default: %(default)s)',
+        }
+    },
+    {
+        'keys': ['-t', '--threads'],
+        'properties': {
+            'type': int,
+            'required': False,
+            'default': 4,
+            'help': 'total number of CPU threads shared by the running jobs (default: %(default)s)',
+        }
+    },
+]
+
+
+class ServeEntryPoint:
+
+    parser: argparse.ArgumentParser
+
+    def main(self, argv):
+        self.parser = argparse.ArgumentParser(
+            prog=SERVE_PROG,
+            description=SERVE_DESCRIPTION,
+            formatter_class=argparse.RawTextHelpFormatter)
+        for item in SERVE_ARGUMENTS:
+            self.parser.add_argument(*item['keys'], **item['properties'])
+        args = self.parser.parse_args(argv)
+
+        print(f'Start running Qiime2 pipeline version {__VERSION__} as a service\n', flush=True)
+        qiime2_pipeline.serve(
+            state_dir=args.state_dir,
+            host=args.host,
+            port=args.port,
+            max_concurrent_jobs=args.max_concurrent_jobs,
+            threads=args.threads,
+            parse_config=lambda config: get_main_kwargs(parse_project_config(config)))
+
+
 class EntryPoint:
 
     parser: argparse.ArgumentParser
@@ -338,48 +909,15 @@ class EntryPoint:
     def run(self):
         args = self.parser.parse_args()
         print(f'Start running Qiime2 pipeline version {__VERSION__}\n', flush=True)
-        qiime2_pipeline.main(
-            sample_sheet=args.sample_sheet,
-            fq_dir=args.fq_dir,
-            fq1_suffix=args.fq1_suffix,
-            fq2_suffix=args.fq2_suffix,
-            outdir=args.outdir,
-
-            sequencing_platform=args.sequencing_platform,
-
-            clip_r1_5_prime=args.clip_r1_5_prime,
-            clip_r2_5_prime=args.clip_r2_5_prime,
-
-            paired_end_mode=args.paired_end_mode,
-            max_expected_error_bases=args.max_expected_error_bases,
-
-            otu_identity=args.otu_identity,
-            skip_otu=args.skip_otu,
-
-            dna_concentration_column=args.dna_concentration_column,
-            decontam_threshold=args.decontam_threshold,
-
-            feature_classifier=args.feature_classifier,
-            nb_classifier_qza=args.nb_classifier_qza,
-            classifier_reads_per_batch=args.classifier_reads_per_batch,
-            reference_sequence_qza=args.reference_sequence_qza,
-            reference_taxonomy_qza=args.reference_taxonomy_qza,
-            vsearch_classifier_max_hits=args.vsearch_classifier_max_hits,
-
-            alpha_metrics=args.alpha_metrics,
-            beta_diversity_feature_level=args.beta_diversity_feature_level,
-            heatmap_read_fraction=args.heatmap_read_fraction,
-            n_taxa_barplot=args.n_taxa_barplot,
-            colormap=args.colormap,
-            invert_colors=args.invert_colors,
-            publication_figure=args.publication_figure,
-            skip_differential_abundance=args.skip_differential_abundance,
-            differential_abundance_p_value=args.differential_abundance_p_value,
-            min_abundance_per_group=args.min_abundance_per_group,
-
-            threads=args.threads,
-            debug=args.debug)
+        qiime2_pipeline.main(**get_main_kwargs(args))
 
 
 if __name__ == '__main__':
-    EntryPoint().main()
+    if sys.argv[1:2] == ['worker']:
+        WorkerEntryPoint().main(argv=sys.argv[2:])
+    elif sys.argv[1:2] == ['batch']:
+        BatchEntryPoint().main(argv=sys.argv[2:])
+    elif sys.argv[1:2] == ['serve']:
+        ServeEntryPoint().main(argv=sys.argv[2:])
+    else:
+        EntryPoint().main()
@@ -1,8 +1,21 @@
 import os
 import shutil
+import threading
+from typing import List, Dict, Any, Optional, Callable
+from .batch import ProjectBatch
+from .service import PipelineService, create_server
 from .template import Settings
+from .thread_budget import ThreadBudget, limit_in_process_threads
+from .executor import Executor, FileQueueWorker, get_executor
 from .utils import get_temp_path
+from .planning import PlanPipeline
 from .qiime2_pipeline import Qiime2Pipeline
+from .sample_sheet import TranscribeSampleSheet
+from .truncation import parse_truncate_lengths
+from .long_read_filtering import parse_long_read_filter
+
+
+WORKDIR_LOCK = threading.Lock()  # concurrent projects of a batch must not pick the same temp path
 
 
 def main(
@@ -18,12 +31,20 @@ def main(
         clip_r2_5_prime: int,
 
         paired_end_mode: str,
+        reverse_complement_r2: bool,
         max_expected_error_bases: float,
+        feature_store: str,
 
-        otu_identity: float,
+        max_reads_per_sample: int,
+        pilot_fraction: float,
+        subsample_seed: int,
+
+        otu_identity: str,
+        otu_clustering: str,
         skip_otu: bool,
 
         dna_concentration_column: str,
+        negative_control_column: str,
         decontam_threshold: float,
 
         feature_classifier: str,
@@ -45,23 +66,99 @@ def main(
         min_abundance_per_group: float,
 
         threads: int,
-        debug: bool):
+        debug: bool,
+        keep_intermediates: bool,
+        intermediate_compression: str,
+        trimming_engine: str,
+        fastqc: bool,
+        dada2_shard_column: str,
+        dada2_shard_size: int,
+        dada2_truncate_length: str,
+        decontam_engine: str,
+        dereplication_engine: str,
+        dereplication_min_count: int,
+        long_read_filter: str,
+        reference_cache_dir: str,
+        taxonomy_cache: str,
+        taxonomy_cache_max_entries: int,
+        scratch_dir: str,
+        input_staging_workers: int,
+        command_timeout: float,
+        executor: str,
+        executor_workers: int,
+        queue_dir: str,
+        progress_bar: bool,
+
+        plan: bool,
+        run_profiles: str,
+
+        shared_thread_budget: Optional[ThreadBudget] = None,
+        shared_executor: Optional[Executor] = None):
 
     prefix = os.path.basename(outdir)
     for c in [' ', ',', '(', ')']:
         prefix = prefix.replace(c, '_')
-    workdir = get_temp_path(prefix=f'./{prefix}_')
+    scratch_dir = '.' if scratch_dir.lower() == 'none' else scratch_dir
+    with WORKDIR_LOCK:
+        workdir = get_temp_path(prefix=f'{scratch_dir}/{prefix}_')
+        os.makedirs(workdir)
 
     settings = Settings(
         workdir=workdir,
         outdir=outdir,
         threads=threads,
         debug=debug,
-        mock=False,
-        for_publication=publication_figure)
+        mock=plan,  # planning walks through the pipeline without executing any command
+        for_publication=publication_figure,
+        keep_intermediates=keep_intermediates or debug,
+        intermediate_compression=intermediate_compression,
+        trimming_engine=trimming_engine,
+        run_fastqc=fastqc,
+        dada2_shard_column=None if dada2_shard_column.lower() == 'none' else dada2_shard_column,
+        dada2_shard_size=dada2_shard_size,
+        dada2_truncate_lengths=parse_truncate_lengths(dada2_truncate_length),
+        decontam_engine=decontam_engine,
+        dereplication_engine=dereplication_engine,
+        dereplication_min_count=dereplication_min_count,
+        long_read_filter=parse_long_read_filter(long_read_filter),
+        reference_cache_dir=os.path.expanduser(reference_cache_dir),
+        taxonomy_cache=None if taxonomy_cache.lower() == 'none' else os.path.expanduser(taxonomy_cache),
+        taxonomy_cache_max_entries=taxonomy_cache_max_entries,
+        input_staging_workers=input_staging_workers,
+        command_timeout=command_timeout if command_timeout > 0 else None,
+        executor_backend=executor,
+        executor_workers=executor_workers,
+        queue_dir=None if queue_dir.lower() == 'none' else queue_dir,
+        run_profiles=[] if run_profiles.lower() == 'none' else run_profiles.split(','),
+        progress_display=progress_bar)
+
+    if shared_thread_budget is not None:
+        settings.thread_budget = shared_thread_budget
+    if shared_executor is not None:
+        settings.executor = shared_executor
+
+    os.makedirs(outdir, exist_ok=True)
+
+    if plan:
+        PlanPipeline(settings).main(
+            sample_sheet=TranscribeSampleSheet(settings).main(sample_sheet=sample_sheet),
+            fq_dir=fq_dir,
+            fq1_suffix=fq1_suffix,
+            fq2_suffix=None if fq2_suffix.lower() == 'none' else fq2_suffix,
+            sequencing_platform=sequencing_platform,
+            skip_otu=skip_otu,
+            max_reads_per_sample=max_reads_per_sample,
+            pilot_fraction=pilot_fraction,
+            dna_concentration_column=None if dna_concentration_column.lower() == 'none' else dna_concentration_column,
+            negative_control_column=None if negative_control_column.lower() == 'none' else negative_control_column,
+            feature_classifier=feature_classifier,
+            skip_differential_abundance=skip_differential_abundance,
+            run_profiles=settings.run_profiles)
+        shutil.rmtree(workdir)
+        return
 
-    for d in [workdir, outdir]:
-        os.makedirs(d, exist_ok=True)
+    if shared_thread_budget is None:  # otherwise limited once for the whole batch
+        limit_in_process_threads(threads=threads)
 
     Qiime2Pipeline(settings).main(
         sample_sheet=sample_sheet,
@@ -75,12 +172,20 @@ def main(
         clip_r2_5_prime=clip_r2_5_prime,
 
         paired_end_mode=paired_end_mode,
+        reverse_complement_r2=reverse_complement_r2,
         max_expected_error_bases=max_expected_error_bases,
+        feature_store=None if feature_store.lower() == 'none' else feature_store,
+
+        max_reads_per_sample=max_reads_per_sample,
+        pilot_fraction=pilot_fraction,
+        subsample_seed=subsample_seed,
 
-        otu_identity=otu_identity,
+        otu_identities=[float(i) for i in str(otu_identity).split(',')],
+        otu_clustering=otu_clustering,
         skip_otu=skip_otu,
 
         dna_concentration_column=None if dna_concentration_column.lower() == 'none' else dna_concentration_column,
+        negative_control_column=None if negative_control_column.lower() == 'none' else negative_control_column,
         decontam_threshold=decontam_threshold,
 
         feature_classifier=feature_classifier,
@@ -100,5 +205,104 @@ def main(
         differential_abundance_p_value=differential_abundance_p_value,
         min_abundance_per_group=min_abundance_per_group)
 
+    if shared_executor is None:
+        settings.executor.shutdown()
+
     if not debug:
         shutil.rmtree(workdir)
+
+
+def batch(
+        projects: List[Dict[str, Any]],
+        threads: int,
+        concurrent_projects: int,
+        summary_csv: str):
+    """
+    Args:
+        projects: keyword arguments of main() for each project
+
+        threads: total threads shared by all projects
+
+        concurrent_projects: number of projects running at the same time
+    """
+    first = projects[0]
+    scratch_dir = '.' if first['scratch_dir'].lower() == 'none' else first['scratch_dir']
+    with WORKDIR_LOCK:
+        shared_dir = get_temp_path(prefix=f'{scratch_dir}/batch_shared_')
+        os.makedirs(shared_dir)
+
+    thread_budget = ThreadBudget(total=threads)
+    executor = get_executor(
+        backend=first['executor'],
+        workers=first['executor_workers'],
+        queue_dir=None if first['queue_dir'].lower() == 'none' else first['queue_dir'])
+    limit_in_process_threads(threads=threads)
+
+    def run_project(kwargs: Dict[str, Any]):
+        main(
+            **kwargs,
+            shared_thread_budget=thread_budget,
+            shared_executor=executor)
+
+    for kwargs in projects:
+        kwargs['threads'] = thread_budget.share(n_tasks=concurrent_projects)  # commands of one project, within the shared budget
+
+    try:
+        n_failed = ProjectBatch(
+            run_project=run_project,
+            concurrent_projects=concurrent_projects,
+            shared_dir=f'{shared_dir}/references').main(
+            projects=projects,
+            summary_csv=summary_csv)
+    finally:
+        executor.shutdown()
+        shutil.rmtree(shared_dir)
+
+    if n_failed > 0:  # not an assert, which python -O strips
+        raise RuntimeError(f'{n_failed} of {len(projects)} projects failed, see {summary_csv}')
+
+
+def run_service_job(kwargs: Dict[str, Any]):
+    main(**kwargs)
+
+
+def serve(
+        state_dir: str,
+        host: str,
+        port: int,
+        max_concurrent_jobs: int,
+        threads: int,
+        parse_config: Callable[[Dict[str, Any]], Dict[str, Any]]):
+
+    def parse_job_config(config: Dict[str, Any]) -> Dict[str, Any]:
+        kwargs = parse_config(config)
+        kwargs['threads'] = max(1, threads // max_concurrent_jobs)  # jobs run in separate processes with their own budgets
+        return kwargs
+
+    service = PipelineService(
+        state_dir=state_dir,
+        max_concurrent_jobs=max_concurrent_jobs,
+        job_target=run_service_job)
+    server = create_server(service=service, parse_config=parse_job_config, host=host, port=port)
+
+    service.start()
+    print(f'Serving on http://{host}:{server.server_address[1]}, state in "{state_dir}"', flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.stop()
+
+
+def worker(
+        queue_dir: str,
+        poll_seconds: float,
+        idle_exit_seconds: float):
+
+    n_jobs = FileQueueWorker(
+        queue_dir=queue_dir,
+        poll_seconds=poll_seconds,
+        idle_exit_seconds=idle_exit_seconds if idle_exit_seconds > 0 else None).main()
+    print(f'Worker finished {n_jobs} jobs', flush=True)
@@ -22,6 +22,7 @@ class AlphaRarefaction(Processor):
     def set_max_depth(self):
         tsv = ExportFeatureTable(self.settings).main(feature_table_qza=self.feature_table_qza)
         df = pd.read_csv(tsv, sep='\t', index_col=0)
+        self.register_intermediate(tsv, consumers=[])
         sum_per_column = df.sum()
         self.max_depth = int(max(sum_per_column) * 0.99)  # 99%, slightly lower than the max depth
 
@@ -0,0 +1,107 @@
+import os
+import time
+import traceback
+import pandas as pd
+from os.path import basename
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Callable
+from .template import Logger
+from .staging import copy_atomically
+
+
+REFERENCE_KEYS = [
+    'nb_classifier_qza',
+    'reference_sequence_qza',
+    'reference_taxonomy_qza',
+]
+
+
+class ProjectBatch:
+    """
+    Runs many projects in one process, each in its own thread with its own workdir and outdir
+
+    The projects share one thread budget and one executor, passed in by run_project,
+    so that the external commands of independent projects interleave without oversubscription
+
+    Reference artifacts used by several projects are staged once into the shared directory
+    """
+
+    run_project: Callable[[Dict[str, Any]], None]
+    projects: List[Dict[str, Any]]
+    concurrent_projects: int
+    shared_dir: str
+
+    summary: List[Dict[str, Any]]
+    logger: Logger
+
+    def __init__(
+            self,
+            run_project: Callable[[Dict[str, Any]], None],
+            concurrent_projects: int,
+            shared_dir: str):
+        self.run_project = run_project
+        self.concurrent_projects = concurrent_projects
+        self.shared_dir = shared_dir
+        self.summary = []
+        self.logger = Logger(name=self.__class__.__name__, level=Logger.INFO)
+
+    def main(self, projects: List[Dict[str, Any]], summary_csv: str) -> int:
+        """
+        Returns:
+            number of failed projects
+        """
+        self.projects = projects
+        self.assert_unique_outdirs()
+        self.stage_shared_references()
+
+        with ThreadPoolExecutor(max_workers=self.concurrent_projects, thread_name_prefix='Project') as pool:
+            for row in pool.map(self.run_one, self.projects):
+                self.summary.append(row)
+
+        pd.DataFrame(self.summary).to_csv(summary_csv, index=False)
+        return sum(row['Status'] != 'done' for row in self.summary)
+
+    def assert_unique_outdirs(self):
+        outdirs = [os.path.abspath(p['outdir']) for p in self.projects]
+        assert len(set(outdirs)) == len(outdirs), 'Each project needs its own outdir'
+
+    def stage_shared_references(self):
+        staged = {}
+        for project in self.projects:
+            stage_references(project=project, dstdir=self.shared_dir, staged=staged)
+
+    def run_one(self, project: Dict[str, Any]) -> Dict[str, Any]:
+        start = time.time()
+        try:
+            self.run_project(project)
+            status = 'done'
+        except Exception:
+            self.logger.warning(f'Project "{project["outdir"]}" failed:\n{traceback.format_exc()}')
+            status = 'failed'  # the other projects carry on
+        return {
+            'Outdir': project['outdir'],
+            'Sample Sheet': project['sample_sheet'],
+            'Status': status,
+            'Seconds': round(time.time() - start, 1),
+        }
+
+
+def stage_references(project: Dict[str, Any], dstdir: str, staged: Dict[str, str]):
+    """
+    Points the reference artifacts of the project to their copies in dstdir, copying each distinct file only once
+
+    Args:
+        project: keyword arguments of main(), edited in place
+
+        staged: {source path: staged path} of previous calls, updated in place
+    """
+    for key in REFERENCE_KEYS:
+        path = project.get(key, 'None')
+        if path.lower() == 'none':
+            continue
+        if path not in staged:
+            os.makedirs(dstdir, exist_ok=True)
+            dst = f'{dstdir}/{len(staged) + 1}_{basename(path)}'  # numbered in case of same file names
+            copy_atomically(src=path, dst=dst)
+            staged[path] = dst
+        project[key] = staged[path]
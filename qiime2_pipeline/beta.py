@@ -45,10 +45,12 @@ class BetaDiversity(Processor):
 
         self.feature_table_qza = ImportFeatureTable(self.settings).main(
             feature_table_tsv=self.feature_table_tsv)
+        self.register_intermediate(self.feature_table_qza, consumers=['RunAllBetaMetricsToDistanceMatrixTsvs'])
 
         self.distance_matrix_tsvs = RunAllBetaMetricsToDistanceMatrixTsvs(self.settings).main(
             feature_table_qza=self.feature_table_qza,
             rooted_tree_qza=self.rooted_tree_qza)
+        self.release_intermediates(consumer='RunAllBetaMetricsToDistanceMatrixTsvs')
 
         for tsv in self.distance_matrix_tsvs:
             self.logger.info(f'Run {PCoAProcess.NAME} for {tsv}')
@@ -93,12 +95,15 @@ class RunAllBetaMetricsToDistanceMatrixTsvs(Processor):
         self.rooted_tree_qza = rooted_tree_qza
 
         self.distance_matrix_tsvs = []
+        self.progress_items(total=len(self.METRICS) + len(self.PHYLOGENETIC_METRICS), label='beta metrics')
 
         for metric in self.METRICS:
             self.run_one_beta_metric_to_tsv(metric=metric)
+            self.progress_advance()
 
         for metric in self.PHYLOGENETIC_METRICS:
             self.run_one_beta_phylogenetic_metric_to_tsv(metric=metric)
+            self.progress_advance()
 
         self.move_distance_matrix_tsvs_to_outdir()
 
@@ -132,7 +137,7 @@ class RunAllBetaMetricsToDistanceMatrixTsvs(Processor):
                 old_suffix='',
                 new_suffix='',
                 dstdir=dstdir)
-            self.call(f'mv "{tsv}" "{new}"')
+            self.move(src=tsv, dst=new)
             self.distance_matrix_tsvs[i] = new
 
     def log_error(self, metric: str, exception_instance: Exception):
@@ -171,6 +176,7 @@ class RunOneBetaMetricToTsv(Processor):
     def export(self):
         self.distance_matrix_tsv = ExportBetaDiversity(self.settings).main(
             distance_matrix_qza=self.distance_matrix_qza)
+        self.register_intermediate(self.distance_matrix_qza, consumers=[])
 
 
 class RunOneBetaPhylogeneticMetricToTsv(Processor):
@@ -211,6 +217,7 @@ class RunOneBetaPhylogeneticMetricToTsv(Processor):
     def export(self):
         self.distance_matrix_tsv = ExportBetaDiversity(self.settings).main(
             distance_matrix_qza=self.distance_matrix_qza)
+        self.register_intermediate(self.distance_matrix_qza, consumers=[])
 
 
 
@@ -604,16 +611,22 @@ class RunANOSIMs(Processor):
             self.logger.info('Not enough eligible groups for ANOSIM, skip.')
             return
 
+        n_groups = len(self.eligible_groups)
+        tests_per_tsv = n_groups * (n_groups - 1) // 2 + (1 if n_groups > 2 else 0)
+        self.progress_items(total=len(self.distance_matrix_tsvs) * tests_per_tsv, label='ANOSIM tests')
+
         for tsv in self.distance_matrix_tsvs:
 
             if len(self.eligible_groups) > 2:  # if more than 2 groups, run ANOSIM for all groups
                 self.logger.info(f'Run ANOSIM for {tsv} with all groups: {self.eligible_groups}')
                 self.anosim(distance_matrix_tsv=tsv, groups=self.eligible_groups)
+                self.progress_advance()
 
             for group1, group2 in combinations(self.eligible_groups, 2):
                 groups = [group1, group2]
                 self.logger.info(f'Run pairwise ANOSIM for {tsv} with groups: {groups}')
                 self.anosim(distance_matrix_tsv=tsv, groups=groups)
+                self.progress_advance()
 
         os.makedirs(f'{self.outdir}/beta-diversity', exist_ok=True)
         pd.DataFrame(self.stats_data).to_csv(path_or_buf=f'{self.outdir}/beta-diversity/beta-diversity-anosim.csv', index=False)
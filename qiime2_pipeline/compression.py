@@ -0,0 +1,101 @@
+import os
+import gzip
+import shutil
+from typing import IO
+from .template import Processor
+
+
+GZIP = 'gzip'  # default gzip level, as written by trim_galore --gzip
+GZIP_FAST = 'gzip-1'
+ZSTD = 'zstd'
+NONE = 'none'
+
+POLICIES = [GZIP, GZIP_FAST, ZSTD, NONE]
+
+FASTQ_EXTENSIONS = {
+    GZIP: '.fastq.gz',
+    GZIP_FAST: '.fastq.gz',
+    ZSTD: '.fastq.zst',
+    NONE: '.fastq',
+}
+
+GZIP_LEVELS = {
+    GZIP: 6,
+    GZIP_FAST: 1,
+}
+ZSTD_LEVEL = 3
+
+
+def fastq_extension(policy: str) -> str:
+    assert policy in POLICIES, f'"{policy}" is not a valid intermediate compression policy'
+    return FASTQ_EXTENSIONS[policy]
+
+
+def open_fastq(path: str, mode: str, policy: str = GZIP) -> IO:
+    """
+    Opens a fastq file in binary mode, compression is determined by the file extension
+
+    Args:
+        path: path-like
+
+        mode: 'rb', 'wb' or 'ab'
+
+        policy: only used for the gzip compression level when writing
+    """
+    assert mode in ['rb', 'wb', 'ab']
+
+    if path.endswith('.gz'):
+        level = GZIP_LEVELS.get(policy, GZIP_LEVELS[GZIP])
+        return gzip.open(path, mode, compresslevel=level)
+
+    if path.endswith('.zst'):
+        zstandard = import_zstandard()
+        if mode == 'rb':
+            return zstandard.open(path, mode)
+        return zstandard.open(path, mode, cctx=zstandard.ZstdCompressor(level=ZSTD_LEVEL))
+
+    return open(path, mode)
+
+
+def transcode(src: str, dst: str, policy: str):
+    """
+    Streams src into dst, decoding and encoding by the file extensions
+    """
+    with open_fastq(src, 'rb') as reader:
+        with open_fastq(dst, 'wb', policy=policy) as writer:
+            shutil.copyfileobj(reader, writer, length=1024 ** 2)
+
+
+def recompress(src: str, dst: str, policy: str):
+    transcode(src=src, dst=dst, policy=policy)
+    os.remove(src)
+
+
+def import_zstandard():
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError('The "zstd" intermediate compression requires the "zstandard" Python package: pip install zstandard')
+    return zstandard
+
+
+class StoreIntermediateFastq(Processor):
+    """
+    Moves a fastq written by an external tool (gzip or uncompressed) into its intermediate location,
+    re-encoding it when the intermediate compression policy asks for something the tool cannot write
+    """
+
+    src: str
+    dst: str
+
+    def main(self, src: str, dst: str):
+        self.src = src
+        self.dst = dst
+
+        policy = self.settings.intermediate_compression
+        if policy in [GZIP, NONE]:
+            self.move(src=self.src, dst=self.dst)
+        else:
+            self.logger.info(f'Recompress "{self.src}" to "{self.dst}"')
+            if not self.mock:
+                recompress(src=self.src, dst=self.dst, policy=policy)
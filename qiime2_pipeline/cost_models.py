@@ -0,0 +1,223 @@
+import os
+import gzip
+import numpy as np
+import pandas as pd
+from typing import List, Dict, Any
+
+
+READS = 'reads'  # cost unit: million reads
+FEATURES = 'features'  # cost unit: thousand features
+SAMPLES = 'samples'  # cost unit: samples
+
+READS_PER_MILLION = 1e6
+FEATURES_PER_THOUSAND = 1e3
+
+
+def get_units(samples: int, reads: float, features: float) -> Dict[str, float]:
+    return {
+        SAMPLES: samples,
+        READS: reads / READS_PER_MILLION,
+        FEATURES: features / FEATURES_PER_THOUSAND,
+    }
+
+
+def get_cost_models(
+        sequencing_platform: str,
+        paired_end: bool,
+        skip_otu: bool,
+        feature_classifier: str) -> Dict[str, 'StageCostModel']:
+
+    cost_models = {}
+    for stage, kwargs in DEFAULT_COST_MODELS.items():
+        cost_models[stage] = StageCostModel(**kwargs)
+
+    m = cost_models['generate_asv_otu']
+    factor = PLATFORM_FACTORS[sequencing_platform]
+    if not paired_end:
+        factor *= SINGLE_END_FACTOR
+    if not skip_otu:
+        factor *= OTU_FACTOR
+    m.seconds_per_unit *= factor
+
+    if feature_classifier == 'vsearch':
+        m = cost_models['taxonomic_classification']
+        m.seconds_per_unit *= VSEARCH_CLASSIFIER_FACTOR
+        m.memory_base_mb = VSEARCH_CLASSIFIER_MEMORY_MB
+
+    return cost_models
+
+
+def calibrate_cost_models(cost_models: Dict[str, 'StageCostModel'], run_profiles: List[str]):
+    for csv in run_profiles:
+        df = pd.read_csv(csv)
+        for _, row in df.iterrows():
+            model = cost_models.get(row['Stage'])
+            if model is None:
+                continue
+            units = get_units(
+                samples=row['Samples'],
+                reads=row['Reads'],
+                features=row['Features'])[model.unit]
+            model.add_observation(
+                units=units,
+                threads=row['Threads'],
+                seconds=row['Seconds'],
+                peak_memory_mb=row['Peak Memory (MB)'])
+
+
+def estimate_reads(fq: str, sampled_bytes: int) -> int:
+    """
+    Extrapolates the number of reads from the records in the first sampled_bytes of the file,
+    which is exact if the file is not larger than sampled_bytes
+    """
+    total_bytes = os.path.getsize(fq)
+    with open(fq, 'rb') as raw:
+        fh = gzip.GzipFile(fileobj=raw) if fq.endswith('.gz') else raw
+        lines = 0
+        for _ in fh:
+            lines += 1
+            if lines % 4 == 0 and raw.tell() >= sampled_bytes:
+                break
+        consumed_bytes = raw.tell()
+
+    records = lines // 4
+    if consumed_bytes >= total_bytes:
+        return records
+    return int(records * total_bytes / consumed_bytes)
+
+
+def expected_features(samples: int, platform: str) -> int:
+    # features (ASVs or OTUs) accumulate sublinearly with samples because most are shared
+    return int(FEATURES_PER_SAMPLE[platform] * samples ** FEATURE_ACCUMULATION_EXPONENT)
+
+
+def estimate_stage_seconds(
+        cost_models: Dict[str, 'StageCostModel'],
+        stages: List[str],
+        units: Dict[str, float],
+        threads: int) -> Dict[str, float]:
+    ret = {}
+    for stage in stages:
+        model = cost_models[stage]
+        ret[stage] = model.seconds(units=units[model.unit], threads=threads)
+    return ret
+
+
+def format_seconds(seconds: float) -> str:
+    seconds = int(round(seconds))
+    return f'{seconds // 3600}:{seconds % 3600 // 60:02}:{seconds % 60:02}'
+
+
+class StageCostModel:
+    """
+    seconds = (base + seconds_per_unit * units) * ((1 - parallel_fraction) + parallel_fraction / threads)
+    memory = memory_base_mb + memory_mb_per_unit * units
+
+    seconds_per_unit and memory_mb_per_unit are replaced by the medians of
+    the values back-calculated from observed run profiles
+    """
+
+    unit: str
+    base_seconds: float
+    seconds_per_unit: float
+    parallel_fraction: float
+    memory_base_mb: float
+    memory_mb_per_unit: float
+
+    observed_seconds_per_unit: List[float]
+    observed_memory_mb_per_unit: List[float]
+
+    def __init__(
+            self,
+            unit: str,
+            base_seconds: float,
+            seconds_per_unit: float,
+            parallel_fraction: float,
+            memory_base_mb: float,
+            memory_mb_per_unit: float):
+
+        self.unit = unit
+        self.base_seconds = base_seconds
+        self.seconds_per_unit = seconds_per_unit
+        self.parallel_fraction = parallel_fraction
+        self.memory_base_mb = memory_base_mb
+        self.memory_mb_per_unit = memory_mb_per_unit
+
+        self.observed_seconds_per_unit = []
+        self.observed_memory_mb_per_unit = []
+
+    @property
+    def n_observations(self) -> int:
+        return len(self.observed_seconds_per_unit)
+
+    def add_observation(
+            self,
+            units: float,
+            threads: int,
+            seconds: float,
+            peak_memory_mb: Any):
+
+        if units <= 0:
+            return
+
+        single_thread_seconds = seconds / self.__thread_scaling(threads=threads)
+        self.observed_seconds_per_unit.append(
+            max(single_thread_seconds - self.base_seconds, 0) / units)
+        self.seconds_per_unit = float(np.median(self.observed_seconds_per_unit))
+
+        if pd.notna(peak_memory_mb):
+            self.observed_memory_mb_per_unit.append(
+                max(peak_memory_mb - self.memory_base_mb, 0) / units)
+            self.memory_mb_per_unit = float(np.median(self.observed_memory_mb_per_unit))
+
+    def seconds(self, units: float, threads: int) -> float:
+        return (self.base_seconds + self.seconds_per_unit * units) * self.__thread_scaling(threads=threads)
+
+    def peak_memory_mb(self, units: float) -> float:
+        return self.memory_base_mb + self.memory_mb_per_unit * units
+
+    def __thread_scaling(self, threads: int) -> float:
+        return (1 - self.parallel_fraction) + self.parallel_fraction / max(threads, 1)
+
+
+FEATURES_PER_SAMPLE = {
+    'illumina': 150,
+    'pacbio': 100,
+    'nanopore': 400,
+}
+FEATURE_ACCUMULATION_EXPONENT = 0.75
+
+PLATFORM_FACTORS = {
+    'illumina': 1.,
+    'pacbio': 4.,
+    'nanopore': 8.,
+}
+SINGLE_END_FACTOR = 0.6
+OTU_FACTOR = 1.1
+VSEARCH_CLASSIFIER_FACTOR = 0.3
+VSEARCH_CLASSIFIER_MEMORY_MB = 2000.
+
+# rough defaults on a 16S V3-V4 project, to be replaced by calibration with run profiles
+DEFAULT_COST_MODELS: Dict[str, Dict[str, Any]] = {
+    'transcribe_sample_sheet': dict(unit=SAMPLES, base_seconds=1, seconds_per_unit=0.01, parallel_fraction=0, memory_base_mb=150, memory_mb_per_unit=0),
+    'preflight': dict(unit=READS, base_seconds=1, seconds_per_unit=3, parallel_fraction=0.9, memory_base_mb=200, memory_mb_per_unit=0),
+    'stage_inputs': dict(unit=SAMPLES, base_seconds=1, seconds_per_unit=0, parallel_fraction=0, memory_base_mb=50, memory_mb_per_unit=0),  # copies run in the background
+    'raw_read_counts': dict(unit=READS, base_seconds=1, seconds_per_unit=5, parallel_fraction=0, memory_base_mb=150, memory_mb_per_unit=0),
+    'subsample_reads': dict(unit=READS, base_seconds=1, seconds_per_unit=5, parallel_fraction=0.9, memory_base_mb=150, memory_mb_per_unit=0),
+    'fastqc': dict(unit=READS, base_seconds=5, seconds_per_unit=30, parallel_fraction=0.9, memory_base_mb=500, memory_mb_per_unit=0),
+    'set_colors': dict(unit=SAMPLES, base_seconds=1, seconds_per_unit=0, parallel_fraction=0, memory_base_mb=150, memory_mb_per_unit=0),
+    'generate_asv_otu': dict(unit=READS, base_seconds=300, seconds_per_unit=600, parallel_fraction=0.9, memory_base_mb=2000, memory_mb_per_unit=100),
+    'decontamination': dict(unit=FEATURES, base_seconds=120, seconds_per_unit=10, parallel_fraction=0, memory_base_mb=1500, memory_mb_per_unit=50),
+    'taxonomic_classification': dict(unit=FEATURES, base_seconds=300, seconds_per_unit=120, parallel_fraction=0.9, memory_base_mb=12000, memory_mb_per_unit=200),
+    'feature_labeling': dict(unit=FEATURES, base_seconds=120, seconds_per_unit=10, parallel_fraction=0, memory_base_mb=1500, memory_mb_per_unit=20),
+    'taxon_table': dict(unit=FEATURES, base_seconds=5, seconds_per_unit=5, parallel_fraction=0, memory_base_mb=300, memory_mb_per_unit=20),
+    'alpha_diversity': dict(unit=SAMPLES, base_seconds=60, seconds_per_unit=0.5, parallel_fraction=0, memory_base_mb=1500, memory_mb_per_unit=1),
+    'alpha_rarefaction': dict(unit=SAMPLES, base_seconds=60, seconds_per_unit=2, parallel_fraction=0, memory_base_mb=1500, memory_mb_per_unit=2),
+    'phylogeny_and_beta_diversity': dict(unit=FEATURES, base_seconds=400, seconds_per_unit=120, parallel_fraction=0.5, memory_base_mb=2000, memory_mb_per_unit=200),
+    'plot_heatmaps': dict(unit=SAMPLES, base_seconds=20, seconds_per_unit=0.5, parallel_fraction=0, memory_base_mb=500, memory_mb_per_unit=2),
+    'plot_venn_diagrams': dict(unit=SAMPLES, base_seconds=10, seconds_per_unit=0.1, parallel_fraction=0, memory_base_mb=300, memory_mb_per_unit=0),
+    'taxon_barplot': dict(unit=SAMPLES, base_seconds=20, seconds_per_unit=0.5, parallel_fraction=0, memory_base_mb=500, memory_mb_per_unit=1),
+    'lefse': dict(unit=SAMPLES, base_seconds=120, seconds_per_unit=2, parallel_fraction=0, memory_base_mb=800, memory_mb_per_unit=2),
+    'differential_abundance': dict(unit=SAMPLES, base_seconds=60, seconds_per_unit=1, parallel_fraction=0, memory_base_mb=500, memory_mb_per_unit=1),
+    'collect_log_files': dict(unit=SAMPLES, base_seconds=1, seconds_per_unit=0, parallel_fraction=0, memory_base_mb=50, memory_mb_per_unit=0),
+}
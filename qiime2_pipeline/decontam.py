@@ -1,8 +1,24 @@
+import numpy as np
 import pandas as pd
-from typing import Tuple
+from matplotlib.figure import Figure
+from scipy import stats
+from typing import Tuple, Optional
 from .template import Processor
 from .utils import get_temp_path
-from .exporting import ExportFeatureTable
+from .fasta import FastaParser, FastaWriter
+from .importing import ImportFeatureTable, ImportFeatureSequence
+from .exporting import ExportFeatureTable, ExportFeatureSequence
+
+
+QIIME = 'qiime'
+NATIVE = 'native'
+DECONTAM_ENGINES = [QIIME, NATIVE]
+
+FREQUENCY = 'frequency'
+PREVALENCE = 'prevalence'
+COMBINED = 'combined'
+
+DECONTAM_SCORES_TSV = 'decontam-scores.tsv'
 
 
 class Decontam(Processor):
@@ -10,10 +26,12 @@ class Decontam(Processor):
     feature_table_qza: str
     feature_sequence_qza: str
     sample_sheet: str
-    dna_concentration_column: str
+    dna_concentration_column: Optional[str]
+    negative_control_column: Optional[str]
     decontam_threshold: float
 
-    dna_concentration_tsv: str
+    method: str
+    metadata_tsv: str
     decontam_scores_qza: str
 
     decontam_table_qza: str
@@ -24,16 +42,32 @@ class Decontam(Processor):
             feature_table_qza: str,
             feature_sequence_qza: str,
             sample_sheet: str,
-            dna_concentration_column: str,
+            dna_concentration_column: Optional[str],
+            negative_control_column: Optional[str],
             decontam_threshold: float) -> Tuple[str, str]:
 
         self.feature_table_qza = feature_table_qza
         self.feature_sequence_qza = feature_sequence_qza
         self.sample_sheet = sample_sheet
         self.dna_concentration_column = dna_concentration_column
+        self.negative_control_column = negative_control_column
         self.decontam_threshold = decontam_threshold
 
-        self.write_dna_concentration_tsv()
+        assert self.settings.decontam_engine in DECONTAM_ENGINES, f'"{self.settings.decontam_engine}" is not a valid decontam engine'
+        self.method = get_decontam_method(
+            dna_concentration_column=self.dna_concentration_column,
+            negative_control_column=self.negative_control_column)
+
+        if self.settings.decontam_engine == NATIVE:
+            return NativeDecontam(self.settings).main(
+                feature_table_qza=self.feature_table_qza,
+                feature_sequence_qza=self.feature_sequence_qza,
+                sample_sheet=self.sample_sheet,
+                dna_concentration_column=self.dna_concentration_column,
+                negative_control_column=self.negative_control_column,
+                decontam_threshold=self.decontam_threshold)
+
+        self.write_metadata_tsv()
         self.identify_scores()
         self.visualize_score_histogram()
         self.remove_from_feature_table()
@@ -43,30 +77,37 @@ class Decontam(Processor):
 
         return self.decontam_table_qza, self.decontam_sequence_qza
 
-    def write_dna_concentration_tsv(self):
-        if self.sample_sheet.endswith('.csv'):
-            df = pd.read_csv(self.sample_sheet, index_col=0)
-        else:
-            df = pd.read_csv(self.sample_sheet, sep='\t', index_col=0)
-
-        df = df[[self.dna_concentration_column]]  # keep only one column needed
+    def write_metadata_tsv(self):
+        df = read_sample_sheet(self.sample_sheet)
 
-        # these two column names are required by qiime2 decontam-identify
-        df.index.name = 'sample-id'
-        df = df.rename(columns={self.dna_concentration_column: 'dna-concentration'})
+        # these column names are required by qiime2 decontam-identify
+        metadata = pd.DataFrame(index=df.index)
+        metadata.index.name = 'sample-id'
+        if self.dna_concentration_column is not None:
+            metadata['dna-concentration'] = df[self.dna_concentration_column]
+        if self.negative_control_column is not None:
+            metadata['negative-control'] = np.where(is_negative_control(df[self.negative_control_column]), 'true', 'false')
 
-        self.dna_concentration_tsv = f'{self.workdir}/dna-concentration.tsv'
-        df.to_csv(self.dna_concentration_tsv, sep='\t', index=True)
+        self.metadata_tsv = f'{self.workdir}/decontam-metadata.tsv'
+        metadata.to_csv(self.metadata_tsv, sep='\t', index=True)
 
     def identify_scores(self):
         self.decontam_scores_qza = f'{self.workdir}/decontam-scores.qza'
         log = f'{self.outdir}/qiime-quality-control-decontam-identify.log'
-        cmd = self.CMD_LINEBREAK.join([
+        args = [
             'qiime quality-control decontam-identify',
             f'--i-table {self.feature_table_qza}',
-            f'--m-metadata-file {self.dna_concentration_tsv}',
-            f'--p-method frequency',
-            f'--p-freq-concentration-column "dna-concentration"',
+            f'--m-metadata-file {self.metadata_tsv}',
+            f'--p-method {self.method}',
+        ]
+        if self.dna_concentration_column is not None:
+            args.append(f'--p-freq-concentration-column "dna-concentration"')
+        if self.negative_control_column is not None:
+            args += [
+                f'--p-prev-control-column "negative-control"',
+                f'--p-prev-control-indicator "true"',
+            ]
+        cmd = self.CMD_LINEBREAK.join(args + [
             f'--o-decontam-scores {self.decontam_scores_qza}',
             f'1>> "{log}"',
             f'2>> "{log}"'
@@ -100,7 +141,7 @@ class Decontam(Processor):
             f'2>> "{log}"'
         ])
         self.call(cmd)
-    
+
     def remove_from_feature_sequences(self):
         self.decontam_sequence_qza = f'{self.workdir}/decontam-feature-sequence.qza'
         log = f'{self.outdir}/qiime-feature-table-filter-seqs.log'
@@ -117,22 +158,239 @@ class Decontam(Processor):
     def print_summary(self):
         before = CountFeatures(self.settings).main(feature_table_qza=self.feature_table_qza)
         after = CountFeatures(self.settings).main(feature_table_qza=self.decontam_table_qza)
-        msg = f'''\
-Before decontamination: {before} features
-After decontamination: {after} features
-Decontamination removed {before - after} features
-Decontamination removed {((before - after) / before) * 100:.2f}% of features
-'''
-        self.logger.info(msg)
+        self.logger.info(get_summary(before=before, after=after))
+
+
+class NativeDecontam(Processor):
+    """
+    The decontam scores of all features computed at once with numpy,
+    instead of the four qiime commands and the two table exports for counting features
+
+    Frequency: for the samples where a feature is present, the log relative frequency is regressed against the log DNA concentration,
+    comparing the contaminant model (slope -1, frequency inversely proportional to concentration) with the non-contaminant model (slope 0),
+    the score is the F-distribution CDF of the ratio of their residual sums of squares, the same as decontam isContaminantFrequency
+
+    Prevalence: the one-sided Fisher's exact test of a feature being more prevalent in the negative controls than in the true samples
+
+    Combined: both scores merged by Fisher's method
+
+    Features with score < threshold are removed, features without a score (e.g. present in fewer than 2 samples) are kept
+    """
+
+    feature_table_qza: str
+    feature_sequence_qza: str
+    sample_sheet: str
+    dna_concentration_column: Optional[str]
+    negative_control_column: Optional[str]
+    decontam_threshold: float
+
+    feature_table: pd.DataFrame
+    scores: pd.DataFrame
+
+    decontam_table_qza: str
+    decontam_sequence_qza: str
+
+    def main(
+            self,
+            feature_table_qza: str,
+            feature_sequence_qza: str,
+            sample_sheet: str,
+            dna_concentration_column: Optional[str],
+            negative_control_column: Optional[str],
+            decontam_threshold: float) -> Tuple[str, str]:
+
+        self.feature_table_qza = feature_table_qza
+        self.feature_sequence_qza = feature_sequence_qza
+        self.sample_sheet = sample_sheet
+        self.dna_concentration_column = dna_concentration_column
+        self.negative_control_column = negative_control_column
+        self.decontam_threshold = decontam_threshold
+
+        self.read_feature_table()
+        self.set_scores()
+        self.plot_score_histogram()
+        self.remove_from_feature_table()
+        self.remove_from_feature_sequences()
+
+        self.logger.info(get_summary(before=len(self.feature_table), after=int((~self.scores['Contaminant']).sum())))
+
+        return self.decontam_table_qza, self.decontam_sequence_qza
+
+    def read_feature_table(self):
+        tsv = ExportFeatureTable(self.settings).main(feature_table_qza=self.feature_table_qza)
+        self.feature_table = pd.DataFrame() if self.mock else pd.read_csv(tsv, sep='\t', index_col=0)
+        self.feature_table.index = self.feature_table.index.astype(str)
+        self.register_intermediate(tsv, consumers=[])
+
+    def set_scores(self):
+        df = read_sample_sheet(self.sample_sheet)
+        df.index = df.index.astype(str)
+        samples = [str(s) for s in self.feature_table.columns]
+        counts = self.feature_table.to_numpy(dtype=np.float64)
+
+        self.scores = pd.DataFrame(index=self.feature_table.index)
+        self.scores.index.name = 'Feature ID'
+        if self.dna_concentration_column is not None:
+            self.scores['Frequency Score'] = frequency_scores(
+                counts=counts,
+                concentrations=df.loc[samples, self.dna_concentration_column].to_numpy(dtype=np.float64))
+        if self.negative_control_column is not None:
+            self.scores['Prevalence Score'] = prevalence_scores(
+                counts=counts,
+                negative_controls=is_negative_control(df.loc[samples, self.negative_control_column]).to_numpy())
+
+        if len(self.scores.columns) == 2:
+            self.scores['Score'] = combine_scores(
+                frequency=self.scores['Frequency Score'].to_numpy(),
+                prevalence=self.scores['Prevalence Score'].to_numpy())
+        else:
+            self.scores['Score'] = self.scores.iloc[:, 0]
+        self.scores['Contaminant'] = self.scores['Score'] < self.decontam_threshold  # NaN is never a contaminant
+
+        self.scores.to_csv(f'{self.outdir}/{DECONTAM_SCORES_TSV}', sep='\t')
+
+    def plot_score_histogram(self):
+        # a private figure rather than the global pyplot state, which concurrent pipelines in one process would share
+        fig = Figure(figsize=(12 / 2.54, 8 / 2.54), dpi=300)
+        ax = fig.add_subplot()
+        bins = np.linspace(0, 1, 51)
+        for contaminant, color, label in [(True, 'tab:red', 'Contaminant'), (False, 'tab:blue', 'Kept')]:
+            scores = self.scores.loc[self.scores['Contaminant'] == contaminant, 'Score'].dropna()
+            ax.hist(scores, bins=bins, color=color, label=label)
+        ax.axvline(self.decontam_threshold, color='black', linestyle='--', linewidth=1)
+        ax.set_xlabel('Decontam Score')
+        ax.set_ylabel('Features')
+        ax.legend(frameon=False)
+        fig.tight_layout()
+        for ext in ['pdf', 'png']:
+            fig.savefig(f'{self.outdir}/decontam-score-histogram.{ext}', dpi=300)
+
+    def remove_from_feature_table(self):
+        tsv = f'{self.workdir}/decontam-feature-table.tsv'
+        df = self.feature_table.loc[~self.scores['Contaminant']]
+        df.index.name = '#OTU ID'
+        df.to_csv(tsv, sep='\t')
+        self.decontam_table_qza = ImportFeatureTable(self.settings).main(feature_table_tsv=tsv)
+        self.register_intermediate(tsv, consumers=[])
+
+    def remove_from_feature_sequences(self):
+        src = ExportFeatureSequence(self.settings).main(feature_sequence_qza=self.feature_sequence_qza)
+        dst = f'{self.workdir}/decontam-feature-sequence.fa'
+        kept = set(self.scores.index[~self.scores['Contaminant']])
+        if not self.mock:
+            with FastaParser(src) as parser, FastaWriter(dst) as writer:
+                for header, seq in parser:
+                    if header.split()[0] in kept:
+                        writer.write(header, seq)
+        self.decontam_sequence_qza = ImportFeatureSequence(self.settings).main(feature_sequence_fa=dst)
+        for path in [src, dst]:
+            self.register_intermediate(path, consumers=[])
 
 
 class CountFeatures(Processor):
 
     feature_table_qza: str
-    
+
     def main(self, feature_table_qza: str) -> int:
         self.feature_table_qza = feature_table_qza
 
         tsv = ExportFeatureTable(self.settings).main(feature_table_qza=self.feature_table_qza)
         df = pd.read_csv(tsv, sep='\t')
+        self.register_intermediate(tsv, consumers=[])
         return len(df)
+
+
+def get_decontam_method(dna_concentration_column: Optional[str], negative_control_column: Optional[str]) -> str:
+    assert dna_concentration_column is not None or negative_control_column is not None, \
+        'Decontam needs a DNA concentration column or a negative control column'
+    if negative_control_column is None:
+        return FREQUENCY
+    if dna_concentration_column is None:
+        return PREVALENCE
+    return COMBINED
+
+
+def read_sample_sheet(sample_sheet: str) -> pd.DataFrame:
+    if sample_sheet.endswith('.csv'):
+        return pd.read_csv(sample_sheet, index_col=0)
+    else:
+        return pd.read_csv(sample_sheet, sep='\t', index_col=0)
+
+
+def is_negative_control(values: pd.Series) -> pd.Series:
+    """
+    True, yes, 1 (case-insensitive) mark a negative control sample
+    """
+    return values.astype(str).str.strip().str.lower().isin(['true', 'yes', 'y', '1', '1.0'])
+
+
+def frequency_scores(counts: np.ndarray, concentrations: np.ndarray) -> np.ndarray:
+    """
+    Args:
+        counts: (features, samples)
+        concentrations: DNA concentration of each sample, samples without a positive concentration are ignored
+
+    Returns:
+        score of each feature, NaN if present in fewer than 2 samples
+    """
+    valid = (concentrations > 0) & (counts.sum(axis=0) > 0)
+    counts, concentrations = counts[:, valid], concentrations[valid]
+
+    frequencies = counts / counts.sum(axis=0)
+    present = frequencies > 0
+    n = present.sum(axis=1)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        log_f = np.log(np.where(present, frequencies, 1.))
+        log_c = np.log(concentrations)[np.newaxis, :]
+
+        def residual_sum_of_squares(y: np.ndarray) -> np.ndarray:
+            mean = (y * present).sum(axis=1) / n
+            return (((y - mean[:, np.newaxis]) ** 2) * present).sum(axis=1)
+
+        ss0 = residual_sum_of_squares(log_f)  # non-contaminant, log_f = b
+        ss1 = residual_sum_of_squares(log_f + log_c)  # contaminant, log_f = -log_c + b
+        dof = n - 1
+        scores = stats.f.cdf(ss1 / ss0, dof, dof)
+
+    scores[n < 2] = np.nan
+    return scores
+
+
+def prevalence_scores(counts: np.ndarray, negative_controls: np.ndarray) -> np.ndarray:
+    """
+    Args:
+        counts: (features, samples)
+        negative_controls: boolean of each sample
+
+    Returns:
+        one-sided Fisher's exact test p value of each feature, NaN if there is no negative control or no true sample
+    """
+    present = counts > 0
+    n_samples = present.shape[1]
+    n_controls = int(negative_controls.sum())
+    n_present = present.sum(axis=1)
+    n_present_in_controls = present[:, negative_controls].sum(axis=1)
+
+    scores = stats.hypergeom.sf(n_present_in_controls - 1, n_samples, n_present, n_controls)
+    if n_controls == 0 or n_controls == n_samples:
+        scores[:] = np.nan
+    return scores
+
+
+def combine_scores(frequency: np.ndarray, prevalence: np.ndarray) -> np.ndarray:
+    """
+    Fisher's method, the available one of the two scores if the other is NaN
+    """
+    with np.errstate(divide='ignore'):
+        combined = stats.chi2.sf(-2 * np.log(frequency * prevalence), 4)
+    return np.where(np.isnan(frequency), prevalence, np.where(np.isnan(prevalence), frequency, combined))
+
+
+def get_summary(before: int, after: int) -> str:
+    return f'''\
+Before decontamination: {before} features
+After decontamination: {after} features
+Decontamination removed {before - after} features
+Decontamination removed {((before - after) / max(before, 1)) * 100:.2f}% of features
+'''
@@ -0,0 +1,161 @@
+import os
+import biom
+import hashlib
+import pandas as pd
+from biom.util import biom_open
+from scipy.sparse import coo_matrix
+from typing import List, Dict, Tuple
+from .template import Processor
+from .compression import open_fastq
+from .importing import ImportBiomFeatureTable, ImportFeatureSequence
+
+
+QIIME = 'qiime'
+STREAMING = 'streaming'
+DEREPLICATION_ENGINES = [QIIME, STREAMING]
+
+
+class StreamingDereplication(Processor):
+    """
+    Dereplicates the raw reads of each sample in its own process, as a replacement of
+    'qiime vsearch dereplicate-sequences' for millions of long reads
+    """
+
+    sample_sheet: str
+    fq_dir: str
+    fq_suffix: str
+    min_count: int
+
+    sample_names: List[str]
+    sample_fas: List[str]
+    counts: List[Dict[str, int]]
+    feature_ids: List[str]
+
+    feature_table_biom: str
+    feature_sequence_fa: str
+    feature_table_qza: str
+    feature_sequence_qza: str
+
+    def main(
+            self,
+            sample_sheet: str,
+            fq_dir: str,
+            fq_suffix: str,
+            min_count: int) -> Tuple[str, str]:
+
+        self.sample_sheet = sample_sheet
+        self.fq_dir = fq_dir
+        self.fq_suffix = fq_suffix
+        self.min_count = min_count
+
+        assert self.min_count >= 1, f'Min count {self.min_count} is not >= 1'
+
+        self.sample_names = [str(n) for n in pd.read_csv(self.sample_sheet, index_col=0).index]
+        self.feature_table_biom = f'{self.workdir}/dereplicated-table.biom'
+        self.feature_sequence_fa = f'{self.workdir}/dereplicated-sequence.fa'
+
+        self.dereplicate_samples()
+        self.set_feature_ids()
+        self.write_feature_table_biom()
+        self.write_feature_sequence_fa()
+        self.import_qzas()
+
+        return self.feature_table_qza, self.feature_sequence_qza
+
+    def dereplicate_samples(self):
+        os.makedirs(f'{self.workdir}/dereplicated_samples', exist_ok=True)
+        self.sample_fas = [f'{self.workdir}/dereplicated_samples/{name}.fa' for name in self.sample_names]
+        kwargs_list = [
+            dict(fq=f'{self.fq_dir}/{name}{self.fq_suffix}', fa=fa)
+            for name, fa in zip(self.sample_names, self.sample_fas)
+        ]
+        for kwargs in kwargs_list:
+            self.logger.info(f'Dereplicate "{kwargs["fq"]}" into "{kwargs["fa"]}"')
+        for fa in self.sample_fas:
+            self.register_intermediate(fa, consumers=['write_feature_sequence_fa'])
+        if self.mock:
+            self.counts = [{} for _ in self.sample_names]
+            return
+
+        self.counts = self.map_in_processes(dereplicate_one_sample, kwargs_list, label='samples')
+
+    def set_feature_ids(self):
+        totals = {}
+        for counts in self.counts:
+            for id_, n in counts.items():
+                totals[id_] = totals.get(id_, 0) + n
+        self.feature_ids = sorted(
+            (id_ for id_, n in totals.items() if n >= self.min_count),
+            key=lambda id_: -totals[id_])  # most abundant first, as vsearch
+
+        n_reads = sum(totals.values())
+        n_kept_reads = sum(totals[id_] for id_ in self.feature_ids)
+        self.logger.info(f'{len(totals)} unique sequences of {n_reads} reads, {len(self.feature_ids)} sequences of {n_kept_reads} reads with count >= {self.min_count}')
+        if not self.mock:
+            assert len(self.feature_ids) > 0, f'No sequence with count >= {self.min_count}'
+
+    def write_feature_table_biom(self):
+        row_of = {id_: i for i, id_ in enumerate(self.feature_ids)}
+        rows, cols, data = [], [], []
+        for col, counts in enumerate(self.counts):
+            for id_, n in counts.items():
+                row = row_of.get(id_)
+                if row is not None:  # below min_count
+                    rows.append(row)
+                    cols.append(col)
+                    data.append(n)
+
+        matrix = coo_matrix((data, (rows, cols)), shape=(len(self.feature_ids), len(self.sample_names)))
+        table = biom.Table(matrix, observation_ids=self.feature_ids, sample_ids=self.sample_names)
+        with biom_open(self.feature_table_biom, 'w') as fh:
+            table.to_hdf5(fh, generated_by='qiime2_pipeline')
+
+    def write_feature_sequence_fa(self):
+        kept = set(self.feature_ids)
+        with open(self.feature_sequence_fa, 'w') as writer:
+            for fa in self.sample_fas:
+                if self.mock:
+                    continue
+                with open(fa) as reader:
+                    for header in reader:
+                        seq = reader.readline()
+                        id_ = header[1:].rstrip()
+                        if id_ in kept:
+                            writer.write(header + seq)
+                            kept.remove(id_)
+        self.release_intermediates(consumer='write_feature_sequence_fa')
+        self.register_intermediate(self.feature_sequence_fa, consumers=['import_qzas'])
+
+    def import_qzas(self):
+        self.feature_table_qza = ImportBiomFeatureTable(self.settings).main(
+            feature_table_biom=self.feature_table_biom)
+        self.feature_sequence_qza = ImportFeatureSequence(self.settings).main(
+            feature_sequence_fa=self.feature_sequence_fa)
+        self.release_intermediates(consumer='import_qzas')
+
+
+def dereplicate_one_sample(fq: str, fa: str) -> Dict[str, int]:
+    """
+    The job function of one sample, writes each unique sequence once to fa, on one line
+
+    Returns:
+        {SHA1 of the upper-case sequence: number of reads}
+    """
+    seq_counts = {}
+    with open_fastq(fq, 'rb') as reader:
+        while True:
+            header = reader.readline()
+            if not header:
+                break
+            seq = reader.readline().rstrip(b'\r\n').upper()
+            reader.readline()
+            reader.readline()
+            seq_counts[seq] = seq_counts.get(seq, 0) + 1
+
+    counts = {}
+    with open(fa, 'w') as writer:
+        for seq, n in seq_counts.items():
+            id_ = hashlib.sha1(seq).hexdigest()
+            counts[id_] = n
+            writer.write(f'>{id_}\n{seq.decode()}\n')
+    return counts
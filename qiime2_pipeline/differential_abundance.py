@@ -214,6 +214,10 @@ class MannwhitneyuTestsAndBoxplots(Processor):
         self.p_value = p_value
         self.min_abundance_per_group = min_abundance_per_group
 
+        n_taxa = len(self.taxon_df.columns) - 1  # without the group column
+        n_pairs = len(list(combinations(self.taxon_df[GROUP_COLUMN].unique(), 2)))
+        self.progress_items(total=n_taxa * (1 + n_pairs), label=f'{self.taxon_level} taxa')
+
         self.plot_all()
 
         self.groups = self.taxon_df[GROUP_COLUMN].unique().tolist()
@@ -235,6 +239,7 @@ class MannwhitneyuTestsAndBoxplots(Processor):
                 title=taxon,
                 png=f'{dstdir}/{taxon}.png'
             )
+            self.progress_advance()
 
     def process_group_pair(self, group_1: str, group_2: str):
         dstdir = f'{self.outdir}/{DSTDIR_NAME}/{self.taxon_level}/{group_1}-{group_2}'
@@ -281,6 +286,8 @@ class MannwhitneyuTestsAndBoxplots(Processor):
                     png=f'{dstdir}/{pvalue:.4f}_{taxon}.png'
                 )
 
+            self.progress_advance()
+
         self.__save_stats_data(stats_data=stats_data, dstdir=dstdir)
 
     def __save_stats_data(self, stats_data: List[Dict[str, Any]], dstdir: str):
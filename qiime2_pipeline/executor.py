@@ -0,0 +1,327 @@
+import os
+import time
+import uuid
+import pickle
+import socket
+import threading
+import traceback
+import multiprocessing
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import List, Dict, Any, Callable, Optional
+
+
+SERIAL = 'serial'
+LOCAL = 'local'
+QUEUE = 'queue'
+
+BACKENDS = [SERIAL, LOCAL, QUEUE]
+
+PENDING = 'pending'
+CLAIMED = 'claimed'
+DONE = 'done'
+
+
+class Executor:
+    """
+    Runs a picklable function with each of the keyword arguments, returning the results in order
+    before_submit(i) is called right before the i-th job is submitted, on_done(i) once it has finished
+    """
+
+    concurrency: int
+
+    def map(
+            self,
+            func: Callable,
+            kwargs_list: List[Dict[str, Any]],
+            before_submit: Optional[Callable[[int], None]] = None,
+            on_done: Optional[Callable[[int], None]] = None) -> List[Any]:
+        raise NotImplementedError
+
+    def shutdown(self):
+        pass
+
+
+class SerialExecutor(Executor):
+
+    def __init__(self):
+        self.concurrency = 1
+
+    def map(
+            self,
+            func: Callable,
+            kwargs_list: List[Dict[str, Any]],
+            before_submit: Optional[Callable[[int], None]] = None,
+            on_done: Optional[Callable[[int], None]] = None) -> List[Any]:
+        ret = []
+        for i, kwargs in enumerate(kwargs_list):
+            if before_submit is not None:
+                before_submit(i)
+            ret.append(func(**kwargs))
+            if on_done is not None:
+                on_done(i)
+        return ret
+
+
+class LocalProcessPoolExecutor(Executor):
+    """
+    One pool of spawned processes, shared by concurrent callers for the lifetime of the executor
+    """
+
+    pool: Optional[ProcessPoolExecutor]
+    lock: threading.Lock
+
+    def __init__(self, workers: int):
+        self.concurrency = workers
+        self.pool = None
+        self.lock = threading.Lock()
+
+    def map(
+            self,
+            func: Callable,
+            kwargs_list: List[Dict[str, Any]],
+            before_submit: Optional[Callable[[int], None]] = None,
+            on_done: Optional[Callable[[int], None]] = None) -> List[Any]:
+        with self.lock:
+            if self.pool is None:
+                self.pool = ProcessPoolExecutor(
+                    max_workers=self.concurrency,
+                    mp_context=multiprocessing.get_context('spawn'))
+            pool = self.pool
+
+        futures = []
+        try:
+            for i, kwargs in enumerate(kwargs_list):
+                if before_submit is not None:
+                    before_submit(i)  # not under the lock, which would block the submissions of concurrent callers
+                futures.append(pool.submit(func, **kwargs))
+        except BaseException:
+            for f in futures:
+                f.cancel()
+            raise
+
+        if on_done is not None:
+            index = {f: i for i, f in enumerate(futures)}
+            for f in as_completed(futures):
+                on_done(index[f])
+        return [f.result() for f in futures]
+
+    def shutdown(self):
+        with self.lock:
+            if self.pool is not None:
+                self.pool.shutdown(wait=True)
+                self.pool = None
+
+
+class FileQueueExecutor(Executor):
+    """
+    Jobs are pickled into queue_dir/pending, claimed by FileQueueWorker processes on any node,
+    and their results written back to queue_dir/done
+    """
+
+    POLL_SECONDS = 1.
+    STALE_SECONDS = 300.
+    UNCLAIMED_WARNING_SECONDS = 60.
+    UNCLAIMED_TIMEOUT_SECONDS = 3600.
+
+    queue_dir: str
+
+    def __init__(self, queue_dir: str, workers: int = 1):
+        self.queue_dir = queue_dir
+        self.concurrency = workers  # workers on other nodes have their own cores, so this only matters for sharing a node
+        for d in [PENDING, CLAIMED, DONE]:
+            os.makedirs(f'{self.queue_dir}/{d}', exist_ok=True)
+
+    def map(
+            self,
+            func: Callable,
+            kwargs_list: List[Dict[str, Any]],
+            before_submit: Optional[Callable[[int], None]] = None,
+            on_done: Optional[Callable[[int], None]] = None) -> List[Any]:
+        jobs = []
+        for i, kwargs in enumerate(kwargs_list):
+            if before_submit is not None:
+                before_submit(i)
+            jobs.append(self.submit(func, kwargs))
+        outcomes = {}
+        last_claimed = last_warned = time.time()
+        while len(outcomes) < len(jobs):
+            for i, job in enumerate(jobs):
+                if job in outcomes:
+                    continue
+                done = f'{self.queue_dir}/{DONE}/{job}.pkl'
+                if os.path.exists(done):
+                    with open(done, 'rb') as fh:
+                        outcomes[job] = pickle.load(fh)
+                    os.remove(done)
+                    if on_done is not None:
+                        on_done(i)
+            self.requeue_stale_jobs(jobs)
+            if len(outcomes) == len(jobs):
+                break
+
+            now = time.time()
+            unclaimed = [j for j in jobs if j not in outcomes and os.path.exists(f'{self.queue_dir}/{PENDING}/{j}.pkl')]
+            if len(outcomes) + len(unclaimed) < len(jobs):  # some job is running on a worker
+                last_claimed = last_warned = now
+            elif now - last_claimed > self.UNCLAIMED_TIMEOUT_SECONDS:
+                self.withdraw(unclaimed)
+                raise RuntimeError(
+                    f'No worker claimed any job from "{self.queue_dir}" for {self.UNCLAIMED_TIMEOUT_SECONDS:.0f} seconds')
+            elif now - last_warned > self.UNCLAIMED_WARNING_SECONDS:
+                print(f'{self.__class__.__name__}\tWARNING\t{datetime.now()}', flush=True)  # the format of Logger
+                print(f'{len(unclaimed)} jobs unclaimed for {now - last_claimed:.0f} seconds, '
+                      f'is a worker running on "{self.queue_dir}"?\n', flush=True)
+                last_warned = now
+            time.sleep(self.POLL_SECONDS)
+
+        results = []
+        for job in jobs:
+            outcome = outcomes[job]
+            if 'error' in outcome:
+                raise RuntimeError(f'Job {job} failed on {outcome["worker"]}:\n{outcome["error"]}')
+            results.append(outcome['result'])
+        return results
+
+    def submit(self, func: Callable, kwargs: Dict[str, Any]) -> str:
+        job = uuid.uuid4().hex
+        temp = f'{self.queue_dir}/{PENDING}/.{job}.tmp'
+        with open(temp, 'wb') as fh:
+            pickle.dump({'func': func, 'kwargs': kwargs}, fh)
+        os.replace(temp, f'{self.queue_dir}/{PENDING}/{job}.pkl')
+        return job
+
+    def withdraw(self, jobs: List[str]):
+        for job in jobs:
+            try:
+                os.remove(f'{self.queue_dir}/{PENDING}/{job}.pkl')
+            except FileNotFoundError:  # claimed at the last moment
+                pass
+
+    def requeue_stale_jobs(self, jobs: List[str]):
+        for job in jobs:
+            claimed = f'{self.queue_dir}/{CLAIMED}/{job}.pkl'
+            try:
+                if time.time() - os.path.getmtime(claimed) > self.STALE_SECONDS:
+                    os.replace(claimed, f'{self.queue_dir}/{PENDING}/{job}.pkl')
+            except FileNotFoundError:  # not claimed, or finished meanwhile
+                pass
+
+
+class FileQueueWorker:
+    """
+    Runs the claimed jobs one at a time, until idle for idle_exit_seconds (never if None)
+    """
+
+    HEARTBEAT_SECONDS = 30.
+
+    queue_dir: str
+    poll_seconds: float
+    idle_exit_seconds: Optional[float]
+    name: str
+
+    def __init__(
+            self,
+            queue_dir: str,
+            poll_seconds: float = 1.,
+            idle_exit_seconds: Optional[float] = None):
+        self.queue_dir = queue_dir
+        self.poll_seconds = poll_seconds
+        self.idle_exit_seconds = idle_exit_seconds
+        self.name = f'{socket.gethostname()}:{os.getpid()}'
+        for d in [PENDING, CLAIMED, DONE]:
+            os.makedirs(f'{self.queue_dir}/{d}', exist_ok=True)
+
+    def main(self) -> int:
+        """
+        Returns:
+            number of jobs run
+        """
+        n_jobs = 0
+        idle_since = time.time()
+        while True:
+            job = self.claim()
+            if job is not None:
+                self.run(job)
+                n_jobs += 1
+                idle_since = time.time()
+                continue
+            if self.idle_exit_seconds is not None and time.time() - idle_since > self.idle_exit_seconds:
+                return n_jobs
+            time.sleep(self.poll_seconds)
+
+    def claim(self) -> Optional[str]:
+        for f in sorted(os.listdir(f'{self.queue_dir}/{PENDING}')):
+            if not f.endswith('.pkl'):
+                continue
+            try:
+                os.rename(f'{self.queue_dir}/{PENDING}/{f}', f'{self.queue_dir}/{CLAIMED}/{f}')
+            except FileNotFoundError:  # claimed by another worker
+                continue
+            os.utime(f'{self.queue_dir}/{CLAIMED}/{f}')  # rename keeps the mtime of submission, which is not a heartbeat
+            return f[:-len('.pkl')]
+        return None
+
+    def run(self, job: str):
+        claimed = f'{self.queue_dir}/{CLAIMED}/{job}.pkl'
+        stop = threading.Event()
+        heartbeat = threading.Thread(target=self.heartbeat, args=(claimed, stop), daemon=True)
+        heartbeat.start()
+        try:
+            with open(claimed, 'rb') as fh:
+                payload = pickle.load(fh)
+            outcome = {'worker': self.name, 'result': payload['func'](**payload['kwargs'])}
+        except Exception:
+            outcome = {'worker': self.name, 'error': traceback.format_exc()}
+        finally:
+            stop.set()
+            heartbeat.join()
+
+        temp = f'{self.queue_dir}/{DONE}/.{job}.tmp'
+        with open(temp, 'wb') as fh:
+            pickle.dump(outcome, fh)
+        os.replace(temp, f'{self.queue_dir}/{DONE}/{job}.pkl')
+        try:
+            os.remove(claimed)
+        except FileNotFoundError:
+            pass
+
+    def heartbeat(self, claimed: str, stop: threading.Event):
+        while not stop.wait(self.HEARTBEAT_SECONDS):
+            try:
+                os.utime(claimed)
+            except FileNotFoundError:
+                return
+
+
+def get_executor(backend: str, workers: int, queue_dir: Optional[str]) -> Executor:
+    assert backend in BACKENDS, f'"{backend}" is not a valid executor backend'
+    if backend == LOCAL:
+        return LocalProcessPoolExecutor(workers=workers)
+    if backend == QUEUE:
+        assert queue_dir is not None, 'The queue executor needs a queue directory'
+        return FileQueueExecutor(queue_dir=queue_dir, workers=workers)
+    return SerialExecutor()
+
+
+def run_processor(processor: type, settings: Any, kwargs: Dict[str, Any]) -> Any:
+    """
+    The job function of Processor.fan_out(), picklable because the Processor class is pickled by reference
+    """
+    return processor(settings).main(**kwargs)
+
+
+def run_commands(
+        cmds: List[str],
+        threads: int,
+        timeout: Optional[float],
+        max_try: int,
+        backoff_seconds: float):
+    """
+    The job function of Processor.call_all() on a non-serial executor
+    """
+    from .runner import CommandRunner, parse_command
+    CommandRunner(max_try=max_try, backoff_seconds=backoff_seconds).run(
+        commands=[parse_command(c) for c in cmds],
+        threads=threads,
+        timeout=timeout)
@@ -18,7 +18,7 @@ class Export(Processor):
 
     def mv(self, src: str, dst: str):
         if abspath(src) != abspath(dst):
-            self.call(f'mv "{src}" "{dst}"')
+            self.move(src=src, dst=dst)
 
 
 class ExportFeatureTable(Export):
@@ -56,6 +56,7 @@ class ExportFeatureTable(Export):
             f'2>> "{log}"'
         ])
         self.call(cmd)
+        self.register_intermediate(f'{self.workdir}/feature-table.biom', consumers=[])
 
     def remove_first_line(self):
         with open(self.tsv, 'r') as f:
@@ -0,0 +1,61 @@
+import os
+import pandas as pd
+from typing import Optional, List
+from .template import Processor
+
+
+FASTQC_DIRNAME = 'fastqc'
+
+
+class FastQC(Processor):
+    """
+    FastQC of the input reads as a stage of its own, for the trimming engines that do not run FastQC,
+    one command per sample running concurrently, each with one thread per fastq file
+
+    The reports go to the same outdir/fastqc as those of trim_galore, which are of the trimmed reads
+    """
+
+    sample_sheet: str
+    fq_dir: str
+    fq1_suffix: str
+    fq2_suffix: Optional[str]
+
+    dstdir: str
+
+    def main(
+            self,
+            sample_sheet: str,
+            fq_dir: str,
+            fq1_suffix: str,
+            fq2_suffix: Optional[str]):
+
+        self.sample_sheet = sample_sheet
+        self.fq_dir = fq_dir
+        self.fq1_suffix = fq1_suffix
+        self.fq2_suffix = fq2_suffix
+
+        self.dstdir = f'{self.outdir}/{FASTQC_DIRNAME}'
+        os.makedirs(self.dstdir, exist_ok=True)
+
+        names = pd.read_csv(self.sample_sheet, index_col=0).index.tolist()
+        fqs_list = [self.get_fqs(name) for name in names]
+        cmds = [self.get_cmd(fqs=fqs) for fqs in fqs_list]
+        self.call_all(
+            cmds, threads=1 if self.fq2_suffix is None else 2, staged_inputs=fqs_list, progress_label='samples')
+
+    def get_fqs(self, name: str) -> List[str]:
+        fqs = [f'{self.fq_dir}/{name}{self.fq1_suffix}']
+        if self.fq2_suffix is not None:
+            fqs.append(f'{self.fq_dir}/{name}{self.fq2_suffix}')
+        return fqs
+
+    def get_cmd(self, fqs: List[str]) -> str:
+        log = f'{self.outdir}/fastqc.log'
+        return self.CMD_LINEBREAK.join([
+            'fastqc',
+            f'--threads {len(fqs)}',
+            f'--outdir "{self.dstdir}"',
+        ] + [f'"{fq}"' for fq in fqs] + [
+            f'1>> "{log}"',
+            f'2>> "{log}"'
+        ])
@@ -0,0 +1,307 @@
+import os
+import json
+import uuid
+import fcntl
+import shutil
+import threading
+import pandas as pd
+from datetime import date, datetime
+from os.path import exists
+from typing import Dict, Any, List, Tuple, Optional, TextIO
+from .template import Processor, Logger
+from .generate_asv import GenerateASV
+from .sharding import concat_stats_tsvs
+from .long_read_filtering import get_filter_parameters
+
+
+FEATURE_TABLE_QZA = 'feature-table.qza'
+FEATURE_SEQUENCE_QZA = 'feature-sequence.qza'
+SAMPLES_CSV = 'samples.csv'
+PARAMETERS_JSON = 'parameters.json'
+DADA2_STATS_TSV = 'dada2-stats.tsv'
+CURRENT_TXT = 'CURRENT'
+VERSIONS_DIRNAME = 'versions'
+LOCK_FILENAME = '.lock'
+
+# GenerateASV arguments that change the ASVs, all samples of a store must be denoised with the same values
+STORED_PARAMETERS = [
+    'pacbio',
+    'paired_end_mode',
+    'reverse_complement_r2',
+    'clip_r1_5_prime',
+    'clip_r2_5_prime',
+    'max_expected_error_bases',
+    'long_read_filter',
+]
+
+
+class IncrementalGenerateASV(Processor):
+    """
+    Keeps the DADA2 features of a project in a feature store across runs,
+    so that a run only denoises the samples not in the store yet
+    """
+
+    feature_store: str
+    sample_sheet: str
+    generate_asv_kwargs: Dict[str, Any]
+
+    current_dir: Optional[str]
+    sample_names: List[str]
+    stored_names: List[str]
+    new_names: List[str]
+    parameters: Dict[str, Any]
+
+    feature_table_qza: str
+    feature_sequence_qza: str
+
+    def main(
+            self,
+            feature_store: str,
+            sample_sheet: str,
+            generate_asv_kwargs: Dict[str, Any]) -> Tuple[str, str]:
+        """
+        Args:
+            feature_store: directory, created if not existing
+
+            sample_sheet: all samples of this run, stored or not
+
+            generate_asv_kwargs: keyword arguments of GenerateASV.main() except sample_sheet
+        """
+        self.feature_store = feature_store
+        self.sample_sheet = sample_sheet
+        self.generate_asv_kwargs = generate_asv_kwargs
+
+        os.makedirs(f'{self.feature_store}/{VERSIONS_DIRNAME}', exist_ok=True)
+        with StoreLock(path=f'{self.feature_store}/{LOCK_FILENAME}', logger=self.logger):
+            self.read_current_version()
+            self.remove_unpublished_versions()
+            self.sample_names = [str(n) for n in pd.read_csv(self.sample_sheet, index_col=0).index]
+            self.read_stored_names()
+            self.check_parameters()
+
+            self.new_names = [n for n in self.sample_names if n not in self.stored_names]
+            self.logger.info(f'{len(self.new_names)} new samples, {len(self.sample_names) - len(self.new_names)} samples in the feature store "{self.feature_store}"')
+
+            if len(self.new_names) > 0:
+                self.denoise_new_samples()
+            self.filter_sample_sheet_samples()
+
+        return self.feature_table_qza, self.feature_sequence_qza
+
+    def read_current_version(self):
+        pointer = f'{self.feature_store}/{CURRENT_TXT}'
+        self.current_dir = None
+        if exists(pointer):
+            with open(pointer) as fh:
+                self.current_dir = f'{self.feature_store}/{VERSIONS_DIRNAME}/{fh.read().strip()}'
+
+    def remove_unpublished_versions(self):
+        """
+        Left by runs that died before or right after the rename of their version, i.e. before the pointer was replaced
+        """
+        if self.mock:
+            return
+        versions_dir = f'{self.feature_store}/{VERSIONS_DIRNAME}'
+        for d in os.listdir(versions_dir):
+            path = f'{versions_dir}/{d}'
+            if path != self.current_dir:
+                self.logger.info(f'Remove the unpublished feature store version "{path}"')
+                shutil.rmtree(path)
+
+    def read_stored_names(self):
+        self.stored_names = []
+        if self.current_dir is None:
+            return
+        csv = f'{self.current_dir}/{SAMPLES_CSV}'
+        if exists(csv):
+            self.stored_names = pd.read_csv(csv, dtype={'Sample ID': str})['Sample ID'].tolist()
+
+    def check_parameters(self):
+        self.parameters = {k: self.generate_asv_kwargs[k] for k in STORED_PARAMETERS}
+        if not self.parameters['pacbio']:
+            self.parameters['long_read_filter'] = None  # only pacbio reads are filtered
+        elif self.parameters['long_read_filter'] is not None:  # with the defaults, which may change between versions
+            self.parameters['long_read_filter'] = get_filter_parameters(
+                platform='pacbio', long_read_filter=self.parameters['long_read_filter'])
+        self.parameters['trimming_engine'] = self.settings.trimming_engine
+        if self.settings.dada2_truncate_lengths is None:
+            raise ValueError('Automatic DADA2 truncation may choose other lengths for new samples, a feature store needs fixed truncation lengths')
+        self.parameters['dada2_truncate_lengths'] = list(self.settings.dada2_truncate_lengths)
+
+        if self.current_dir is None or not exists(f'{self.current_dir}/{PARAMETERS_JSON}'):
+            return
+        json_path = f'{self.current_dir}/{PARAMETERS_JSON}'
+        with open(json_path) as fh:
+            stored = json.load(fh)
+        different = [k for k in self.parameters if stored.get(k) != self.parameters[k]]
+        if len(different) > 0:
+            details = ', '.join(f'{k}: {stored.get(k)} (stored) vs {self.parameters[k]} (this run)' for k in different)
+            raise ValueError(f'Feature store "{self.feature_store}" was denoised with different parameters, {details}')
+
+    def denoise_new_samples(self):
+        new_sample_sheet = f'{self.workdir}/new-samples-sample-sheet.csv'
+        df = pd.read_csv(self.sample_sheet, index_col=0)
+        df[[str(n) in self.new_names for n in df.index]].to_csv(new_sample_sheet)
+
+        new_table_qza, new_sequence_qza = GenerateASV(self.settings).main(
+            sample_sheet=new_sample_sheet,
+            **self.generate_asv_kwargs)
+
+        if len(self.stored_names) == 0:
+            self.save_store(table_qza=new_table_qza, sequence_qza=new_sequence_qza)
+            return
+
+        merged_table_qza = f'{self.workdir}/feature-store-merged-table.qza'
+        merged_sequence_qza = f'{self.workdir}/feature-store-merged-sequence.qza'
+        log = f'{self.outdir}/qiime-feature-table-merge.log'
+        self.call_all([
+            self.CMD_LINEBREAK.join([
+                'qiime feature-table merge',
+                f'--i-tables {self.current_dir}/{FEATURE_TABLE_QZA}',
+                f'--i-tables {new_table_qza}',
+                f'--o-merged-table {merged_table_qza}',
+                f'1>> "{log}"',
+                f'2>> "{log}"'
+            ]),
+            self.CMD_LINEBREAK.join([
+                'qiime feature-table merge-seqs',
+                f'--i-data {self.current_dir}/{FEATURE_SEQUENCE_QZA}',
+                f'--i-data {new_sequence_qza}',
+                f'--o-merged-data {merged_sequence_qza}',
+                f'1>> "{log}"',
+                f'2>> "{log}"'
+            ]),
+        ], threads=1)
+        for path in [new_table_qza, new_sequence_qza]:
+            self.register_intermediate(path, consumers=[])
+
+        self.save_store(table_qza=merged_table_qza, sequence_qza=merged_sequence_qza)
+
+    def save_store(self, table_qza: str, sequence_qza: str):
+        """
+        Writes a complete new version and publishes it by replacing the pointer, then removes the previous version
+        """
+        version = f'{datetime.now():%Y%m%d-%H%M%S}-{uuid.uuid4().hex[:8]}'
+        version_dir = f'{self.feature_store}/{VERSIONS_DIRNAME}/{version}'
+        self.logger.info(f'Save {len(self.stored_names) + len(self.new_names)} samples to the feature store version "{version_dir}"')
+        if self.mock:
+            self.current_dir = version_dir
+            return
+
+        temp_dir = f'{version_dir}.temp'
+        os.makedirs(temp_dir)
+        for src, name in [
+            (table_qza, FEATURE_TABLE_QZA),
+            (sequence_qza, FEATURE_SEQUENCE_QZA),
+        ]:
+            shutil.copyfile(src, f'{temp_dir}/{name}')
+            self.register_intermediate(src, consumers=[])
+
+        stats_tsv = f'{self.outdir}/{DADA2_STATS_TSV}'  # of the new samples only
+        if exists(stats_tsv):
+            tsvs = [stats_tsv]
+            if self.current_dir is not None and exists(f'{self.current_dir}/{DADA2_STATS_TSV}'):
+                tsvs.insert(0, f'{self.current_dir}/{DADA2_STATS_TSV}')
+            concat_stats_tsvs(tsvs=tsvs, dst=f'{temp_dir}/{DADA2_STATS_TSV}')
+
+        with open(f'{temp_dir}/{PARAMETERS_JSON}', 'w') as fh:
+            json.dump(self.parameters, fh, indent=2)
+
+        today = date.today().isoformat()
+        pd.DataFrame({
+            'Sample ID': self.stored_names + self.new_names,
+            'Added': self.read_added_dates() + [today] * len(self.new_names),
+        }).to_csv(f'{temp_dir}/{SAMPLES_CSV}', index=False)
+
+        os.rename(temp_dir, version_dir)
+        pointer = f'{self.feature_store}/{CURRENT_TXT}'
+        with open(f'{pointer}.temp', 'w') as fh:
+            fh.write(version + '\n')
+        os.replace(f'{pointer}.temp', pointer)  # the single atomic step that publishes the new version
+
+        previous_dir, self.current_dir = self.current_dir, version_dir
+        if previous_dir is not None:
+            shutil.rmtree(previous_dir)
+        if exists(f'{self.current_dir}/{DADA2_STATS_TSV}'):
+            shutil.copyfile(f'{self.current_dir}/{DADA2_STATS_TSV}', stats_tsv)  # all samples of the store
+
+    def read_added_dates(self) -> List[str]:
+        if self.current_dir is None or not exists(f'{self.current_dir}/{SAMPLES_CSV}'):
+            return []
+        return pd.read_csv(f'{self.current_dir}/{SAMPLES_CSV}', dtype=str)['Added'].tolist()
+
+    def filter_sample_sheet_samples(self):
+        """
+        The store may hold more samples than the sample sheet of this run
+        """
+        self.feature_table_qza = f'{self.workdir}/feature-store-table.qza'
+        self.feature_sequence_qza = f'{self.workdir}/feature-store-sequence.qza'
+
+        metadata_tsv = f'{self.workdir}/feature-store-samples.tsv'
+        with open(metadata_tsv, 'w') as fh:
+            fh.write('\n'.join(['sample-id'] + self.sample_names) + '\n')
+
+        log = f'{self.outdir}/qiime-feature-table-filter.log'
+        for cmd in [
+            self.CMD_LINEBREAK.join([
+                'qiime feature-table filter-samples',
+                f'--i-table {self.current_dir}/{FEATURE_TABLE_QZA}',
+                f'--m-metadata-file {metadata_tsv}',
+                f'--o-filtered-table {self.feature_table_qza}',
+                f'1>> "{log}"',
+                f'2>> "{log}"'
+            ]),
+            self.CMD_LINEBREAK.join([
+                'qiime feature-table filter-seqs',
+                f'--i-data {self.current_dir}/{FEATURE_SEQUENCE_QZA}',
+                f'--i-table {self.feature_table_qza}',
+                f'--o-filtered-data {self.feature_sequence_qza}',
+                f'1>> "{log}"',
+                f'2>> "{log}"'
+            ]),
+        ]:
+            self.call(cmd)
+        self.register_intermediate(metadata_tsv, consumers=[])
+
+
+class StoreLock:
+    """
+    An exclusive POSIX lock on a file of the feature store, plus a thread lock for runs in the same process
+    """
+
+    THREAD_LOCKS: Dict[str, threading.Lock] = {}
+    THREAD_LOCKS_LOCK = threading.Lock()
+
+    path: str
+    logger: Logger
+    thread_lock: threading.Lock
+    fh: Optional[TextIO]
+
+    def __init__(self, path: str, logger: Logger):
+        self.path = path
+        self.logger = logger
+        with self.THREAD_LOCKS_LOCK:
+            self.thread_lock = self.THREAD_LOCKS.setdefault(os.path.abspath(path), threading.Lock())
+        self.fh = None
+
+    def __enter__(self):
+        if not self.thread_lock.acquire(blocking=False):
+            self.logger.info(f'Wait for another run to release the feature store lock "{self.path}"')
+            self.thread_lock.acquire()
+        try:
+            self.fh = open(self.path, 'a')
+            try:
+                fcntl.lockf(self.fh, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                self.logger.info(f'Wait for another run to release the feature store lock "{self.path}"')
+                fcntl.lockf(self.fh, fcntl.LOCK_EX)
+        except BaseException:
+            self.thread_lock.release()
+            raise
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        fcntl.lockf(self.fh, fcntl.LOCK_UN)
+        self.fh.close()
+        self.fh = None
+        self.thread_lock.release()
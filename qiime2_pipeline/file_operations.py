@@ -0,0 +1,74 @@
+import os
+import glob
+import errno
+import shutil
+from os.path import isdir, basename, join
+from typing import List, BinaryIO
+
+
+BUFFER_BYTES = 1024 ** 2
+COPY_FILE_RANGE_BYTES = 64 * 1024 ** 2
+COPY_FILE_RANGE_UNSUPPORTED = [errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.EBADF]
+
+
+def move(src: str, dst: str) -> str:
+    """
+    Like mv, i.e. into dst if it is a directory
+
+    A rename within one file system is atomic, across file systems it falls back to copy-and-delete
+
+    Returns:
+        the new path
+    """
+    if isdir(dst) and not isdir(src):
+        dst = join(dst, basename(src))
+    try:
+        os.replace(src, dst)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+        shutil.move(src, dst)
+    return dst
+
+
+def move_glob(srcdir: str, pattern: str, dstdir: str) -> List[str]:
+    """
+    Like mv "srcdir"/pattern "dstdir/", i.e. only the pattern is expanded, and it fails if nothing matches
+
+    Returns:
+        the new paths
+    """
+    srcs = sorted(glob.glob(join(glob.escape(srcdir), pattern)))
+    if len(srcs) == 0:
+        raise FileNotFoundError(f'No file matches "{srcdir}/{pattern}"')
+    return [move(src, dstdir) for src in srcs]
+
+
+def concatenate(srcs: List[str], dst: str):
+    """
+    Like cat srcs > dst, but dst only appears once completely written
+
+    Uses copy_file_range() for an in-kernel copy where the file systems support it
+    """
+    temp = f'{dst}.concatenating'
+    with open(temp, 'wb') as writer:
+        for src in srcs:
+            with open(src, 'rb') as reader:
+                append(reader=reader, writer=writer)
+    os.replace(temp, dst)
+
+
+def append(reader: BinaryIO, writer: BinaryIO):
+    writer.flush()  # copy_file_range() writes at the OS-level offset, behind the Python buffer
+    if hasattr(os, 'copy_file_range'):
+        copied = 0
+        try:
+            while True:
+                n = os.copy_file_range(reader.fileno(), writer.fileno(), COPY_FILE_RANGE_BYTES)
+                if n == 0:
+                    return
+                copied += n
+        except OSError as e:
+            if copied > 0 or e.errno not in COPY_FILE_RANGE_UNSUPPORTED:
+                raise
+    shutil.copyfileobj(reader, writer, length=BUFFER_BYTES)
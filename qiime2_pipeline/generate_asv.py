@@ -1,9 +1,11 @@
-import os
-import pandas as pd
-from typing import Tuple, Optional, List
+from typing import Tuple, Optional, Dict, Any
 from .template import Processor
+from .pooling import BatchPool
+from .sharding import ShardedDada2
 from .importing import ImportSingleEndFastq, ImportPairedEndFastq
-from .trimming import BatchTrimGalorePairedEnd, BatchTrimGaloreSingleEnd
+from .trimming import BatchTrimGalorePairedEnd, BatchTrimGaloreSingleEnd, STREAMING, TRIMMING_ENGINES
+from .streaming_trimming import StreamingTrimAndImport
+from .long_read_filtering import LongReadFilter
 
 
 class GenerateASV(Processor):
@@ -14,9 +16,11 @@ class GenerateASV(Processor):
     fq2_suffix: Optional[str]
     pacbio: bool
     paired_end_mode: str
+    reverse_complement_r2: bool
     clip_r1_5_prime: int
     clip_r2_5_prime: int
     max_expected_error_bases: float
+    long_read_filter: Optional[Dict[str, Any]]
 
     feature_table_qza: str
     feature_sequence_qza: str
@@ -29,19 +33,26 @@ class GenerateASV(Processor):
             fq2_suffix: Optional[str],
             pacbio: bool,
             paired_end_mode: str,
+            reverse_complement_r2: bool,
             clip_r1_5_prime: int,
             clip_r2_5_prime: int,
-            max_expected_error_bases: float) -> Tuple[str, str]:
-
+            max_expected_error_bases: float,
+            long_read_filter: Optional[Dict[str, Any]] = None) -> Tuple[str, str]:
+        """
+        Args:
+            long_read_filter: overrides of the pacbio filter defaults, None for no filtering
+        """
         self.sample_sheet = sample_sheet
         self.fq_dir = fq_dir
         self.fq1_suffix = fq1_suffix
         self.fq2_suffix = fq2_suffix
         self.pacbio = pacbio
         self.paired_end_mode = paired_end_mode
+        self.reverse_complement_r2 = reverse_complement_r2
         self.clip_r1_5_prime = clip_r1_5_prime
         self.clip_r2_5_prime = clip_r2_5_prime
         self.max_expected_error_bases = max_expected_error_bases
+        self.long_read_filter = long_read_filter
 
         if self.pacbio:
             self.generate_asv_pacbio()
@@ -59,7 +70,8 @@ class GenerateASV(Processor):
             sample_sheet=self.sample_sheet,
             fq_dir=self.fq_dir,
             fq_suffix=self.fq1_suffix,
-            max_expected_error_bases=self.max_expected_error_bases)
+            max_expected_error_bases=self.max_expected_error_bases,
+            long_read_filter=self.long_read_filter)
 
     def generate_asv_single_end(self):
         self.feature_table_qza, self.feature_sequence_qza = GenerateASVSingleEnd(self.settings).main(
@@ -78,6 +90,7 @@ class GenerateASV(Processor):
             clip_r1_5_prime=self.clip_r1_5_prime,
             clip_r2_5_prime=self.clip_r2_5_prime,
             paired_end_mode=self.paired_end_mode,
+            reverse_complement_r2=self.reverse_complement_r2,
             max_expected_error_bases=self.max_expected_error_bases)
 
 
@@ -87,6 +100,7 @@ class GenerateASVPacBio(Processor):
     fq_dir: str
     fq_suffix: str
     max_expected_error_bases: float
+    long_read_filter: Optional[Dict[str, Any]]
 
     feature_sequence_qza: str
     feature_table_qza: str
@@ -96,23 +110,40 @@ class GenerateASVPacBio(Processor):
             sample_sheet: str,
             fq_dir: str,
             fq_suffix: str,
-            max_expected_error_bases: float) -> Tuple[str, str]:
+            max_expected_error_bases: float,
+            long_read_filter: Optional[Dict[str, Any]] = None) -> Tuple[str, str]:
 
         self.sample_sheet = sample_sheet
         self.fq_dir = fq_dir
         self.fq_suffix = fq_suffix
         self.max_expected_error_bases = max_expected_error_bases
+        self.long_read_filter = long_read_filter
+
+        # 1 filtering
+        if self.long_read_filter is not None:
+            self.fq_dir, self.fq_suffix = LongReadFilter(self.settings).main(
+                sample_sheet=self.sample_sheet,
+                fq_dir=self.fq_dir,
+                fq_suffix=self.fq_suffix,
+                platform='pacbio',
+                long_read_filter=self.long_read_filter)
+            self.register_intermediate(self.fq_dir, consumers=['ImportSingleEndFastq'])
 
-        # 1 importing
+        # 2 importing
         single_end_seq_qza = ImportSingleEndFastq(self.settings).main(
             sample_sheet=self.sample_sheet,
             fq_dir=self.fq_dir,
             fq_suffix=self.fq_suffix)
+        self.release_intermediates(consumer='ImportSingleEndFastq')
+        self.register_intermediate(single_end_seq_qza, consumers=['Dada2PacBio'])
 
-        # 2 denoise
-        self.feature_table_qza, self.feature_sequence_qza = Dada2PacBio(self.settings).main(
+        # 3 denoise
+        self.feature_table_qza, self.feature_sequence_qza = ShardedDada2(self.settings).main(
+            dada2=Dada2PacBio,
             demultiplexed_seq_qza=single_end_seq_qza,
-            max_expected_error_bases=self.max_expected_error_bases)
+            max_expected_error_bases=self.max_expected_error_bases,
+            sample_sheet=self.sample_sheet)
+        self.release_intermediates(consumer='Dada2PacBio')
 
         return self.feature_table_qza, self.feature_sequence_qza
 
@@ -142,25 +173,44 @@ class GenerateASVSingleEnd(Processor):
         self.clip_5_prime = clip_5_prime
         self.max_expected_error_bases = max_expected_error_bases
 
-        # 1 trimming
+        # 1 and 2 trimming and importing
+        single_end_seq_qza = self.trim_and_import()
+        self.register_intermediate(single_end_seq_qza, consumers=['Dada2SingleEnd'])
+
+        # 3 denoise
+        self.feature_table_qza, self.feature_sequence_qza = ShardedDada2(self.settings).main(
+            dada2=Dada2SingleEnd,
+            demultiplexed_seq_qza=single_end_seq_qza,
+            max_expected_error_bases=self.max_expected_error_bases,
+            sample_sheet=self.sample_sheet)
+        self.release_intermediates(consumer='Dada2SingleEnd')
+
+        return self.feature_table_qza, self.feature_sequence_qza
+
+    def trim_and_import(self) -> str:
+        if self.settings.trimming_engine == STREAMING:
+            return StreamingTrimAndImport(self.settings).main(
+                sample_sheet=self.sample_sheet,
+                fq_dir=self.fq_dir,
+                fq1_suffix=self.fq_suffix,
+                fq2_suffix=None,
+                clip_r1_5_prime=self.clip_5_prime,
+                clip_r2_5_prime=0,
+                pool=False)
+
         trimmed_fq_dir, trimmed_fq_suffix = BatchTrimGaloreSingleEnd(self.settings).main(
             sample_sheet=self.sample_sheet,
             fq_dir=self.fq_dir,
             fq_suffix=self.fq_suffix,
             clip_5_prime=self.clip_5_prime)
+        self.register_intermediate(trimmed_fq_dir, consumers=['ImportSingleEndFastq'])
 
-        # 2 importing
         single_end_seq_qza = ImportSingleEndFastq(self.settings).main(
             sample_sheet=self.sample_sheet,
             fq_dir=trimmed_fq_dir,
             fq_suffix=trimmed_fq_suffix)
-
-        # 3 denoise
-        self.feature_table_qza, self.feature_sequence_qza = Dada2SingleEnd(self.settings).main(
-            demultiplexed_seq_qza=single_end_seq_qza,
-            max_expected_error_bases=self.max_expected_error_bases)
-
-        return self.feature_table_qza, self.feature_sequence_qza
+        self.release_intermediates(consumer='ImportSingleEndFastq')
+        return single_end_seq_qza
 
 
 class GenerateASVPairedEnd(Processor):
@@ -175,6 +225,7 @@ class GenerateASVPairedEnd(Processor):
     clip_r1_5_prime: int
     clip_r2_5_prime: int
     paired_end_mode: str
+    reverse_complement_r2: bool
     max_expected_error_bases: float
 
     feature_sequence_qza: str
@@ -189,6 +240,7 @@ class GenerateASVPairedEnd(Processor):
             clip_r1_5_prime: int,
             clip_r2_5_prime: int,
             paired_end_mode: str,
+            reverse_complement_r2: bool,
             max_expected_error_bases: float) -> Tuple[str, str]:
 
         self.sample_sheet = sample_sheet
@@ -198,9 +250,11 @@ class GenerateASVPairedEnd(Processor):
         self.clip_r1_5_prime = clip_r1_5_prime
         self.clip_r2_5_prime = clip_r2_5_prime
         self.paired_end_mode = paired_end_mode
+        self.reverse_complement_r2 = reverse_complement_r2
         self.max_expected_error_bases = max_expected_error_bases
 
         assert self.paired_end_mode in [self.MERGE, self.POOL], f'"{self.paired_end_mode}" is not a valid mode for GenerateASV'
+        assert self.settings.trimming_engine in TRIMMING_ENGINES, f'"{self.settings.trimming_engine}" is not a valid trimming engine'
 
         if self.paired_end_mode == self.MERGE:
             self.run_merge_mode()
@@ -210,56 +264,90 @@ class GenerateASVPairedEnd(Processor):
         return self.feature_table_qza, self.feature_sequence_qza
 
     def run_merge_mode(self):
-        # 1 trimming
-        trimmed_fq_dir, trimmed_fq1_suffix, trimmed_fq2_suffix = BatchTrimGalorePairedEnd(
-            self.settings).main(
-            sample_sheet=self.sample_sheet,
-            fq_dir=self.fq_dir,
-            fq1_suffix=self.fq1_suffix,
-            fq2_suffix=self.fq2_suffix,
-            clip_r1_5_prime=self.clip_r1_5_prime,
-            clip_r2_5_prime=self.clip_r2_5_prime)
-
-        # 2 importing
-        paired_end_seq_qza = ImportPairedEndFastq(self.settings).main(
-            sample_sheet=self.sample_sheet,
-            fq_dir=trimmed_fq_dir,
-            fq1_suffix=trimmed_fq1_suffix,
-            fq2_suffix=trimmed_fq2_suffix)
+        if self.settings.trimming_engine == STREAMING:
+            # 1 and 2 trimming and importing
+            paired_end_seq_qza = self.streaming_trim_and_import(pool=False)
+        else:
+            # 1 trimming
+            trimmed_fq_dir, trimmed_fq1_suffix, trimmed_fq2_suffix = BatchTrimGalorePairedEnd(
+                self.settings).main(
+                sample_sheet=self.sample_sheet,
+                fq_dir=self.fq_dir,
+                fq1_suffix=self.fq1_suffix,
+                fq2_suffix=self.fq2_suffix,
+                clip_r1_5_prime=self.clip_r1_5_prime,
+                clip_r2_5_prime=self.clip_r2_5_prime)
+            self.register_intermediate(trimmed_fq_dir, consumers=['ImportPairedEndFastq'])
+
+            # 2 importing
+            paired_end_seq_qza = ImportPairedEndFastq(self.settings).main(
+                sample_sheet=self.sample_sheet,
+                fq_dir=trimmed_fq_dir,
+                fq1_suffix=trimmed_fq1_suffix,
+                fq2_suffix=trimmed_fq2_suffix)
+            self.release_intermediates(consumer='ImportPairedEndFastq')
+        self.register_intermediate(paired_end_seq_qza, consumers=['Dada2PairedEnd'])
 
         # 3 denoise
-        self.feature_table_qza, self.feature_sequence_qza = Dada2PairedEnd(self.settings).main(
+        self.feature_table_qza, self.feature_sequence_qza = ShardedDada2(self.settings).main(
+            dada2=Dada2PairedEnd,
             demultiplexed_seq_qza=paired_end_seq_qza,
-            max_expected_error_bases=self.max_expected_error_bases)
+            max_expected_error_bases=self.max_expected_error_bases,
+            sample_sheet=self.sample_sheet)
+        self.release_intermediates(consumer='Dada2PairedEnd')
 
     def run_pool_mode(self):
-        # 1 trimming
-        trimmed_fq_dir, trimmed_fq1_suffix, trimmed_fq2_suffix = BatchTrimGalorePairedEnd(
-            self.settings).main(
+        if self.settings.trimming_engine == STREAMING:
+            # 1, 2 and 3 trimming, pooling and importing
+            single_end_seq_qza = self.streaming_trim_and_import(pool=True)
+        else:
+            # 1 trimming
+            trimmed_fq_dir, trimmed_fq1_suffix, trimmed_fq2_suffix = BatchTrimGalorePairedEnd(
+                self.settings).main(
+                sample_sheet=self.sample_sheet,
+                fq_dir=self.fq_dir,
+                fq1_suffix=self.fq1_suffix,
+                fq2_suffix=self.fq2_suffix,
+                clip_r1_5_prime=self.clip_r1_5_prime,
+                clip_r2_5_prime=self.clip_r2_5_prime)
+            self.register_intermediate(trimmed_fq_dir, consumers=['BatchPool'])
+
+            # 2 pooling
+            pooled_fq_dir, pooled_fq_suffix = BatchPool(self.settings).main(
+                sample_sheet=self.sample_sheet,
+                fq_dir=trimmed_fq_dir,
+                fq1_suffix=trimmed_fq1_suffix,
+                fq2_suffix=trimmed_fq2_suffix,
+                reverse_complement_r2=self.reverse_complement_r2)
+            self.release_intermediates(consumer='BatchPool')
+            self.register_intermediate(pooled_fq_dir, consumers=['ImportSingleEndFastq'])
+
+            # 3 importing
+            single_end_seq_qza = ImportSingleEndFastq(self.settings).main(
+                sample_sheet=self.sample_sheet,
+                fq_dir=pooled_fq_dir,
+                fq_suffix=pooled_fq_suffix)
+            self.release_intermediates(consumer='ImportSingleEndFastq')
+        self.register_intermediate(single_end_seq_qza, consumers=['Dada2SingleEnd'])
+
+        # 4 denoise
+        self.feature_table_qza, self.feature_sequence_qza = ShardedDada2(self.settings).main(
+            dada2=Dada2SingleEnd,
+            demultiplexed_seq_qza=single_end_seq_qza,
+            max_expected_error_bases=self.max_expected_error_bases,
+            sample_sheet=self.sample_sheet)
+        self.release_intermediates(consumer='Dada2SingleEnd')
+
+    def streaming_trim_and_import(self, pool: bool) -> str:
+        return StreamingTrimAndImport(self.settings).main(
             sample_sheet=self.sample_sheet,
             fq_dir=self.fq_dir,
             fq1_suffix=self.fq1_suffix,
             fq2_suffix=self.fq2_suffix,
             clip_r1_5_prime=self.clip_r1_5_prime,
-            clip_r2_5_prime=self.clip_r2_5_prime)
-
-        # 2 pooling
-        pooled_fq_dir, pooled_fq_suffix = BatchPool(self.settings).main(
-            sample_sheet=self.sample_sheet,
-            fq_dir=trimmed_fq_dir,
-            fq1_suffix=trimmed_fq1_suffix,
-            fq2_suffix=trimmed_fq2_suffix)
-
-        # 3 importing
-        single_end_seq_qza = ImportSingleEndFastq(self.settings).main(
-            sample_sheet=self.sample_sheet,
-            fq_dir=pooled_fq_dir,
-            fq_suffix=pooled_fq_suffix)
-
-        # 4 denoise
-        self.feature_table_qza, self.feature_sequence_qza = Dada2SingleEnd(self.settings).main(
-            demultiplexed_seq_qza=single_end_seq_qza,
-            max_expected_error_bases=self.max_expected_error_bases)
+            clip_r2_5_prime=self.clip_r2_5_prime,
+            pool=pool,
+            reverse_complement_r2=self.reverse_complement_r2)
 
 
 #
@@ -268,10 +356,14 @@ class GenerateASVPairedEnd(Processor):
 class Dada2Base(Processor):
 
     TRIM_LEFT = 0  # number of 5' bases to be clipped
-    TRUNCATE_LENGTH = 0  # min read length
+    N_TRUNCATED_READS = 1  # number of read directions truncated by the command, R1 and R2 of a pair = 2
+    MIN_OVERLAP = 0  # of R1 and R2 after truncation, only for pairs
 
     demultiplexed_seq_qza: str
     max_expected_error_bases: float
+    truncate_lengths: Tuple[int, int]
+    prefix: str
+    stats_tsv: str
 
     feature_sequence_qza: str
     feature_table_qza: str
@@ -282,28 +374,52 @@ class Dada2Base(Processor):
     def main(
             self,
             demultiplexed_seq_qza: str,
-            max_expected_error_bases: float) -> Tuple[str, str]:
+            max_expected_error_bases: float,
+            truncate_lengths: Tuple[int, int]) -> Tuple[str, str]:
+
+        self.prepare(
+            demultiplexed_seq_qza=demultiplexed_seq_qza,
+            max_expected_error_bases=max_expected_error_bases,
+            truncate_lengths=truncate_lengths,
+            prefix='dada2',
+            stats_tsv=f'{self.outdir}/dada2-stats.tsv')
+        self.call(self.cmd)
+        self.export_stats()
+
+        return self.feature_table_qza, self.feature_sequence_qza
 
+    def prepare(
+            self,
+            demultiplexed_seq_qza: str,
+            max_expected_error_bases: float,
+            truncate_lengths: Tuple[int, int],
+            prefix: str,
+            stats_tsv: str):
+        """
+        Sets the output paths and the command without running it, so that shards can be denoised concurrently
+
+        Args:
+            truncate_lengths: of R1 and R2, 0 for no truncation
+        """
         self.demultiplexed_seq_qza = demultiplexed_seq_qza
         self.max_expected_error_bases = max_expected_error_bases
+        self.truncate_lengths = truncate_lengths
+        self.prefix = prefix
+        self.stats_tsv = stats_tsv
 
         self.set_output_paths()
         self.set_cmd()
-        self.call(self.cmd)
-        self.export_stats()
-
-        return self.feature_table_qza, self.feature_sequence_qza
 
     def set_output_paths(self):
-        self.feature_sequence_qza = f'{self.workdir}/dada2-feature-sequence.qza'
-        self.feature_table_qza = f'{self.workdir}/dada2-feature-table.qza'
-        self.denoising_stats_qza = f'{self.workdir}/dada2-stats.qza'
+        self.feature_sequence_qza = f'{self.workdir}/{self.prefix}-feature-sequence.qza'
+        self.feature_table_qza = f'{self.workdir}/{self.prefix}-feature-table.qza'
+        self.denoising_stats_qza = f'{self.workdir}/{self.prefix}-stats.qza'
 
     def set_cmd(self):
         pass
 
     def export_stats(self):
-        out = f'{self.workdir}/dada2'
+        out = f'{self.workdir}/{self.prefix}'
         log = f'{self.outdir}/qiime-tools-export.log'
 
         cmd = self.CMD_LINEBREAK.join([
@@ -315,7 +431,10 @@ class Dada2Base(Processor):
         ])
         self.call(cmd)
 
-        self.call(f'mv "{out}/stats.tsv" "{self.outdir}/dada2-stats.tsv"')
+        self.move(src=f'{out}/stats.tsv', dst=self.stats_tsv)
+
+        for path in [self.denoising_stats_qza, out]:
+            self.register_intermediate(path, consumers=[])
 
 
 class Dada2SingleEnd(Dada2Base):
@@ -326,7 +445,7 @@ class Dada2SingleEnd(Dada2Base):
             'qiime dada2 denoise-single',
             f'--i-demultiplexed-seqs {self.demultiplexed_seq_qza}',
             f'--p-trim-left {self.TRIM_LEFT}',
-            f'--p-trunc-len {self.TRUNCATE_LENGTH}',
+            f'--p-trunc-len {self.truncate_lengths[0]}',
             f'--p-max-ee {self.max_expected_error_bases}',
             f'--p-n-threads {self.threads}',
             f'--o-representative-sequences {self.feature_sequence_qza}',
@@ -340,6 +459,7 @@ class Dada2SingleEnd(Dada2Base):
 class Dada2PairedEnd(Dada2Base):
 
     MIN_OVERLAP = 12
+    N_TRUNCATED_READS = 2
 
     def set_cmd(self):
         log = f'{self.outdir}/qiime-dada2-denoise-paired.log'
@@ -348,8 +468,8 @@ class Dada2PairedEnd(Dada2Base):
             f'--i-demultiplexed-seqs {self.demultiplexed_seq_qza}',
             f'--p-trim-left-f {self.TRIM_LEFT}',
             f'--p-trim-left-r {self.TRIM_LEFT}',
-            f'--p-trunc-len-f {self.TRUNCATE_LENGTH}',
-            f'--p-trunc-len-r {self.TRUNCATE_LENGTH}',
+            f'--p-trunc-len-f {self.truncate_lengths[0]}',
+            f'--p-trunc-len-r {self.truncate_lengths[1]}',
             f'--p-max-ee-f {self.max_expected_error_bases}',
             f'--p-max-ee-r {self.max_expected_error_bases}',
             f'--p-min-overlap {self.MIN_OVERLAP}',
@@ -373,6 +493,7 @@ class Dada2PacBio(Dada2Base):
     MIN_LENGTH = 1000
     MAX_LENGTH = 1600
     MIN_FOLD_PARENT_OVER_ABUNDANCE = 3.5
+    N_TRUNCATED_READS = 0  # full-length reads are filtered by MIN_LENGTH and MAX_LENGTH instead
 
     def set_cmd(self):
         log = f'{self.outdir}/qiime-dada2-denoise-ccs.log'
@@ -393,50 +514,3 @@ class Dada2PacBio(Dada2Base):
             f'2>> "{log}"'
         ])
 
-
-#
-
-
-class BatchPool(Processor):
-
-    OUT_FQ_DIRNAME = 'pool_fastqs'
-    OUT_FQ_SUFFIX = '.fastq.gz'
-
-    sample_sheet: str
-    fq_dir: str
-    fq1_suffix: str
-    fq2_suffix: str
-
-    sample_names: List[str]
-    out_fq_dir: str
-
-    def main(
-            self,
-            sample_sheet: str,
-            fq_dir: str,
-            fq1_suffix: str,
-            fq2_suffix: str) -> Tuple[str, str]:
-
-        self.sample_sheet = sample_sheet
-        self.fq_dir = fq_dir
-        self.fq1_suffix = fq1_suffix
-        self.fq2_suffix = fq2_suffix
-
-        self.set_sample_names()
-        self.make_out_fq_dir()
-        for name in self.sample_names:
-            self.process_one_pair(name=name)
-
-        return self.out_fq_dir, self.OUT_FQ_SUFFIX
-
-    def set_sample_names(self):
-        self.sample_names = pd.read_csv(self.sample_sheet, index_col=0).index.tolist()
-
-    def make_out_fq_dir(self):
-        self.out_fq_dir = f'{self.workdir}/{self.OUT_FQ_DIRNAME}'
-        os.makedirs(self.out_fq_dir, exist_ok=True)
-
-    def process_one_pair(self, name: str):
-        fq1 = f'{self.fq_dir}/{name}{self.fq1_suffix}'
-        fq2 = f'{self.fq_dir}/{name}{self.fq2_suffix}'
-        self.call(f'cat {fq1} {fq2} > {self.out_fq_dir}/{name}{self.OUT_FQ_SUFFIX}')
@@ -1,6 +1,9 @@
-from typing import Tuple
-from .template import Processor
+import os
+from typing import List, Dict, Tuple
+from .template import Processor, Settings
 from .importing import ImportSingleEndFastq
+from .dereplication import StreamingDereplication, STREAMING, DEREPLICATION_ENGINES
+from .long_read_filtering import LongReadFilter
 
 
 class GenerateOTU(Processor):
@@ -41,6 +44,76 @@ class GenerateOTU(Processor):
         return self.clustered_table_qza, self.clustered_sequence_qza
 
 
+class GenerateMultiThresholdOTU(Processor):
+    """
+    Clusters the features at several identities in one run, the finest identity first from the input features,
+    and each coarser identity on top of the OTUs of the previous one, which is valid because cluster-features-de-novo
+    keeps the centroid sequences and sums the counts of their members, so that the abundance-sorted input of the next clustering
+    is the finer OTUs with their total counts
+
+    Each coarser clustering runs on fewer features, and every coarse OTU is a union of finer OTUs,
+    while a feature near the boundary of two coarse centroids may be assigned differently than in a direct clustering
+
+    The OTUs of each identity are in its own subdirectory of the workdir (see get_otu_dirname),
+    as is the log in the outdir
+    """
+
+    feature_table_qza: str
+    feature_sequence_qza: str
+    identities: List[float]
+
+    otu_qzas: Dict[float, Tuple[str, str]]
+
+    def main(
+            self,
+            feature_table_qza: str,
+            feature_sequence_qza: str,
+            identities: List[float]) -> Dict[float, Tuple[str, str]]:
+        """
+        Returns:
+            {identity: (clustered_table_qza, clustered_sequence_qza)}
+        """
+        self.feature_table_qza = feature_table_qza
+        self.feature_sequence_qza = feature_sequence_qza
+        self.identities = sorted(set(identities), reverse=True)
+
+        for identity in self.identities:
+            assert 0 < identity <= 1, f'OTU identity {identity} is not in (0, 1]'
+
+        self.otu_qzas = {}
+        table_qza, sequence_qza = self.feature_table_qza, self.feature_sequence_qza
+        for identity in self.identities:
+            self.logger.info(f'Cluster {identity} identity OTUs from "{sequence_qza}"')
+            table_qza, sequence_qza = GenerateOTU(get_otu_settings(settings=self.settings, identity=identity)).main(
+                feature_table_qza=table_qza,
+                feature_sequence_qza=sequence_qza,
+                identity=identity)
+            self.otu_qzas[identity] = (table_qza, sequence_qza)
+
+        return self.otu_qzas
+
+
+def get_otu_settings(settings: Settings, identity: float) -> Settings:
+    """
+    Returns:
+        settings of the outdir and workdir subdirectories of the identity, created if not existing
+    """
+    dirname = get_otu_dirname(identity)
+    otu_settings = settings.for_subtree(
+        outdir=f'{settings.outdir}/{dirname}',
+        workdir=f'{settings.workdir}/{dirname}')
+    for d in [otu_settings.outdir, otu_settings.workdir]:
+        os.makedirs(d, exist_ok=True)
+    return otu_settings
+
+
+def get_otu_dirname(identity: float) -> str:
+    """
+    e.g. 0.97 -> 'otu-97', 0.985 -> 'otu-98.5'
+    """
+    return f'otu-{round(identity * 100, 6):g}'
+
+
 class GenerateNanoporeOTU(Processor):
 
     sample_sheet: str
@@ -48,8 +121,6 @@ class GenerateNanoporeOTU(Processor):
     fq_suffix: str
     identity: float
 
-    single_end_seq_qza: str
-
     dereplicated_table_qza: str
     dereplicated_sequence_qza: str
 
@@ -68,20 +139,76 @@ class GenerateNanoporeOTU(Processor):
         self.fq_suffix = fq_suffix
         self.identity = identity
 
-        self.single_end_seq_qza = ImportSingleEndFastq(self.settings).main(
+        self.dereplicated_table_qza, self.dereplicated_sequence_qza = DereplicateNanoporeReads(self.settings).main(
             sample_sheet=self.sample_sheet,
             fq_dir=self.fq_dir,
             fq_suffix=self.fq_suffix)
 
-        self.dereplicate_sequences()
+        for path in [self.dereplicated_table_qza, self.dereplicated_sequence_qza]:
+            self.register_intermediate(path, consumers=['GenerateOTU'])
 
         self.clustered_table_qza, self.clustered_sequence_qza = GenerateOTU(self.settings).main(
             feature_table_qza=self.dereplicated_table_qza,
             feature_sequence_qza=self.dereplicated_sequence_qza,
             identity=self.identity)
+        self.release_intermediates(consumer='GenerateOTU')
 
         return self.clustered_table_qza, self.clustered_sequence_qza
 
+
+class DereplicateNanoporeReads(Processor):
+
+    sample_sheet: str
+    fq_dir: str
+    fq_suffix: str
+
+    single_end_seq_qza: str
+
+    dereplicated_table_qza: str
+    dereplicated_sequence_qza: str
+
+    def main(
+            self,
+            sample_sheet: str,
+            fq_dir: str,
+            fq_suffix: str) -> Tuple[str, str]:
+
+        self.sample_sheet = sample_sheet
+        self.fq_dir = fq_dir
+        self.fq_suffix = fq_suffix
+
+        assert self.settings.dereplication_engine in DEREPLICATION_ENGINES, f'"{self.settings.dereplication_engine}" is not a valid dereplication engine'
+
+        if self.settings.long_read_filter is not None:
+            self.fq_dir, self.fq_suffix = LongReadFilter(self.settings).main(
+                sample_sheet=self.sample_sheet,
+                fq_dir=self.fq_dir,
+                fq_suffix=self.fq_suffix,
+                platform='nanopore',
+                long_read_filter=self.settings.long_read_filter)
+            self.register_intermediate(self.fq_dir, consumers=['dereplication'])
+
+        if self.settings.dereplication_engine == STREAMING:
+            self.dereplicated_table_qza, self.dereplicated_sequence_qza = StreamingDereplication(self.settings).main(
+                sample_sheet=self.sample_sheet,
+                fq_dir=self.fq_dir,
+                fq_suffix=self.fq_suffix,
+                min_count=self.settings.dereplication_min_count)
+        else:
+            self.single_end_seq_qza = ImportSingleEndFastq(self.settings).main(
+                sample_sheet=self.sample_sheet,
+                fq_dir=self.fq_dir,
+                fq_suffix=self.fq_suffix)
+            self.register_intermediate(self.single_end_seq_qza, consumers=['dereplicate_sequences'])
+
+            self.dereplicate_sequences()
+            self.release_intermediates(consumer='dereplicate_sequences')
+            if self.settings.dereplication_min_count > 1:
+                self.filter_low_count_sequences()
+        self.release_intermediates(consumer='dereplication')
+
+        return self.dereplicated_table_qza, self.dereplicated_sequence_qza
+
     def dereplicate_sequences(self):
         self.dereplicated_table_qza = f'{self.workdir}/dereplicated-table.qza'
         self.dereplicated_sequence_qza = f'{self.workdir}/dereplicated-sequence.qza'
@@ -95,3 +222,30 @@ class GenerateNanoporeOTU(Processor):
             f'2>> "{log}"'
         ])
         self.call(cmd)
+
+    def filter_low_count_sequences(self):
+        table_qza = f'{self.workdir}/dereplicated-filtered-table.qza'
+        sequence_qza = f'{self.workdir}/dereplicated-filtered-sequence.qza'
+        log = f'{self.outdir}/qiime-feature-table-filter.log'
+        for cmd in [
+            self.CMD_LINEBREAK.join([
+                'qiime feature-table filter-features',
+                f'--i-table {self.dereplicated_table_qza}',
+                f'--p-min-frequency {self.settings.dereplication_min_count}',
+                f'--o-filtered-table {table_qza}',
+                f'1>> "{log}"',
+                f'2>> "{log}"'
+            ]),
+            self.CMD_LINEBREAK.join([
+                'qiime feature-table filter-seqs',
+                f'--i-data {self.dereplicated_sequence_qza}',
+                f'--i-table {table_qza}',
+                f'--o-filtered-data {sequence_qza}',
+                f'1>> "{log}"',
+                f'2>> "{log}"'
+            ]),
+        ]:
+            self.call(cmd)
+        for path in [self.dereplicated_table_qza, self.dereplicated_sequence_qza]:
+            self.register_intermediate(path, consumers=[])
+        self.dereplicated_table_qza, self.dereplicated_sequence_qza = table_qza, sequence_qza
@@ -1,8 +1,10 @@
 import os
 import pandas as pd
 from typing import List
+from os.path import basename
 from .utils import edit_fpath
 from .template import Processor
+from .compression import GZIP, transcode
 
 
 class ImportFastq(Processor):
@@ -29,6 +31,7 @@ class ImportSingleEndFastq(ImportFastq):
 
         self.write_manifest_tsv()
         self.import_with_manifest_tsv()
+        self.register_intermediate(f'{self.workdir}/{WriteManifestTsv.DECOMPRESSED_FQ_DIRNAME}', consumers=[])
 
         return self.output_qza
 
@@ -75,6 +78,7 @@ class ImportPairedEndFastq(ImportFastq):
 
         self.write_manifest_tsv()
         self.import_with_manifest_tsv()
+        self.register_intermediate(f'{self.workdir}/{WriteManifestTsv.DECOMPRESSED_FQ_DIRNAME}', consumers=[])
 
         return self.output_qza
 
@@ -106,6 +110,7 @@ class WriteManifestTsv(Processor):
 
     # https://docs.qiime2.org/2021.11/tutorials/importing/
     SAMPLE_ID_COLUMN = 'sample-id'
+    DECOMPRESSED_FQ_DIRNAME = 'manifest_fastqs'
 
     sample_sheet: str
     fq_dir: str
@@ -115,6 +120,20 @@ class WriteManifestTsv(Processor):
     def set_sample_names(self):
         self.sample_names = pd.read_csv(self.sample_sheet, index_col=0).index.tolist()
 
+    def to_importable(self, fq: str) -> str:
+        """
+        qiime tools import only reads gzip or uncompressed fastq, so zstd intermediates are decompressed for it
+        """
+        if not fq.endswith('.zst'):
+            return fq
+        dstdir = f'{os.path.abspath(self.workdir)}/{self.DECOMPRESSED_FQ_DIRNAME}'
+        os.makedirs(dstdir, exist_ok=True)
+        dst = f'{dstdir}/{basename(fq)[:-len(".zst")]}'
+        self.logger.info(f'Decompress "{fq}" to "{dst}"')
+        if not self.mock:
+            transcode(src=fq, dst=dst, policy=GZIP)
+        return dst
+
 
 class WriteSingleEndManifestTsv(WriteManifestTsv):
 
@@ -145,9 +164,11 @@ class WriteSingleEndManifestTsv(WriteManifestTsv):
             for name in self.sample_names
         ]
         self.assert_paths_exist()
+        self.fq_paths = [self.to_importable(p) for p in self.fq_paths]
 
     def assert_paths_exist(self):
         for p in self.fq_paths:
+            self.wait_for_staged_input(p)
             assert os.path.exists(p), f'{p} does not exist'
 
     def write_tsv(self):
@@ -197,10 +218,13 @@ class WritePairedEndManifestTsv(WriteManifestTsv):
             for name in self.sample_names
         ]
         self.assert_paths_exist()
+        self.fq1_paths = [self.to_importable(p) for p in self.fq1_paths]
+        self.fq2_paths = [self.to_importable(p) for p in self.fq2_paths]
 
     def assert_paths_exist(self):
         for paths in [self.fq1_paths, self.fq2_paths]:
             for p in paths:
+                self.wait_for_staged_input(p)
                 assert os.path.exists(p), f'{p} does not exist'
 
     def write_tsv(self):
@@ -261,6 +285,18 @@ class ImportFeatureTable(Processor):
             f'2>> "{log}"'
         ])
         self.call(cmd)
+        self.register_intermediate(self.biom, consumers=[])
+
+
+class ImportBiomFeatureTable(ImportFeatureTable):
+    """
+    For a table already written as HDF5 biom, e.g. built sparse in Python without the dense tsv
+    """
+
+    def main(self, feature_table_biom: str) -> str:
+        self.biom = feature_table_biom
+        self.biom_to_qza()
+        return self.qza
 
 
 class ImportFeatureSequence(Processor):
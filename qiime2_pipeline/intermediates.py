@@ -0,0 +1,96 @@
+import os
+import shutil
+import pandas as pd
+from typing import List, Dict, Union
+
+
+class IntermediateFiles:
+    """
+    Reference counting of intermediate files (or directories) in the workdir
+
+    Each intermediate is registered with the names of the later steps consuming it,
+    and is deleted as soon as the last of its consumers is released
+
+    The workdir size is checked at every release to keep the high-water mark of disk usage
+    """
+
+    workdir: str
+    keep: bool
+
+    consumers: Dict[str, List[str]]
+    high_water_mark: int
+    usage_data: List[Dict[str, Union[str, float]]]
+
+    def __init__(self, workdir: str, keep: bool):
+        self.workdir = workdir
+        self.keep = keep
+        self.consumers = {}
+        self.high_water_mark = 0
+        self.usage_data = []
+
+    def register(self, path: str, consumers: List[str]) -> List[str]:
+        """
+        An intermediate without any consumer is deleted right away
+
+        Returns:
+            deleted paths
+        """
+        self.consumers[path] = list(consumers)
+        return self.__delete_unconsumed()
+
+    def release(self, consumer: str) -> List[str]:
+        """
+        Called when the consumer step finishes
+
+        Returns:
+            deleted paths
+        """
+        self.check_disk_usage(checkpoint=consumer)
+        for consumers in self.consumers.values():
+            if consumer in consumers:
+                consumers.remove(consumer)
+        return self.__delete_unconsumed()
+
+    def __delete_unconsumed(self) -> List[str]:
+        deleted = []
+        for path, consumers in list(self.consumers.items()):
+            if len(consumers) > 0:
+                continue
+            self.consumers.pop(path)
+            if self.keep or not os.path.exists(path):
+                continue
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+            deleted.append(path)
+        return deleted
+
+    def check_disk_usage(self, checkpoint: str):
+        usage = get_disk_usage(self.workdir)
+        self.high_water_mark = max(self.high_water_mark, usage)
+        self.usage_data.append({
+            'Checkpoint': checkpoint,
+            'Disk Usage (GB)': round(usage / 1024 ** 3, 3),
+        })
+
+    def write_report(self, csv: str):
+        df = pd.DataFrame(self.usage_data)
+        df.to_csv(csv, index=False)
+
+
+def get_disk_usage(path: str) -> int:
+    """
+    Returns the total bytes of all files under the path
+    """
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for f in filenames:
+            fpath = os.path.join(dirpath, f)
+            if os.path.islink(fpath):
+                continue
+            try:
+                total += os.path.getsize(fpath)
+            except FileNotFoundError:  # deleted while walking
+                pass
+    return total
@@ -28,6 +28,7 @@ class LefSe(Processor):
         self.sample_sheet = sample_sheet
         self.colors = colors
 
+        self.progress_items(total=len(self.table_tsv_dict), label='LEfSe levels')
         for name, tsv in self.table_tsv_dict.items():
             try:
                 OneLefSe(self.settings).main(
@@ -37,6 +38,7 @@ class LefSe(Processor):
                     colors=self.colors)
             except Exception as e:
                 self.logger.warning(f'Failed to run LefSe on "{name}" table, with Exception:\n{repr(e)}')
+            self.progress_advance()
 
 
 class OneLefSe(Processor):
@@ -0,0 +1,264 @@
+import os
+import numpy as np
+import pandas as pd
+from typing import List, Dict, Tuple, Any, Optional
+from numpy.lib.stride_tricks import sliding_window_view
+from .template import Processor
+from .compression import open_fastq, fastq_extension
+from .pooling import reverse_complement
+
+
+LONG_READ_FILTER_COUNTS_CSV = 'long-read-filter-counts.csv'
+
+FORWARD_PRIMER = 'AGRGTTYGATYMTGGCTCAG'  # 27F, the same as Dada2PacBio
+REVERSE_PRIMER = 'RGYTACCTTGTTACGACTT'  # 1492R
+
+PLATFORM_DEFAULTS = {
+    'pacbio': dict(
+        min_length=1000,
+        max_length=1700,
+        min_mean_quality=20.,
+        max_error_rate=0.01,
+        orient=False),  # Dada2PacBio orients reads by primers itself
+    'nanopore': dict(
+        min_length=1200,
+        max_length=1800,
+        min_mean_quality=10.,
+        max_error_rate=0.1,
+        orient=True),
+}
+
+IUPAC = {
+    'A': 'A', 'C': 'C', 'G': 'G', 'T': 'T',
+    'R': 'AG', 'Y': 'CT', 'S': 'CG', 'W': 'AT', 'K': 'GT', 'M': 'AC',
+    'B': 'CGT', 'D': 'AGT', 'H': 'ACT', 'V': 'ACG', 'N': 'ACGT',
+}
+
+PHRED_OFFSET = 33
+ERROR_PROBABILITIES = 10 ** (-np.arange(256, dtype=np.float64) / 10)
+
+PASSED = 'Passed'
+TOO_SHORT = 'Too Short'
+TOO_LONG = 'Too Long'
+LOW_MEAN_QUALITY = 'Low Mean Quality'
+HIGH_ERROR_RATE = 'High Error Rate'
+NO_PRIMER = 'No Primer'
+OUTCOMES = [TOO_SHORT, TOO_LONG, LOW_MEAN_QUALITY, HIGH_ERROR_RATE, NO_PRIMER, PASSED]
+
+
+class LongReadFilter(Processor):
+    """
+    Filters the raw nanopore or PacBio reads of each sample before importing, one local process per sample,
+    so that reads which would be discarded anyway do not go through import, dereplication and denoising
+
+    A read passes if its length is within [min_length, max_length], its mean Phred score >= min_mean_quality,
+    and its expected error rate (mean error probability of its bases) <= max_error_rate
+
+    With orient, a read is reverse-complemented if the reverse primer (1492R) matches its 5' end better than the forward primer (27F),
+    and dropped if neither matches with at most MAX_PRIMER_MISMATCHES within the first PRIMER_SEARCH_WINDOW bases
+
+    Parameters are PLATFORM_DEFAULTS, overridden by long_read_filter (e.g. settings.long_read_filter),
+    and the outcome counts of each sample are saved to long-read-filter-counts.csv
+    """
+
+    MAX_PRIMER_MISMATCHES = 4
+    PRIMER_SEARCH_WINDOW = 100
+    OUT_FQ_DIRNAME = 'long_read_filtered_fastqs'
+
+    sample_sheet: str
+    fq_dir: str
+    fq_suffix: str
+    platform: str
+    long_read_filter: Dict[str, Any]
+
+    parameters: Dict[str, Any]
+    sample_names: List[str]
+    out_fq_dir: str
+    out_fq_suffix: str
+
+    def main(
+            self,
+            sample_sheet: str,
+            fq_dir: str,
+            fq_suffix: str,
+            platform: str,
+            long_read_filter: Dict[str, Any]) -> Tuple[str, str]:
+        """
+        Args:
+            platform: 'pacbio' or 'nanopore'
+
+            long_read_filter: overrides of the platform defaults
+        """
+        self.sample_sheet = sample_sheet
+        self.fq_dir = fq_dir
+        self.fq_suffix = fq_suffix
+        self.platform = platform
+        self.long_read_filter = long_read_filter
+
+        self.set_parameters()
+        self.sample_names = [str(n) for n in pd.read_csv(self.sample_sheet, index_col=0).index]
+        self.out_fq_dir = f'{self.workdir}/{self.OUT_FQ_DIRNAME}'
+        os.makedirs(self.out_fq_dir, exist_ok=True)
+        self.out_fq_suffix = fastq_extension(self.settings.intermediate_compression)
+        self.filter()
+
+        return self.out_fq_dir, self.out_fq_suffix
+
+    def set_parameters(self):
+        self.parameters = get_filter_parameters(platform=self.platform, long_read_filter=self.long_read_filter)
+        self.logger.info(f'Filter {self.platform} reads with {self.parameters}')
+
+    def filter(self):
+        kwargs_list = [
+            dict(
+                src=f'{self.fq_dir}/{name}{self.fq_suffix}',
+                dst=f'{self.out_fq_dir}/{name}{self.out_fq_suffix}',
+                policy=self.settings.intermediate_compression,
+                max_primer_mismatches=self.MAX_PRIMER_MISMATCHES,
+                primer_search_window=self.PRIMER_SEARCH_WINDOW,
+                **self.parameters)
+            for name in self.sample_names
+        ]
+        for kwargs in kwargs_list:
+            self.logger.info(f'Filter "{kwargs["src"]}" into "{kwargs["dst"]}"')
+        if self.mock:
+            return
+
+        counts = self.map_in_processes(filter_one_sample, kwargs_list, label='samples')
+        df = pd.DataFrame(counts, columns=OUTCOMES)
+        df.insert(0, 'Sample ID', self.sample_names)
+        df.insert(1, 'Input', df[OUTCOMES].sum(axis=1))
+        df.to_csv(f'{self.outdir}/{LONG_READ_FILTER_COUNTS_CSV}', index=False)
+
+
+def get_filter_parameters(platform: str, long_read_filter: Dict[str, Any]) -> Dict[str, Any]:
+    assert platform in PLATFORM_DEFAULTS, f'"{platform}" is not a long-read platform'
+    return {**PLATFORM_DEFAULTS[platform], **long_read_filter}
+
+
+def filter_one_sample(
+        src: str,
+        dst: str,
+        policy: str,
+        min_length: int,
+        max_length: int,
+        min_mean_quality: float,
+        max_error_rate: float,
+        orient: bool,
+        max_primer_mismatches: int,
+        primer_search_window: int) -> Dict[str, int]:
+    """
+    The job function of one sample, dst only appears once completely written
+
+    Returns:
+        number of reads of each outcome in OUTCOMES
+    """
+    forward = get_primer_matrix(FORWARD_PRIMER)
+    reverse = get_primer_matrix(REVERSE_PRIMER)
+    counts = {k: 0 for k in OUTCOMES}
+
+    temp = f'{os.path.dirname(dst)}/filtering-{os.path.basename(dst)}'  # same extension, which determines the compression
+    with open_fastq(src, 'rb') as reader:
+        with open_fastq(temp, 'wb', policy=policy) as writer:
+            while True:
+                header = reader.readline()
+                if not header:
+                    break
+                seq = reader.readline().rstrip(b'\r\n')
+                reader.readline()
+                qual = reader.readline().rstrip(b'\r\n')
+
+                outcome = get_quality_outcome(
+                    qual=qual,
+                    min_length=min_length,
+                    max_length=max_length,
+                    min_mean_quality=min_mean_quality,
+                    max_error_rate=max_error_rate)
+
+                if outcome == PASSED and orient:
+                    f = min_mismatches(seq=seq[:primer_search_window], primer_matrix=forward)
+                    r = min_mismatches(seq=seq[:primer_search_window], primer_matrix=reverse)
+                    if min(f, r) > max_primer_mismatches:
+                        outcome = NO_PRIMER
+                    elif r < f:
+                        seq, qual = reverse_complement(seq), qual[::-1]
+
+                counts[outcome] += 1
+                if outcome == PASSED:
+                    writer.write(b'%s%s\n+\n%s\n' % (header, seq, qual))
+    os.replace(temp, dst)
+
+    return counts
+
+
+def get_quality_outcome(
+        qual: bytes,
+        min_length: int,
+        max_length: int,
+        min_mean_quality: float,
+        max_error_rate: float) -> str:
+    if len(qual) < min_length:
+        return TOO_SHORT
+    if len(qual) > max_length:
+        return TOO_LONG
+    scores = np.frombuffer(qual, dtype=np.uint8) - PHRED_OFFSET
+    if scores.mean() < min_mean_quality:
+        return LOW_MEAN_QUALITY
+    if ERROR_PROBABILITIES[scores].mean() > max_error_rate:
+        return HIGH_ERROR_RATE
+    return PASSED
+
+
+def get_primer_matrix(primer: str) -> np.ndarray:
+    """
+    Returns:
+        boolean matrix of (primer position, byte), True if the byte (upper or lower case base) matches the IUPAC code
+    """
+    matrix = np.zeros((len(primer), 256), dtype=bool)
+    for i, code in enumerate(primer):
+        for base in IUPAC[code]:
+            matrix[i, ord(base)] = True
+            matrix[i, ord(base.lower())] = True
+    return matrix
+
+
+def min_mismatches(seq: bytes, primer_matrix: np.ndarray) -> int:
+    """
+    Returns:
+        the fewest mismatches of the primer at any position of seq, without gaps
+    """
+    length = len(primer_matrix)
+    if len(seq) < length:
+        return length
+    windows = sliding_window_view(np.frombuffer(seq, dtype=np.uint8), length)
+    matches = primer_matrix[np.arange(length), windows].sum(axis=1)
+    return int(length - matches.max())
+
+
+def parse_long_read_filter(value: str) -> Optional[Dict[str, Any]]:
+    """
+    Args:
+        value: 'none', 'default' for the defaults of the platform,
+            or overrides of the defaults, e.g. 'min_length=1300,max_length=1700,orient=false'
+
+    Returns:
+        None if no filtering, otherwise the overrides
+    """
+    if value.lower() == 'none':
+        return None
+    if value.lower() == 'default':
+        return {}
+
+    types = {k: type(v) for k, v in PLATFORM_DEFAULTS['nanopore'].items()}
+    overrides = {}
+    for item in value.split(','):
+        assert '=' in item, f'"{item}" of long-read filter is not key=value'
+        key, val = item.split('=', 1)
+        key = key.strip()
+        assert key in types, f'"{key}" is not a long-read filter parameter, choose from {list(types.keys())}'
+        if types[key] is bool:
+            assert val.lower() in ['true', 'false'], f'"{val}" of {key} is not true or false'
+            overrides[key] = val.lower() == 'true'
+        else:
+            overrides[key] = types[key](val)
+    return overrides
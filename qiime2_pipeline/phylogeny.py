@@ -105,7 +105,8 @@ class MafftFasttree(Processor):
             (self.masked_aligned_seq_qza, self.masked_aligned_seq_fa),
         ]:
             f = ExportAlignedSequence(self.settings).main(aligned_sequence_qza=qza)
-            self.call(f'mv "{f}" "{fa}"')
+            self.move(src=f, dst=fa)
+            self.register_intermediate(qza, consumers=[])
 
     def export_to_nwk(self):
         for qza, nwk in [
@@ -113,7 +114,7 @@ class MafftFasttree(Processor):
             (self.unrooted_tree_qza, self.unrooted_tree_nwk),
         ]:
             f = ExportTree(self.settings).main(tree_qza=qza)
-            self.call(f'mv "{f}" "{nwk}"')
+            self.move(src=f, dst=nwk)
 
 
 class DrawTree(Processor):
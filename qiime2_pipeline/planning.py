@@ -0,0 +1,171 @@
+import os
+import pandas as pd
+from typing import List, Dict, Optional
+from .template import Processor
+from .qiime2_pipeline import get_planned_stages
+from .cost_models import StageCostModel, get_cost_models, calibrate_cost_models, get_units, expected_features, \
+    estimate_reads, format_seconds
+
+
+class PlanPipeline(Processor):
+    """
+    Projects a timeline of Qiime2Pipeline stages without running any of them
+    """
+
+    sample_sheet: str
+    fq_dir: str
+    fq1_suffix: str
+    fq2_suffix: Optional[str]
+    sequencing_platform: str
+    skip_otu: bool
+    max_reads_per_sample: int
+    pilot_fraction: float
+    dna_concentration_column: Optional[str]
+    negative_control_column: Optional[str]
+    feature_classifier: str
+    skip_differential_abundance: bool
+    run_profiles: List[str]
+
+    input_df: pd.DataFrame
+    units: Dict[str, float]
+    cost_models: Dict[str, 'StageCostModel']
+    plan_df: pd.DataFrame
+
+    def main(
+            self,
+            sample_sheet: str,
+            fq_dir: str,
+            fq1_suffix: str,
+            fq2_suffix: Optional[str],
+            sequencing_platform: str,
+            skip_otu: bool,
+            max_reads_per_sample: int,
+            pilot_fraction: float,
+            dna_concentration_column: Optional[str],
+            negative_control_column: Optional[str],
+            feature_classifier: str,
+            skip_differential_abundance: bool,
+            run_profiles: List[str]) -> str:
+
+        self.sample_sheet = sample_sheet
+        self.fq_dir = fq_dir
+        self.fq1_suffix = fq1_suffix
+        self.fq2_suffix = fq2_suffix
+        self.sequencing_platform = sequencing_platform
+        self.skip_otu = skip_otu
+        self.max_reads_per_sample = max_reads_per_sample
+        self.pilot_fraction = pilot_fraction
+        self.dna_concentration_column = dna_concentration_column
+        self.negative_control_column = negative_control_column
+        self.feature_classifier = feature_classifier
+        self.skip_differential_abundance = skip_differential_abundance
+        self.run_profiles = run_profiles
+
+        self.inspect_inputs()
+        self.set_units()
+        self.set_cost_models()
+        self.calibrate_cost_models()
+        self.project_timeline()
+        return self.save_plan()
+
+    def inspect_inputs(self):
+        self.input_df = InspectInputs(self.settings).main(
+            sample_sheet=self.sample_sheet,
+            fq_dir=self.fq_dir,
+            fq1_suffix=self.fq1_suffix,
+            fq2_suffix=self.fq2_suffix)
+
+    def set_units(self):
+        samples = len(self.input_df)
+        reads = self.input_df['Estimated Reads'].sum()
+        features = expected_features(samples=samples, platform=self.sequencing_platform)
+        self.units = get_units(samples=samples, reads=reads, features=features)
+        self.logger.info(f'''\
+Samples: {samples}
+FASTQ size: {self.input_df['FASTQ Bytes'].sum() / 1e9:.2f} GB
+Estimated reads: {reads:,}
+Expected features: {features:,}''')
+
+    def set_cost_models(self):
+        self.cost_models = get_cost_models(
+            sequencing_platform=self.sequencing_platform,
+            paired_end=self.fq2_suffix is not None,
+            skip_otu=self.skip_otu,
+            feature_classifier=self.feature_classifier)
+
+    def calibrate_cost_models(self):
+        for csv in self.run_profiles:
+            self.logger.info(f'Calibrate cost models with "{csv}"')
+        calibrate_cost_models(cost_models=self.cost_models, run_profiles=self.run_profiles)
+
+    def project_timeline(self):
+        data = []
+        clock = 0.
+        for stage in self.get_planned_stages():
+            model = self.cost_models[stage]
+            seconds = model.seconds(units=self.units[model.unit], threads=self.threads)
+            data.append({
+                'Stage': stage,
+                'Start': format_seconds(clock),
+                'Duration': format_seconds(seconds),
+                'End': format_seconds(clock + seconds),
+                'Peak Memory (GB)': round(model.peak_memory_mb(units=self.units[model.unit]) / 1024, 2),
+                'Calibrated': model.n_observations > 0,
+            })
+            clock += seconds
+        self.plan_df = pd.DataFrame(data)
+
+        msg = self.plan_df.to_string(index=False)
+        msg += f'\n\nProjected total time with {self.threads} threads: {format_seconds(clock)}'
+        msg += f'\nProjected peak memory: {self.plan_df["Peak Memory (GB)"].max()} GB'
+        self.logger.info(msg)
+
+    def get_planned_stages(self) -> List[str]:
+        return get_planned_stages(
+            dna_concentration_column=self.dna_concentration_column,
+            negative_control_column=self.negative_control_column,
+            skip_differential_abundance=self.skip_differential_abundance,
+            input_staging_workers=self.settings.input_staging_workers,
+            subsample_reads=self.max_reads_per_sample > 0 or self.pilot_fraction < 1,
+            fastqc=self.settings.run_fastqc)
+
+    def save_plan(self) -> str:
+        csv = f'{self.outdir}/plan.csv'
+        self.plan_df.to_csv(csv, index=False)
+        return csv
+
+
+class InspectInputs(Processor):
+
+    SAMPLED_BYTES = 4 * 1024 ** 2
+
+    sample_sheet: str
+    fq_dir: str
+    fq1_suffix: str
+    fq2_suffix: Optional[str]
+
+    def main(
+            self,
+            sample_sheet: str,
+            fq_dir: str,
+            fq1_suffix: str,
+            fq2_suffix: Optional[str]) -> pd.DataFrame:
+
+        self.sample_sheet = sample_sheet
+        self.fq_dir = fq_dir
+        self.fq1_suffix = fq1_suffix
+        self.fq2_suffix = fq2_suffix
+
+        data = []
+        for name in pd.read_csv(self.sample_sheet, index_col=0).index:
+            fqs = [f'{self.fq_dir}/{name}{self.fq1_suffix}']
+            if self.fq2_suffix is not None:
+                fqs.append(f'{self.fq_dir}/{name}{self.fq2_suffix}')
+            data.append({
+                'Sample': name,
+                'FASTQ Bytes': sum(os.path.getsize(fq) for fq in fqs),
+                'Estimated Reads': sum(estimate_reads(fq=fq, sampled_bytes=self.SAMPLED_BYTES) for fq in fqs),
+            })
+
+        return pd.DataFrame(data)
+
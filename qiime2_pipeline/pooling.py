@@ -0,0 +1,196 @@
+import os
+import zlib
+import pandas as pd
+from os.path import dirname, basename
+from typing import List, Dict, Tuple, Any, BinaryIO
+from .template import Processor
+from .file_operations import BUFFER_BYTES
+from .compression import fastq_extension, open_fastq, import_zstandard
+
+
+POOLED_READ_COUNTS_CSV = 'pooled-read-counts.csv'
+
+COMPLEMENT = bytes.maketrans(b'ACGTRYKMBVDHNacgtrykmbvdhn', b'TGCAYRMKVBHDNtgcayrmkvbhdn')
+
+
+class BatchPool(Processor):
+    """
+    Pools R1 and R2 of each sample into one single-end fastq, the samples concurrently,
+    one local process per thread or one job per sample on the executor
+
+    Without reverse complement, the compressed bytes of R1 and R2 are copied as they are
+    (concatenated gzip members or zstd frames are still valid streams), and decompressed on the fly for counting
+
+    With reverse complement, R1 is still copied as it is, and R2 is streamed record by record
+    into a new compressed member appended after R1, so that all pooled reads share the orientation of R1
+
+    Per-sample read counts are saved to pooled-read-counts.csv
+    """
+
+    OUT_FQ_DIRNAME = 'pool_fastqs'
+
+    sample_sheet: str
+    fq_dir: str
+    fq1_suffix: str
+    fq2_suffix: str
+    reverse_complement_r2: bool
+
+    sample_names: List[str]
+    out_fq_dir: str
+    out_fq_suffix: str
+
+    def main(
+            self,
+            sample_sheet: str,
+            fq_dir: str,
+            fq1_suffix: str,
+            fq2_suffix: str,
+            reverse_complement_r2: bool) -> Tuple[str, str]:
+
+        self.sample_sheet = sample_sheet
+        self.fq_dir = fq_dir
+        self.fq1_suffix = fq1_suffix
+        self.fq2_suffix = fq2_suffix
+        self.reverse_complement_r2 = reverse_complement_r2
+
+        self.set_sample_names()
+        self.make_out_fq_dir()
+        self.out_fq_suffix = fastq_extension(self.settings.intermediate_compression)
+        self.pool()
+
+        return self.out_fq_dir, self.out_fq_suffix
+
+    def set_sample_names(self):
+        self.sample_names = pd.read_csv(self.sample_sheet, index_col=0).index.tolist()
+
+    def make_out_fq_dir(self):
+        self.out_fq_dir = f'{self.workdir}/{self.OUT_FQ_DIRNAME}'
+        os.makedirs(self.out_fq_dir, exist_ok=True)
+
+    def pool(self):
+        kwargs_list = [self.get_one_pair_kwargs(name=name) for name in self.sample_names]
+        for kwargs in kwargs_list:
+            rc = ' (R2 reverse-complemented)' if self.reverse_complement_r2 else ''
+            self.logger.info(f'Pool "{kwargs["fq1"]}" and "{kwargs["fq2"]}" into "{kwargs["dst"]}"{rc}')
+        if self.mock:
+            return
+
+        counts = self.map_in_processes(pool_one_pair, kwargs_list, label='samples')
+        save_pooled_read_counts(
+            csv=f'{self.outdir}/{POOLED_READ_COUNTS_CSV}',
+            sample_names=self.sample_names,
+            counts=counts)
+
+    def get_one_pair_kwargs(self, name: str) -> Dict[str, Any]:
+        return dict(
+            fq1=f'{self.fq_dir}/{name}{self.fq1_suffix}',
+            fq2=f'{self.fq_dir}/{name}{self.fq2_suffix}',
+            dst=f'{self.out_fq_dir}/{name}{self.out_fq_suffix}',
+            reverse_complement_r2=self.reverse_complement_r2,
+            policy=self.settings.intermediate_compression)
+
+
+def pool_one_pair(
+        fq1: str,
+        fq2: str,
+        dst: str,
+        reverse_complement_r2: bool,
+        policy: str) -> Tuple[int, int]:
+    """
+    The job function of one sample, dst only appears once completely written
+
+    Returns:
+        number of reads of R1 and R2
+    """
+    temp = f'{dirname(dst)}/pooling-{basename(dst)}'  # same extension, which determines the compression
+    with open(temp, 'wb') as writer:
+        n1 = copy_counting_reads(src=fq1, writer=writer)
+        if not reverse_complement_r2:
+            n2 = copy_counting_reads(src=fq2, writer=writer)
+    if reverse_complement_r2:
+        with open_fastq(fq2, 'rb') as reader:
+            with open_fastq(temp, 'ab', policy=policy) as writer:
+                n2 = write_reverse_complement(reader=reader, writer=writer)
+    os.replace(temp, dst)
+
+    return n1, n2
+
+
+def copy_counting_reads(src: str, writer: BinaryIO) -> int:
+    """
+    Copies the bytes of src as they are, counting its reads on the way, so that src is read only once
+
+    Returns:
+        number of reads
+    """
+    counter = LineCounter(compression=src.rsplit('.', 1)[-1])
+    with open(src, 'rb') as reader:
+        for chunk in iter(lambda: reader.read(BUFFER_BYTES), b''):
+            writer.write(chunk)
+            counter.feed(chunk)
+    return counter.n_lines // 4
+
+
+class LineCounter:
+    """
+    Counts the lines of a gzip (.gz), zstd (.zst) or uncompressed stream fed as compressed chunks,
+    across concatenated gzip members or zstd frames
+    """
+
+    compression: str
+    n_lines: int
+
+    def __init__(self, compression: str):
+        self.compression = compression
+        self.n_lines = 0
+        self.decompressor = self.new_decompressor()
+
+    def new_decompressor(self):
+        if self.compression == 'gz':
+            return zlib.decompressobj(wbits=zlib.MAX_WBITS | 16)
+        if self.compression == 'zst':
+            return import_zstandard().ZstdDecompressor().decompressobj()
+        return None
+
+    def feed(self, chunk: bytes):
+        if self.decompressor is None:
+            self.n_lines += chunk.count(b'\n')
+            return
+        while len(chunk) > 0:
+            self.n_lines += self.decompressor.decompress(chunk).count(b'\n')
+            if not self.decompressor.eof:
+                return
+            chunk = self.decompressor.unused_data  # the start of the next member or frame
+            self.decompressor = self.new_decompressor()
+
+
+def write_reverse_complement(reader, writer) -> int:
+    """
+    Returns:
+        number of reads written
+    """
+    n = 0
+    while True:
+        header = reader.readline()
+        if not header:
+            break
+        seq = reader.readline().rstrip(b'\r\n')
+        reader.readline()
+        qual = reader.readline().rstrip(b'\r\n')
+        writer.write(b'%s%s\n+\n%s\n' % (header, reverse_complement(seq), qual[::-1]))
+        n += 1
+    return n
+
+
+def reverse_complement(seq: bytes) -> bytes:
+    return seq[::-1].translate(COMPLEMENT)
+
+
+def save_pooled_read_counts(csv: str, sample_names: List[str], counts: List[Tuple[int, int]]):
+    df = pd.DataFrame({
+        'Sample ID': sample_names,
+        'R1': [n1 for n1, _ in counts],
+        'R2': [n2 for _, n2 in counts],
+        'Pooled': [n1 + n2 for n1, n2 in counts],
+    })
+    df.to_csv(csv, index=False)
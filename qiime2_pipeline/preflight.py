@@ -0,0 +1,202 @@
+import os
+import gzip
+import zlib
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional, Tuple
+from .template import Processor
+
+
+PREFLIGHT_REPORT_CSV = 'preflight-report.csv'
+
+
+class Preflight(Processor):
+    """
+    Validates all input FASTQs before any heavy stage, so that a bad input stops the run within minutes:
+        existence
+        gzip integrity, i.e. the whole stream decompresses and passes the CRC check
+        record count, i.e. complete 4-line records
+        structure and read IDs of the first SAMPLED_RECORDS records
+        R1/R2 pairing, i.e. equal record counts and concordant read IDs
+
+    Files are checked in parallel, zlib releases the GIL while decompressing
+
+    Writes a report of all samples, and raises with all problems at once if any
+    """
+
+    SAMPLED_RECORDS = 1000
+    MAX_PROBLEMS_IN_MESSAGE = 20
+
+    sample_sheet: str
+    fq_dir: str
+    fq1_suffix: str
+    fq2_suffix: Optional[str]
+
+    sample_names: List[str]
+    results: Dict[str, Dict[str, Any]]
+    report_df: pd.DataFrame
+
+    def main(
+            self,
+            sample_sheet: str,
+            fq_dir: str,
+            fq1_suffix: str,
+            fq2_suffix: Optional[str]) -> pd.DataFrame:
+        """
+        Returns:
+            the report, with the read counts in the columns of raw-read-counts.csv
+        """
+        self.sample_sheet = sample_sheet
+        self.fq_dir = fq_dir
+        self.fq1_suffix = fq1_suffix
+        self.fq2_suffix = fq2_suffix
+
+        self.sample_names = pd.read_csv(self.sample_sheet, index_col=0).index.tolist()
+        self.check_files()
+        self.set_report_df()
+        self.save_report()
+        self.raise_if_any_problem()
+
+        return self.report_df
+
+    def get_fqs(self, name: str) -> List[str]:
+        fqs = [f'{self.fq_dir}/{name}{self.fq1_suffix}']
+        if self.fq2_suffix is not None:
+            fqs.append(f'{self.fq_dir}/{name}{self.fq2_suffix}')
+        return fqs
+
+    def check_files(self):
+        fqs = [fq for name in self.sample_names for fq in self.get_fqs(name)]
+        self.logger.info(f'Check {len(fqs)} FASTQ files in "{self.fq_dir}" with {self.threads} threads')
+        self.progress_items(total=len(fqs), label='FASTQ files')
+        self.results = {}
+        with ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix='Preflight') as pool:
+            for fq, result in zip(fqs, pool.map(self.check_one, fqs)):
+                self.results[fq] = result
+                self.progress_advance()
+
+    def check_one(self, fq: str) -> Dict[str, Any]:
+        return check_fastq(fq=fq, sampled_records=self.SAMPLED_RECORDS)
+
+    def set_report_df(self):
+        data = []
+        for name in self.sample_names:
+            fqs = self.get_fqs(name)
+            results = [self.results[fq] for fq in fqs]
+
+            problems = []
+            for fq, result in zip(fqs, results):
+                problems += [f'{os.path.basename(fq)}: {p}' for p in result['problems']]
+            if len(results) == 2:
+                problems += check_pair(r1=results[0], r2=results[1])
+
+            row = {'Sample ID': name}
+            if len(results) == 1:
+                row['Count'] = results[0]['records']
+            else:
+                row['Count (R1)'] = results[0]['records']
+                row['Count (R2)'] = results[1]['records']
+            row['Problems'] = '; '.join(problems)
+            data.append(row)
+        self.report_df = pd.DataFrame(data)
+
+    def save_report(self):
+        self.report_df.to_csv(f'{self.outdir}/{PREFLIGHT_REPORT_CSV}', index=False)
+
+    def raise_if_any_problem(self):
+        df = self.report_df[self.report_df['Problems'] != '']
+        if len(df) == 0:
+            self.logger.info(f'All {len(self.report_df)} samples passed the preflight check')
+            return
+        lines = [f'{row["Sample ID"]}: {row["Problems"]}' for _, row in df.head(self.MAX_PROBLEMS_IN_MESSAGE).iterrows()]
+        if len(df) > self.MAX_PROBLEMS_IN_MESSAGE:
+            lines.append(f'... and {len(df) - self.MAX_PROBLEMS_IN_MESSAGE} more samples')
+        msg = '\n'.join(lines)
+        raise ValueError(f'{len(df)} of {len(self.report_df)} samples failed the preflight check, see "{self.outdir}/{PREFLIGHT_REPORT_CSV}":\n{msg}')
+
+
+def check_fastq(fq: str, sampled_records: int) -> Dict[str, Any]:
+    """
+    Returns:
+        {'records': int or None if unknown, 'read_ids': the first sampled_records read IDs, 'problems': [str]}
+    """
+    ret = {'records': None, 'read_ids': [], 'problems': []}
+    if not os.path.exists(fq):
+        ret['problems'].append('does not exist')
+        return ret
+
+    fh = gzip.open(fq, 'rb') if fq.endswith('.gz') else open(fq, 'rb')
+    try:
+        lines, last_byte, head = count_lines(fh=fh, head_lines=4 * sampled_records)
+    except (OSError, EOFError, zlib.error) as e:  # gzip.BadGzipFile is an OSError
+        ret['problems'].append(f'corrupt or truncated gzip ({e})')
+        return ret
+    finally:
+        fh.close()
+
+    if last_byte not in [b'', b'\n']:
+        lines += 1  # a last line without line break
+        ret['problems'].append('truncated last line')
+    if lines % 4 != 0:
+        ret['problems'].append(f'{lines} lines, not complete 4-line records')
+    ret['records'] = lines // 4
+
+    read_ids, problems = parse_records(head)
+    ret['read_ids'] = read_ids
+    ret['problems'] += problems
+    return ret
+
+
+def count_lines(fh: Any, head_lines: int, buffer_bytes: int = 1024 ** 2) -> Tuple[int, bytes, List[bytes]]:
+    """
+    Returns:
+        number of line breaks, the last byte, the first head_lines lines
+    """
+    lines = 0
+    last_byte = b''
+    head = b''
+    while True:
+        chunk = fh.read(buffer_bytes)
+        if not chunk:
+            break
+        if lines < head_lines:
+            head += chunk
+        lines += chunk.count(b'\n')
+        last_byte = chunk[-1:]
+    return lines, last_byte, head.split(b'\n')[:head_lines]
+
+
+def parse_records(lines: List[bytes]) -> Tuple[List[str], List[str]]:
+    read_ids = []
+    for i in range(0, len(lines) - 3, 4):
+        header, seq, plus, qual = lines[i:i + 4]
+        n = i // 4 + 1
+        if not header.startswith(b'@'):
+            return read_ids, [f'record {n} has no "@" header']
+        if not plus.startswith(b'+'):
+            return read_ids, [f'record {n} has no "+" separator']
+        if len(seq) != len(qual):
+            return read_ids, [f'record {n} has {len(seq)} bases but {len(qual)} quality scores']
+        read_ids.append(normalize_read_id(header.decode(errors='replace')))
+    return read_ids, []
+
+
+def normalize_read_id(header: str) -> str:
+    """
+    '@M01234:1:000:1:1:1:1 1:N:0:1' -> 'M01234:1:000:1:1:1:1', '@read1/1' -> 'read1'
+    """
+    read_id = header[1:].split()[0] if len(header) > 1 else ''
+    if read_id.endswith('/1') or read_id.endswith('/2'):
+        read_id = read_id[:-2]
+    return read_id
+
+
+def check_pair(r1: Dict[str, Any], r2: Dict[str, Any]) -> List[str]:
+    if r1['records'] is None or r2['records'] is None:
+        return []  # already reported
+    if r1['records'] != r2['records']:
+        return [f'R1 has {r1["records"]} reads but R2 has {r2["records"]}']
+    for i, (id1, id2) in enumerate(zip(r1['read_ids'], r2['read_ids'])):
+        if id1 != id2:
+            return [f'read IDs of R1 and R2 differ at record {i + 1}: "{id1}" vs "{id2}"']
+    return []
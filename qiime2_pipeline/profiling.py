@@ -0,0 +1,82 @@
+import time
+import resource
+import pandas as pd
+from typing import List, Dict, Union, Optional
+
+
+RUN_PROFILE_CSV = 'run-profile.csv'
+
+
+class StageProfiler:
+    """
+    Records wall time and peak memory of each pipeline stage
+
+    Peak memory comes from getrusage(), which only reports the all-time max RSS
+    of this process and of its largest terminated child process,
+    so a stage gets a peak only if it raised one of the two maxima,
+    otherwise its peak is left empty, i.e. not larger than an earlier stage
+    """
+
+    threads: int
+
+    stage: Optional[str]
+    start_time: float
+    self_maxrss: int
+    children_maxrss: int
+
+    rows: List[Dict[str, Union[str, float, int]]]
+
+    def __init__(self, threads: int):
+        self.threads = threads
+        self.stage = None
+        self.self_maxrss = get_maxrss(resource.RUSAGE_SELF)
+        self.children_maxrss = get_maxrss(resource.RUSAGE_CHILDREN)
+        self.rows = []
+
+    def start(self, stage: str):
+        self.stage = stage
+        self.start_time = time.time()
+
+    def stop(self):
+        seconds = time.time() - self.start_time
+
+        peaks = []
+        for who, previous in [
+            (resource.RUSAGE_SELF, self.self_maxrss),
+            (resource.RUSAGE_CHILDREN, self.children_maxrss),
+        ]:
+            current = get_maxrss(who)
+            if current > previous:
+                peaks.append(current)
+
+        self.self_maxrss = get_maxrss(resource.RUSAGE_SELF)
+        self.children_maxrss = get_maxrss(resource.RUSAGE_CHILDREN)
+
+        self.rows.append({
+            'Stage': self.stage,
+            'Seconds': round(seconds, 1),
+            'Peak Memory (MB)': round(max(peaks) / 1024, 1) if len(peaks) > 0 else None,
+            'Threads': self.threads,
+        })
+        self.stage = None
+
+    def write_csv(
+            self,
+            csv: str,
+            samples: int,
+            reads: int,
+            features: int):
+
+        df = pd.DataFrame(self.rows)
+        # run-level sizes are repeated in every row, so each row alone calibrates a cost model
+        df['Samples'] = samples
+        df['Reads'] = reads
+        df['Features'] = features
+        df.to_csv(csv, index=False)
+
+
+def get_maxrss(who: int) -> int:
+    """
+    Returns max resident set size in KB (Linux reports ru_maxrss in KB)
+    """
+    return resource.getrusage(who).ru_maxrss
@@ -0,0 +1,173 @@
+import os
+import sys
+import json
+import time
+import threading
+from typing import List, Dict, Any, Optional, TextIO
+from .cost_models import format_seconds
+
+
+PROGRESS_JSON = 'progress.json'
+
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+
+
+class StageProgress:
+    """
+    Keeps {outdir}/progress.json up to date with the status of each pipeline stage,
+    so that other processes (e.g. the service) can follow a run
+
+    Within a stage, loops over samples or analysis items report their items done,
+    and the time remaining is the estimated seconds of the pending stages
+    plus what is left of the running stage, extrapolated from its items if it reports any
+
+    Item updates are written at most every WRITE_INTERVAL_SECONDS, stage changes right away
+    """
+
+    WRITE_INTERVAL_SECONDS = 1.
+    BAR_WIDTH = 30
+
+    json_path: str
+    stages: Dict[str, Dict[str, Any]]
+    start_time: float
+    estimates: Dict[str, float]
+    display: Optional[TextIO]
+
+    current: Optional[str]
+    items: Optional[Dict[str, Any]]
+    last_write: float
+    lock: threading.RLock
+
+    def __init__(self, json_path: str, stages: List[str], display: bool = False):
+        self.json_path = json_path
+        self.stages = {s: {'status': PENDING, 'seconds': None} for s in stages}
+        self.start_time = time.time()
+        self.estimates = {}
+        self.display = sys.stderr if display else None
+        self.current = None
+        self.items = None
+        self.last_write = 0.
+        self.lock = threading.RLock()
+        self.write()
+
+    def set_estimates(self, estimates: Dict[str, float]):
+        """
+        Args:
+            estimates: {stage: seconds}, e.g. from the cost models calibrated with the run profiles of earlier runs
+        """
+        with self.lock:
+            self.estimates = {k: v for k, v in estimates.items() if k in self.stages}
+            self.write()
+
+    def start(self, stage: str):
+        with self.lock:
+            self.stages[stage]['status'] = RUNNING
+            self.stages[stage]['started'] = time.time()
+            self.current = stage
+            self.items = None
+            self.write()
+
+    def stop(self, stage: str):
+        with self.lock:
+            s = self.stages[stage]
+            s['status'] = DONE
+            s['seconds'] = round(time.time() - s.pop('started'), 1)
+            self.current = None
+            self.items = None
+            self.write()
+
+    def start_items(self, total: int, label: str):
+        """
+        A new loop of the running stage, replacing the previous one
+        """
+        with self.lock:
+            if self.current is None:
+                return
+            self.items = {'label': label, 'done': 0, 'total': total, 'started': time.time()}
+            self.write()
+
+    def advance(self, n: int = 1):
+        with self.lock:
+            if self.items is None:
+                return
+            self.items['done'] = min(self.items['done'] + n, self.items['total'])
+            if self.items['done'] == self.items['total'] or time.time() - self.last_write >= self.WRITE_INTERVAL_SECONDS:
+                self.write()
+
+    def get_eta_seconds(self) -> Optional[float]:
+        if len(self.estimates) == 0:
+            return None
+        eta = sum(self.estimates.get(k, 0.) for k, v in self.stages.items() if v['status'] == PENDING)
+        if self.current is not None:
+            eta += self.get_current_stage_remaining_seconds()
+        return round(eta, 1)
+
+    def get_current_stage_remaining_seconds(self) -> float:
+        items = self.items
+        if items is not None and items['done'] > 0:
+            seconds_per_item = (time.time() - items['started']) / items['done']
+            return seconds_per_item * (items['total'] - items['done'])
+        elapsed = time.time() - self.stages[self.current]['started']
+        return max(self.estimates.get(self.current, 0.) - elapsed, 0.)
+
+    def get_data(self) -> Dict[str, Any]:
+        with self.lock:
+            n_done = sum(s['status'] == DONE for s in self.stages.values())
+            stages = []
+            for k, v in self.stages.items():
+                stage = {'stage': k, **v}
+                if k == self.current and self.items is not None:
+                    stage['items'] = {key: self.items[key] for key in ['label', 'done', 'total']}
+                stages.append(stage)
+            return {
+                'elapsed_seconds': round(time.time() - self.start_time, 1),
+                'eta_seconds': self.get_eta_seconds(),
+                'stages_done': n_done,
+                'stages_total': len(self.stages),
+                'stages': stages,
+            }
+
+    def write(self):
+        with self.lock:
+            data = self.get_data()
+            temp = f'{self.json_path}.tmp'
+            with open(temp, 'w') as fh:
+                json.dump(data, fh, indent=2)
+            os.replace(temp, self.json_path)  # readers never see a partial file
+            self.last_write = time.time()
+            if self.display is not None:
+                self.display.write(format_progress_line(data=data, bar_width=self.BAR_WIDTH) + '\n')
+                self.display.flush()
+
+
+def format_progress_line(data: Dict[str, Any], bar_width: int) -> str:
+    """
+    e.g. [######------------------------] 4/18 generate_asv_otu TrimOnePairedEndSample 12/48 | elapsed 0:12:05 | ETA 1:02:31
+    """
+    fraction = data['stages_done'] / max(data['stages_total'], 1)
+    running = [s for s in data['stages'] if s['status'] == RUNNING]
+
+    line = f'{data["stages_done"]}/{data["stages_total"]}'
+    if len(running) > 0:
+        stage = running[0]
+        line += f' {stage["stage"]}'
+        items = stage.get('items')
+        if items is not None:
+            line += f' {items["label"]} {items["done"]}/{items["total"]}'
+            fraction += items['done'] / max(items['total'], 1) / max(data['stages_total'], 1)
+
+    filled = int(round(fraction * bar_width))
+    line = f'[{"#" * filled}{"-" * (bar_width - filled)}] {line} | elapsed {format_seconds(data["elapsed_seconds"])}'
+    if data['eta_seconds'] is not None:
+        line += f' | ETA {format_seconds(data["eta_seconds"])}'
+    return line
+
+
+def read_progress(outdir: str) -> Dict[str, Any]:
+    path = f'{outdir}/{PROGRESS_JSON}'
+    if not os.path.exists(path):
+        return {}
+    with open(path) as fh:
+        return json.load(fh)
@@ -1,5 +1,9 @@
+import threading
+import pandas as pd
 from os import makedirs
-from typing import List, Optional, Dict
+from contextlib import nullcontext
+from os.path import exists
+from typing import List, Optional, Dict, Tuple, Any
 from .lefse import LefSe
 from .taxonomy import Taxonomy
 from .decontam import Decontam
@@ -13,17 +17,96 @@ from .venn import PlotVennDiagrams
 from .taxon_table import TaxonTable
 from .labeling import FeatureLabeling
 from .generate_asv import GenerateASV
+from .feature_store import IncrementalGenerateASV
 from .exporting import ExportFeatureTable
 from .raw_read_counts import RawReadCounts
 from .taxon_barplot import PlotTaxonBarplots
 from .sample_sheet import TranscribeSampleSheet
 from .alpha_rarefaction import AlphaRarefaction
+from .staging import InputStager
+from .preflight import Preflight
+from .subsampling import SubsampleReads
+from .fastqc import FastQC
+from .profiling import StageProfiler, RUN_PROFILE_CSV
+from .progress import StageProgress, PROGRESS_JSON
+from .cost_models import get_cost_models, calibrate_cost_models, get_units, expected_features, estimate_reads, \
+    estimate_stage_seconds
 from .differential_abundance import DifferentialAbundance
-from .generate_otu import GenerateOTU, GenerateNanoporeOTU
+from .generate_otu import GenerateOTU, GenerateMultiThresholdOTU, DereplicateNanoporeReads, get_otu_settings
+from .reference_otu import ReferenceOTU, DE_NOVO, OPEN_REFERENCE
+
+
+SERIALIZED_STAGE_LOCK = threading.Lock()
 
 
 class Qiime2Pipeline(Processor):
 
+    STAGES = [
+        'transcribe_sample_sheet',
+        'preflight',
+        'stage_inputs',
+        'raw_read_counts',
+        'subsample_reads',
+        'fastqc',
+        'set_colors',
+        'generate_asv_otu',
+        'decontamination',
+        'taxonomic_classification',
+        'feature_labeling',
+        'taxon_table',
+        'alpha_diversity',
+        'alpha_rarefaction',
+        'phylogeny_and_beta_diversity',
+        'plot_heatmaps',
+        'plot_venn_diagrams',
+        'taxon_barplot',
+        'lefse',
+        'differential_abundance',
+        'collect_log_files',
+    ]
+
+    # in-process matplotlib, ete3 (Qt) and rpy2 are not thread-safe,
+    # so concurrent pipelines in one process (batch mode) take turns in these stages
+    SERIALIZED_STAGES = [
+        'set_colors',
+        'alpha_diversity',
+        'phylogeny_and_beta_diversity',
+        'plot_heatmaps',
+        'plot_venn_diagrams',
+        'taxon_barplot',
+        'lefse',
+        'differential_abundance',
+    ]
+
+    # with several OTU identities, each of these stages runs once per identity, in the subtree of the identity
+    OTU_STAGES = [
+        'decontamination',
+        'taxonomic_classification',
+        'feature_labeling',
+        'taxon_table',
+        'alpha_diversity',
+        'alpha_rarefaction',
+        'phylogeny_and_beta_diversity',
+        'plot_heatmaps',
+        'plot_venn_diagrams',
+        'taxon_barplot',
+        'lefse',
+        'differential_abundance',
+    ]
+    OTU_STATE_ATTRIBUTES = [
+        'settings',
+        'feature_table_qza',
+        'feature_sequence_qza',
+        'taxonomy_qza',
+        'labeled_feature_table_tsv',
+        'labeled_feature_table_qza',
+        'labeled_feature_sequence_fa',
+        'labeled_feature_sequence_qza',
+        'taxon_table_tsv_dict',
+    ]
+
+    ESTIMATE_READS_SAMPLED_BYTES = 1024 ** 2
+
     sample_sheet: str
     fq_dir: str
     fq1_suffix: str
@@ -35,12 +118,20 @@ class Qiime2Pipeline(Processor):
     clip_r2_5_prime: int
 
     paired_end_mode: str
+    reverse_complement_r2: bool
     max_expected_error_bases: float
+    feature_store: Optional[str]
 
-    otu_identity: float
+    max_reads_per_sample: int
+    pilot_fraction: float
+    subsample_seed: int
+
+    otu_identities: List[float]
+    otu_clustering: str
     skip_otu: bool
 
     dna_concentration_column: Optional[str]
+    negative_control_column: Optional[str]
     decontam_threshold: float
 
     feature_classifier: str
@@ -69,6 +160,11 @@ class Qiime2Pipeline(Processor):
     labeled_feature_sequence_fa: str
     labeled_feature_sequence_qza: str
     taxon_table_tsv_dict: Dict[str, str]
+    preflight_df: Optional[pd.DataFrame]
+    otu_states: List[Dict[str, Any]]
+
+    profiler: StageProfiler
+    progress: StageProgress
 
     def main(
             self,
@@ -83,12 +179,20 @@ class Qiime2Pipeline(Processor):
             clip_r2_5_prime: int,
 
             paired_end_mode: str,
+            reverse_complement_r2: bool,
             max_expected_error_bases: float,
+            feature_store: Optional[str],
+
+            max_reads_per_sample: int,
+            pilot_fraction: float,
+            subsample_seed: int,
 
-            otu_identity: float,
+            otu_identities: List[float],
+            otu_clustering: str,
             skip_otu: bool,
 
             dna_concentration_column: Optional[str],
+            negative_control_column: Optional[str],
             decontam_threshold: float,
 
             feature_classifier: str,
@@ -119,12 +223,20 @@ class Qiime2Pipeline(Processor):
         self.clip_r2_5_prime = clip_r2_5_prime
 
         self.paired_end_mode = paired_end_mode
+        self.reverse_complement_r2 = reverse_complement_r2
         self.max_expected_error_bases = max_expected_error_bases
+        self.feature_store = feature_store
 
-        self.otu_identity = otu_identity
+        self.max_reads_per_sample = max_reads_per_sample
+        self.pilot_fraction = pilot_fraction
+        self.subsample_seed = subsample_seed
+
+        self.otu_identities = otu_identities
+        self.otu_clustering = otu_clustering
         self.skip_otu = skip_otu
 
         self.dna_concentration_column = dna_concentration_column
+        self.negative_control_column = negative_control_column
         self.decontam_threshold = decontam_threshold
 
         self.feature_classifier = feature_classifier
@@ -144,37 +256,165 @@ class Qiime2Pipeline(Processor):
         self.differential_abundance_p_value = differential_abundance_p_value
         self.min_abundance_per_group = min_abundance_per_group
 
-        self.transcribe_sample_sheet()
-
-        self.raw_read_counts()
-        self.set_colors()
-
-        self.generate_asv_otu()
-        self.decontamination()
+        self.preflight_df = None
+        self.otu_states = []
+
+        self.profiler = StageProfiler(threads=self.threads)
+        self.progress = StageProgress(
+            json_path=f'{self.outdir}/{PROGRESS_JSON}',
+            stages=get_planned_stages(
+                dna_concentration_column=self.dna_concentration_column,
+                negative_control_column=self.negative_control_column,
+                skip_differential_abundance=self.skip_differential_abundance,
+                input_staging_workers=self.settings.input_staging_workers,
+                subsample_reads=self.max_reads_per_sample > 0 or self.pilot_fraction < 1,
+                fastqc=self.settings.run_fastqc),
+            display=self.settings.progress_display)
+        self.settings.progress = self.progress
+        try:
+            for stage in self.progress.stages:  # skipped stages are not planned
+                with self.stage_lock(stage):
+                    self.profiler.start(stage=stage)
+                    self.progress.start(stage=stage)
+                    self.run_stage(stage)
+                    self.progress.stop(stage=stage)
+                    self.profiler.stop()
+                self.release_intermediates(consumer=stage)
+        finally:
+            self.stop_staging()
+            self.settings.progress = None
+
+        self.write_run_profile()
+        self.report_disk_usage()
+
+    def run_stage(self, stage: str):
+        if stage not in self.OTU_STAGES or len(self.otu_states) == 0:
+            getattr(self, stage)()
+            return
 
-        self.taxonomic_classification()
-        self.feature_labeling()
-        self.taxon_table()
+        main_state = self.get_otu_state()
+        for otu_state in self.otu_states:
+            self.set_otu_state(otu_state)
+            getattr(self, stage)()
+            otu_state.update(self.get_otu_state())
+        self.set_otu_state(main_state)
 
-        self.alpha_diversity()
-        self.alpha_rarefaction()
+    def get_otu_state(self) -> Dict[str, Any]:
+        return {k: getattr(self, k) for k in self.OTU_STATE_ATTRIBUTES if hasattr(self, k)}
 
-        self.phylogeny_and_beta_diversity()
+    def set_otu_state(self, state: Dict[str, Any]):
+        for k in self.OTU_STATE_ATTRIBUTES:
+            if k in state:
+                setattr(self, k, state[k])
+            elif hasattr(self, k):
+                delattr(self, k)
 
-        self.plot_heatmaps()
-        self.plot_venn_diagrams()
-        self.taxon_barplot()
-        self.lefse()
-        self.differential_abundance()
+    def planned(self, stages: List[str]) -> List[str]:
+        # an intermediate consumed by a stage that is not planned would never be released
+        return [s for s in stages if s in self.progress.stages]
 
-        self.collect_log_files()
+    def stage_lock(self, stage: str):
+        return SERIALIZED_STAGE_LOCK if stage in self.SERIALIZED_STAGES else nullcontext()
 
     def transcribe_sample_sheet(self):
         self.sample_sheet = TranscribeSampleSheet(self.settings).main(
             sample_sheet=self.sample_sheet)
+        self.estimate_stage_seconds(reads=self.estimate_total_reads())
+
+    def estimate_total_reads(self) -> int:
+        if self.mock:
+            return 0
+        reads = 0
+        for name in pd.read_csv(self.sample_sheet, index_col=0).index:
+            fqs = [f'{self.fq_dir}/{name}{self.fq1_suffix}']
+            if self.fq2_suffix is not None:
+                fqs.append(f'{self.fq_dir}/{name}{self.fq2_suffix}')
+            for fq in fqs:
+                try:
+                    reads += estimate_reads(fq=fq, sampled_bytes=self.ESTIMATE_READS_SAMPLED_BYTES)
+                except (OSError, EOFError):
+                    pass  # missing or corrupt, reported by the preflight
+        return reads
+
+    def estimate_stage_seconds(self, reads: int):
+        """
+        Time estimates of the progress report, from the cost models of --plan calibrated with --run-profiles
+        """
+        samples = len(pd.read_csv(self.sample_sheet, index_col=0))
+        cost_models = get_cost_models(
+            sequencing_platform=self.sequencing_platform,
+            paired_end=self.fq2_suffix is not None,
+            skip_otu=self.skip_otu,
+            feature_classifier=self.feature_classifier)
+        calibrate_cost_models(cost_models=cost_models, run_profiles=self.settings.run_profiles)
+        self.progress.set_estimates(estimate_stage_seconds(
+            cost_models=cost_models,
+            stages=list(self.progress.stages.keys()),
+            units=get_units(
+                samples=samples,
+                reads=reads,
+                features=expected_features(samples=samples, platform=self.sequencing_platform)),
+            threads=self.threads))
+
+    def preflight(self):
+        if self.mock:
+            return
+        self.preflight_df = Preflight(self.settings).main(
+            sample_sheet=self.sample_sheet,
+            fq_dir=self.fq_dir,
+            fq1_suffix=self.fq1_suffix,
+            fq2_suffix=self.fq2_suffix)
+        reads = int(self.preflight_df.drop(columns=['Sample ID', 'Problems']).sum().sum())
+        self.estimate_stage_seconds(reads=reads)  # exact counts for a better estimate
+
+    def stage_inputs(self):
+        if self.settings.input_staging_workers == 0 or self.mock:
+            return
+
+        srcs = []
+        for name in pd.read_csv(self.sample_sheet, index_col=0).index:
+            srcs.append(f'{self.fq_dir}/{name}{self.fq1_suffix}')
+            if self.fq2_suffix is not None:
+                srcs.append(f'{self.fq_dir}/{name}{self.fq2_suffix}')
+
+        dstdir = f'{self.workdir}/staged_fastqs'
+        self.logger.info(f'Stage {len(srcs)} input files from "{self.fq_dir}" to "{dstdir}" with {self.settings.input_staging_workers} workers')
+        self.settings.input_stager = InputStager(dstdir=dstdir, max_workers=self.settings.input_staging_workers)
+        self.settings.input_stager.start(srcs=srcs)
+        self.register_intermediate(dstdir, consumers=self.planned(['raw_read_counts', 'fastqc', 'generate_asv_otu']))
+
+        self.fq_dir = dstdir
+
+    def stop_staging(self):
+        if self.settings.input_stager is not None:
+            self.settings.input_stager.shutdown()
+            self.settings.input_stager = None
 
     def raw_read_counts(self):
-        RawReadCounts(self.settings).main(
+        if self.preflight_df is not None:  # already counted, no need to read the inputs again
+            self.preflight_df.drop(columns='Problems').to_csv(f'{self.outdir}/raw-read-counts.csv', index=False)
+        else:
+            RawReadCounts(self.settings).main(
+                sample_sheet=self.sample_sheet,
+                fq_dir=self.fq_dir,
+                fq1_suffix=self.fq1_suffix,
+                fq2_suffix=self.fq2_suffix)
+
+    def subsample_reads(self):
+        if self.mock:
+            return
+        self.fq_dir = SubsampleReads(self.settings).main(
+            sample_sheet=self.sample_sheet,
+            fq_dir=self.fq_dir,
+            fq1_suffix=self.fq1_suffix,
+            fq2_suffix=self.fq2_suffix,
+            max_reads_per_sample=self.max_reads_per_sample,
+            pilot_fraction=self.pilot_fraction,
+            seed=self.subsample_seed)
+        self.register_intermediate(self.fq_dir, consumers=self.planned(['fastqc', 'generate_asv_otu']))
+
+    def fastqc(self):
+        FastQC(self.settings).main(
             sample_sheet=self.sample_sheet,
             fq_dir=self.fq_dir,
             fq1_suffix=self.fq1_suffix,
@@ -188,44 +428,104 @@ class Qiime2Pipeline(Processor):
 
     def generate_asv_otu(self):
         if self.sequencing_platform == 'nanopore':
-            self.feature_table_qza, self.feature_sequence_qza = GenerateNanoporeOTU(self.settings).main(
+            assert self.feature_store is None, 'Feature store only works with the ASVs of illumina or pacbio'
+            self.feature_table_qza, self.feature_sequence_qza = DereplicateNanoporeReads(self.settings).main(
                 sample_sheet=self.sample_sheet,
                 fq_dir=self.fq_dir,
-                fq_suffix=self.fq1_suffix,
-                identity=self.otu_identity)
+                fq_suffix=self.fq1_suffix)
+            self.cluster_otus()
 
         elif self.sequencing_platform in ['illumina', 'pacbio']:
-            self.feature_table_qza, self.feature_sequence_qza = GenerateASV(self.settings).main(
-                sample_sheet=self.sample_sheet,
+            generate_asv_kwargs = dict(
                 fq_dir=self.fq_dir,
                 fq1_suffix=self.fq1_suffix,
                 fq2_suffix=self.fq2_suffix,
                 pacbio=self.sequencing_platform == 'pacbio',
                 paired_end_mode=self.paired_end_mode,
+                reverse_complement_r2=self.reverse_complement_r2,
                 clip_r1_5_prime=self.clip_r1_5_prime,
                 clip_r2_5_prime=self.clip_r2_5_prime,
-                max_expected_error_bases=self.max_expected_error_bases)
+                max_expected_error_bases=self.max_expected_error_bases,
+                long_read_filter=self.settings.long_read_filter)
+            if self.feature_store is None:
+                self.feature_table_qza, self.feature_sequence_qza = GenerateASV(self.settings).main(
+                    sample_sheet=self.sample_sheet,
+                    **generate_asv_kwargs)
+            else:
+                self.feature_table_qza, self.feature_sequence_qza = IncrementalGenerateASV(self.settings).main(
+                    feature_store=self.feature_store,
+                    sample_sheet=self.sample_sheet,
+                    generate_asv_kwargs=generate_asv_kwargs)
             if not self.skip_otu:
-                self.feature_table_qza, self.feature_sequence_qza = GenerateOTU(self.settings).main(
-                    feature_table_qza=self.feature_table_qza,
-                    feature_sequence_qza=self.feature_sequence_qza,
-                    identity=self.otu_identity)
+                self.cluster_otus()
 
         else:
             raise ValueError(f'Invalid sequencing platform: {self.sequencing_platform}')
 
+    def cluster_otus(self):
+        for path in [self.feature_table_qza, self.feature_sequence_qza]:
+            self.register_intermediate(path, consumers=['GenerateOTU'])
+
+        if self.otu_clustering != DE_NOVO:
+            self.cluster_otus_to_reference()
+        elif len(set(self.otu_identities)) == 1:
+            self.feature_table_qza, self.feature_sequence_qza = GenerateOTU(self.settings).main(
+                feature_table_qza=self.feature_table_qza,
+                feature_sequence_qza=self.feature_sequence_qza,
+                identity=self.otu_identities[0])
+        else:
+            otu_qzas = GenerateMultiThresholdOTU(self.settings).main(
+                feature_table_qza=self.feature_table_qza,
+                feature_sequence_qza=self.feature_sequence_qza,
+                identities=self.otu_identities)
+            self.set_otu_states(otu_qzas=otu_qzas)
+
+        self.release_intermediates(consumer='GenerateOTU')
+
+    def cluster_otus_to_reference(self):
+        # features are mapped independently at each identity, not stacked as de novo, because mapping is per feature
+        assert self.reference_sequence_qza is not None, f'Reference sequence qza is required for {self.otu_clustering} OTU clustering'
+        kwargs = dict(
+            feature_table_qza=self.feature_table_qza,
+            feature_sequence_qza=self.feature_sequence_qza,
+            reference_sequence_qza=self.reference_sequence_qza,
+            open_reference=self.otu_clustering == OPEN_REFERENCE)
+
+        if len(set(self.otu_identities)) == 1:
+            self.feature_table_qza, self.feature_sequence_qza = ReferenceOTU(self.settings).main(
+                identity=self.otu_identities[0], **kwargs)
+        else:
+            otu_qzas = {}
+            for identity in sorted(set(self.otu_identities), reverse=True):
+                otu_qzas[identity] = ReferenceOTU(get_otu_settings(settings=self.settings, identity=identity)).main(
+                    identity=identity, **kwargs)
+            self.set_otu_states(otu_qzas=otu_qzas)
+
+    def set_otu_states(self, otu_qzas: Dict[float, Tuple[str, str]]):
+        self.otu_states = []
+        for identity, (table_qza, sequence_qza) in otu_qzas.items():
+            self.otu_states.append({
+                'settings': get_otu_settings(settings=self.settings, identity=identity),
+                'feature_table_qza': table_qza,
+                'feature_sequence_qza': sequence_qza,
+            })
+
     def decontamination(self):
         # decontam needs to work right after ASV/OTU generation, before taxonomy annotation
         # because taxonomy annotation adds SPACES to feature names, not compatible with fasta header format,
         # so it breaks decontam
-        if self.dna_concentration_column is None:
+        if self.dna_concentration_column is None and self.negative_control_column is None:
             return
+        for path in [self.feature_table_qza, self.feature_sequence_qza]:
+            self.register_intermediate(path, consumers=['Decontam'])
         self.feature_table_qza, self.feature_sequence_qza = Decontam(self.settings).main(
             feature_table_qza=self.feature_table_qza,
             feature_sequence_qza=self.feature_sequence_qza,
             sample_sheet=self.sample_sheet,
             dna_concentration_column=self.dna_concentration_column,
+            negative_control_column=self.negative_control_column,
             decontam_threshold=self.decontam_threshold)
+        self.release_intermediates(consumer='Decontam')
 
     def taxonomic_classification(self):
         self.taxonomy_qza = Taxonomy(self.settings).main(
@@ -314,6 +614,54 @@ class Qiime2Pipeline(Processor):
             min_abundance_per_group=self.min_abundance_per_group)
 
     def collect_log_files(self):
-        makedirs(f'{self.outdir}/log', exist_ok=True)
-        cmd = f'mv "{self.outdir}"/*.log "{self.outdir}"/log/'
-        self.call(cmd)
+        for outdir in [self.outdir] + [s['settings'].outdir for s in self.otu_states]:
+            makedirs(f'{outdir}/log', exist_ok=True)
+            self.move_glob(srcdir=outdir, pattern='*.log', dstdir=f'{outdir}/log')
+
+    def write_run_profile(self):
+        if self.mock:
+            return
+        samples = len(pd.read_csv(self.sample_sheet, index_col=0))
+
+        reads = 0
+        raw_read_counts_csv = f'{self.outdir}/raw-read-counts.csv'
+        if exists(raw_read_counts_csv):
+            df = pd.read_csv(raw_read_counts_csv, index_col=0)
+            reads = int(df.sum().sum())
+
+        # the finest OTUs with several identities
+        labeled_feature_table_tsv = self.otu_states[0]['labeled_feature_table_tsv'] if len(self.otu_states) > 0 \
+            else self.labeled_feature_table_tsv
+        features = len(pd.read_csv(labeled_feature_table_tsv, sep='\t'))
+
+        self.profiler.write_csv(
+            csv=f'{self.outdir}/{RUN_PROFILE_CSV}',
+            samples=samples,
+            reads=reads,
+            features=features)
+
+    def report_disk_usage(self):
+        intermediates = self.settings.intermediates
+        intermediates.write_report(csv=f'{self.outdir}/workdir-disk-usage.csv')
+        self.logger.info(f'High-water mark of workdir disk usage: {intermediates.high_water_mark / 1024 ** 3:.2f} GB')
+
+
+def get_planned_stages(
+        dna_concentration_column: Optional[str],
+        negative_control_column: Optional[str],
+        skip_differential_abundance: bool,
+        input_staging_workers: int,
+        subsample_reads: bool,
+        fastqc: bool) -> List[str]:
+    skipped = []
+    if dna_concentration_column is None and negative_control_column is None:
+        skipped.append('decontamination')
+    if skip_differential_abundance:
+        skipped.append('differential_abundance')
+    if input_staging_workers == 0:
+        skipped.append('stage_inputs')
+    if not subsample_reads:
+        skipped.append('subsample_reads')
+    if not fastqc:
+        skipped.append('fastqc')
+    return [s for s in Qiime2Pipeline.STAGES if s not in skipped]
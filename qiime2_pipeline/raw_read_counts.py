@@ -77,12 +77,16 @@ class PairedEnd(Processor):
 
     def read_fqs(self):
         self.data = []
+        self.progress_items(total=len(self.fq1s), label='samples')
         for fq1, fq2 in zip(self.fq1s, self.fq2s):
+            self.wait_for_staged_input(fq1)
+            self.wait_for_staged_input(fq2)
             self.data.append({
                 'Sample ID': basename(fq1)[:-len(self.fq1_suffix)],
                 'Count (R1)': count_reads(fq1),
                 'Count (R2)': count_reads(fq2),
             })
+            self.progress_advance()
 
     def save_csv(self):
         pd.DataFrame(self.data).to_csv(f'{self.outdir}/raw-read-counts.csv', index=False)
@@ -120,11 +124,14 @@ class SingleEnd(Processor):
 
     def read_fqs(self):
         self.data = []
+        self.progress_items(total=len(self.fqs), label='samples')
         for fq in self.fqs:
+            self.wait_for_staged_input(fq)
             self.data.append({
                 'Sample ID': basename(fq)[:-len(self.fq_suffix)],
                 'Count': count_reads(fq)
             })
+            self.progress_advance()
 
     def save_csv(self):
         pd.DataFrame(self.data).to_csv(f'{self.outdir}/raw-read-counts.csv', index=False)
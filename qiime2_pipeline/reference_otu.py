@@ -0,0 +1,304 @@
+import os
+import uuid
+import pandas as pd
+from os.path import exists
+from typing import List, Dict, Tuple
+from .template import Processor
+from .utils import get_artifact_uuid
+from .fasta import FastaParser, FastaWriter
+from .importing import ImportFeatureTable, ImportFeatureSequence
+from .exporting import ExportFeatureTable, ExportFeatureSequence
+
+
+DE_NOVO = 'de_novo'
+CLOSED_REFERENCE = 'closed_reference'
+OPEN_REFERENCE = 'open_reference'
+OTU_CLUSTERING_METHODS = [DE_NOVO, CLOSED_REFERENCE, OPEN_REFERENCE]
+
+
+class ReferenceIndex(Processor):
+    """
+    Exports the reference sequences and builds their vsearch database (UDB) once,
+    cached in cache_dir under the UUID of the reference artifact, which is unique to its content,
+    so later runs (and concurrent batches) with the same reference skip the export and the indexing
+
+    Cached files are written under a temporary name unique to each call and renamed when complete,
+    so concurrent builds of the same index (e.g. batch projects, threads of the same process) do not collide
+    """
+
+    reference_sequence_qza: str
+    cache_dir: str
+
+    uuid: str
+    fa: str
+    udb: str
+
+    def main(self, reference_sequence_qza: str, cache_dir: str) -> Tuple[str, str]:
+        """
+        Returns:
+            reference fasta and UDB
+        """
+        self.reference_sequence_qza = reference_sequence_qza
+        self.cache_dir = cache_dir
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.uuid = 'mock' if self.mock else get_artifact_uuid(self.reference_sequence_qza)
+        self.fa = f'{self.cache_dir}/{self.uuid}.fa'
+        self.udb = f'{self.cache_dir}/{self.uuid}.udb'
+
+        if exists(self.fa) and exists(self.udb):
+            self.logger.info(f'Use the cached reference index "{self.udb}"')
+            return self.fa, self.udb
+
+        self.export_fa()
+        self.make_udb()
+
+        return self.fa, self.udb
+
+    def export_fa(self):
+        fa = ExportFeatureSequence(self.settings).main(feature_sequence_qza=self.reference_sequence_qza)
+        temp = f'{self.fa}.{uuid.uuid4().hex}.temp'
+        self.move(src=fa, dst=temp)
+        self.move(src=temp, dst=self.fa)
+
+    def make_udb(self):
+        temp = f'{self.udb}.{uuid.uuid4().hex}.temp'
+        log = f'{self.outdir}/vsearch-makeudb-usearch.log'
+        cmd = self.CMD_LINEBREAK.join([
+            'vsearch',
+            f'--makeudb_usearch "{self.fa}"',
+            f'--output "{temp}"',
+            f'1>> "{log}"',
+            f'2>> "{log}"'
+        ])
+        self.call(cmd)
+        self.move(src=temp, dst=self.udb)
+
+
+class ReferenceOTU(Processor):
+    """
+    Closed-reference OTUs: each feature is mapped to its best reference sequence with identity >= identity,
+    and the counts of the features mapped to the same reference sequence are summed into the OTU of that reference sequence,
+    unmatched features are dropped
+
+    Open-reference OTUs: unmatched features are clustered de novo instead (largest first),
+    and each de novo OTU is named after its centroid feature
+
+    The features are mapped in chunks, concurrently, against the cached ReferenceIndex
+
+    Because each feature is mapped on its own, closed-reference OTU tables of separate batches
+    (with the same reference and identity) can be merged with 'qiime feature-table merge' without reclustering,
+    whereas the de novo OTUs of open-reference only merge if the same centroids are chosen
+    """
+
+    MIN_FEATURES_PER_CHUNK = 1000
+    MAPPING_TSV = 'reference-otu-mapping.tsv'
+
+    feature_table_qza: str
+    feature_sequence_qza: str
+    reference_sequence_qza: str
+    identity: float
+    open_reference: bool
+
+    reference_fa: str
+    reference_udb: str
+    feature_table: pd.DataFrame
+    feature_sequence_fa: str
+    feature_to_otu: Dict[str, str]
+    de_novo_otus: List[str]
+
+    clustered_table_qza: str
+    clustered_sequence_qza: str
+
+    def main(
+            self,
+            feature_table_qza: str,
+            feature_sequence_qza: str,
+            reference_sequence_qza: str,
+            identity: float,
+            open_reference: bool) -> Tuple[str, str]:
+
+        self.feature_table_qza = feature_table_qza
+        self.feature_sequence_qza = feature_sequence_qza
+        self.reference_sequence_qza = reference_sequence_qza
+        self.identity = identity
+        self.open_reference = open_reference
+
+        self.reference_fa, self.reference_udb = ReferenceIndex(self.settings).main(
+            reference_sequence_qza=self.reference_sequence_qza,
+            cache_dir=self.settings.reference_cache_dir or f'{self.workdir}/reference_index')
+
+        self.export_features()
+        self.map_to_reference()
+        if self.open_reference:
+            self.cluster_unmatched()
+        self.save_mapping()
+        self.write_otu_table()
+        self.write_otu_sequences()
+
+        return self.clustered_table_qza, self.clustered_sequence_qza
+
+    def export_features(self):
+        tsv = ExportFeatureTable(self.settings).main(feature_table_qza=self.feature_table_qza)
+        self.feature_sequence_fa = ExportFeatureSequence(self.settings).main(feature_sequence_qza=self.feature_sequence_qza)
+        self.feature_table = pd.DataFrame() if self.mock else pd.read_csv(tsv, sep='\t', index_col=0)
+        self.feature_table.index = self.feature_table.index.astype(str)
+        self.register_intermediate(tsv, consumers=[])
+        self.register_intermediate(self.feature_sequence_fa, consumers=['write_otu_sequences'])
+
+    def map_to_reference(self):
+        n_chunks = max(1, min(self.threads, len(self.feature_table) // self.MIN_FEATURES_PER_CHUNK))
+        chunk_fas = [f'{self.workdir}/reference-otu-query-{i + 1}.fa' for i in range(n_chunks)]
+        ucs = [f'{self.workdir}/reference-otu-query-{i + 1}.uc' for i in range(n_chunks)]
+        if not self.mock:
+            split_fasta(fa=self.feature_sequence_fa, dsts=chunk_fas)
+
+        threads = self.settings.thread_budget.share(n_tasks=n_chunks)
+        log = f'{self.outdir}/vsearch-usearch-global.log'
+        cmds = [
+            self.CMD_LINEBREAK.join([
+                'vsearch',
+                f'--usearch_global "{fa}"',
+                f'--db "{self.reference_udb}"',
+                f'--id {self.identity}',
+                '--strand plus',
+                '--qmask none',
+                f'--threads {threads}',
+                f'--uc "{uc}"',
+                f'1>> "{log}"',
+                f'2>> "{log}"'
+            ])
+            for fa, uc in zip(chunk_fas, ucs)
+        ]
+        self.call_all(cmds, threads=threads)
+
+        self.feature_to_otu = {}
+        self.de_novo_otus = []
+        for uc in ucs:
+            if not self.mock:
+                self.feature_to_otu.update(read_uc_hits(uc))
+        for path in chunk_fas + ucs:
+            self.register_intermediate(path, consumers=[])
+
+        n = len(self.feature_table)
+        self.logger.info(f'{len(self.feature_to_otu)} of {n} features mapped to the reference at identity {self.identity}')
+
+    def cluster_unmatched(self):
+        unmatched = [f for f in self.feature_table.index if f not in self.feature_to_otu]
+        sizes = self.feature_table.loc[unmatched].sum(axis=1).sort_values(ascending=False, kind='stable')
+
+        fa = f'{self.workdir}/reference-otu-unmatched.fa'
+        uc = f'{self.workdir}/reference-otu-unmatched.uc'
+        if not self.mock:
+            write_sized_fasta(src=self.feature_sequence_fa, dst=fa, sizes=sizes.to_dict())
+
+        log = f'{self.outdir}/vsearch-cluster-size.log'
+        cmd = self.CMD_LINEBREAK.join([
+            'vsearch',
+            f'--cluster_size "{fa}"',
+            f'--id {self.identity}',
+            '--sizein',
+            '--qmask none',
+            f'--threads {self.threads}',
+            f'--uc "{uc}"',
+            f'1>> "{log}"',
+            f'2>> "{log}"'
+        ])
+        if len(unmatched) > 0 or self.mock:
+            self.call(cmd)
+
+        de_novo = {} if self.mock or len(unmatched) == 0 else read_uc_clusters(uc)
+        self.feature_to_otu.update(de_novo)
+        self.de_novo_otus = sorted(set(de_novo.values()))
+        for path in [fa, uc]:
+            self.register_intermediate(path, consumers=[])
+        self.logger.info(f'{len(unmatched)} unmatched features clustered into {len(self.de_novo_otus)} de novo OTUs')
+
+    def save_mapping(self):
+        df = pd.DataFrame({
+            'Feature ID': list(self.feature_to_otu.keys()),
+            'OTU ID': list(self.feature_to_otu.values()),
+        })
+        df.to_csv(f'{self.outdir}/{self.MAPPING_TSV}', sep='\t', index=False)
+
+    def write_otu_table(self):
+        tsv = f'{self.workdir}/otu-feature-table.tsv'
+        df = self.feature_table.loc[[f for f in self.feature_table.index if f in self.feature_to_otu]]
+        df = df.groupby(by=lambda f: self.feature_to_otu[f], sort=False).sum()
+        df.index.name = '#OTU ID'
+        df.to_csv(tsv, sep='\t')
+        self.clustered_table_qza = ImportFeatureTable(self.settings).main(feature_table_tsv=tsv)
+        self.register_intermediate(tsv, consumers=[])
+
+    def write_otu_sequences(self):
+        fa = f'{self.workdir}/otu-feature-sequence.fa'
+        de_novo_otus = set(self.de_novo_otus)
+        reference_otus = set(self.feature_to_otu.values()) - de_novo_otus
+        if not self.mock:
+            with FastaWriter(fa) as writer:
+                for src, ids in [(self.reference_fa, reference_otus), (self.feature_sequence_fa, de_novo_otus)]:
+                    with FastaParser(src) as parser:
+                        for header, seq in parser:
+                            id_ = header.split()[0]
+                            if id_ in ids:
+                                writer.write(id_, seq)
+        self.clustered_sequence_qza = ImportFeatureSequence(self.settings).main(feature_sequence_fa=fa)
+        self.register_intermediate(fa, consumers=[])
+        self.release_intermediates(consumer='write_otu_sequences')
+
+
+def split_fasta(fa: str, dsts: List[str]):
+    """
+    Splits the records of fa into contiguous chunks of similar sizes
+    """
+    with FastaParser(fa) as parser:
+        records = list(parser)
+    size = -(-len(records) // len(dsts))
+    for i, dst in enumerate(dsts):
+        with FastaWriter(dst) as writer:
+            for header, seq in records[i * size:(i + 1) * size]:
+                writer.write(header, seq)
+
+
+def write_sized_fasta(src: str, dst: str, sizes: Dict[str, int]):
+    """
+    Writes the records of sizes, in the order of sizes, with the vsearch size annotation (';size=n')
+    """
+    with FastaParser(src) as parser:
+        seqs = {header.split()[0]: seq for header, seq in parser if header.split()[0] in sizes}
+    with FastaWriter(dst) as writer:
+        for id_, size in sizes.items():
+            writer.write(f'{id_};size={int(size)}', seqs[id_])
+
+
+def read_uc_hits(uc: str) -> Dict[str, str]:
+    """
+    Returns:
+        {query: target} of the hit (H) records of a usearch_global uc file
+    """
+    hits = {}
+    with open(uc) as fh:
+        for line in fh:
+            fields = line.rstrip('\n').split('\t')
+            if fields[0] == 'H':
+                hits[fields[8].split()[0]] = fields[9].split()[0]
+    return hits
+
+
+def read_uc_clusters(uc: str) -> Dict[str, str]:
+    """
+    Returns:
+        {member: centroid} of a cluster_size uc file, a centroid is its own member, size annotations removed
+    """
+    def strip(label: str) -> str:
+        return label.split()[0].split(';size=')[0]
+
+    clusters = {}
+    with open(uc) as fh:
+        for line in fh:
+            fields = line.rstrip('\n').split('\t')
+            if fields[0] == 'S':
+                clusters[strip(fields[8])] = strip(fields[8])
+            elif fields[0] == 'H':
+                clusters[strip(fields[8])] = strip(fields[9])
+    return clusters
@@ -0,0 +1,342 @@
+import os
+import re
+import sys
+import shlex
+import errno
+import signal
+import asyncio
+from typing import List, Optional, Callable, Tuple, BinaryIO
+from .thread_budget import ThreadBudget, thread_limit_env
+
+
+OK = 'ok'
+TIMEOUT = 'timeout'
+OOM_KILL = 'oom-kill'
+SIGNAL = 'signal'
+NON_ZERO_EXIT = 'non-zero-exit'
+TRANSIENT_IO = 'transient-io'
+LAUNCH_ERROR = 'launch-error'
+
+RETRYABLE = [TIMEOUT, TRANSIENT_IO]  # the others would fail the same way again
+
+TRANSIENT_ERRNOS = [errno.EAGAIN, errno.EIO, errno.ESTALE, errno.EBUSY, errno.ETXTBSY, errno.EINTR]
+TRANSIENT_IO_MESSAGES = [
+    b'Stale file handle',
+    b'Input/output error',
+    b'Resource temporarily unavailable',
+    b'Connection reset by peer',
+    b'Text file busy',
+]
+OOM_MESSAGES = [
+    b'MemoryError',
+    b'std::bad_alloc',
+    b'Cannot allocate memory',
+    b'Out of memory',
+]
+
+SHELL_METACHARACTERS = '|&;<>()*?[]{}~!'
+REDIRECT_PATTERN = re.compile(r'\s+([12])>>\s*"([^"]*)"\s*$')
+QUOTED_PATTERN = re.compile(r'"(?:[^"\\]|\\.)*"|\'[^\']*\'')
+
+
+class Command:
+
+    cmd: str
+    args: List[str]
+    shell: bool
+    stdout: Optional[str]
+    stderr: Optional[str]
+
+    def __init__(
+            self,
+            cmd: str,
+            args: List[str],
+            shell: bool,
+            stdout: Optional[str],
+            stderr: Optional[str]):
+        self.cmd = cmd
+        self.args = args
+        self.shell = shell
+        self.stdout = stdout
+        self.stderr = stderr
+
+
+def parse_command(cmd: str) -> Command:
+    """
+    Parses a command string as written by the Processors, i.e. joined with CMD_LINEBREAK
+    and ending with optional '1>> "log"' and '2>> "log"' redirects
+
+    The redirects are taken over by the runner, anything else needing a shell
+    (pipes, globs, other redirects, variables) falls back to running the whole string with a shell
+    """
+    s = cmd.replace('\\\n', ' ').strip()
+
+    logs = {}
+    while True:
+        match = REDIRECT_PATTERN.search(s)
+        if match is None:
+            break
+        logs[match.group(1)] = match.group(2)
+        s = s[:match.start()]
+
+    unquoted = QUOTED_PATTERN.sub('', s)
+    needs_shell = any(c in unquoted for c in SHELL_METACHARACTERS) or '$' in s or '`' in s
+    if needs_shell:
+        return Command(cmd=cmd, args=[], shell=True, stdout=None, stderr=None)
+
+    return Command(
+        cmd=cmd,
+        args=shlex.split(s),
+        shell=False,
+        stdout=logs.get('1'),
+        stderr=logs.get('2'))
+
+
+def classify(returncode: int, shell: bool, stderr_tail: bytes) -> str:
+    if returncode == 0:
+        return OK
+
+    sig = None
+    if returncode < 0:
+        sig = -returncode
+    elif shell and returncode > 128:  # the shell reports a child killed by signal n as 128 + n
+        sig = returncode - 128
+
+    if sig == signal.SIGKILL or any(m in stderr_tail for m in OOM_MESSAGES):
+        return OOM_KILL  # the kernel OOM killer sends SIGKILL
+    if sig is not None:
+        return SIGNAL
+    if any(m in stderr_tail for m in TRANSIENT_IO_MESSAGES):
+        return TRANSIENT_IO
+    return NON_ZERO_EXIT
+
+
+class CommandFailed(Exception):
+
+    failure: str
+
+    def __init__(self, msg: str, failure: str):
+        super().__init__(msg)
+        self.failure = failure
+
+
+class CommandRunner:
+    """
+    Runs commands as asyncio subprocesses, without a shell unless the command needs one
+
+    - stdout and stderr are streamed to the log files of the command (or to the console)
+    - each attempt can be limited by a timeout, after which the process group is killed
+    - only timeouts and transient I/O errors are retried, with exponential backoff
+    - many commands run concurrently from one event loop, each under a lease from the thread budget
+    """
+
+    CHUNK_BYTES = 64 * 1024
+    TAIL_BYTES = 8 * 1024
+    KILL_GRACE_SECONDS = 10
+    ACQUIRE_POLL_SECONDS = 0.1
+
+    max_try: int
+    backoff_seconds: float
+    thread_budget: Optional[ThreadBudget]
+    log: Callable[[str], None]
+
+    def __init__(
+            self,
+            max_try: int,
+            backoff_seconds: float,
+            thread_budget: Optional[ThreadBudget] = None,
+            log: Callable[[str], None] = print):
+        self.max_try = max_try
+        self.backoff_seconds = backoff_seconds
+        self.thread_budget = thread_budget
+        self.log = log
+
+    def run(
+            self,
+            commands: List[Command],
+            threads: int,
+            timeout: Optional[float] = None,
+            before_start: Optional[Callable[[int], None]] = None,
+            on_done: Optional[Callable[[int], None]] = None):
+        """
+        Blocks until all commands finish, raises CommandFailed on the first failed command and cancels the others
+
+        before_start(i) is called (in a thread, as it may block) right before the i-th command starts,
+        on_done(i) right after it succeeded
+        """
+        asyncio.run(self.run_all(
+            commands=commands, threads=threads, timeout=timeout, before_start=before_start, on_done=on_done))
+
+    async def run_all(
+            self,
+            commands: List[Command],
+            threads: int,
+            timeout: Optional[float] = None,
+            before_start: Optional[Callable[[int], None]] = None,
+            on_done: Optional[Callable[[int], None]] = None):
+        tasks = [
+            asyncio.ensure_future(self.start_one(
+                i, c, threads=threads, timeout=timeout, before_start=before_start, on_done=on_done))
+            for i, c in enumerate(commands)
+        ]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+
+    async def start_one(
+            self,
+            i: int,
+            command: Command,
+            threads: int,
+            timeout: Optional[float],
+            before_start: Optional[Callable[[int], None]],
+            on_done: Optional[Callable[[int], None]]):
+        if before_start is not None:
+            await asyncio.get_running_loop().run_in_executor(None, before_start, i)
+        await self.run_one(command, threads=threads, timeout=timeout)
+        if on_done is not None:
+            on_done(i)
+
+    async def run_one(
+            self,
+            command: Command,
+            threads: int,
+            timeout: Optional[float] = None):
+        tried = 0
+        while True:
+            failure, message = await self.attempt(command, threads=threads, timeout=timeout)
+            if failure == OK:
+                return
+
+            tried += 1
+            self.log(f'Failed ({failure}): {message}')
+            if failure not in RETRYABLE:
+                raise CommandFailed(f'Failed with {failure}, not retried: {message}', failure=failure)
+            if tried >= self.max_try:
+                raise CommandFailed('Failed too many times', failure=failure)
+            await asyncio.sleep(self.backoff_seconds * 2 ** (tried - 1))
+
+    async def attempt(
+            self,
+            command: Command,
+            threads: int,
+            timeout: Optional[float]) -> Tuple[str, str]:
+        granted = await self.acquire(threads)
+        try:
+            return await self.execute(command, env=thread_limit_env(threads=granted), timeout=timeout)
+        finally:
+            if self.thread_budget is not None:
+                self.thread_budget.release(granted)
+
+    async def acquire(self, threads: int) -> int:
+        if self.thread_budget is None:
+            return threads
+        while True:
+            granted = self.thread_budget.try_acquire(threads)
+            if granted is not None:
+                return granted
+            await asyncio.sleep(self.ACQUIRE_POLL_SECONDS)
+
+    async def execute(
+            self,
+            command: Command,
+            env: dict,
+            timeout: Optional[float]) -> Tuple[str, str]:
+        kwargs = dict(
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            env=env,
+            start_new_session=True)  # own process group, so that a kill also reaches the children of a shell
+        try:
+            if command.shell:
+                process = await asyncio.create_subprocess_shell(command.cmd, **kwargs)
+            else:
+                process = await asyncio.create_subprocess_exec(*command.args, **kwargs)
+        except OSError as e:
+            return (TRANSIENT_IO if e.errno in TRANSIENT_ERRNOS else LAUNCH_ERROR), str(e)
+
+        stderr_tail = bytearray()
+        with Sink(path=command.stdout, console=sys.stdout) as out, Sink(path=command.stderr, console=sys.stderr) as err:
+            done = asyncio.gather(
+                self.pump(process.stdout, sink=out),
+                self.pump(process.stderr, sink=err, tail=stderr_tail),
+                process.wait())
+            try:
+                await asyncio.wait_for(done, timeout=timeout)
+            except asyncio.TimeoutError:
+                await self.kill(process)
+                return TIMEOUT, f'no exit after {timeout} seconds'
+            except asyncio.CancelledError:
+                await self.kill(process)
+                raise
+
+        failure = classify(returncode=process.returncode, shell=command.shell, stderr_tail=bytes(stderr_tail))
+        lines = bytes(stderr_tail).decode(errors='replace').strip().splitlines()
+        message = f'exit code {process.returncode}' + (f', {lines[-1]}' if len(lines) > 0 else '')
+        return failure, message
+
+    async def pump(
+            self,
+            stream: asyncio.StreamReader,
+            sink: 'Sink',
+            tail: Optional[bytearray] = None):
+        while True:
+            chunk = await stream.read(self.CHUNK_BYTES)
+            if not chunk:
+                break
+            sink.write(chunk)
+            if tail is not None:
+                tail.extend(chunk)
+                del tail[:-self.TAIL_BYTES]
+
+    async def kill(self, process: asyncio.subprocess.Process):
+        if process.returncode is not None:
+            return
+        try:
+            os.killpg(process.pid, signal.SIGTERM)
+            try:
+                await asyncio.wait_for(process.wait(), timeout=self.KILL_GRACE_SECONDS)
+            except asyncio.TimeoutError:
+                os.killpg(process.pid, signal.SIGKILL)
+                await process.wait()
+        except ProcessLookupError:  # already gone
+            pass
+
+
+class Sink:
+    """
+    Appends the output of a command to its log file, or to the console if it has none
+    """
+
+    path: Optional[str]
+    console: object
+    fh: Optional[BinaryIO]
+
+    def __init__(self, path: Optional[str], console: object):
+        self.path = path
+        self.console = console
+        self.fh = None
+
+    def __enter__(self):
+        if self.path is not None:
+            self.fh = open(self.path, 'ab')
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self.fh is not None:
+            self.fh.close()
+
+    def write(self, chunk: bytes):
+        if self.fh is not None:
+            self.fh.write(chunk)
+            self.fh.flush()  # so that the log can be followed while the command runs
+        elif hasattr(self.console, 'buffer'):
+            self.console.buffer.write(chunk)
+            self.console.buffer.flush()
+        else:
+            self.console.write(chunk.decode(errors='replace'))
+            self.console.flush()
@@ -0,0 +1,353 @@
+import os
+import json
+import time
+import uuid
+import signal
+import threading
+import traceback
+import multiprocessing
+from multiprocessing.process import BaseProcess
+from concurrent.futures import ThreadPoolExecutor, Future
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import List, Dict, Any, Callable, Optional
+from .batch import stage_references
+from .progress import read_progress
+
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+
+
+class JobStore:
+    """
+    One JSON file per job in {state_dir}/jobs, rewritten atomically on every change, so jobs survive a restart
+    """
+
+    jobdir: str
+    jobs: Dict[str, Dict[str, Any]]
+    lock: threading.RLock
+
+    def __init__(self, state_dir: str):
+        self.jobdir = f'{state_dir}/jobs'
+        os.makedirs(self.jobdir, exist_ok=True)
+        self.jobs = {}
+        self.lock = threading.RLock()
+        self.load()
+
+    def load(self):
+        for f in sorted(os.listdir(self.jobdir)):
+            if not f.endswith('.json'):
+                continue
+            with open(f'{self.jobdir}/{f}') as fh:
+                job = json.load(fh)
+            if job['status'] == RUNNING:  # interrupted by the restart, so run it again
+                job['status'] = QUEUED
+                job['pid'] = None
+            self.jobs[job['id']] = job
+            self.save(job)
+
+    def add(self, kwargs: Dict[str, Any], config: Dict[str, Any]) -> Dict[str, Any]:
+        job = {
+            'id': uuid.uuid4().hex[:12],
+            'status': QUEUED,
+            'config': config,
+            'kwargs': kwargs,
+            'outdir': os.path.abspath(kwargs['outdir']),
+            'submitted': time.time(),
+            'started': None,
+            'finished': None,
+            'pid': None,
+            'error': None,
+        }
+        with self.lock:
+            self.jobs[job['id']] = job
+            self.save(job)
+        return job
+
+    def update(self, job_id: str, **fields):
+        with self.lock:
+            job = self.jobs[job_id]
+            job.update(fields)
+            self.save(job)
+
+    def transition(self, job_id: str, expected: str, **fields) -> bool:
+        """
+        Compare-and-set: updates the job only if its status is still the expected one, e.g. not cancelled meanwhile
+
+        Returns:
+            whether the job was updated
+        """
+        with self.lock:
+            if self.jobs[job_id]['status'] != expected:
+                return False
+            self.update(job_id, **fields)
+            return True
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self.lock:
+            job = self.jobs.get(job_id)
+            return None if job is None else dict(job)
+
+    def list(self) -> List[Dict[str, Any]]:
+        with self.lock:
+            return sorted([dict(j) for j in self.jobs.values()], key=lambda j: j['submitted'])
+
+    def save(self, job: Dict[str, Any]):
+        path = f'{self.jobdir}/{job["id"]}.json'
+        with open(f'{path}.tmp', 'w') as fh:
+            json.dump(job, fh, indent=2)
+        os.replace(f'{path}.tmp', path)
+
+
+class PipelineService:
+    """
+    Queues submitted jobs and runs up to max_concurrent_jobs of them, each forked from a forkserver
+    """
+
+    POLL_SECONDS = 1.
+    CANCEL_GRACE_SECONDS = 30.
+
+    state_dir: str
+    max_concurrent_jobs: int
+    job_target: Callable[[Dict[str, Any]], None]
+
+    store: JobStore
+    context: Any
+    processes: Dict[str, BaseProcess]
+    staging: Dict[str, Future]
+    staging_pool: ThreadPoolExecutor
+    staged_references: Dict[str, str]
+    stop_event: threading.Event
+    scheduler: Optional[threading.Thread]
+
+    def __init__(
+            self,
+            state_dir: str,
+            max_concurrent_jobs: int,
+            job_target: Callable[[Dict[str, Any]], None]):
+        self.state_dir = state_dir
+        self.max_concurrent_jobs = max_concurrent_jobs
+        self.job_target = job_target
+
+        self.store = JobStore(state_dir=state_dir)
+        self.context = multiprocessing.get_context('forkserver')
+        self.context.set_forkserver_preload(['qiime2_pipeline'])
+        self.processes = {}
+        self.staging = {}
+        self.staging_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='Staging')  # one thread owns staged_references
+        self.staged_references = {}
+        self.stop_event = threading.Event()
+        self.scheduler = None
+
+    def start(self):
+        self.scheduler = threading.Thread(target=self.schedule, name='Scheduler', daemon=True)
+        self.scheduler.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.scheduler is not None:
+            self.scheduler.join()
+        self.staging_pool.shutdown(wait=True)
+
+    def submit(self, kwargs: Dict[str, Any], config: Dict[str, Any]) -> Dict[str, Any]:
+        return self.store.add(kwargs=kwargs, config=config)
+
+    def cancel(self, job_id: str) -> Dict[str, Any]:
+        with self.store.lock:  # the scheduler starts processes under the same lock
+            job = self.store.get(job_id)
+            if job['status'] == QUEUED:
+                self.store.update(job_id, status=CANCELLED, finished=time.time())
+            elif job['status'] == RUNNING:
+                self.store.update(job_id, status=CANCELLED)  # the scheduler reaps the process, or drops the staged job
+                process = self.processes.get(job_id)
+                if process is not None and process.pid is not None:
+                    # SIGINT first, so that the runner kills the running commands on the way out
+                    os.kill(process.pid, signal.SIGINT)
+                    threading.Timer(self.CANCEL_GRACE_SECONDS, kill_process_group, args=(process,)).start()
+            return self.store.get(job_id)
+
+    def schedule(self):
+        while not self.stop_event.is_set():
+            self.reap()
+            self.start_staged_jobs()
+            self.launch()
+            self.stop_event.wait(self.POLL_SECONDS)
+
+    def reap(self):
+        for job_id, process in list(self.processes.items()):
+            if process.is_alive():
+                continue
+            process.join()
+            self.processes.pop(job_id)
+            job = self.store.get(job_id)
+            if job['status'] == CANCELLED:
+                self.store.update(job_id, finished=time.time(), pid=None)
+            elif process.exitcode == 0:
+                self.store.update(job_id, status=DONE, finished=time.time(), pid=None)
+            else:
+                self.store.update(job_id, status=FAILED, finished=time.time(), pid=None, error=read_error(job['outdir']))
+
+    def launch(self):
+        n_free = self.max_concurrent_jobs - len(self.processes) - len(self.staging)
+        for job in [j for j in self.store.list() if j['status'] == QUEUED]:
+            if n_free <= 0:
+                break
+            if not self.store.transition(job['id'], expected=QUEUED, status=RUNNING, started=time.time()):
+                continue  # cancelled since listed
+            self.staging[job['id']] = self.staging_pool.submit(self.stage, dict(job['kwargs']))
+            n_free -= 1
+
+    def stage(self, kwargs: Dict[str, Any]) -> Dict[str, Any]:
+        stage_references(project=kwargs, dstdir=f'{self.state_dir}/references', staged=self.get_fresh_staged_references())
+        return kwargs
+
+    def start_staged_jobs(self):
+        for job_id, future in list(self.staging.items()):
+            if not future.done():
+                continue
+            self.staging.pop(job_id)
+            try:
+                kwargs = future.result()
+            except Exception:
+                self.store.transition(job_id, expected=RUNNING, status=FAILED, finished=time.time(), error=traceback.format_exc())
+                continue
+
+            with self.store.lock:
+                if self.store.get(job_id)['status'] != RUNNING:  # cancelled while staging
+                    self.store.update(job_id, finished=time.time())
+                    continue
+                process = self.context.Process(target=run_job, args=(self.job_target, kwargs), name=f'Job-{job_id}')
+                process.start()
+                self.processes[job_id] = process
+                self.store.update(job_id, pid=process.pid)
+
+    def get_fresh_staged_references(self) -> Dict[str, str]:
+        for src, dst in list(self.staged_references.items()):
+            if not os.path.exists(dst) or os.path.getmtime(src) > os.path.getmtime(dst):
+                self.staged_references.pop(src)  # the source was replaced since staging
+        return self.staged_references
+
+    def get_status(self, job_id: str) -> Optional[Dict[str, Any]]:
+        job = self.store.get(job_id)
+        if job is None:
+            return None
+        job['progress'] = read_progress(job['outdir'])
+        return job
+
+    def get_outputs(self, job_id: str) -> Optional[List[Dict[str, Any]]]:
+        job = self.store.get(job_id)
+        if job is None:
+            return None
+        ret = []
+        for dirpath, _, filenames in os.walk(job['outdir']):
+            for f in sorted(filenames):
+                path = os.path.join(dirpath, f)
+                ret.append({'path': os.path.relpath(path, job['outdir']), 'bytes': os.path.getsize(path)})
+        return ret
+
+
+def run_job(job_target: Callable[[Dict[str, Any]], None], kwargs: Dict[str, Any]):
+    """
+    Entry of a job process, which leads its own process group so that a cancel can kill all of it
+    """
+    os.setpgrp()
+    signal.signal(signal.SIGINT, signal.default_int_handler)  # the forkserver ignores SIGINT
+    error_txt = f'{kwargs["outdir"]}/service-error.txt'
+    try:
+        job_target(kwargs)
+    except BaseException:
+        os.makedirs(kwargs['outdir'], exist_ok=True)
+        with open(error_txt, 'w') as fh:
+            fh.write(traceback.format_exc())
+        raise
+
+
+def read_error(outdir: str) -> Optional[str]:
+    path = f'{outdir}/service-error.txt'
+    if not os.path.exists(path):
+        return None
+    with open(path) as fh:
+        return fh.read()
+
+
+def kill_process_group(process: BaseProcess):
+    if process.is_alive():
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+
+class ServiceHandler(BaseHTTPRequestHandler):
+    """
+    HTTP API to submit, list, inspect and cancel jobs, and list their outputs
+    """
+
+    service: PipelineService  # set by serve()
+    parse_config: Callable[[Dict[str, Any]], Dict[str, Any]]
+
+    def do_GET(self):
+        parts = self.path.strip('/').split('/')
+        if parts == ['jobs']:
+            self.respond(200, self.service.store.list())
+        elif len(parts) == 2 and parts[0] == 'jobs':
+            self.respond_or_404(self.service.get_status(parts[1]))
+        elif len(parts) == 3 and parts[0] == 'jobs' and parts[2] == 'outputs':
+            self.respond_or_404(self.service.get_outputs(parts[1]))
+        else:
+            self.respond(404, {'error': f'Unknown path "{self.path}"'})
+
+    def do_POST(self):
+        parts = self.path.strip('/').split('/')
+        if parts == ['jobs']:
+            config = self.read_json()
+            try:
+                kwargs = self.parse_config(config)
+            except (SystemExit, Exception) as e:  # argparse exits on invalid arguments
+                self.respond(400, {'error': f'Invalid config: {e!r}'})
+                return
+            self.respond(201, self.service.submit(kwargs=kwargs, config=config))
+        elif len(parts) == 3 and parts[0] == 'jobs' and parts[2] == 'cancel':
+            if self.service.store.get(parts[1]) is None:
+                self.respond(404, {'error': f'Unknown job "{parts[1]}"'})
+            else:
+                self.respond(200, self.service.cancel(parts[1]))
+        else:
+            self.respond(404, {'error': f'Unknown path "{self.path}"'})
+
+    def read_json(self) -> Dict[str, Any]:
+        length = int(self.headers.get('Content-Length', 0))
+        return json.loads(self.rfile.read(length) or b'{}')
+
+    def respond_or_404(self, data: Any):
+        if data is None:
+            self.respond(404, {'error': 'Unknown job'})
+        else:
+            self.respond(200, data)
+
+    def respond(self, code: int, data: Any):
+        body = json.dumps(data).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args):
+        pass  # no access log on stderr
+
+
+def create_server(
+        service: PipelineService,
+        parse_config: Callable[[Dict[str, Any]], Dict[str, Any]],
+        host: str,
+        port: int) -> ThreadingHTTPServer:
+
+    handler = type('Handler', (ServiceHandler,), {
+        'service': service,
+        'parse_config': staticmethod(parse_config),
+    })
+    return ThreadingHTTPServer((host, port), handler)
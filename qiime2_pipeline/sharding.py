@@ -0,0 +1,207 @@
+import pandas as pd
+from typing import List, Tuple, Optional
+from .template import Processor
+from .truncation import AutoTruncation
+
+
+class ShardedDada2(Processor):
+    """
+    Denoises the samples in shards, by the values of the sample sheet column settings.dada2_shard_column (e.g. sequencing run),
+    each of which further split into shards of at most settings.dada2_shard_size samples if > 0,
+    so that samples of different runs do not share an error model, and no single DADA2 call holds all samples
+
+    Shards are denoised concurrently, each with an equal share of the threads, and merged afterwards:
+    DADA2 feature IDs are the MD5 hashes of the exact sequences, so the same ASV has the same ID in every shard,
+    and the shards have disjoint samples, so their tables merge without overlap
+
+    Falls back to one DADA2 call over all samples if there is only one shard
+
+    Truncation lengths are settings.dada2_truncate_lengths, or chosen once from all samples if None,
+    so that every shard truncates at the same lengths, otherwise the same sequence would give different ASVs
+    """
+
+    dada2: type
+    demultiplexed_seq_qza: str
+    max_expected_error_bases: float
+    sample_sheet: str
+
+    truncate_lengths: Tuple[int, int]
+    shards: List[List[str]]
+    shard_qzas: List[str]
+    denoisers: list
+
+    feature_table_qza: str
+    feature_sequence_qza: str
+
+    def main(
+            self,
+            dada2: type,
+            demultiplexed_seq_qza: str,
+            max_expected_error_bases: float,
+            sample_sheet: str) -> Tuple[str, str]:
+        """
+        Args:
+            dada2: Dada2SingleEnd, Dada2PairedEnd or Dada2PacBio
+        """
+        self.dada2 = dada2
+        self.demultiplexed_seq_qza = demultiplexed_seq_qza
+        self.max_expected_error_bases = max_expected_error_bases
+        self.sample_sheet = sample_sheet
+
+        self.set_truncate_lengths()
+        self.shards = get_shards(
+            df=pd.read_csv(self.sample_sheet, index_col=0),
+            column=self.settings.dada2_shard_column,
+            size=self.settings.dada2_shard_size)
+
+        if len(self.shards) == 1:
+            return self.dada2(self.settings).main(
+                demultiplexed_seq_qza=self.demultiplexed_seq_qza,
+                max_expected_error_bases=self.max_expected_error_bases,
+                truncate_lengths=self.truncate_lengths)
+
+        self.logger.info(f'Denoise {len(self.shards)} shards of {", ".join(str(len(s)) for s in self.shards)} samples')
+        self.filter_shards()
+        self.denoise_shards()
+        self.merge_tables()
+        self.merge_sequences()
+        self.merge_stats()
+        self.remove_shard_outputs()
+
+        return self.feature_table_qza, self.feature_sequence_qza
+
+    def set_truncate_lengths(self):
+        self.truncate_lengths = self.settings.dada2_truncate_lengths
+        if self.truncate_lengths is not None:
+            return
+        if self.dada2.N_TRUNCATED_READS == 0:
+            self.truncate_lengths = (0, 0)
+            return
+        self.truncate_lengths = AutoTruncation(self.settings).main(
+            demultiplexed_seq_qza=self.demultiplexed_seq_qza,
+            paired=self.dada2.N_TRUNCATED_READS == 2,
+            min_overlap=self.dada2.MIN_OVERLAP)
+
+    def filter_shards(self):
+        self.shard_qzas = []
+        cmds = []
+        log = f'{self.outdir}/qiime-demux-filter-samples.log'
+        for i, names in enumerate(self.shards):
+            metadata_tsv = f'{self.workdir}/dada2-shard-{i + 1}-samples.tsv'
+            with open(metadata_tsv, 'w') as fh:
+                fh.write('\n'.join(['sample-id'] + [str(n) for n in names]) + '\n')
+
+            qza = f'{self.workdir}/dada2-shard-{i + 1}-demultiplexed.qza'
+            self.shard_qzas.append(qza)
+            cmds.append(self.CMD_LINEBREAK.join([
+                'qiime demux filter-samples',
+                f'--i-demux {self.demultiplexed_seq_qza}',
+                f'--m-metadata-file {metadata_tsv}',
+                f'--o-filtered-demux {qza}',
+                f'1>> "{log}"',
+                f'2>> "{log}"'
+            ]))
+            self.register_intermediate(metadata_tsv, consumers=['denoise_shards'])
+            self.register_intermediate(qza, consumers=['denoise_shards'])
+        self.call_all(cmds, threads=1)
+
+    def denoise_shards(self):
+        threads = self.settings.thread_budget.share(n_tasks=len(self.shards))
+        settings = self.settings.for_worker(threads=threads)
+
+        self.denoisers = []
+        for i, qza in enumerate(self.shard_qzas):
+            denoiser = self.dada2(settings)
+            denoiser.prepare(
+                demultiplexed_seq_qza=qza,
+                max_expected_error_bases=self.max_expected_error_bases,
+                truncate_lengths=self.truncate_lengths,
+                prefix=f'dada2-shard-{i + 1}',
+                stats_tsv=f'{self.workdir}/dada2-shard-{i + 1}-stats.tsv')
+            self.denoisers.append(denoiser)
+
+        self.call_all([d.cmd for d in self.denoisers], threads=threads, progress_label='DADA2 shards')
+
+        for denoiser in self.denoisers:
+            denoiser.export_stats()
+        self.release_intermediates(consumer='denoise_shards')
+
+    def merge_tables(self):
+        self.feature_table_qza = f'{self.workdir}/dada2-feature-table.qza'
+        log = f'{self.outdir}/qiime-feature-table-merge.log'
+        self.call(self.CMD_LINEBREAK.join(
+            ['qiime feature-table merge'] +
+            [f'--i-tables {d.feature_table_qza}' for d in self.denoisers] +
+            [
+                f'--o-merged-table {self.feature_table_qza}',
+                f'1>> "{log}"',
+                f'2>> "{log}"'
+            ]))
+
+    def merge_sequences(self):
+        self.feature_sequence_qza = f'{self.workdir}/dada2-feature-sequence.qza'
+        log = f'{self.outdir}/qiime-feature-table-merge-seqs.log'
+        self.call(self.CMD_LINEBREAK.join(
+            ['qiime feature-table merge-seqs'] +
+            [f'--i-data {d.feature_sequence_qza}' for d in self.denoisers] +
+            [
+                f'--o-merged-data {self.feature_sequence_qza}',
+                f'1>> "{log}"',
+                f'2>> "{log}"'
+            ]))
+
+    def merge_stats(self):
+        if self.mock:
+            return
+        concat_stats_tsvs(
+            tsvs=[d.stats_tsv for d in self.denoisers],
+            dst=f'{self.outdir}/dada2-stats.tsv')
+
+    def remove_shard_outputs(self):
+        for denoiser in self.denoisers:
+            for path in [denoiser.feature_table_qza, denoiser.feature_sequence_qza, denoiser.stats_tsv]:
+                self.register_intermediate(path, consumers=[])
+
+
+def concat_stats_tsvs(tsvs: List[str], dst: str):
+    """
+    Concatenates DADA2 stats exported by qiime, keeping the header (and the #q2:types line) of the first only
+    """
+    lines = []
+    for tsv in tsvs:
+        with open(tsv) as fh:
+            tsv_lines = fh.read().splitlines()
+        n_header_lines = 2 if len(tsv_lines) > 1 and tsv_lines[1].startswith('#q2:types') else 1
+        if len(lines) == 0:
+            lines += tsv_lines[:n_header_lines]
+        lines += tsv_lines[n_header_lines:]
+    with open(dst, 'w') as fh:
+        fh.write('\n'.join(lines) + '\n')
+
+
+def get_shards(df: pd.DataFrame, column: Optional[str], size: int) -> List[List[str]]:
+    """
+    Args:
+        df: sample sheet, indexed by sample name
+
+        column: shard by the values of this column, None for no column
+
+        size: max number of samples per shard, 0 for no limit
+
+    Returns:
+        sample names of each shard, in the order of the sample sheet
+    """
+    if column is None:
+        groups = [df.index.tolist()]
+    else:
+        assert column in df.columns, f'Shard column "{column}" is not in the sample sheet'
+        assert df[column].notna().all(), f'Shard column "{column}" has empty values'
+        groups = [g.index.tolist() for _, g in df.groupby(column, sort=False)]
+
+    shards = []
+    for names in groups:
+        if size > 0:
+            shards += [names[i:i + size] for i in range(0, len(names), size)]
+        else:
+            shards.append(names)
+    return shards
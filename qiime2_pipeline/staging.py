@@ -0,0 +1,44 @@
+import os
+import shutil
+from os.path import abspath, basename
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import List, Dict
+
+
+class InputStager:
+    """
+    Copies input files to local scratch in background threads with bounded concurrency,
+    so that reading from network storage overlaps with the processing of already staged files
+    """
+
+    dstdir: str
+    executor: ThreadPoolExecutor
+    futures: Dict[str, Future]
+
+    def __init__(self, dstdir: str, max_workers: int):
+        self.dstdir = dstdir
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='InputStager')
+        self.futures = {}
+
+    def start(self, srcs: List[str]):
+        os.makedirs(self.dstdir, exist_ok=True)
+        for src in srcs:  # files are copied in the given order
+            dst = f'{self.dstdir}/{basename(src)}'
+            self.futures[abspath(dst)] = self.executor.submit(copy_atomically, src, dst)
+
+    def wait(self, path: str):
+        """
+        Blocks until the staged path is completely copied, returns immediately for any other path
+        """
+        future = self.futures.get(abspath(path))
+        if future is not None:
+            future.result()
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True, cancel_futures=True)
+
+
+def copy_atomically(src: str, dst: str):
+    temp = f'{dst}.staging'
+    shutil.copyfile(src, temp)
+    os.replace(temp, dst)
@@ -0,0 +1,259 @@
+import os
+import re
+import gzip
+import pandas as pd
+from typing import List, Dict, Tuple, Optional, Pattern
+from .template import Processor
+from .compression import GZIP_LEVELS, GZIP, open_fastq
+from .pooling import POOLED_READ_COUNTS_CSV, reverse_complement, save_pooled_read_counts
+
+
+QUALITY = 20
+LENGTH = 20
+MAX_N = 0
+PHRED_OFFSET = 33
+ILLUMINA_ADAPTER = b'AGATCGGAAGAGC'  # as trim_galore --illumina
+ADAPTER_ERROR_RATE = 0.1  # as the default of cutadapt
+EXACT_OVERLAP_BELOW = 10  # shorter 3' partial adapters must match exactly, where 0.1 * overlap < 1
+
+CASAVA_FQ_DIRNAME = 'casava_fastqs'
+STREAMING_TRIMMING_REPORT_CSV = 'streaming-trimming-report.csv'
+
+
+class StreamingTrimAndImport(Processor):
+    """
+    Trims the reads in Python with the steps of trim_galore,
+    writing them straight into a CASAVA 1.8 directory for import
+    """
+
+    SINGLE_END_TYPE = 'SampleData[SequencesWithQuality]'
+    PAIRED_END_TYPE = 'SampleData[PairedEndSequencesWithQuality]'
+
+    sample_sheet: str
+    fq_dir: str
+    fq1_suffix: str
+    fq2_suffix: Optional[str]
+    clip_r1_5_prime: int
+    clip_r2_5_prime: int
+    pool: bool
+    reverse_complement_r2: bool
+
+    sample_names: List[str]
+    casava_dir: str
+    output_qza: str
+
+    def main(
+            self,
+            sample_sheet: str,
+            fq_dir: str,
+            fq1_suffix: str,
+            fq2_suffix: Optional[str],
+            clip_r1_5_prime: int,
+            clip_r2_5_prime: int,
+            pool: bool,
+            reverse_complement_r2: bool) -> str:
+
+        self.sample_sheet = sample_sheet
+        self.fq_dir = fq_dir
+        self.fq1_suffix = fq1_suffix
+        self.fq2_suffix = fq2_suffix
+        self.clip_r1_5_prime = clip_r1_5_prime
+        self.clip_r2_5_prime = clip_r2_5_prime
+        self.pool = pool
+        self.reverse_complement_r2 = reverse_complement_r2
+
+        self.sample_names = pd.read_csv(self.sample_sheet, index_col=0).index.tolist()
+        self.make_casava_dir()
+        self.trim_all_samples()
+        self.import_casava_dir()
+        self.register_intermediate(self.casava_dir, consumers=[])
+
+        return self.output_qza
+
+    def make_casava_dir(self):
+        self.casava_dir = f'{self.workdir}/{CASAVA_FQ_DIRNAME}'
+        os.makedirs(self.casava_dir, exist_ok=True)
+
+    def trim_all_samples(self):
+        kwargs_list = [self.get_one_sample_kwargs(i, name) for i, name in enumerate(self.sample_names)]
+        for kwargs in kwargs_list:
+            self.logger.info(f'Trim {kwargs["fqs"]} into {kwargs["dsts"]}')
+        if self.mock:
+            return
+
+        stats = self.map_in_processes(
+            trim_one_sample, kwargs_list, label='samples', staged_inputs=[kwargs['fqs'] for kwargs in kwargs_list])
+
+        df = pd.DataFrame(stats)
+        df.insert(0, 'Sample ID', self.sample_names)
+        df.to_csv(f'{self.outdir}/{STREAMING_TRIMMING_REPORT_CSV}', index=False)
+
+        if self.pool and self.fq2_suffix is not None:
+            save_pooled_read_counts(
+                csv=f'{self.outdir}/{POOLED_READ_COUNTS_CSV}',
+                sample_names=self.sample_names,
+                counts=[(s['Written'], s['Written']) for s in stats])
+
+    def get_one_sample_kwargs(self, i: int, name: str) -> Dict:
+        fqs = [f'{self.fq_dir}/{name}{self.fq1_suffix}']
+        clips = [self.clip_r1_5_prime]
+        if self.fq2_suffix is not None:
+            fqs.append(f'{self.fq_dir}/{name}{self.fq2_suffix}')
+            clips.append(self.clip_r2_5_prime)
+
+        n_outputs = 1 if (self.pool or self.fq2_suffix is None) else 2
+        dsts = [f'{self.casava_dir}/{name}_S{i + 1}_L001_R{r}_001.fastq.gz' for r in range(1, n_outputs + 1)]
+
+        return dict(
+            fqs=fqs,
+            dsts=dsts,
+            clip_5_primes=clips,
+            reverse_complement_r2=self.reverse_complement_r2,
+            gzip_level=GZIP_LEVELS.get(self.settings.intermediate_compression, GZIP_LEVELS[GZIP]))
+
+    def import_casava_dir(self):
+        paired = self.fq2_suffix is not None and not self.pool
+        name = 'paired-end-demultiplexed.qza' if paired else 'single-end-demultiplexed.qza'
+        self.output_qza = f'{self.workdir}/{name}'
+        log = f'{self.outdir}/qiime-tools-import.log'
+        cmd = self.CMD_LINEBREAK.join([
+            'qiime tools import',
+            f'--type \'{self.PAIRED_END_TYPE if paired else self.SINGLE_END_TYPE}\'',
+            f'--input-format CasavaOneEightSingleLanePerSampleDirFmt',
+            f'--input-path "{self.casava_dir}"',
+            f'--output-path "{self.output_qza}"',
+            f'1>> "{log}"',
+            f'2>> "{log}"'
+        ])
+        self.call(cmd)
+
+
+def trim_one_sample(
+        fqs: List[str],
+        dsts: List[str],
+        clip_5_primes: List[int],
+        reverse_complement_r2: bool,
+        gzip_level: int) -> Dict[str, int]:
+    """
+    The job function of one sample, reads 1 or 2 fastqs in lockstep, writes into 1 (single-end or pooled) or 2 fastqs,
+    reverse_complement_r2 only applies to pooled R2
+
+    Returns:
+        read counts of the trimming report
+    """
+    adapter_regex = compile_adapter_regex(ILLUMINA_ADAPTER)
+    readers = [open_fastq(fq, 'rb') for fq in fqs]
+    writers = [gzip.open(dst, 'wb', compresslevel=gzip_level) for dst in dsts]
+    stats = {'Input': 0, 'Adapter Trimmed': 0, 'Too Short': 0, 'Too Many N': 0, 'Written': 0}
+    try:
+        while True:
+            records = [read_record(r) for r in readers]
+            if records[0] is None:
+                break
+            stats['Input'] += 1
+
+            trimmed = []
+            for (header, seq, qual), clip in zip(records, clip_5_primes):
+                seq, qual, adapter_found = trim_read(seq=seq, qual=qual, clip_5_prime=clip, adapter_regex=adapter_regex)
+                stats['Adapter Trimmed'] += adapter_found
+                trimmed.append((header, seq, qual))
+
+            if any(len(seq) < LENGTH for _, seq, _ in trimmed):
+                stats['Too Short'] += 1
+                continue
+            if any(seq.count(b'N') > MAX_N for _, seq, _ in trimmed):
+                stats['Too Many N'] += 1
+                continue
+
+            pooled = len(trimmed) > len(writers)
+            for i, (header, seq, qual) in enumerate(trimmed):
+                if pooled and i == 1 and reverse_complement_r2:
+                    seq, qual = reverse_complement(seq), qual[::-1]
+                writer = writers[min(i, len(writers) - 1)]
+                writer.write(b'%s\n%s\n+\n%s\n' % (header, seq, qual))
+            stats['Written'] += 1
+    finally:
+        for fh in readers + writers:
+            fh.close()
+    return stats
+
+
+def read_record(reader) -> Optional[Tuple[bytes, bytes, bytes]]:
+    header = reader.readline()
+    if not header:
+        return None
+    seq = reader.readline().rstrip(b'\r\n')
+    reader.readline()
+    qual = reader.readline().rstrip(b'\r\n')
+    return header.rstrip(b'\r\n'), seq, qual
+
+
+def trim_read(seq: bytes, qual: bytes, clip_5_prime: int, adapter_regex: Pattern) -> Tuple[bytes, bytes, bool]:
+    end = quality_trim_index(qual=qual, cutoff=QUALITY)
+    seq, qual = seq[:end], qual[:end]
+
+    end = adapter_trim_index(seq=seq, adapter=ILLUMINA_ADAPTER, adapter_regex=adapter_regex)
+    adapter_found = end < len(seq)
+    seq, qual = seq[:end], qual[:end]
+
+    start, end = n_trim_indices(seq)
+    start = max(start, clip_5_prime)
+    return seq[start:end], qual[start:end], adapter_found
+
+
+def quality_trim_index(qual: bytes, cutoff: int) -> int:
+    """
+    BWA 3' quality trimming as in cutadapt: the cut position which maximizes the sum of (cutoff - quality) of the trimmed tail
+
+    Returns:
+        the end index of the retained read
+    """
+    s = 0
+    max_s = 0
+    max_i = len(qual)
+    for i in range(len(qual) - 1, -1, -1):
+        s += cutoff - (qual[i] - PHRED_OFFSET)
+        if s < 0:
+            break
+        if s > max_s:
+            max_s = s
+            max_i = i
+    return max_i
+
+
+def compile_adapter_regex(adapter: bytes) -> Pattern:
+    """
+    The full-length adapter with up to int(ADAPTER_ERROR_RATE * len) mismatches, the first occurrence wins
+    """
+    n_mismatches = int(ADAPTER_ERROR_RATE * len(adapter))
+    if n_mismatches == 0:
+        return re.compile(re.escape(adapter))
+    alternatives = [re.escape(adapter)]
+    for i in range(len(adapter)):
+        alternatives.append(re.escape(adapter[:i]) + b'.' + re.escape(adapter[i + 1:]))
+    return re.compile(b'|'.join(alternatives))
+
+
+def adapter_trim_index(seq: bytes, adapter: bytes, adapter_regex: Pattern) -> int:
+    """
+    Returns:
+        start of the full-length adapter, or of a partial adapter at the 3' end, or len(seq) if none
+    """
+    m = adapter_regex.search(seq)
+    if m is not None:
+        return m.start()
+    for overlap in range(min(len(adapter) - 1, len(seq)), 0, -1):  # the longest partial adapter first
+        if overlap < EXACT_OVERLAP_BELOW:
+            found = seq.endswith(adapter[:overlap])
+        else:
+            mismatches = sum(a != b for a, b in zip(seq[-overlap:], adapter[:overlap]))
+            found = mismatches <= int(ADAPTER_ERROR_RATE * overlap)
+        if found:
+            return len(seq) - overlap
+    return len(seq)
+
+
+def n_trim_indices(seq: bytes) -> Tuple[int, int]:
+    start = len(seq) - len(seq.lstrip(b'N'))
+    end = len(seq.rstrip(b'N'))
+    return (start, end) if start < end else (0, 0)
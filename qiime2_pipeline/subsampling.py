@@ -0,0 +1,173 @@
+import os
+import random
+import pandas as pd
+from os.path import abspath
+from typing import List, Dict, Any, Optional
+from .template import Processor
+from .compression import open_fastq
+
+
+SUBSAMPLED_READ_COUNTS_CSV = 'subsampled-read-counts.csv'
+
+
+class SubsampleReads(Processor):
+    """
+    Caps the reads of each sample at max_reads_per_sample and/or keeps a pilot_fraction of them,
+    so that a few very deep samples do not dominate the denoising time
+
+    Each sample is streamed once with selection sampling (Knuth's algorithm S), which keeps
+    exactly the target number of reads, uniformly at random, without holding any read in memory,
+    because the number of reads is known from raw-read-counts.csv
+
+    R1 and R2 are read in lockstep, so that a pair is either kept or dropped as a whole
+
+    The random generator of each sample is seeded with the seed and the sample name,
+    so the subsample of a sample does not depend on the other samples, or on the order of the jobs
+    """
+
+    sample_sheet: str
+    fq_dir: str
+    fq1_suffix: str
+    fq2_suffix: Optional[str]
+    max_reads_per_sample: int
+    pilot_fraction: float
+    seed: int
+
+    raw_counts: Dict[str, int]
+    out_fq_dir: str
+    data: List[Dict[str, Any]]
+
+    def main(
+            self,
+            sample_sheet: str,
+            fq_dir: str,
+            fq1_suffix: str,
+            fq2_suffix: Optional[str],
+            max_reads_per_sample: int,
+            pilot_fraction: float,
+            seed: int) -> str:
+        """
+        Returns:
+            the directory of subsampled fastqs, with the same file names as fq_dir
+        """
+        self.sample_sheet = sample_sheet
+        self.fq_dir = fq_dir
+        self.fq1_suffix = fq1_suffix
+        self.fq2_suffix = fq2_suffix
+        self.max_reads_per_sample = max_reads_per_sample
+        self.pilot_fraction = pilot_fraction
+        self.seed = seed
+
+        assert 0 < self.pilot_fraction <= 1, f'Pilot fraction {self.pilot_fraction} is not in (0, 1]'
+
+        self.read_raw_counts()
+        self.make_out_fq_dir()
+        self.subsample()
+        self.save_csv()
+
+        return self.out_fq_dir
+
+    def read_raw_counts(self):
+        df = pd.read_csv(f'{self.outdir}/raw-read-counts.csv', index_col=0)
+        column = 'Count' if self.fq2_suffix is None else 'Count (R1)'
+        self.raw_counts = {str(k): int(v) for k, v in df[column].items()}
+
+    def make_out_fq_dir(self):
+        self.out_fq_dir = f'{self.workdir}/subsampled_fastqs'
+        os.makedirs(self.out_fq_dir, exist_ok=True)
+
+    def subsample(self):
+        names = pd.read_csv(self.sample_sheet, index_col=0).index.tolist()
+        kwargs_list = [self.get_one_sample_kwargs(name) for name in names]
+        retained = self.fan_out(SubsampleOneSample, kwargs_list, staged_inputs=[kwargs['fqs'] for kwargs in kwargs_list])
+        self.data = []
+        for name, kwargs, n_retained in zip(names, kwargs_list, retained):
+            self.data.append({
+                'Sample ID': name,
+                'Raw': kwargs['n_reads'],
+                'Retained': n_retained,
+            })
+
+    def get_one_sample_kwargs(self, name: str) -> Dict[str, Any]:
+        suffixes = [self.fq1_suffix] if self.fq2_suffix is None else [self.fq1_suffix, self.fq2_suffix]
+        fqs = [f'{self.fq_dir}/{name}{s}' for s in suffixes]
+
+        n_reads = self.raw_counts[str(name)]
+        n_keep = int(round(n_reads * self.pilot_fraction))
+        if self.max_reads_per_sample > 0:
+            n_keep = min(n_keep, self.max_reads_per_sample)
+
+        return dict(
+            fqs=fqs,
+            dsts=[f'{self.out_fq_dir}/{name}{s}' for s in suffixes],
+            n_reads=n_reads,
+            n_keep=n_keep,
+            seed=f'{self.seed}:{name}')
+
+    def save_csv(self):
+        df = pd.DataFrame(self.data)
+        self.logger.info(f'Retained {df["Retained"].sum():,} of {df["Raw"].sum():,} reads')
+        df.to_csv(f'{self.outdir}/{SUBSAMPLED_READ_COUNTS_CSV}', index=False)
+
+
+class SubsampleOneSample(Processor):
+
+    def main(
+            self,
+            fqs: List[str],
+            dsts: List[str],
+            n_reads: int,
+            n_keep: int,
+            seed: str) -> int:
+        """
+        Returns:
+            number of reads (or pairs) retained
+        """
+        if n_keep >= n_reads:  # nothing to drop
+            for fq, dst in zip(fqs, dsts):
+                self.logger.debug(f'ln -s "{abspath(fq)}" "{dst}"')
+                if not self.mock:
+                    os.symlink(abspath(fq), dst)
+            return n_reads
+
+        self.logger.info(f'Subsample {n_keep:,} of {n_reads:,} reads from {fqs}')
+        if self.mock:
+            return n_keep
+        return select_reads(
+            fqs=fqs,
+            dsts=dsts,
+            n_reads=n_reads,
+            n_keep=n_keep,
+            rng=random.Random(seed),
+            policy=self.settings.intermediate_compression)
+
+
+def select_reads(
+        fqs: List[str],
+        dsts: List[str],
+        n_reads: int,
+        n_keep: int,
+        rng: random.Random,
+        policy: str) -> int:
+    """
+    Selection sampling: the i-th of n_reads records is kept with probability (n_keep - kept) / (n_reads - i),
+    which keeps exactly n_keep records, each with equal probability
+    """
+    readers = [open_fastq(fq, 'rb') for fq in fqs]
+    writers = [open_fastq(dst, 'wb', policy=policy) for dst in dsts]
+    kept = 0
+    try:
+        for i in range(n_reads):
+            keep = rng.random() * (n_reads - i) < n_keep - kept
+            for reader, writer in zip(readers, writers):
+                record = b''.join(reader.readline() for _ in range(4))
+                if keep:
+                    writer.write(record)
+            if keep:
+                kept += 1
+                if kept == n_keep:
+                    break
+    finally:
+        for fh in readers + writers:
+            fh.close()
+    return kept
@@ -1,8 +1,14 @@
 import pandas as pd
-from typing import Optional
+from typing import Optional, Dict, Tuple, Callable
 from .template import Processor
-from .exporting import ExportTaxonomy
-from .importing import ImportTaxonomy
+from .utils import get_artifact_uuid
+from .fasta import FastaParser, FastaWriter
+from .taxonomy_cache import TaxonomyCache, get_classifier_key, hash_sequence
+from .exporting import ExportTaxonomy, ExportFeatureSequence
+from .importing import ImportTaxonomy, ImportFeatureSequence
+
+
+TAXONOMY_CACHE_HITS_CSV = 'taxonomy-cache-hits.csv'
 
 
 class Taxonomy(Processor):
@@ -35,40 +41,177 @@ class Taxonomy(Processor):
         self.reference_taxonomy_qza = reference_taxonomy_qza
         self.vsearch_classifier_max_hits = vsearch_classifier_max_hits
 
-        if self.feature_classifier == 'nb':
-            self.classify_nb()
-        elif self.feature_classifier == 'vsearch':
-            self.classify_vsearch()
+        if self.settings.taxonomy_cache is None:
+            self.taxonomy_qza = self.classify(representative_seq_qza=self.representative_seq_qza)
+        else:
+            self.taxonomy_qza = CachedTaxonomy(self.settings).main(
+                representative_seq_qza=self.representative_seq_qza,
+                classifier_key=self.get_classifier_key(),
+                score_column='Confidence' if self.feature_classifier == 'nb' else 'Consensus',
+                classify=self.classify)
 
         return self.taxonomy_qza
 
-    def classify_nb(self):
+    def classify(self, representative_seq_qza: str) -> str:
+        if self.feature_classifier == 'nb':
+            return self.classify_nb(representative_seq_qza=representative_seq_qza)
+        elif self.feature_classifier == 'vsearch':
+            return self.classify_vsearch(representative_seq_qza=representative_seq_qza)
+        else:
+            raise ValueError(f'Invalid feature classifier: {self.feature_classifier}')
+
+    def get_classifier_key(self) -> str:
+        if self.feature_classifier == 'nb':
+            qzas = [self.nb_classifier_qza]
+            parameters = dict(confidence=ClassifyNB.CONFIDENCE_CUTOFF, read_orientations=['same', 'reverse-complement'])
+        else:
+            qzas = [self.reference_sequence_qza, self.reference_taxonomy_qza]
+            parameters = dict(strand='both', maxhits=self.vsearch_classifier_max_hits)
+        return get_classifier_key(
+            classifier=self.feature_classifier,
+            artifact_uuids=[qza if self.mock else get_artifact_uuid(qza) for qza in qzas],
+            parameters=parameters)
+
+    def classify_nb(self, representative_seq_qza: str) -> str:
         assert self.nb_classifier_qza is not None
-        self.taxonomy_qza = ClassifyNB(self.settings).main(
-            representative_seq_qza=self.representative_seq_qza,
+        return ClassifyNB(self.settings).main(
+            representative_seq_qza=representative_seq_qza,
             nb_classifier_qza=self.nb_classifier_qza,
             classifier_reads_per_batch=self.classifier_reads_per_batch)
 
-    def classify_vsearch(self):
+    def classify_vsearch(self, representative_seq_qza: str) -> str:
         assert self.reference_sequence_qza is not None
         assert self.reference_taxonomy_qza is not None
-        self.taxonomy_qza = f'{self.workdir}/taxonomy-vsearch.qza'
+        taxonomy_qza = f'{self.workdir}/taxonomy-vsearch.qza'
         search_results_qza = f'{self.workdir}/search-results.qza'
         log = f'{self.outdir}/qiime-feature-classifier-classify-consensus-vsearch.log'
         args = [
             'qiime feature-classifier classify-consensus-vsearch',
-            f'--i-query {self.representative_seq_qza}',
+            f'--i-query {representative_seq_qza}',
             f'--i-reference-reads {self.reference_sequence_qza}',
             f'--i-reference-taxonomy {self.reference_taxonomy_qza}',
             f'--p-strand both',
             f'--p-maxhits {self.vsearch_classifier_max_hits}',
             f'--p-threads {self.threads}',
-            f'--o-classification {self.taxonomy_qza}',
+            f'--o-classification {taxonomy_qza}',
             f'--o-search-results {search_results_qza}',
             f'1>> "{log}"',
             f'2>> "{log}"'
         ]
         self.call(self.CMD_LINEBREAK.join(args))
+        self.register_intermediate(search_results_qza, consumers=[])
+        return taxonomy_qza
+
+
+class CachedTaxonomy(Processor):
+    """
+    Classifies only the representative sequences missing from the persistent TaxonomyCache (settings.taxonomy_cache),
+    adds their taxonomy to the cache, and merges the cached and the new taxonomy into one taxonomy qza
+
+    The hit rate is saved to taxonomy-cache-hits.csv, and the cache is then evicted down to settings.taxonomy_cache_max_entries
+    """
+
+    representative_seq_qza: str
+    classifier_key: str
+    score_column: str
+    classify: Callable[[str], str]
+
+    cache: TaxonomyCache
+    sequences: Dict[str, str]
+    feature_hashes: Dict[str, str]
+    hits: Dict[str, Tuple[str, str]]
+    new: Dict[str, Tuple[str, str]]
+
+    taxonomy_qza: str
+
+    def main(
+            self,
+            representative_seq_qza: str,
+            classifier_key: str,
+            score_column: str,
+            classify: Callable[[str], str]) -> str:
+        """
+        Args:
+            classifier_key: see get_classifier_key
+
+            score_column: 'Confidence' or 'Consensus' of the taxonomy tsv
+
+            classify: classifies a sequence qza, returns the taxonomy qza
+        """
+        self.representative_seq_qza = representative_seq_qza
+        self.classifier_key = classifier_key
+        self.score_column = score_column
+        self.classify = classify
+
+        if self.mock:  # no sequences to look up
+            return self.classify(self.representative_seq_qza)
+
+        self.cache = TaxonomyCache(
+            path=self.settings.taxonomy_cache,
+            max_entries=self.settings.taxonomy_cache_max_entries)
+        try:
+            self.read_sequences()
+            self.hits = self.cache.get(
+                sequence_hashes=list(self.feature_hashes.values()),
+                classifier_key=self.classifier_key)
+            self.classify_misses()
+            self.save_taxonomy()
+            self.report_hits()
+        finally:
+            self.cache.close()
+
+        return self.taxonomy_qza
+
+    def read_sequences(self):
+        fa = ExportFeatureSequence(self.settings).main(feature_sequence_qza=self.representative_seq_qza)
+        with FastaParser(fa) as parser:
+            self.sequences = {header.split()[0]: seq for header, seq in parser}
+        self.feature_hashes = {id_: hash_sequence(seq) for id_, seq in self.sequences.items()}
+        self.register_intermediate(fa, consumers=[])
+
+    def classify_misses(self):
+        self.new = {}
+        missing = [id_ for id_, h in self.feature_hashes.items() if h not in self.hits]
+        if len(missing) == 0:
+            return
+
+        fa = f'{self.workdir}/taxonomy-cache-misses.fa'
+        with FastaWriter(fa) as writer:
+            for id_ in missing:
+                writer.write(id_, self.sequences[id_])
+        seq_qza = ImportFeatureSequence(self.settings).main(feature_sequence_fa=fa)
+        taxonomy_qza = self.classify(seq_qza)
+        tsv = ExportTaxonomy(self.settings).main(taxonomy_qza=taxonomy_qza)
+
+        df = pd.read_csv(tsv, sep='\t', dtype=str)
+        for id_, taxon, score in zip(df['Feature ID'], df['Taxon'], df[self.score_column]):
+            self.new[self.feature_hashes[id_]] = (taxon, score)
+        self.cache.put(entries=self.new, classifier_key=self.classifier_key)
+
+        for path in [fa, seq_qza, taxonomy_qza, tsv]:
+            self.register_intermediate(path, consumers=[])
+
+    def save_taxonomy(self):
+        taxonomy = {**self.hits, **self.new}
+        rows = [(id_,) + taxonomy[h] for id_, h in self.feature_hashes.items()]
+        tsv = f'{self.workdir}/taxonomy-cached.tsv'
+        pd.DataFrame(rows, columns=['Feature ID', 'Taxon', self.score_column]).to_csv(tsv, sep='\t', index=False)
+        self.taxonomy_qza = ImportTaxonomy(self.settings).main(taxonomy_tsv=tsv)
+        self.register_intermediate(tsv, consumers=[])
+
+    def report_hits(self):
+        n = len(self.feature_hashes)
+        n_hits = sum(h in self.hits for h in self.feature_hashes.values())
+        hit_rate = n_hits / n if n > 0 else 0.
+        n_evicted = self.cache.evict()
+        self.logger.info(f'Taxonomy cache "{self.settings.taxonomy_cache}": {n_hits} of {n} sequences cached ({hit_rate:.1%}), {n - n_hits} classified, {n_evicted} least recently used entries evicted')
+        pd.DataFrame([{
+            'Sequences': n,
+            'Hits': n_hits,
+            'Misses': n - n_hits,
+            'Hit Rate': hit_rate,
+            'Evicted': n_evicted,
+        }]).to_csv(f'{self.outdir}/{TAXONOMY_CACHE_HITS_CSV}', index=False)
 
 
 class ClassifyNB(Processor):
@@ -95,9 +238,12 @@ class ClassifyNB(Processor):
 
         self.forward_taxonomy_qza = self.classify(read_orientation='same')
         self.reverse_taxonomy_qza = self.classify(read_orientation='reverse-complement')
+        for path in [self.forward_taxonomy_qza, self.reverse_taxonomy_qza]:
+            self.register_intermediate(path, consumers=['MergeForwardReverseTaxonomy'])
         self.merged_taxonomy_qza = MergeForwardReverseTaxonomy(self.settings).main(
             forward_taxonomy_qza=self.forward_taxonomy_qza,
             reverse_taxonomy_qza=self.reverse_taxonomy_qza)
+        self.release_intermediates(consumer='MergeForwardReverseTaxonomy')
 
         return self.merged_taxonomy_qza
 
@@ -152,9 +298,11 @@ class MergeForwardReverseTaxonomy(Processor):
         tsv = ExportTaxonomy(self.settings).main(
             taxonomy_qza=self.forward_taxonomy_qza)
         self.f_df = pd.read_csv(tsv, sep='\t')
+        self.register_intermediate(tsv, consumers=[])
         tsv = ExportTaxonomy(self.settings).main(
             taxonomy_qza=self.reverse_taxonomy_qza)
         self.r_df = pd.read_csv(tsv, sep='\t')
+        self.register_intermediate(tsv, consumers=[])
 
     def rename_columns(self):
         self.f_df = self.f_df.rename(
@@ -0,0 +1,103 @@
+import json
+import time
+import sqlite3
+import hashlib
+from typing import List, Dict, Tuple, Any
+
+
+class TaxonomyCache:
+    """
+    A persistent sqlite cache of the taxonomy of sequences, shared across runs (and concurrent batches) on the same machine
+
+    An entry is keyed by the SHA1 of the upper-case sequence and the classifier key (see get_classifier_key),
+    and stores the taxon with its confidence (nb) or consensus (vsearch) as text
+
+    The cache holds at most max_entries, the least recently used entries are evicted first
+    """
+
+    path: str
+    max_entries: int
+
+    connection: sqlite3.Connection
+
+    def __init__(self, path: str, max_entries: int):
+        self.path = path
+        self.max_entries = max_entries
+        self.connection = sqlite3.connect(self.path, timeout=600)  # wait for other runs writing to the cache
+        with self.connection:
+            self.connection.execute('''
+                CREATE TABLE IF NOT EXISTS taxonomy (
+                    sequence_hash TEXT NOT NULL,
+                    classifier_key TEXT NOT NULL,
+                    taxon TEXT NOT NULL,
+                    score TEXT NOT NULL,
+                    last_used REAL NOT NULL,
+                    PRIMARY KEY (sequence_hash, classifier_key)
+                )''')
+            self.connection.execute('CREATE INDEX IF NOT EXISTS last_used_index ON taxonomy (last_used)')
+
+    def get(self, sequence_hashes: List[str], classifier_key: str) -> Dict[str, Tuple[str, str]]:
+        """
+        Returns:
+            {sequence hash: (taxon, score)} of the cached sequences, whose last use is updated
+        """
+        hits = {}
+        unique = list(dict.fromkeys(sequence_hashes))
+        with self.connection:
+            for chunk in chunks(unique, size=500):  # below the sqlite limit of variables per statement
+                placeholders = ','.join('?' * len(chunk))
+                rows = self.connection.execute(
+                    f'SELECT sequence_hash, taxon, score FROM taxonomy '
+                    f'WHERE classifier_key = ? AND sequence_hash IN ({placeholders})',
+                    [classifier_key] + chunk).fetchall()
+                for sequence_hash, taxon, score in rows:
+                    hits[sequence_hash] = (taxon, score)
+            now = time.time()
+            self.connection.executemany(
+                'UPDATE taxonomy SET last_used = ? WHERE sequence_hash = ? AND classifier_key = ?',
+                [(now, h, classifier_key) for h in hits])
+        return hits
+
+    def put(self, entries: Dict[str, Tuple[str, str]], classifier_key: str):
+        now = time.time()
+        with self.connection:
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO taxonomy VALUES (?, ?, ?, ?, ?)',
+                [(h, classifier_key, taxon, score, now) for h, (taxon, score) in entries.items()])
+
+    def evict(self) -> int:
+        """
+        Returns:
+            number of evicted entries
+        """
+        with self.connection:
+            n = self.connection.execute('SELECT COUNT(*) FROM taxonomy').fetchone()[0]
+            excess = n - self.max_entries
+            if excess <= 0:
+                return 0
+            self.connection.execute(
+                'DELETE FROM taxonomy WHERE rowid IN (SELECT rowid FROM taxonomy ORDER BY last_used LIMIT ?)',
+                (excess,))
+        return excess
+
+    def close(self):
+        self.connection.close()
+
+
+def get_classifier_key(classifier: str, artifact_uuids: List[str], parameters: Dict[str, Any]) -> str:
+    """
+    Args:
+        classifier: e.g. 'nb' or 'vsearch'
+        artifact_uuids: of the classifier or reference qzas, which identify their content
+        parameters: classifier parameters that change the taxonomy
+    """
+    identity = json.dumps(dict(classifier=classifier, artifacts=artifact_uuids, parameters=parameters), sort_keys=True)
+    return hashlib.sha1(identity.encode()).hexdigest()
+
+
+def hash_sequence(seq: str) -> str:
+    return hashlib.sha1(seq.upper().encode()).hexdigest()
+
+
+def chunks(items: list, size: int) -> List[list]:
+    return [items[i:i + size] for i in range(0, len(items), size)]
@@ -1,6 +1,14 @@
-import subprocess
-from typing import Any
+import copy
+from typing import Any, List, Dict, Tuple, Optional, Callable
 from datetime import datetime
+from .staging import InputStager
+from .progress import StageProgress
+from .thread_budget import ThreadBudget
+from .runner import CommandRunner, parse_command
+from . import file_operations
+from .executor import Executor, SerialExecutor, LocalProcessPoolExecutor, get_executor, run_processor, run_commands, \
+    SERIAL
+from .intermediates import IntermediateFiles
 
 
 class Settings:
@@ -11,6 +19,33 @@ class Settings:
     debug: bool
     mock: bool
     for_publication: bool
+    keep_intermediates: bool
+    intermediate_compression: str
+    trimming_engine: str
+    run_fastqc: bool
+    dada2_shard_column: Optional[str]
+    dada2_shard_size: int
+    dada2_truncate_lengths: Optional[Tuple[int, int]]  # None for automatic truncation from quality profiles
+    decontam_engine: str
+    dereplication_engine: str
+    dereplication_min_count: int
+    long_read_filter: Optional[Dict[str, Any]]  # overrides of the platform defaults, None for no filtering
+    reference_cache_dir: Optional[str]  # None for the workdir, i.e. not cached across runs
+    taxonomy_cache: Optional[str]  # sqlite file, None for no taxonomy cache
+    taxonomy_cache_max_entries: int
+    input_staging_workers: int
+    command_timeout: Optional[float]
+    executor_backend: str
+    executor_workers: int
+    queue_dir: Optional[str]
+    run_profiles: List[str]
+    progress_display: bool
+
+    executor: Executor
+    thread_budget: ThreadBudget
+    intermediates: IntermediateFiles
+    input_stager: Optional[InputStager]
+    progress: Optional[StageProgress]
 
     def __init__(
             self,
@@ -19,7 +54,28 @@ class Settings:
             threads: int,
             debug: bool,
             mock: bool,
-            for_publication: bool):
+            for_publication: bool,
+            keep_intermediates: bool = True,
+            intermediate_compression: str = 'gzip',
+            trimming_engine: str = 'trim_galore',
+            run_fastqc: bool = False,
+            dada2_shard_column: Optional[str] = None,
+            dada2_shard_size: int = 0,
+            dada2_truncate_lengths: Optional[Tuple[int, int]] = (0, 0),
+            decontam_engine: str = 'qiime',
+            dereplication_engine: str = 'qiime',
+            dereplication_min_count: int = 1,
+            long_read_filter: Optional[Dict[str, Any]] = None,
+            reference_cache_dir: Optional[str] = None,
+            taxonomy_cache: Optional[str] = None,
+            taxonomy_cache_max_entries: int = 1_000_000,
+            input_staging_workers: int = 0,
+            command_timeout: Optional[float] = None,
+            executor_backend: str = SERIAL,
+            executor_workers: int = 1,
+            queue_dir: Optional[str] = None,
+            run_profiles: Optional[List[str]] = None,
+            progress_display: bool = False):
 
         self.workdir = workdir
         self.outdir = outdir
@@ -27,6 +83,66 @@ class Settings:
         self.debug = debug
         self.mock = mock
         self.for_publication = for_publication
+        self.keep_intermediates = keep_intermediates
+        self.intermediate_compression = intermediate_compression
+        self.trimming_engine = trimming_engine
+        self.run_fastqc = run_fastqc
+        self.dada2_shard_column = dada2_shard_column
+        self.dada2_shard_size = dada2_shard_size
+        self.dada2_truncate_lengths = dada2_truncate_lengths
+        self.decontam_engine = decontam_engine
+        self.dereplication_engine = dereplication_engine
+        self.dereplication_min_count = dereplication_min_count
+        self.long_read_filter = long_read_filter
+        self.reference_cache_dir = reference_cache_dir
+        self.taxonomy_cache = taxonomy_cache
+        self.taxonomy_cache_max_entries = taxonomy_cache_max_entries
+        self.input_staging_workers = input_staging_workers
+        self.command_timeout = command_timeout
+        self.executor_backend = executor_backend
+        self.executor_workers = executor_workers
+        self.queue_dir = queue_dir
+        self.run_profiles = run_profiles or []
+        self.progress_display = progress_display
+
+        self.executor = get_executor(
+            backend=self.executor_backend,
+            workers=self.executor_workers,
+            queue_dir=self.queue_dir)
+
+        self.thread_budget = ThreadBudget(total=self.threads)
+        self.intermediates = IntermediateFiles(
+            workdir=self.workdir,
+            keep=self.keep_intermediates or self.mock)
+        self.input_stager = None  # started by the pipeline if input_staging_workers > 0
+        self.progress = None  # reported by the pipeline, None for processors run on their own
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # runtime objects stay with the coordinating process, a worker process builds its own
+        state = self.__dict__.copy()
+        for key in ['executor', 'thread_budget', 'input_stager', 'progress']:
+            state.pop(key)
+        return state
+
+    def __setstate__(self, state: Dict[str, Any]):
+        self.__dict__.update(state)
+        self.executor = SerialExecutor()  # no nested fan-out
+        self.thread_budget = ThreadBudget(total=self.threads)
+        self.input_stager = None
+        self.progress = None
+
+    def for_worker(self, threads: int) -> 'Settings':
+        settings = copy.copy(self)
+        settings.threads = threads
+        settings.thread_budget = ThreadBudget(total=threads)
+        return settings
+
+    def for_subtree(self, outdir: str, workdir: str) -> 'Settings':
+        # the runtime objects (thread budget, executor, intermediates, progress) are shared
+        settings = copy.copy(self)
+        settings.outdir = outdir
+        settings.workdir = workdir
+        return settings
 
 
 class Logger:
@@ -65,6 +181,7 @@ class Processor:
 
     CMD_LINEBREAK = ' \\\n  '
     MAX_TRY = 3
+    BACKOFF_SECONDS = 30.
 
     settings: Settings
     workdir: str
@@ -89,19 +206,198 @@ class Processor:
             level=Logger.DEBUG if self.debug else Logger.INFO
         )
 
-    def call(self, cmd: str):
+    def call(self, cmd: str, threads: Optional[int] = None, timeout: Optional[float] = None):
+        """
+        The command runs locally under a lease of threads (default: all) from the thread budget,
+        with its BLAS/OpenMP thread pools limited to the lease
+
+        Only timeouts and transient I/O errors are retried, see CommandRunner
+        """
         self.logger.info(cmd)
         if self.mock:
             return
+        self.__run_locally(cmds=[cmd], threads=threads, timeout=timeout)
+
+    def call_all(
+            self,
+            cmds: List[str],
+            threads: Optional[int] = None,
+            timeout: Optional[float] = None,
+            staged_inputs: Optional[List[List[str]]] = None,
+            progress_label: Optional[str] = None):
+        """
+        Runs the independent commands concurrently, each under its own lease of threads,
+        or as one job per command on the executor if it is not serial
+
+        staged_inputs[i] are the input files of cmds[i], which does not start before they are staged
+
+        With a progress_label, the commands are reported as the items of the running stage, advanced as each finishes
+        """
+        for cmd in cmds:
+            self.logger.info(cmd)
+        if progress_label is not None:
+            self.progress_items(total=len(cmds), label=progress_label)
+        if self.mock:
+            if progress_label is not None:
+                self.progress_advance(n=len(cmds))
+            return
+
+        before_start = self.__get_staging_wait(staged_inputs)
+        on_done = None if progress_label is None else self.__advance_one
+
+        executor = self.settings.executor
+        if isinstance(executor, SerialExecutor):
+            self.__run_locally(cmds=cmds, threads=threads, timeout=timeout, before_start=before_start, on_done=on_done)
+            return
+
+        threads = threads or self.settings.thread_budget.share(n_tasks=executor.concurrency)
+        executor.map(run_commands, [dict(
+            cmds=[cmd],
+            threads=threads,
+            timeout=timeout or self.settings.command_timeout,
+            max_try=self.MAX_TRY,
+            backoff_seconds=self.BACKOFF_SECONDS
+        ) for cmd in cmds], before_submit=before_start, on_done=on_done)
+
+    def __run_locally(
+            self,
+            cmds: List[str],
+            threads: Optional[int],
+            timeout: Optional[float],
+            before_start: Optional[Callable[[int], None]] = None,
+            on_done: Optional[Callable[[int], None]] = None):
+        runner = CommandRunner(
+            max_try=self.MAX_TRY,
+            backoff_seconds=self.BACKOFF_SECONDS,
+            thread_budget=self.settings.thread_budget,
+            log=self.logger.info)
+        runner.run(
+            commands=[parse_command(cmd) for cmd in cmds],
+            threads=threads or self.threads,
+            timeout=timeout or self.settings.command_timeout,
+            before_start=before_start,
+            on_done=on_done)
+
+    def fan_out(
+            self,
+            processor: type,
+            kwargs_list: List[Dict[str, Any]],
+            staged_inputs: Optional[List[List[str]]] = None) -> List[Any]:
+        """
+        Runs processor(settings).main(**kwargs) for each of the independent kwargs on the executor,
+        each job gets an equal share of the threads of this node
+
+        staged_inputs[i] are the input files of kwargs_list[i], whose job is not submitted before they are staged
+
+        Returns:
+            the return values of main() in the order of kwargs_list
+        """
+        self.progress_items(total=len(kwargs_list), label=processor.__name__)
+        before_submit = self.__get_staging_wait(staged_inputs)
+
+        executor = self.settings.executor
+        if self.mock or isinstance(executor, SerialExecutor):
+            ret = []
+            for i, kwargs in enumerate(kwargs_list):
+                if before_submit is not None:
+                    before_submit(i)
+                ret.append(processor(self.settings).main(**kwargs))
+                self.progress_advance()
+            return ret
+
+        settings = self.settings.for_worker(threads=self.settings.thread_budget.share(n_tasks=executor.concurrency))
+        return executor.map(run_processor, [
+            dict(processor=processor, settings=settings, kwargs=kwargs) for kwargs in kwargs_list
+        ], before_submit=before_submit, on_done=self.__advance_one)
+
+    def map_in_processes(
+            self,
+            function: Callable,
+            kwargs_list: List[Dict[str, Any]],
+            label: str,
+            staged_inputs: Optional[List[List[str]]] = None) -> List[Any]:
+        """
+        Runs the module-level function(**kwargs) for each of the independent kwargs on the executor,
+        or on a temporary pool of one local process per thread if the executor is serial,
+        for pure-Python work (e.g. streaming through reads) that would otherwise run on one core
+
+        staged_inputs[i] are the input files of kwargs_list[i], whose job is not submitted before they are staged
+
+        Returns:
+            the return values of function() in the order of kwargs_list
+        """
+        self.progress_items(total=len(kwargs_list), label=label)
+
+        executor = self.settings.executor
+        own_executor = isinstance(executor, SerialExecutor) and len(kwargs_list) > 1 and self.threads > 1
+        if own_executor:
+            executor = LocalProcessPoolExecutor(workers=min(self.threads, len(kwargs_list)))
+        try:
+            return executor.map(
+                function,
+                kwargs_list,
+                before_submit=self.__get_staging_wait(staged_inputs),
+                on_done=self.__advance_one)
+        finally:
+            if own_executor:
+                executor.shutdown()
+
+    def progress_items(self, total: int, label: str):
+        """
+        Reports a loop of total items (e.g. samples) in the running pipeline stage, see StageProgress
+        """
+        if self.settings.progress is not None:
+            self.settings.progress.start_items(total=total, label=label)
+
+    def progress_advance(self, n: int = 1):
+        if self.settings.progress is not None:
+            self.settings.progress.advance(n=n)
+
+    def __advance_one(self, i: int):
+        # the on_done callback of executor jobs, i.e. one item per finished job whatever its index
+        self.progress_advance()
+
+    def move(self, src: str, dst: str):
+        self.logger.info(f'mv "{src}" "{dst}"')
+        if not self.mock:
+            file_operations.move(src=src, dst=dst)
+
+    def move_glob(self, srcdir: str, pattern: str, dstdir: str):
+        self.logger.info(f'mv "{srcdir}"/{pattern} "{dstdir}/"')
+        if not self.mock:
+            file_operations.move_glob(srcdir=srcdir, pattern=pattern, dstdir=dstdir)
+
+    def concatenate(self, srcs: List[str], dst: str):
+        self.logger.info(f'cat {" ".join(srcs)} > {dst}')
+        if not self.mock:
+            file_operations.concatenate(srcs=srcs, dst=dst)
+
+    def wait_for_staged_input(self, path: str):
+        if self.settings.input_stager is not None:
+            self.settings.input_stager.wait(path)
+
+    def __get_staging_wait(self, staged_inputs: Optional[List[List[str]]]) -> Optional[Callable[[int], None]]:
+        """
+        Returns:
+            a callback blocking until the staged inputs of the i-th job are copied, None if there is nothing to wait for
+        """
+        if staged_inputs is None or self.settings.input_stager is None:
+            return None
+
+        def wait(i: int):
+            for path in staged_inputs[i]:
+                self.wait_for_staged_input(path)
+
+        return wait
+
+    def register_intermediate(self, path: str, consumers: List[str]):
+        deleted = self.settings.intermediates.register(path=path, consumers=consumers)
+        self.__log_deleted(deleted)
+
+    def release_intermediates(self, consumer: str):
+        deleted = self.settings.intermediates.release(consumer=consumer)
+        self.__log_deleted(deleted)
 
-        tried = 0
-        while True:
-            try:
-                subprocess.check_call(cmd, shell=True)
-                break  # succeed and break from the loop
-            except Exception as e:
-                self.logger.info(f'Failed: {e}')
-                tried += 1
-
-            if tried >= self.MAX_TRY:
-                raise Exception('Failed too many times')
+    def __log_deleted(self, deleted: List[str]):
+        for path in deleted:
+            self.logger.debug(f'Deleted intermediate "{path}"')
@@ -0,0 +1,103 @@
+import os
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional
+
+
+THREAD_LIMIT_ENV_VARS = [
+    'OMP_NUM_THREADS',
+    'OPENBLAS_NUM_THREADS',
+    'MKL_NUM_THREADS',
+]
+
+
+class ThreadBudget:
+    """
+    Hands out leases of cores from a fixed total, so that concurrent work never runs more threads than allocated
+
+    A lease larger than the total is clamped to the total, otherwise it would never be granted
+    """
+
+    total: int
+    in_use: int
+    condition: threading.Condition
+
+    def __init__(self, total: int):
+        assert total > 0, f'Thread budget must be positive, got {total}'
+        self.total = total
+        self.in_use = 0
+        self.condition = threading.Condition()
+
+    @property
+    def available(self) -> int:
+        with self.condition:
+            return self.total - self.in_use
+
+    @contextmanager
+    def lease(self, threads: int) -> Iterator[int]:
+        """
+        Blocks until the requested number of cores is free
+
+        Yields:
+            granted number of threads
+        """
+        threads = self.clamp(threads)
+        with self.condition:
+            self.condition.wait_for(lambda: self.total - self.in_use >= threads)
+            self.in_use += threads
+        try:
+            yield threads
+        finally:
+            self.release(threads)
+
+    def try_acquire(self, threads: int) -> Optional[int]:
+        """
+        Non-blocking version of lease() for callers that cannot block, e.g. an event loop
+
+        Returns:
+            granted number of threads, which must be given back with release(), or None if not available now
+        """
+        threads = self.clamp(threads)
+        with self.condition:
+            if self.total - self.in_use < threads:
+                return None
+            self.in_use += threads
+            return threads
+
+    def release(self, threads: int):
+        with self.condition:
+            self.in_use -= threads
+            self.condition.notify_all()
+
+    def clamp(self, threads: int) -> int:
+        return min(max(threads, 1), self.total)
+
+    def share(self, n_tasks: int) -> int:
+        """
+        Returns the threads per task when n_tasks run concurrently within the budget
+        """
+        return max(1, self.total // max(n_tasks, 1))
+
+
+def thread_limit_env(threads: int) -> Dict[str, str]:
+    """
+    Returns a copy of the current environment with BLAS/OpenMP thread pools limited, for child processes
+    """
+    env = os.environ.copy()
+    for var in THREAD_LIMIT_ENV_VARS:
+        env[var] = str(threads)
+    return env
+
+
+def limit_in_process_threads(threads: int):
+    """
+    The environment variables only take effect for libraries loaded afterwards (and for child processes),
+    threadpoolctl (installed with scikit-learn) also resizes the BLAS/OpenMP pools already loaded
+    """
+    for var in THREAD_LIMIT_ENV_VARS:
+        os.environ[var] = str(threads)
+    try:
+        from threadpoolctl import threadpool_limits
+    except ImportError:
+        return
+    threadpool_limits(limits=threads)
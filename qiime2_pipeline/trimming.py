@@ -1,8 +1,18 @@
 import os
 import pandas as pd
 from os.path import basename
-from typing import Tuple, List
-from .template import Processor, Settings
+from typing import Tuple, List, Dict, Any
+from .template import Processor
+from .compression import GZIP, GZIP_LEVELS, fastq_extension, StoreIntermediateFastq
+
+
+TRIM_GALORE = 'trim_galore'
+CUTADAPT = 'cutadapt'
+STREAMING = 'streaming'
+
+TRIMMING_ENGINES = [TRIM_GALORE, CUTADAPT, STREAMING]
+
+CUTADAPT_REPORT_DIRNAME = 'cutadapt'
 
 
 class TrimGalorePairedEnd(Processor):
@@ -52,7 +62,7 @@ class TrimGalorePairedEnd(Processor):
             f'--length {self.LENGTH}',
             f'--max_n {self.MAX_N}',
             '--trim-n',
-            '--gzip',
+            self.gzip_arg(),
             f'--output_dir {self.workdir}'
         ]
 
@@ -75,22 +85,32 @@ class TrimGalorePairedEnd(Processor):
     def move_fastqc_report(self):
         dstdir = f'{self.outdir}/fastqc'
         os.makedirs(dstdir, exist_ok=True)
-        for suffix in [
-            'fastqc.html',
-            'fastqc.zip',
-            'trimming_report.txt'
-        ]:
-            self.call(f'mv {self.workdir}/*{suffix} "{dstdir}/"')
+        # the exact files of this sample, other samples may be trimmed concurrently in the same workdir
+        for fq, read in [(self.fq1, 1), (self.fq2, 2)]:
+            stem = self.__strip_file_extension(basename(fq))
+            for f in [
+                f'{stem}_val_{read}_fastqc.html',
+                f'{stem}_val_{read}_fastqc.zip',
+                f'{basename(fq)}_trimming_report.txt'
+            ]:
+                self.move(src=f'{self.workdir}/{f}', dst=dstdir)
 
     def set_out_fq1(self):
         f = basename(self.fq1)
         f = self.__strip_file_extension(f)
-        self.out_fq1 = f'{self.workdir}/{f}_val_1.fq.gz'
+        self.out_fq1 = f'{self.workdir}/{f}_val_1{self.fq_extension()}'
 
     def set_out_fq2(self):
         f = basename(self.fq2)
         f = self.__strip_file_extension(f)
-        self.out_fq2 = f'{self.workdir}/{f}_val_2.fq.gz'
+        self.out_fq2 = f'{self.workdir}/{f}_val_2{self.fq_extension()}'
+
+    def gzip_arg(self) -> str:
+        # only the default gzip level is written by trim_galore, other policies are applied afterwards
+        return '--gzip' if self.settings.intermediate_compression == GZIP else '--dont_gzip'
+
+    def fq_extension(self) -> str:
+        return '.fq.gz' if self.settings.intermediate_compression == GZIP else '.fq'
 
     def __strip_file_extension(self, f):
         for suffix in [
@@ -106,8 +126,8 @@ class TrimGalorePairedEnd(Processor):
 
 class BatchTrimGalorePairedEnd(Processor):
 
-    TRIMMED_FQ1_SUFFIX = '_R1.fastq.gz'
-    TRIMMED_FQ2_SUFFIX = '_R2.fastq.gz'
+    TRIMMED_FQ1_SUFFIX = '_R1'  # followed by the fastq extension of intermediate compression
+    TRIMMED_FQ2_SUFFIX = '_R2'
 
     sample_sheet: str
     fq_dir: str
@@ -118,10 +138,8 @@ class BatchTrimGalorePairedEnd(Processor):
 
     sample_names: List[str]
     out_fq_dir: str
-
-    def __init__(self, settings: Settings):
-        super().__init__(settings=settings)
-        self.trim_galore = TrimGalorePairedEnd(self.settings).main
+    out_fq1_suffix: str
+    out_fq2_suffix: str
 
     def main(
             self,
@@ -141,10 +159,16 @@ class BatchTrimGalorePairedEnd(Processor):
 
         self.set_sample_names()
         self.make_out_fq_dir()
-        for name in self.sample_names:
-            self.process_one_pair(name)
+        self.set_out_fq_suffixes()
+        kwargs_list = [self.get_one_pair_kwargs(name) for name in self.sample_names]
+        staged_inputs = [[kwargs['fq1'], kwargs['fq2']] for kwargs in kwargs_list]
+        if self.settings.trimming_engine == CUTADAPT:
+            add_report_jsons(outdir=self.outdir, sample_names=self.sample_names, kwargs_list=kwargs_list)
+            self.fan_out(CutadaptPairedEnd, kwargs_list, staged_inputs=staged_inputs)
+        else:
+            self.fan_out(TrimOnePairedEndSample, kwargs_list, staged_inputs=staged_inputs)
 
-        return self.out_fq_dir, self.TRIMMED_FQ1_SUFFIX, self.TRIMMED_FQ2_SUFFIX
+        return self.out_fq_dir, self.out_fq1_suffix, self.out_fq2_suffix
 
     def set_sample_names(self):
         self.sample_names = pd.read_csv(self.sample_sheet, index_col=0).index.tolist()
@@ -153,23 +177,47 @@ class BatchTrimGalorePairedEnd(Processor):
         self.out_fq_dir = f'{self.workdir}/trimmed_fastqs'
         os.makedirs(self.out_fq_dir, exist_ok=True)
 
-    def process_one_pair(self, name: str):
+    def set_out_fq_suffixes(self):
+        extension = fastq_extension(self.settings.intermediate_compression)
+        self.out_fq1_suffix = self.TRIMMED_FQ1_SUFFIX + extension
+        self.out_fq2_suffix = self.TRIMMED_FQ2_SUFFIX + extension
+
+    def get_one_pair_kwargs(self, name: str) -> Dict[str, Any]:
         fq1 = f'{self.fq_dir}/{name}{self.fq1_suffix}'
         fq2 = f'{self.fq_dir}/{name}{self.fq2_suffix}'
-
-        trimmed_fq1_gz, trimmed_fq2_gz = self.trim_galore(
+        return dict(
             fq1=fq1,
             fq2=fq2,
             clip_r1_5_prime=self.clip_r1_5_prime,
-            clip_r2_5_prime=self.clip_r2_5_prime
+            clip_r2_5_prime=self.clip_r2_5_prime,
+            dst1=f'{self.out_fq_dir}/{name}{self.out_fq1_suffix}',
+            dst2=f'{self.out_fq_dir}/{name}{self.out_fq2_suffix}')
+
+
+class TrimOnePairedEndSample(Processor):
+
+    def main(
+            self,
+            fq1: str,
+            fq2: str,
+            clip_r1_5_prime: int,
+            clip_r2_5_prime: int,
+            dst1: str,
+            dst2: str):
+
+        trimmed_fq1, trimmed_fq2 = TrimGalorePairedEnd(self.settings).main(
+            fq1=fq1,
+            fq2=fq2,
+            clip_r1_5_prime=clip_r1_5_prime,
+            clip_r2_5_prime=clip_r2_5_prime
         )
 
-        for fq_gz, suffix in [
-            (trimmed_fq1_gz, self.TRIMMED_FQ1_SUFFIX),
-            (trimmed_fq2_gz, self.TRIMMED_FQ2_SUFFIX)
+        store_intermediate_fastq = StoreIntermediateFastq(self.settings).main
+        for fq, dst in [
+            (trimmed_fq1, dst1),
+            (trimmed_fq2, dst2)
         ]:
-            dst = f'{self.out_fq_dir}/{name}{suffix}'
-            self.call(f'mv "{fq_gz}" "{dst}"')
+            store_intermediate_fastq(src=fq, dst=dst)
 
 
 class TrimGaloreSingleEnd(Processor):
@@ -206,7 +254,7 @@ class TrimGaloreSingleEnd(Processor):
             f'--length {self.LENGTH}',
             f'--max_n {self.MAX_N}',
             '--trim-n',
-            '--gzip',
+            self.gzip_arg(),
             f'--output_dir {self.workdir}',
         ]
 
@@ -225,17 +273,26 @@ class TrimGaloreSingleEnd(Processor):
     def move_fastqc_report(self):
         dstdir = f'{self.outdir}/fastqc'
         os.makedirs(dstdir, exist_ok=True)
-        for suffix in [
-            'fastqc.html',
-            'fastqc.zip',
-            'trimming_report.txt'
+        # the exact files of this sample, other samples may be trimmed concurrently in the same workdir
+        stem = self.__strip_file_extension(basename(self.fq))
+        for f in [
+            f'{stem}_trimmed_fastqc.html',
+            f'{stem}_trimmed_fastqc.zip',
+            f'{basename(self.fq)}_trimming_report.txt'
         ]:
-            self.call(f'mv {self.workdir}/*{suffix} "{dstdir}/"')
+            self.move(src=f'{self.workdir}/{f}', dst=dstdir)
 
     def set_out_fq(self):
         f = basename(self.fq)
         f = self.__strip_file_extension(f)
-        self.out_fq = f'{self.workdir}/{f}_trimmed.fq.gz'
+        self.out_fq = f'{self.workdir}/{f}_trimmed{self.fq_extension()}'
+
+    def gzip_arg(self) -> str:
+        # only the default gzip level is written by trim_galore, other policies are applied afterwards
+        return '--gzip' if self.settings.intermediate_compression == GZIP else '--dont_gzip'
+
+    def fq_extension(self) -> str:
+        return '.fq.gz' if self.settings.intermediate_compression == GZIP else '.fq'
 
     def __strip_file_extension(self, f):
         for suffix in [
@@ -251,8 +308,6 @@ class TrimGaloreSingleEnd(Processor):
 
 class BatchTrimGaloreSingleEnd(Processor):
 
-    TRIMMED_FQ_SUFFIX = '.fastq.gz'
-
     sample_sheet: str
     fq_dir: str
     fq_suffix: str
@@ -260,10 +315,7 @@ class BatchTrimGaloreSingleEnd(Processor):
 
     sample_names: List[str]
     out_fq_dir: str
-
-    def __init__(self, settings: Settings):
-        super().__init__(settings=settings)
-        self.trim_galore = TrimGaloreSingleEnd(self.settings).main
+    out_fq_suffix: str
 
     def main(
             self,
@@ -279,10 +331,16 @@ class BatchTrimGaloreSingleEnd(Processor):
 
         self.set_sample_names()
         self.make_out_fq_dir()
-        for name in self.sample_names:
-            self.process_one_fq(name)
+        self.out_fq_suffix = fastq_extension(self.settings.intermediate_compression)
+        kwargs_list = [self.get_one_fq_kwargs(name) for name in self.sample_names]
+        staged_inputs = [[kwargs['fq']] for kwargs in kwargs_list]
+        if self.settings.trimming_engine == CUTADAPT:
+            add_report_jsons(outdir=self.outdir, sample_names=self.sample_names, kwargs_list=kwargs_list)
+            self.fan_out(CutadaptSingleEnd, kwargs_list, staged_inputs=staged_inputs)
+        else:
+            self.fan_out(TrimOneSingleEndSample, kwargs_list, staged_inputs=staged_inputs)
 
-        return self.out_fq_dir, self.TRIMMED_FQ_SUFFIX
+        return self.out_fq_dir, self.out_fq_suffix
 
     def set_sample_names(self):
         self.sample_names = pd.read_csv(self.sample_sheet, index_col=0).index.tolist()
@@ -291,9 +349,169 @@ class BatchTrimGaloreSingleEnd(Processor):
         self.out_fq_dir = f'{self.workdir}/trimmed_fastqs'
         os.makedirs(self.out_fq_dir, exist_ok=True)
 
-    def process_one_fq(self, name: str):
+    def get_one_fq_kwargs(self, name: str) -> Dict[str, Any]:
         fq = f'{self.fq_dir}/{name}{self.fq_suffix}'
+        return dict(
+            fq=fq,
+            clip_5_prime=self.clip_5_prime,
+            dst=f'{self.out_fq_dir}/{name}{self.out_fq_suffix}')
+
+
+class TrimOneSingleEndSample(Processor):
+
+    def main(self, fq: str, clip_5_prime: int, dst: str):
+        trimmed_fq = TrimGaloreSingleEnd(self.settings).main(fq=fq, clip_5_prime=clip_5_prime)
+        StoreIntermediateFastq(self.settings).main(src=trimmed_fq, dst=dst)
+
+
+class CutadaptPairedEnd(Processor):
+    """
+    Runs cutadapt directly with the same trimming as TrimGalorePairedEnd, but without the trim_galore wrapper,
+    so all the threads of the job go to cutadapt --cores, and FastQC is not run
+
+    The trimmed reads are written straight into their intermediate location, and the trimming report
+    of the sample is a compact cutadapt JSON in place of the text report and FastQC HTML/zip
+    """
+
+    QUALITY = 20
+    LENGTH = 20
+    MAX_N = 0
+    ILLUMINA_ADAPTER = 'AGATCGGAAGAGC'  # as trim_galore --illumina
+    ERROR_RATE = 0.1
+    MIN_OVERLAP = 1  # as trim_galore --stringency 1
+
+    fq1: str
+    fq2: str
+    clip_r1_5_prime: int
+    clip_r2_5_prime: int
+    dst1: str
+    dst2: str
+    report_json: str
+
+    def main(
+            self,
+            fq1: str,
+            fq2: str,
+            clip_r1_5_prime: int,
+            clip_r2_5_prime: int,
+            dst1: str,
+            dst2: str,
+            report_json: str):
+
+        self.fq1 = fq1
+        self.fq2 = fq2
+        self.clip_r1_5_prime = clip_r1_5_prime
+        self.clip_r2_5_prime = clip_r2_5_prime
+        self.dst1 = dst1
+        self.dst2 = dst2
+        self.report_json = report_json
+
+        self.execute()
+
+    def execute(self):
+        args = [
+            'cutadapt',
+            f'--cores {self.threads}',
+            f'--quality-cutoff {self.QUALITY}',
+            f'--adapter {self.ILLUMINA_ADAPTER}',
+            f'-A {self.ILLUMINA_ADAPTER}',
+            f'--error-rate {self.ERROR_RATE}',
+            f'--overlap {self.MIN_OVERLAP}',
+            '--trim-n',
+            f'--minimum-length {self.LENGTH}',
+            f'--max-n {self.MAX_N}',
+        ]
+
+        if self.clip_r1_5_prime > 0:
+            args.append(f'--cut {self.clip_r1_5_prime}')
+
+        if self.clip_r2_5_prime > 0:
+            args.append(f'-U {self.clip_r2_5_prime}')
+
+        log = f'{self.outdir}/cutadapt.log'
+        args += [
+            self.compression_arg(),
+            f'--json "{self.report_json}"',
+            f'--output "{self.dst1}"',
+            f'--paired-output "{self.dst2}"',
+            f'"{self.fq1}"',
+            f'"{self.fq2}"',
+            f'1>> "{log}"',
+            f'2>> "{log}"'
+        ]
+
+        self.call(self.CMD_LINEBREAK.join(args))
+
+    def compression_arg(self) -> str:
+        # zstd or no compression follows the extension of the output
+        level = GZIP_LEVELS.get(self.settings.intermediate_compression, GZIP_LEVELS[GZIP])
+        return f'--compression-level {level}'
+
+
+class CutadaptSingleEnd(Processor):
+    """
+    Single-end version of CutadaptPairedEnd, with the same trimming as TrimGaloreSingleEnd
+    """
+
+    QUALITY = 20
+    LENGTH = 20
+    MAX_N = 0
+    ILLUMINA_ADAPTER = 'AGATCGGAAGAGC'
+    ERROR_RATE = 0.1
+    MIN_OVERLAP = 1
+
+    fq: str
+    clip_5_prime: int
+    dst: str
+    report_json: str
+
+    def main(self, fq: str, clip_5_prime: int, dst: str, report_json: str):
+        self.fq = fq
+        self.clip_5_prime = clip_5_prime
+        self.dst = dst
+        self.report_json = report_json
+
+        self.execute()
+
+    def execute(self):
+        args = [
+            'cutadapt',
+            f'--cores {self.threads}',
+            f'--quality-cutoff {self.QUALITY}',
+            f'--adapter {self.ILLUMINA_ADAPTER}',
+            f'--error-rate {self.ERROR_RATE}',
+            f'--overlap {self.MIN_OVERLAP}',
+            '--trim-n',
+            f'--minimum-length {self.LENGTH}',
+            f'--max-n {self.MAX_N}',
+        ]
+
+        if self.clip_5_prime > 0:
+            args.append(f'--cut {self.clip_5_prime}')
+
+        log = f'{self.outdir}/cutadapt.log'
+        args += [
+            self.compression_arg(),
+            f'--json "{self.report_json}"',
+            f'--output "{self.dst}"',
+            f'"{self.fq}"',
+            f'1>> "{log}"',
+            f'2>> "{log}"'
+        ]
+
+        self.call(self.CMD_LINEBREAK.join(args))
+
+    def compression_arg(self) -> str:
+        # zstd or no compression follows the extension of the output
+        level = GZIP_LEVELS.get(self.settings.intermediate_compression, GZIP_LEVELS[GZIP])
+        return f'--compression-level {level}'
 
-        fq = self.trim_galore(fq=fq, clip_5_prime=self.clip_5_prime)
 
-        self.call(f'mv "{fq}" "{self.out_fq_dir}/{name}{self.TRIMMED_FQ_SUFFIX}"')
+def add_report_jsons(outdir: str, sample_names: List[str], kwargs_list: List[Dict[str, Any]]):
+    """
+    Adds the path of the cutadapt JSON report of each sample to the kwargs of CutadaptPairedEnd or CutadaptSingleEnd
+    """
+    report_dir = f'{outdir}/{CUTADAPT_REPORT_DIRNAME}'
+    os.makedirs(report_dir, exist_ok=True)
+    for name, kwargs in zip(sample_names, kwargs_list):
+        kwargs['report_json'] = f'{report_dir}/{name}.json'
@@ -0,0 +1,277 @@
+import gzip
+import json
+import zipfile
+import numpy as np
+import pandas as pd
+from os.path import basename
+from typing import List, Dict, Tuple, Optional, IO
+from .template import Processor
+from .pooling import reverse_complement
+
+
+AUTO = 'auto'
+
+TRUNCATION_PROFILE_CSV = 'dada2-truncation-profile.csv'
+TRUNCATION_JSON = 'dada2-truncation.json'
+
+PHRED_OFFSET = 33
+MAX_PHRED = 93
+
+
+class AutoTruncation(Processor):
+    """
+    Chooses the DADA2 truncation lengths from the quality profiles of the first reads of every sample,
+    saved to dada2-truncation-profile.csv and dada2-truncation.json
+    """
+
+    MIN_MEDIAN_QUALITY = 25
+    MIN_READ_FRACTION = 0.9
+    MIN_TRUNCATE_LENGTH = 100
+    MAX_SAMPLED_READS = 100_000
+    KMER_SIZE = 16
+    AMPLICON_LENGTH_PERCENTILE = 95
+
+    demultiplexed_seq_qza: str
+    paired: bool
+    min_overlap: int
+
+    r1_reads: List[Tuple[bytes, bytes]]
+    r2_reads: List[Tuple[bytes, bytes]]
+    profiles: List[pd.DataFrame]
+    quality_lengths: List[int]
+    max_lengths: List[int]
+    amplicon_length: Optional[int]
+    truncate_lengths: Tuple[int, int]
+
+    def main(
+            self,
+            demultiplexed_seq_qza: str,
+            paired: bool,
+            min_overlap: int) -> Tuple[int, int]:
+        """
+        Returns:
+            truncation lengths of R1 and R2, R2 is 0 for single-end reads
+        """
+        self.demultiplexed_seq_qza = demultiplexed_seq_qza
+        self.paired = paired
+        self.min_overlap = min_overlap
+
+        if self.mock:
+            self.logger.info(f'Choose DADA2 truncation lengths from the quality profiles of "{self.demultiplexed_seq_qza}"')
+            return 0, 0
+
+        self.sample_reads()
+        self.set_profiles()
+        self.set_amplicon_length()
+        self.set_truncate_lengths()
+        self.save_profiles()
+        self.save_decision()
+
+        return self.truncate_lengths
+
+    def sample_reads(self):
+        with zipfile.ZipFile(self.demultiplexed_seq_qza) as qza:
+            members = get_fastq_members(names=qza.namelist())
+            assert len(members) > 0, f'No fastq in "{self.demultiplexed_seq_qza}"'
+
+            reads_per_file = max(1, self.MAX_SAMPLED_READS // len(members))
+            self.r1_reads, self.r2_reads = [], []
+            for sample_members in members.values():
+                with qza.open(sample_members['R1']) as fh:
+                    self.r1_reads += read_first_reads(fh=fh, n=reads_per_file)
+                if self.paired:
+                    with qza.open(sample_members['R2']) as fh:
+                        self.r2_reads += read_first_reads(fh=fh, n=reads_per_file)
+
+        self.logger.info(f'Sampled {len(self.r1_reads)} reads ({reads_per_file} per sample) for DADA2 truncation')
+
+    def set_profiles(self):
+        self.profiles, self.quality_lengths, self.max_lengths = [], [], []
+        for reads in [self.r1_reads, self.r2_reads] if self.paired else [self.r1_reads]:
+            profile = get_quality_profile(quals=[q for _, q in reads])
+            self.profiles.append(profile)
+            self.quality_lengths.append(get_passing_length(
+                profile=profile,
+                min_median_quality=self.MIN_MEDIAN_QUALITY,
+                min_read_fraction=self.MIN_READ_FRACTION))
+            self.max_lengths.append(get_passing_length(
+                profile=profile,
+                min_median_quality=0,
+                min_read_fraction=self.MIN_READ_FRACTION))
+
+    def set_amplicon_length(self):
+        self.amplicon_length = None
+        if not self.paired:
+            return
+        lengths = []
+        for (seq1, _), (seq2, _) in zip(self.r1_reads, self.r2_reads):
+            length = estimate_amplicon_length(seq1=seq1, seq2=seq2, k=self.KMER_SIZE)
+            if length is not None:
+                lengths.append(length)
+        if len(lengths) > 0:
+            self.amplicon_length = int(np.percentile(lengths, self.AMPLICON_LENGTH_PERCENTILE))
+        self.logger.info(f'Amplicon length {self.amplicon_length}, estimated from {len(lengths)} overlapping read pairs')
+
+    def set_truncate_lengths(self):
+        if not self.paired:
+            length = self.quality_lengths[0]
+            if length == 0:  # DADA2 would take 0 as no truncation, the opposite of the failing quality
+                length = min(self.MIN_TRUNCATE_LENGTH, self.max_lengths[0])
+                self.logger.warning(
+                    f'Median quality below {self.MIN_MEDIAN_QUALITY} from the first position, truncate at {length}')
+            self.truncate_lengths = (length, 0)
+        elif self.amplicon_length is None:
+            self.logger.warning('Read pairs do not overlap, no truncation')
+            self.truncate_lengths = (0, 0)
+        else:
+            self.truncate_lengths = extend_to_overlap(
+                profiles=self.profiles,
+                quality_lengths=self.quality_lengths,
+                max_lengths=self.max_lengths,
+                required_length=self.amplicon_length + self.min_overlap)
+            if self.truncate_lengths == (0, 0):
+                self.logger.warning(f'Reads too short to overlap by {self.min_overlap} bases after truncation, no truncation')
+
+        self.logger.info(f'DADA2 truncation lengths: {self.truncate_lengths}')
+
+    def save_profiles(self):
+        n_positions = max(len(p) for p in self.profiles)
+        columns = {'Position': np.arange(1, n_positions + 1)}
+        for read, profile in zip(['R1', 'R2'], self.profiles):
+            profile = profile.reindex(range(n_positions))
+            columns[f'{read} Median Quality'] = profile['Median Quality'].values
+            columns[f'{read} Read Fraction'] = profile['Read Fraction'].fillna(0).values
+        pd.DataFrame(columns).to_csv(f'{self.outdir}/{TRUNCATION_PROFILE_CSV}', index=False)
+
+    def save_decision(self):
+        decision = {
+            'sampled_reads': len(self.r1_reads),
+            'min_median_quality': self.MIN_MEDIAN_QUALITY,
+            'min_read_fraction': self.MIN_READ_FRACTION,
+            'quality_lengths': self.quality_lengths,
+            'max_lengths': self.max_lengths,
+            'amplicon_length': self.amplicon_length,
+            'min_overlap': self.min_overlap if self.paired else None,
+            'truncate_lengths': list(self.truncate_lengths),
+        }
+        with open(f'{self.outdir}/{TRUNCATION_JSON}', 'w') as fh:
+            json.dump(decision, fh, indent=2)
+
+
+def get_fastq_members(names: List[str]) -> Dict[str, Dict[str, str]]:
+    """
+    Args:
+        names: of a demultiplexed qza, the fastqs in casava format, e.g. 'uuid/data/S1_1_L001_R2_001.fastq.gz'
+
+    Returns:
+        {sample id: {'R1': name, 'R2': name}}, R1 and R2 of a sample may have different barcode numbers
+    """
+    members = {}
+    for name in sorted(names):
+        if '/data/' not in name or not name.endswith('.fastq.gz'):
+            continue
+        sample_id, _, _, read, _ = basename(name).rsplit('_', 4)
+        members.setdefault(sample_id, {})[read] = name
+    return members
+
+
+def read_first_reads(fh: IO, n: int) -> List[Tuple[bytes, bytes]]:
+    """
+    Args:
+        fh: binary gzip fastq
+
+    Returns:
+        sequence and quality of the first n reads
+    """
+    reads = []
+    with gzip.GzipFile(fileobj=fh) as reader:
+        while len(reads) < n:
+            header = reader.readline()
+            if not header:
+                break
+            seq = reader.readline().rstrip(b'\r\n')
+            reader.readline()
+            qual = reader.readline().rstrip(b'\r\n')
+            reads.append((seq, qual))
+    return reads
+
+
+def get_quality_profile(quals: List[bytes]) -> pd.DataFrame:
+    """
+    Returns:
+        indexed by 0-based position, columns 'Median Quality' and 'Read Fraction' (fraction of reads at least that long)
+    """
+    max_length = max((len(q) for q in quals), default=0)
+    histogram = np.zeros((max_length, MAX_PHRED + 1), dtype=np.int64)
+    for qual in quals:
+        scores = np.frombuffer(qual, dtype=np.uint8).astype(np.int64) - PHRED_OFFSET
+        histogram[np.arange(len(scores)), np.clip(scores, 0, MAX_PHRED)] += 1
+
+    n_reads = histogram.sum(axis=1)
+    cumulative = histogram.cumsum(axis=1)
+    medians = (cumulative < (n_reads[:, None] / 2)).sum(axis=1)
+    return pd.DataFrame({
+        'Median Quality': medians,
+        'Read Fraction': n_reads / max(len(quals), 1),
+    })
+
+
+def get_passing_length(profile: pd.DataFrame, min_median_quality: int, min_read_fraction: float) -> int:
+    passing = (profile['Median Quality'] >= min_median_quality) & (profile['Read Fraction'] >= min_read_fraction)
+    failing = np.flatnonzero(~passing.values)
+    return int(failing[0]) if len(failing) > 0 else len(profile)
+
+
+def estimate_amplicon_length(seq1: bytes, seq2: bytes, k: int) -> Optional[int]:
+    """
+    Finds a k-mer of the reverse-complemented R2 that occurs exactly once in R1,
+    trying k-mers from the 3' end of R2 (the start of the reverse complement) onwards
+
+    Returns:
+        None if no k-mer is found, i.e. the reads may not overlap
+    """
+    rc2 = reverse_complement(seq2)
+    for offset in range(0, len(rc2) - k + 1, k):
+        kmer = rc2[offset:offset + k]
+        pos = seq1.find(kmer)
+        if pos >= 0 and seq1.find(kmer, pos + 1) < 0:
+            return pos - offset + len(rc2)
+    return None
+
+
+def extend_to_overlap(
+        profiles: List[pd.DataFrame],
+        quality_lengths: List[int],
+        max_lengths: List[int],
+        required_length: int) -> Tuple[int, int]:
+    """
+    Extends the shorter-than-required sum of R1 and R2 truncation lengths one position at a time,
+    choosing the direction with the better median quality at its next position
+
+    Returns:
+        (0, 0) if the required length cannot be reached within the max lengths
+    """
+    lengths = list(quality_lengths)
+    while sum(lengths) < required_length:
+        candidates = [i for i in range(2) if lengths[i] < max_lengths[i]]
+        if len(candidates) == 0:
+            return 0, 0
+        i = max(candidates, key=lambda i: profiles[i]['Median Quality'].iloc[lengths[i]])
+        lengths[i] += 1
+    return lengths[0], lengths[1]
+
+
+def parse_truncate_lengths(value: str) -> Optional[Tuple[int, int]]:
+    """
+    Args:
+        value: 'auto', '250' (both R1 and R2) or '250,200' (R1,R2), 0 for no truncation
+
+    Returns:
+        None for automatic truncation
+    """
+    if value.lower() == AUTO:
+        return None
+    lengths = [int(v) for v in value.split(',')]
+    assert len(lengths) in [1, 2], f'"{value}" is not a valid DADA2 truncation length'
+    assert all(n >= 0 for n in lengths), f'"{value}" is not a valid DADA2 truncation length'
+    return lengths[0], lengths[-1]
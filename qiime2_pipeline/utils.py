@@ -1,4 +1,5 @@
 import os
+import zipfile
 from typing import Optional
 
 
@@ -29,3 +30,11 @@ def get_temp_path(
         if not os.path.exists(fpath):
             return fpath
         i += 1
+
+
+def get_artifact_uuid(qza: str) -> str:
+    """
+    A qza is a zip of one directory named after the UUID of the artifact
+    """
+    with zipfile.ZipFile(qza) as z:
+        return z.namelist()[0].split('/')[0]
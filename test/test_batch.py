@@ -0,0 +1,59 @@
+import os
+import threading
+import pandas as pd
+from .setup import TestCase
+from qiime2_pipeline.batch import ProjectBatch
+
+
+class TestProjectBatch(TestCase):
+
+    def setUp(self):
+        self.set_up(py_path=__file__)
+        self.classifier = f'{self.workdir}/classifier.qza'
+        with open(self.classifier, 'wb') as fh:
+            fh.write(b'qza')
+
+    def tearDown(self):
+        self.tear_down()
+
+    def get_projects(self, n: int):
+        return [{
+            'sample_sheet': f'{self.workdir}/sheet_{i}.csv',
+            'outdir': f'{self.outdir}/project_{i}',
+            'nb_classifier_qza': self.classifier,
+            'reference_sequence_qza': 'None',
+        } for i in range(n)]
+
+    def test_main(self):
+        seen = []
+        lock = threading.Lock()
+
+        def run_project(kwargs):
+            with lock:
+                seen.append(kwargs['nb_classifier_qza'])
+            if kwargs['outdir'].endswith('project_2'):
+                raise RuntimeError('bad project')
+
+        summary_csv = f'{self.outdir}/batch-summary.csv'
+        n_failed = ProjectBatch(
+            run_project=run_project,
+            concurrent_projects=2,
+            shared_dir=f'{self.workdir}/shared').main(
+            projects=self.get_projects(n=4),
+            summary_csv=summary_csv)
+
+        self.assertEqual(1, n_failed)
+        self.assertSetEqual({f'{self.workdir}/shared/1_classifier.qza'}, set(seen))  # staged once, shared by all
+        self.assertListEqual(['done', 'done', 'failed', 'done'], pd.read_csv(summary_csv)['Status'].tolist())
+        self.assertListEqual(['1_classifier.qza'], os.listdir(f'{self.workdir}/shared'))
+
+    def test_same_outdir(self):
+        projects = self.get_projects(n=2)
+        projects[1]['outdir'] = projects[0]['outdir']
+        with self.assertRaises(AssertionError):
+            ProjectBatch(
+                run_project=lambda kwargs: None,
+                concurrent_projects=2,
+                shared_dir=f'{self.workdir}/shared').main(
+                projects=projects,
+                summary_csv=f'{self.outdir}/batch-summary.csv')
@@ -0,0 +1,77 @@
+import os
+import gzip
+from .setup import TestCase
+from qiime2_pipeline.template import Settings
+from qiime2_pipeline.compression import open_fastq, transcode, fastq_extension, StoreIntermediateFastq
+
+
+RECORDS = b'@read1\nACGT\n+\nIIII\n@read2\nTTGA\n+\nIIII\n'
+
+
+class TestFunctions(TestCase):
+
+    def setUp(self):
+        self.set_up(py_path=__file__)
+
+    def tearDown(self):
+        self.tear_down()
+
+    def test_fastq_extension(self):
+        for policy, expected in [
+            ('gzip', '.fastq.gz'),
+            ('gzip-1', '.fastq.gz'),
+            ('zstd', '.fastq.zst'),
+            ('none', '.fastq'),
+        ]:
+            self.assertEqual(expected, fastq_extension(policy))
+
+    def test_open_fastq_round_trip(self):
+        for fname in ['R1.fastq', 'R1.fastq.gz', 'R1.fastq.zst']:
+            if fname.endswith('.zst'):
+                try:
+                    import zstandard
+                except ImportError:
+                    continue
+            fq = f'{self.workdir}/{fname}'
+            with open_fastq(fq, 'wb', policy='gzip-1') as fh:
+                fh.write(RECORDS)
+            with open_fastq(fq, 'rb') as fh:
+                self.assertEqual(RECORDS, fh.read())
+
+    def test_transcode(self):
+        src = f'{self.workdir}/R1.fastq'
+        dst = f'{self.workdir}/R1.fastq.gz'
+        with open(src, 'wb') as fh:
+            fh.write(RECORDS)
+        transcode(src=src, dst=dst, policy='gzip-1')
+        with gzip.open(dst, 'rb') as fh:
+            self.assertEqual(RECORDS, fh.read())
+
+
+class TestStoreIntermediateFastq(TestCase):
+
+    def setUp(self):
+        self.set_up(py_path=__file__)
+
+    def tearDown(self):
+        self.tear_down()
+
+    def test_gzip_fast(self):
+        settings = Settings(
+            workdir=self.workdir,
+            outdir=self.outdir,
+            threads=1,
+            debug=True,
+            mock=False,
+            for_publication=False,
+            intermediate_compression='gzip-1')
+        src = f'{self.workdir}/R1_val_1.fq'
+        dst = f'{self.workdir}/S1_R1.fastq.gz'
+        with open(src, 'wb') as fh:
+            fh.write(RECORDS)
+
+        StoreIntermediateFastq(settings).main(src=src, dst=dst)
+
+        self.assertFalse(os.path.exists(src))
+        with gzip.open(dst, 'rb') as fh:
+            self.assertEqual(RECORDS, fh.read())
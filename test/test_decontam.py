@@ -1,5 +1,9 @@
+import numpy as np
+import pandas as pd
+from scipy import stats
 from .setup import TestCase
-from qiime2_pipeline.decontam import Decontam
+from qiime2_pipeline.decontam import Decontam, NativeDecontam, frequency_scores, prevalence_scores, combine_scores, \
+    is_negative_control, get_decontam_method
 
 
 class TestDecontam(TestCase):
@@ -16,6 +20,7 @@ class TestDecontam(TestCase):
             feature_sequence_qza=f'{self.indir}/feature-sequence.qza',
             sample_sheet=f'{self.indir}/sample-sheet.csv',
             dna_concentration_column='DNA conc. (ng/µL)',
+            negative_control_column=None,
             decontam_threshold=0.1,
         )
         for expected, actual in [
@@ -23,3 +28,80 @@ class TestDecontam(TestCase):
             (f'{self.workdir}/decontam-feature-sequence.qza', decontam_sequence_qza),
         ]:
             self.assertFileExists(expected, actual)
+
+
+class TestNativeDecontam(TestCase):
+
+    def setUp(self):
+        self.set_up(py_path=__file__)
+
+    def tearDown(self):
+        self.tear_down()
+
+    def test_main(self):
+        decontam_table_qza, decontam_sequence_qza = NativeDecontam(self.settings).main(
+            feature_table_qza=f'{self.indir}/feature-table.qza',
+            feature_sequence_qza=f'{self.indir}/feature-sequence.qza',
+            sample_sheet=f'{self.indir}/sample-sheet.csv',
+            dna_concentration_column='DNA conc. (ng/µL)',
+            negative_control_column=None,
+            decontam_threshold=0.1,
+        )
+        for expected, actual in [
+            (f'{self.workdir}/decontam-feature-table.qza', decontam_table_qza),
+            (f'{self.workdir}/decontam-feature-sequence.qza', decontam_sequence_qza),
+        ]:
+            self.assertFileExists(expected, actual)
+
+
+class TestFunctions(TestCase):
+
+    def test_frequency_scores(self):
+        rng = np.random.default_rng(0)
+        concentrations = rng.uniform(1, 50, size=12)
+        counts = np.vstack([
+            np.round(1000 / concentrations),  # contaminant, inversely proportional to DNA concentration
+            rng.integers(100, 200, size=12),  # non-contaminant
+            np.array([5] + [0] * 11),  # present in one sample
+        ]).astype(float)
+        counts = np.vstack([counts, 10000 - counts.sum(axis=0)])
+
+        actual = frequency_scores(counts=counts, concentrations=concentrations)
+
+        for i in range(2):
+            frequencies = counts[i] / counts.sum(axis=0)
+            log_f, log_c = np.log(frequencies), np.log(concentrations)
+            ss0 = ((log_f - log_f.mean()) ** 2).sum()
+            ss1 = ((log_f + log_c - (log_f + log_c).mean()) ** 2).sum()
+            self.assertAlmostEqual(stats.f.cdf(ss1 / ss0, 11, 11), actual[i])
+        self.assertLess(actual[0], 0.1)
+        self.assertGreater(actual[1], 0.1)
+        self.assertTrue(np.isnan(actual[2]))
+
+    def test_prevalence_scores(self):
+        counts = np.array([
+            [1, 1, 1, 0, 0, 0, 0, 0],  # only in the controls
+            [0, 0, 0, 1, 1, 1, 1, 1],  # only in the true samples
+        ])
+        negative_controls = np.array([True, True, True, False, False, False, False, False])
+
+        actual = prevalence_scores(counts=counts, negative_controls=negative_controls)
+
+        self.assertAlmostEqual(stats.fisher_exact([[3, 0], [0, 5]], alternative='greater')[1], actual[0])
+        self.assertAlmostEqual(1., actual[1])
+
+    def test_combine_scores(self):
+        actual = combine_scores(
+            frequency=np.array([0.01, np.nan, 0.5]),
+            prevalence=np.array([0.02, 0.3, np.nan]))
+        self.assertAlmostEqual(stats.chi2.sf(-2 * np.log(0.01 * 0.02), 4), actual[0])
+        self.assertListEqual([0.3, 0.5], actual[1:].tolist())
+
+    def test_is_negative_control(self):
+        actual = is_negative_control(pd.Series(['TRUE', 'false', 'yes', 'No', '1', '0', np.nan]))
+        self.assertListEqual([True, False, True, False, True, False, False], actual.tolist())
+
+    def test_get_decontam_method(self):
+        self.assertEqual('frequency', get_decontam_method(dna_concentration_column='DNA', negative_control_column=None))
+        self.assertEqual('prevalence', get_decontam_method(dna_concentration_column=None, negative_control_column='Control'))
+        self.assertEqual('combined', get_decontam_method(dna_concentration_column='DNA', negative_control_column='Control'))
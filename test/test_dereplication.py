@@ -0,0 +1,70 @@
+import os
+import gzip
+import biom
+import hashlib
+import pandas as pd
+from .setup import TestCase
+from qiime2_pipeline.dereplication import StreamingDereplication, dereplicate_one_sample
+
+
+def write_fq(fq: str, seqs):
+    with gzip.open(fq, 'wb') as fh:
+        for i, seq in enumerate(seqs):
+            fh.write(b'@r%d\n%s\n+\n%s\n' % (i, seq, b'I' * len(seq)))
+
+
+def sha1(seq: bytes) -> str:
+    return hashlib.sha1(seq).hexdigest()
+
+
+class TestStreamingDereplication(TestCase):
+
+    def setUp(self):
+        self.set_up(py_path=__file__)
+        self.sample_sheet = f'{self.workdir}/sample-sheet.csv'
+        pd.DataFrame({'Sample': ['S1', 'S2'], 'Group': ['A', 'B']}).to_csv(self.sample_sheet, index=False)
+        self.fq_dir = f'{self.workdir}/fq_dir'
+        os.makedirs(self.fq_dir)
+        write_fq(f'{self.fq_dir}/S1_Nanopore.fastq.gz', [b'AACG', b'aacg', b'TTTT'])
+        write_fq(f'{self.fq_dir}/S2_Nanopore.fastq.gz', [b'AACG', b'GGGG'])
+
+    def tearDown(self):
+        self.tear_down()
+
+    def test_main(self):
+        feature_table_qza, feature_sequence_qza = StreamingDereplication(self.settings).main(
+            sample_sheet=self.sample_sheet,
+            fq_dir=self.fq_dir,
+            fq_suffix='_Nanopore.fastq.gz',
+            min_count=2)
+
+        table = biom.load_table(f'{self.workdir}/dereplicated-table.biom')
+        self.assertListEqual([sha1(b'AACG')], list(table.ids(axis='observation')))
+        self.assertListEqual([2, 1], table.data(sha1(b'AACG'), axis='observation').tolist())
+        with open(f'{self.workdir}/dereplicated-sequence.fa') as fh:
+            self.assertEqual(f'>{sha1(b"AACG")}\nAACG\n', fh.read())
+        for expected, actual in [
+            (f'{self.workdir}/dereplicated-table.qza', feature_table_qza),
+            (f'{self.workdir}/dereplicated-sequence.qza', feature_sequence_qza),
+        ]:
+            self.assertFileExists(expected, actual)
+
+
+class TestFunctions(TestCase):
+
+    def setUp(self):
+        self.set_up(py_path=__file__)
+
+    def tearDown(self):
+        self.tear_down()
+
+    def test_dereplicate_one_sample(self):
+        fq = f'{self.workdir}/S1.fastq.gz'
+        fa = f'{self.workdir}/S1.fa'
+        write_fq(fq, [b'AACG', b'TTTT', b'aacg'])
+
+        counts = dereplicate_one_sample(fq=fq, fa=fa)
+
+        self.assertDictEqual({sha1(b'AACG'): 2, sha1(b'TTTT'): 1}, counts)
+        with open(fa) as fh:
+            self.assertEqual(f'>{sha1(b"AACG")}\nAACG\n>{sha1(b"TTTT")}\nTTTT\n', fh.read())
@@ -0,0 +1,139 @@
+import os
+import pickle
+from multiprocessing import Process
+from .setup import TestCase
+from qiime2_pipeline.template import Processor, Settings
+from qiime2_pipeline.executor import SerialExecutor, LocalProcessPoolExecutor, FileQueueExecutor, \
+    FileQueueWorker, get_executor
+
+
+def square(x: int) -> int:
+    return x * x
+
+
+def fail(x: int):
+    raise ValueError(f'bad {x}')
+
+
+def run_worker(queue_dir: str):
+    FileQueueWorker(queue_dir=queue_dir, poll_seconds=0.05, idle_exit_seconds=1).main()
+
+
+class WriteThreads(Processor):
+
+    def main(self, name: str) -> int:
+        with open(f'{self.outdir}/{name}.txt', 'w') as fh:
+            fh.write(f'{self.threads}')
+        return self.threads
+
+
+class TestExecutor(TestCase):
+
+    def setUp(self):
+        self.set_up(py_path=__file__)
+
+    def tearDown(self):
+        self.tear_down()
+
+    def test_serial(self):
+        self.assertListEqual([0, 1, 4], SerialExecutor().map(square, [dict(x=x) for x in range(3)]))
+
+    def test_local_process_pool(self):
+        executor = LocalProcessPoolExecutor(workers=2)
+        self.assertListEqual([0, 1, 4, 9], executor.map(square, [dict(x=x) for x in range(4)]))
+
+    def test_before_submit_and_on_done(self):
+        for executor in [SerialExecutor(), LocalProcessPoolExecutor(workers=2)]:
+            submitted, done = [], []
+            results = executor.map(
+                square, [dict(x=x) for x in range(4)], before_submit=submitted.append, on_done=done.append)
+            executor.shutdown()
+            self.assertListEqual([0, 1, 4, 9], results)
+            self.assertListEqual([0, 1, 2, 3], submitted)
+            self.assertListEqual([0, 1, 2, 3], sorted(done))  # in the order of completion
+
+    def test_file_queue(self):
+        queue_dir = f'{self.workdir}/queue'
+        executor = FileQueueExecutor(queue_dir=queue_dir)
+        executor.POLL_SECONDS = 0.05
+
+        workers = [Process(target=run_worker, args=(queue_dir,)) for _ in range(2)]
+        for w in workers:
+            w.start()
+        results = executor.map(square, [dict(x=x) for x in range(10)])
+        for w in workers:
+            w.join()
+
+        self.assertListEqual([x * x for x in range(10)], results)
+        for d in ['pending', 'claimed', 'done']:
+            self.assertListEqual([], os.listdir(f'{queue_dir}/{d}'))
+
+    def test_file_queue_error(self):
+        queue_dir = f'{self.workdir}/queue'
+        executor = FileQueueExecutor(queue_dir=queue_dir)
+        executor.POLL_SECONDS = 0.05
+
+        worker = Process(target=run_worker, args=(queue_dir,))
+        worker.start()
+        with self.assertRaises(RuntimeError):
+            executor.map(fail, [dict(x=1)])
+        worker.join()
+
+    def test_file_queue_unclaimed(self):
+        queue_dir = f'{self.workdir}/queue'
+        executor = FileQueueExecutor(queue_dir=queue_dir)
+        executor.POLL_SECONDS = 0.05
+        executor.UNCLAIMED_WARNING_SECONDS = 0.1
+        executor.UNCLAIMED_TIMEOUT_SECONDS = 0.3
+
+        with self.assertRaises(RuntimeError):
+            executor.map(square, [dict(x=1), dict(x=2)])  # no worker
+        self.assertListEqual([], os.listdir(f'{queue_dir}/pending'))
+
+    def test_get_executor(self):
+        self.assertIsInstance(get_executor(backend='serial', workers=4, queue_dir=None), SerialExecutor)
+        self.assertIsInstance(get_executor(backend='local', workers=4, queue_dir=None), LocalProcessPoolExecutor)
+
+
+class TestFanOut(TestCase):
+
+    def setUp(self):
+        self.set_up(py_path=__file__)
+
+    def tearDown(self):
+        self.tear_down()
+
+    def test_settings_picklable(self):
+        settings = pickle.loads(pickle.dumps(self.settings))
+        self.assertEqual(self.settings.workdir, settings.workdir)
+        self.assertIsInstance(settings.executor, SerialExecutor)
+        self.assertEqual(settings.threads, settings.thread_budget.total)
+
+    def test_fan_out_local(self):
+        settings = Settings(
+            workdir=self.workdir,
+            outdir=self.outdir,
+            threads=4,
+            debug=True,
+            mock=False,
+            for_publication=False,
+            executor_backend='local',
+            executor_workers=2)
+        threads = Processor(settings).fan_out(WriteThreads, [dict(name=f'sample_{i}') for i in range(3)])
+        self.assertListEqual([2, 2, 2], threads)  # 4 threads shared by 2 workers
+        for i in range(3):
+            self.assertTrue(os.path.exists(f'{self.outdir}/sample_{i}.txt'))
+
+    def test_call(self):
+        txt = f'{self.outdir}/call.txt'
+        Processor(self.settings).call(f'touch "{txt}"')
+        self.assertTrue(os.path.exists(txt))
+
+    def test_call_all_progress(self):
+        advanced = []
+        processor = Processor(self.settings)
+        processor.progress_advance = lambda n=1: advanced.append(n)
+        processor.call_all([f'touch "{self.outdir}/{i}.txt"' for i in range(3)], threads=1, progress_label='files')
+        self.assertListEqual([1, 1, 1], advanced)  # one per finished command
+        for i in range(3):
+            self.assertTrue(os.path.exists(f'{self.outdir}/{i}.txt'))
@@ -0,0 +1,33 @@
+import os
+import gzip
+import pandas as pd
+from .setup import TestCase
+from qiime2_pipeline.fastqc import FastQC
+
+
+class TestFastQC(TestCase):
+
+    def setUp(self):
+        self.set_up(py_path=__file__)
+
+    def tearDown(self):
+        self.tear_down()
+
+    def test_main(self):
+        sample_sheet = f'{self.workdir}/sample-sheet.csv'
+        pd.DataFrame({'Sample': ['S1', 'S2'], 'Group': ['A', 'B']}).to_csv(sample_sheet, index=False)
+        for name in ['S1', 'S2']:
+            for r in [1, 2]:
+                with gzip.open(f'{self.workdir}/{name}_R{r}.fastq.gz', 'wt') as fh:
+                    for i in range(100):
+                        fh.write(f'@read{i}/{r}\nACGTACGTAC\n+\nIIIIIIIIII\n')
+
+        FastQC(self.settings).main(
+            sample_sheet=sample_sheet,
+            fq_dir=self.workdir,
+            fq1_suffix='_R1.fastq.gz',
+            fq2_suffix='_R2.fastq.gz')
+
+        for name in ['S1', 'S2']:
+            for r in [1, 2]:
+                self.assertTrue(os.path.exists(f'{self.outdir}/fastqc/{name}_R{r}_fastqc.html'))
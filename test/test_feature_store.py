@@ -0,0 +1,127 @@
+import os
+import json
+import threading
+import pandas as pd
+from datetime import date
+from .setup import TestCase
+from qiime2_pipeline.feature_store import IncrementalGenerateASV, StoreLock
+
+
+def write_version(feature_store: str, version: str, samples: pd.DataFrame) -> str:
+    version_dir = f'{feature_store}/versions/{version}'
+    os.makedirs(version_dir)
+    samples.to_csv(f'{version_dir}/samples.csv', index=False)
+    with open(f'{feature_store}/CURRENT', 'w') as fh:
+        fh.write(version + '\n')
+    return version_dir
+
+
+class TestIncrementalGenerateASV(TestCase):
+
+    def setUp(self):
+        self.set_up(py_path=__file__)
+        self.settings.mock = True
+
+        self.feature_store = f'{self.workdir}/feature_store'
+        self.version_dir = write_version(
+            feature_store=self.feature_store,
+            version='v1',
+            samples=pd.DataFrame({'Sample ID': ['S1'], 'Added': ['2026-01-01']}))
+
+        self.sample_sheet = f'{self.workdir}/sample-sheet.csv'
+        pd.DataFrame({'Sample': ['S1', 'S2'], 'Group': ['A', 'B']}).to_csv(self.sample_sheet, index=False)
+
+        self.generate_asv_kwargs = dict(
+            fq_dir=f'{self.workdir}/fq_dir',
+            fq1_suffix='_R1.fastq.gz',
+            fq2_suffix='_R2.fastq.gz',
+            pacbio=False,
+            paired_end_mode='merge',
+            reverse_complement_r2=False,
+            clip_r1_5_prime=17,
+            clip_r2_5_prime=0,
+            max_expected_error_bases=2.0,
+            long_read_filter=None)
+
+    def tearDown(self):
+        self.tear_down()
+
+    def test_all_samples_stored(self):
+        pd.DataFrame({
+            'Sample ID': ['S1', 'S2', 'S3'],
+            'Added': ['2026-01-01', '2026-02-01', '2026-02-01'],
+        }).to_csv(f'{self.version_dir}/samples.csv', index=False)
+
+        processor = IncrementalGenerateASV(self.settings)
+        feature_table_qza, feature_sequence_qza = processor.main(
+            feature_store=self.feature_store,
+            sample_sheet=self.sample_sheet,
+            generate_asv_kwargs=self.generate_asv_kwargs)
+
+        self.assertListEqual([], processor.new_names)
+        self.assertEqual(f'{self.workdir}/feature-store-table.qza', feature_table_qza)
+        self.assertEqual(f'{self.workdir}/feature-store-sequence.qza', feature_sequence_qza)
+        with open(f'{self.workdir}/feature-store-samples.tsv') as fh:
+            self.assertEqual('sample-id\nS1\nS2\n', fh.read())
+
+    def test_different_parameters(self):
+        with open(f'{self.version_dir}/parameters.json', 'w') as fh:
+            json.dump({**self.generate_asv_kwargs, 'max_expected_error_bases': 8.0, 'trimming_engine': 'trim_galore', 'dada2_truncate_lengths': [0, 0]}, fh)
+
+        with self.assertRaises(ValueError) as context:
+            IncrementalGenerateASV(self.settings).main(
+                feature_store=self.feature_store,
+                sample_sheet=self.sample_sheet,
+                generate_asv_kwargs=self.generate_asv_kwargs)
+        self.assertIn('max_expected_error_bases: 8.0 (stored) vs 2.0 (this run)', str(context.exception))
+
+    def test_different_long_read_filter(self):
+        self.generate_asv_kwargs.update(pacbio=True, long_read_filter={'min_length': 1300})
+        with open(f'{self.version_dir}/parameters.json', 'w') as fh:
+            json.dump({**self.generate_asv_kwargs, 'long_read_filter': None, 'trimming_engine': 'trim_galore', 'dada2_truncate_lengths': [0, 0]}, fh)
+
+        with self.assertRaises(ValueError) as context:
+            IncrementalGenerateASV(self.settings).main(
+                feature_store=self.feature_store,
+                sample_sheet=self.sample_sheet,
+                generate_asv_kwargs=self.generate_asv_kwargs)
+        self.assertIn('long_read_filter: None (stored)', str(context.exception))
+
+    def test_save_store_publishes_new_version(self):
+        self.settings.mock = False
+        processor = IncrementalGenerateASV(self.settings)
+        processor.feature_store = self.feature_store
+        processor.current_dir = self.version_dir
+        processor.stored_names = ['S1']
+        processor.new_names = ['S2']
+        processor.parameters = {'pacbio': False}
+        for qza in ['table.qza', 'sequence.qza']:
+            with open(f'{self.workdir}/{qza}', 'w') as fh:
+                fh.write(qza)
+
+        processor.save_store(table_qza=f'{self.workdir}/table.qza', sequence_qza=f'{self.workdir}/sequence.qza')
+
+        with open(f'{self.feature_store}/CURRENT') as fh:
+            version_dir = f'{self.feature_store}/versions/{fh.read().strip()}'
+        self.assertEqual(version_dir, processor.current_dir)
+        self.assertListEqual([os.path.basename(version_dir)], os.listdir(f'{self.feature_store}/versions'))
+        samples = pd.read_csv(f'{version_dir}/samples.csv', dtype=str)
+        self.assertListEqual(['S1', 'S2'], samples['Sample ID'].tolist())
+        self.assertListEqual(['2026-01-01', date.today().isoformat()], samples['Added'].tolist())
+        with open(f'{version_dir}/feature-table.qza') as fh:
+            self.assertEqual('table.qza', fh.read())
+
+    def test_store_lock(self):
+        path = f'{self.feature_store}/.lock'
+        acquired = threading.Event()
+
+        def lock_in_thread():
+            with StoreLock(path=path, logger=IncrementalGenerateASV(self.settings).logger):
+                acquired.set()
+
+        with StoreLock(path=path, logger=IncrementalGenerateASV(self.settings).logger):
+            thread = threading.Thread(target=lock_in_thread)
+            thread.start()
+            self.assertFalse(acquired.wait(timeout=0.2))  # another run of the same process waits
+        thread.join()
+        self.assertTrue(acquired.is_set())
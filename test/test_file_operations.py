@@ -0,0 +1,60 @@
+import os
+from unittest import mock
+from .setup import TestCase
+from qiime2_pipeline.file_operations import move, move_glob, concatenate
+
+
+class TestFileOperations(TestCase):
+
+    def setUp(self):
+        self.set_up(py_path=__file__)
+
+    def tearDown(self):
+        self.tear_down()
+
+    def write_file(self, fname: str, content: bytes) -> str:
+        path = f'{self.workdir}/{fname}'
+        with open(path, 'wb') as fh:
+            fh.write(content)
+        return path
+
+    def read_file(self, path: str) -> bytes:
+        with open(path, 'rb') as fh:
+            return fh.read()
+
+    def test_move(self):
+        src = self.write_file('a.txt', b'a')
+        dst = move(src=src, dst=f'{self.outdir}/b.txt')
+        self.assertEqual(f'{self.outdir}/b.txt', dst)
+        self.assertFalse(os.path.exists(src))
+        self.assertEqual(b'a', self.read_file(dst))
+
+    def test_move_into_dir(self):
+        src = self.write_file('a.txt', b'a')
+        dst = move(src=src, dst=self.outdir)
+        self.assertEqual(f'{self.outdir}/a.txt', dst)
+
+    def test_move_glob(self):
+        for f in ['x_fastqc.html', 'y_fastqc.html', 'x_fastqc.zip']:
+            self.write_file(f, b'')
+        dsts = move_glob(srcdir=self.workdir, pattern='*fastqc.html', dstdir=self.outdir)
+        self.assertListEqual([f'{self.outdir}/x_fastqc.html', f'{self.outdir}/y_fastqc.html'], dsts)
+        self.assertTrue(os.path.exists(f'{self.workdir}/x_fastqc.zip'))
+
+    def test_move_glob_no_match(self):
+        with self.assertRaises(FileNotFoundError):
+            move_glob(srcdir=self.workdir, pattern='*.log', dstdir=self.outdir)
+
+    def test_concatenate(self):
+        srcs = [self.write_file(f'{i}.fq', bytes([65 + i]) * 1000) for i in range(3)]
+        dst = f'{self.outdir}/pooled.fq'
+        concatenate(srcs=srcs, dst=dst)
+        self.assertEqual(b'A' * 1000 + b'B' * 1000 + b'C' * 1000, self.read_file(dst))
+        self.assertFalse(os.path.exists(f'{dst}.concatenating'))
+
+    def test_concatenate_without_copy_file_range(self):
+        srcs = [self.write_file(f'{i}.fq', bytes([65 + i]) * 1000) for i in range(2)]
+        dst = f'{self.outdir}/pooled.fq'
+        with mock.patch('os.copy_file_range', side_effect=OSError(18, 'Invalid cross-device link')):
+            concatenate(srcs=srcs, dst=dst)
+        self.assertEqual(b'A' * 1000 + b'B' * 1000, self.read_file(dst))
@@ -18,6 +18,7 @@ class TestGenerateASV(TestCase):
             fq2_suffix=None,
             pacbio=True,
             paired_end_mode='merge',  # not used anyway
+            reverse_complement_r2=False,
             clip_r1_5_prime=0,
             clip_r2_5_prime=0,
             max_expected_error_bases=8.,
@@ -36,6 +37,7 @@ class TestGenerateASV(TestCase):
             fq2_suffix=None,
             pacbio=False,
             paired_end_mode='merge',  # not used anyway
+            reverse_complement_r2=False,
             clip_r1_5_prime=17,
             clip_r2_5_prime=0,
             max_expected_error_bases=2.,
@@ -54,6 +56,7 @@ class TestGenerateASV(TestCase):
             fq2_suffix='_L001_R2_001.fastq.gz',
             pacbio=False,
             paired_end_mode='pool',
+            reverse_complement_r2=False,
             clip_r1_5_prime=17,
             clip_r2_5_prime=0,
             max_expected_error_bases=2.,
@@ -72,6 +75,7 @@ class TestGenerateASV(TestCase):
             fq2_suffix='_L001_R2_001.fastq.gz',
             pacbio=False,
             paired_end_mode='merge',
+            reverse_complement_r2=False,
             clip_r1_5_prime=17,
             clip_r2_5_prime=0,
             max_expected_error_bases=2.,
@@ -96,6 +100,7 @@ class TestBatchPool(TestCase):
             sample_sheet=f'{self.indir}/sample-sheet.csv',
             fq_dir=f'{self.indir}/fq_dir',
             fq1_suffix='_L001_R1_001.fastq.gz',
-            fq2_suffix='_L001_R2_001.fastq.gz')
+            fq2_suffix='_L001_R2_001.fastq.gz',
+            reverse_complement_r2=False)
         self.assertFileExists(f'{self.workdir}/pool_fastqs', fq_dir)
         self.assertEqual('.fastq.gz', fq_suffix)
@@ -1,5 +1,5 @@
 from .setup import TestCase
-from qiime2_pipeline.generate_otu import GenerateOTU, GenerateNanoporeOTU
+from qiime2_pipeline.generate_otu import GenerateOTU, GenerateNanoporeOTU, GenerateMultiThresholdOTU, get_otu_dirname
 
 
 class TestGenerateOTU(TestCase):
@@ -43,3 +43,35 @@ class TestGenerateNanoporeOTU(TestCase):
             (f'{self.workdir}/otu-feature-sequence.qza', clustered_sequence_qza),
         ]:
             self.assertFileExists(expected, actual)
+
+
+class TestGenerateMultiThresholdOTU(TestCase):
+
+    def setUp(self):
+        self.set_up(py_path=__file__)
+
+    def tearDown(self):
+        self.tear_down()
+
+    def test_main(self):
+        otu_qzas = GenerateMultiThresholdOTU(self.settings).main(
+            feature_table_qza=f'{self.indir}/dada2-feature-table.qza',
+            feature_sequence_qza=f'{self.indir}/dada2-feature-sequence.qza',
+            identities=[0.97, 0.99]
+        )
+        self.assertListEqual([0.99, 0.97], list(otu_qzas.keys()))
+        for identity, dirname in [(0.99, 'otu-99'), (0.97, 'otu-97')]:
+            clustered_table_qza, clustered_sequence_qza = otu_qzas[identity]
+            for expected, actual in [
+                (f'{self.workdir}/{dirname}/otu-feature-table.qza', clustered_table_qza),
+                (f'{self.workdir}/{dirname}/otu-feature-sequence.qza', clustered_sequence_qza),
+            ]:
+                self.assertFileExists(expected, actual)
+
+
+class TestFunctions(TestCase):
+
+    def test_get_otu_dirname(self):
+        self.assertEqual('otu-97', get_otu_dirname(0.97))
+        self.assertEqual('otu-98.5', get_otu_dirname(0.985))
+        self.assertEqual('otu-100', get_otu_dirname(1.))
@@ -0,0 +1,64 @@
+import os
+import pandas as pd
+from .setup import TestCase
+from qiime2_pipeline.intermediates import IntermediateFiles, get_disk_usage
+
+
+class TestIntermediateFiles(TestCase):
+
+    def setUp(self):
+        self.set_up(py_path=__file__)
+
+    def tearDown(self):
+        self.tear_down()
+
+    def write_file(self, fname: str, n_bytes: int) -> str:
+        path = f'{self.workdir}/{fname}'
+        with open(path, 'wb') as fh:
+            fh.write(b'A' * n_bytes)
+        return path
+
+    def test_delete_after_last_consumer(self):
+        intermediates = IntermediateFiles(workdir=self.workdir, keep=False)
+        path = self.write_file('trimmed.fq', n_bytes=100)
+
+        intermediates.register(path, consumers=['Import', 'Count'])
+        self.assertListEqual([], intermediates.release(consumer='Import'))
+        self.assertTrue(os.path.exists(path))
+        self.assertListEqual([path], intermediates.release(consumer='Count'))
+        self.assertFalse(os.path.exists(path))
+
+    def test_delete_directory_without_consumer(self):
+        intermediates = IntermediateFiles(workdir=self.workdir, keep=False)
+        d = f'{self.workdir}/dada2'
+        os.makedirs(d)
+
+        deleted = intermediates.register(d, consumers=[])
+        self.assertListEqual([d], deleted)
+        self.assertFalse(os.path.exists(d))
+
+    def test_keep(self):
+        intermediates = IntermediateFiles(workdir=self.workdir, keep=True)
+        path = self.write_file('trimmed.fq', n_bytes=100)
+
+        intermediates.register(path, consumers=['Import'])
+        self.assertListEqual([], intermediates.release(consumer='Import'))
+        self.assertTrue(os.path.exists(path))
+
+    def test_disk_usage_report(self):
+        intermediates = IntermediateFiles(workdir=self.workdir, keep=False)
+        path = self.write_file('trimmed.fq', n_bytes=1000)
+        intermediates.register(path, consumers=['Import'])
+        intermediates.release(consumer='Import')
+        intermediates.check_disk_usage(checkpoint='end')
+
+        self.assertEqual(1000, intermediates.high_water_mark)
+        csv = f'{self.outdir}/workdir-disk-usage.csv'
+        intermediates.write_report(csv=csv)
+        self.assertListEqual(['Import', 'end'], pd.read_csv(csv)['Checkpoint'].tolist())
+
+    def test_get_disk_usage(self):
+        self.write_file('a', n_bytes=10)
+        os.makedirs(f'{self.workdir}/sub')
+        self.write_file('sub/b', n_bytes=20)
+        self.assertEqual(30, get_disk_usage(self.workdir))
@@ -0,0 +1,77 @@
+import os
+import gzip
+import pandas as pd
+from .setup import TestCase
+from qiime2_pipeline.pooling import reverse_complement
+from qiime2_pipeline.long_read_filtering import LongReadFilter, get_primer_matrix, min_mismatches, \
+    parse_long_read_filter, FORWARD_PRIMER
+
+
+def write_fq(fq: str, records):
+    with gzip.open(fq, 'wb') as fh:
+        for i, (seq, qual) in enumerate(records):
+            fh.write(b'@r%d\n%s\n+\n%s\n' % (i, seq, qual))
+
+
+def read_fq(fq: str):
+    with gzip.open(fq, 'rb') as fh:
+        lines = fh.read().splitlines()
+    return [(lines[i + 1], lines[i + 3]) for i in range(0, len(lines), 4)]
+
+
+class TestLongReadFilter(TestCase):
+
+    def setUp(self):
+        self.set_up(py_path=__file__)
+        self.sample_sheet = f'{self.workdir}/sample-sheet.csv'
+        pd.DataFrame({'Sample': ['S1'], 'Group': ['A']}).to_csv(self.sample_sheet, index=False)
+        self.fq_dir = f'{self.workdir}/fq_dir'
+        os.makedirs(self.fq_dir)
+
+        amplicon = b'AGAGTTTGATCCTGGCTCAG' + b'ACGT' * 40 + reverse_complement(b'GGTTACCTTGTTACGACTT')  # 199 bp
+        write_fq(f'{self.fq_dir}/S1_Nanopore.fastq.gz', [
+            (amplicon, b'5' * 199),  # Q20
+            (reverse_complement(amplicon), b'5' * 198 + b'#'),  # reverse strand
+            (amplicon[:100], b'5' * 100),  # too short
+            (amplicon, b'+' * 199),  # Q10
+            (b'T' * 199, b'5' * 199),  # no primer
+        ])
+        self.settings.long_read_filter = parse_long_read_filter('min_length=150,max_length=200,min_mean_quality=15')
+
+    def tearDown(self):
+        self.tear_down()
+
+    def test_main(self):
+        fq_dir, fq_suffix = LongReadFilter(self.settings).main(
+            sample_sheet=self.sample_sheet,
+            fq_dir=self.fq_dir,
+            fq_suffix='_Nanopore.fastq.gz',
+            platform='nanopore',
+            long_read_filter=self.settings.long_read_filter)
+
+        records = read_fq(f'{fq_dir}/S1{fq_suffix}')
+        self.assertEqual(2, len(records))
+        self.assertEqual(records[0][0], records[1][0])  # reverse read oriented
+        self.assertEqual(b'#' + b'5' * 198, records[1][1])
+
+        df = pd.read_csv(f'{self.outdir}/long-read-filter-counts.csv', index_col=0)
+        self.assertDictEqual(
+            {'Input': 5, 'Too Short': 1, 'Too Long': 0, 'Low Mean Quality': 1, 'High Error Rate': 0, 'No Primer': 1, 'Passed': 2},
+            df.loc['S1'].to_dict())
+
+
+class TestFunctions(TestCase):
+
+    def test_min_mismatches(self):
+        matrix = get_primer_matrix(FORWARD_PRIMER)
+        self.assertEqual(0, min_mismatches(seq=b'NNNAGAGTTTGATCCTGGCTCAGNN', primer_matrix=matrix))
+        self.assertEqual(0, min_mismatches(seq=b'agggttcgatcctggctcag', primer_matrix=matrix))
+        self.assertEqual(1, min_mismatches(seq=b'AGAGTTTGATCCTGGCTCAC', primer_matrix=matrix))
+        self.assertEqual(20, min_mismatches(seq=b'AGAG', primer_matrix=matrix))
+
+    def test_parse_long_read_filter(self):
+        self.assertIsNone(parse_long_read_filter('None'))
+        self.assertDictEqual({}, parse_long_read_filter('default'))
+        self.assertDictEqual(
+            {'min_length': 1300, 'max_error_rate': 0.05, 'orient': False},
+            parse_long_read_filter('min_length=1300,max_error_rate=0.05,orient=false'))
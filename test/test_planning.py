@@ -0,0 +1,80 @@
+import gzip
+import pandas as pd
+from .setup import TestCase
+from qiime2_pipeline.planning import PlanPipeline, StageCostModel, estimate_reads, format_seconds
+
+
+def write_fq(fq: str, n_reads: int):
+    with gzip.open(fq, 'wt') as fh:
+        for i in range(n_reads):
+            fh.write(f'@read{i}\nACGTACGTAC\n+\nIIIIIIIIII\n')
+
+
+class TestPlanPipeline(TestCase):
+
+    def setUp(self):
+        self.set_up(py_path=__file__)
+
+    def tearDown(self):
+        self.tear_down()
+
+    def test_main(self):
+        sample_sheet = f'{self.workdir}/sample-sheet.csv'
+        pd.DataFrame({'Sample': ['S1', 'S2'], 'Group': ['A', 'B']}).to_csv(sample_sheet, index=False)
+        for name in ['S1', 'S2']:
+            write_fq(f'{self.workdir}/{name}_R1.fastq.gz', n_reads=100)
+            write_fq(f'{self.workdir}/{name}_R2.fastq.gz', n_reads=100)
+
+        actual = PlanPipeline(self.settings).main(
+            sample_sheet=sample_sheet,
+            fq_dir=self.workdir,
+            fq1_suffix='_R1.fastq.gz',
+            fq2_suffix='_R2.fastq.gz',
+            sequencing_platform='illumina',
+            skip_otu=True,
+            max_reads_per_sample=0,
+            pilot_fraction=1.0,
+            dna_concentration_column=None,
+            negative_control_column=None,
+            feature_classifier='nb',
+            skip_differential_abundance=False,
+            run_profiles=[])
+
+        self.assertFileExists(f'{self.outdir}/plan.csv', actual)
+        df = pd.read_csv(actual)
+        self.assertNotIn('decontamination', df['Stage'].tolist())
+        self.assertIn('differential_abundance', df['Stage'].tolist())
+
+
+class TestStageCostModel(TestCase):
+
+    def test_calibration(self):
+        model = StageCostModel(
+            unit='reads',
+            base_seconds=0,
+            seconds_per_unit=1,
+            parallel_fraction=1,
+            memory_base_mb=100,
+            memory_mb_per_unit=0)
+        model.add_observation(units=2, threads=4, seconds=50, peak_memory_mb=300)
+        self.assertAlmostEqual(100, model.seconds_per_unit)  # 50 s with 4 threads -> 200 s with 1 thread -> 100 s per unit
+        self.assertAlmostEqual(100, model.memory_mb_per_unit)
+        self.assertAlmostEqual(25, model.seconds(units=1, threads=4))
+        self.assertAlmostEqual(400, model.peak_memory_mb(units=3))
+
+
+class TestFunctions(TestCase):
+
+    def setUp(self):
+        self.set_up(py_path=__file__)
+
+    def tearDown(self):
+        self.tear_down()
+
+    def test_estimate_reads_exact(self):
+        fq = f'{self.workdir}/R1.fastq.gz'
+        write_fq(fq, n_reads=123)
+        self.assertEqual(123, estimate_reads(fq=fq, sampled_bytes=1024 ** 2))
+
+    def test_format_seconds(self):
+        self.assertEqual('1:01:01', format_seconds(3661))
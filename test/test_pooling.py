@@ -0,0 +1,76 @@
+import os
+import gzip
+import pandas as pd
+from .setup import TestCase
+from qiime2_pipeline.pooling import BatchPool, LineCounter, reverse_complement
+
+
+def write_fq(fq: str, records):
+    with gzip.open(fq, 'wb') as fh:
+        for header, seq in records:
+            fh.write(b'@%s\n%s\n+\n%s\n' % (header, seq, b'#' * (len(seq) - 1) + b'I'))
+
+
+def read_fq(fq: str):
+    with gzip.open(fq, 'rb') as fh:
+        lines = fh.read().splitlines()
+    return [(lines[i], lines[i + 1], lines[i + 3]) for i in range(0, len(lines), 4)]
+
+
+class TestBatchPool(TestCase):
+
+    def setUp(self):
+        self.set_up(py_path=__file__)
+        self.sample_sheet = f'{self.workdir}/sample-sheet.csv'
+        pd.DataFrame({'Sample': ['S1', 'S2'], 'Group': ['A', 'B']}).to_csv(self.sample_sheet, index=False)
+        self.fq_dir = f'{self.workdir}/fq_dir'
+        os.makedirs(self.fq_dir)
+        for name, n in [('S1', 3), ('S2', 1)]:
+            write_fq(f'{self.fq_dir}/{name}_R1.fastq.gz', [(b'r%d/1' % i, b'AACG') for i in range(n)])
+            write_fq(f'{self.fq_dir}/{name}_R2.fastq.gz', [(b'r%d/2' % i, b'TTGC') for i in range(n)])
+
+    def tearDown(self):
+        self.tear_down()
+
+    def pool(self, reverse_complement_r2: bool) -> str:
+        fq_dir, fq_suffix = BatchPool(self.settings).main(
+            sample_sheet=self.sample_sheet,
+            fq_dir=self.fq_dir,
+            fq1_suffix='_R1.fastq.gz',
+            fq2_suffix='_R2.fastq.gz',
+            reverse_complement_r2=reverse_complement_r2)
+        self.assertEqual('.fastq.gz', fq_suffix)
+        return fq_dir
+
+    def test_main(self):
+        fq_dir = self.pool(reverse_complement_r2=False)
+
+        records = read_fq(f'{fq_dir}/S1.fastq.gz')
+        self.assertEqual(6, len(records))
+        self.assertTupleEqual((b'@r0/2', b'TTGC', b'###I'), records[3])
+
+        df = pd.read_csv(f'{self.outdir}/pooled-read-counts.csv')
+        self.assertListEqual(['S1', 'S2'], df['Sample ID'].tolist())
+        self.assertListEqual([3, 1], df['R2'].tolist())
+        self.assertListEqual([6, 2], df['Pooled'].tolist())
+
+    def test_reverse_complement_r2(self):
+        fq_dir = self.pool(reverse_complement_r2=True)
+
+        records = read_fq(f'{fq_dir}/S1.fastq.gz')
+        self.assertTupleEqual((b'@r0/1', b'AACG', b'###I'), records[0])
+        self.assertTupleEqual((b'@r0/2', b'GCAA', b'I###'), records[3])
+        self.assertListEqual(['S1.fastq.gz', 'S2.fastq.gz'], sorted(os.listdir(fq_dir)))
+
+
+class TestFunctions(TestCase):
+
+    def test_reverse_complement(self):
+        self.assertEqual(b'NRYGCAT', reverse_complement(b'ATGCRYN'))
+
+    def test_line_counter(self):
+        data = gzip.compress(b'a\nb\n') + gzip.compress(b'c\n')  # two gzip members
+        counter = LineCounter(compression='gz')
+        for i in range(0, len(data), 5):
+            counter.feed(data[i:i + 5])
+        self.assertEqual(3, counter.n_lines)
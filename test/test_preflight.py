@@ -0,0 +1,96 @@
+import gzip
+import pandas as pd
+from .setup import TestCase
+from qiime2_pipeline.preflight import Preflight, check_fastq, check_pair, normalize_read_id
+
+
+def write_fq(fq: str, n_reads: int, read_id_suffix: str = ''):
+    with gzip.open(fq, 'wt') as fh:
+        for i in range(n_reads):
+            fh.write(f'@read{i}{read_id_suffix}\nACGTACGTAC\n+\nIIIIIIIIII\n')
+
+
+class TestPreflight(TestCase):
+
+    def setUp(self):
+        self.set_up(py_path=__file__)
+        self.sample_sheet = f'{self.workdir}/sample-sheet.csv'
+
+    def tearDown(self):
+        self.tear_down()
+
+    def write_sample_sheet(self, names):
+        pd.DataFrame({'Sample': names, 'Group': ['A'] * len(names)}).to_csv(self.sample_sheet, index=False)
+
+    def run_preflight(self) -> pd.DataFrame:
+        return Preflight(self.settings).main(
+            sample_sheet=self.sample_sheet,
+            fq_dir=self.workdir,
+            fq1_suffix='_R1.fastq.gz',
+            fq2_suffix='_R2.fastq.gz')
+
+    def test_main(self):
+        self.write_sample_sheet(['S1', 'S2'])
+        for name in ['S1', 'S2']:
+            write_fq(f'{self.workdir}/{name}_R1.fastq.gz', n_reads=10, read_id_suffix='/1')
+            write_fq(f'{self.workdir}/{name}_R2.fastq.gz', n_reads=10, read_id_suffix='/2')
+
+        df = self.run_preflight()
+
+        self.assertListEqual(['Sample ID', 'Count (R1)', 'Count (R2)', 'Problems'], df.columns.tolist())
+        self.assertListEqual([10, 10], df['Count (R1)'].tolist())
+        self.assertTrue((df['Problems'] == '').all())
+
+    def test_consolidated_report(self):
+        self.write_sample_sheet(['missing', 'unpaired', 'truncated'])
+        write_fq(f'{self.workdir}/missing_R1.fastq.gz', n_reads=10)
+        write_fq(f'{self.workdir}/unpaired_R1.fastq.gz', n_reads=10)
+        write_fq(f'{self.workdir}/unpaired_R2.fastq.gz', n_reads=9)
+        write_fq(f'{self.workdir}/truncated_R1.fastq.gz', n_reads=10)
+        write_fq(f'{self.workdir}/truncated_R2.fastq.gz', n_reads=10)
+        with open(f'{self.workdir}/truncated_R2.fastq.gz', 'rb') as fh:
+            data = fh.read()
+        with open(f'{self.workdir}/truncated_R2.fastq.gz', 'wb') as fh:
+            fh.write(data[:len(data) // 2])
+
+        with self.assertRaises(ValueError) as context:
+            self.run_preflight()
+
+        msg = str(context.exception)
+        self.assertIn('3 of 3 samples failed', msg)
+        self.assertIn('missing_R2.fastq.gz: does not exist', msg)
+        self.assertIn('R1 has 10 reads but R2 has 9', msg)
+        self.assertIn('truncated_R2.fastq.gz: corrupt or truncated gzip', msg)
+        df = pd.read_csv(f'{self.outdir}/preflight-report.csv')
+        self.assertEqual(3, len(df))
+
+
+class TestFunctions(TestCase):
+
+    def setUp(self):
+        self.set_up(py_path=__file__)
+
+    def tearDown(self):
+        self.tear_down()
+
+    def test_incomplete_record(self):
+        fq = f'{self.workdir}/R1.fastq'
+        with open(fq, 'w') as fh:
+            fh.write('@read1\nACGT\n+\nIIII\n@read2\nACGT\n+\nII')
+        result = check_fastq(fq=fq, sampled_records=10)
+        self.assertListEqual(['truncated last line', 'record 2 has 4 bases but 2 quality scores'], result['problems'])
+
+    def test_read_id_discordance(self):
+        for suffix, ids in [('_R1.fastq', ['read0', 'read1']), ('_R2.fastq', ['read0', 'read2'])]:
+            with open(f'{self.workdir}/S1{suffix}', 'w') as fh:
+                for i in ids:
+                    fh.write(f'@{i} 1:N:0:1\nACGT\n+\nIIII\n')
+        r1 = check_fastq(fq=f'{self.workdir}/S1_R1.fastq', sampled_records=10)
+        r2 = check_fastq(fq=f'{self.workdir}/S1_R2.fastq', sampled_records=10)
+        self.assertListEqual(
+            ['read IDs of R1 and R2 differ at record 2: "read1" vs "read2"'],
+            check_pair(r1=r1, r2=r2))
+
+    def test_normalize_read_id(self):
+        self.assertEqual('M01234:1:000:1:1:1:1', normalize_read_id('@M01234:1:000:1:1:1:1 1:N:0:1'))
+        self.assertEqual('read1', normalize_read_id('@read1/2'))
@@ -0,0 +1,27 @@
+import pandas as pd
+from .setup import TestCase
+from qiime2_pipeline.profiling import StageProfiler
+
+
+class TestStageProfiler(TestCase):
+
+    def setUp(self):
+        self.set_up(py_path=__file__)
+
+    def tearDown(self):
+        self.tear_down()
+
+    def test_main(self):
+        profiler = StageProfiler(threads=4)
+        for stage in ['stage_1', 'stage_2']:
+            profiler.start(stage=stage)
+            profiler.stop()
+
+        csv = f'{self.outdir}/run-profile.csv'
+        profiler.write_csv(csv=csv, samples=2, reads=1000, features=10)
+
+        df = pd.read_csv(csv)
+        self.assertListEqual(['stage_1', 'stage_2'], df['Stage'].tolist())
+        self.assertListEqual(
+            ['Stage', 'Seconds', 'Peak Memory (MB)', 'Threads', 'Samples', 'Reads', 'Features'],
+            df.columns.tolist())
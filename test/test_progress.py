@@ -0,0 +1,98 @@
+import io
+from .setup import TestCase
+from qiime2_pipeline.template import Processor
+from qiime2_pipeline.progress import StageProgress, read_progress, format_progress_line, PROGRESS_JSON
+
+
+class EchoItems(Processor):
+
+    def main(self, x: int) -> int:
+        return x
+
+
+class TestStageProgress(TestCase):
+
+    def setUp(self):
+        self.set_up(py_path=__file__)
+        self.progress = StageProgress(
+            json_path=f'{self.outdir}/{PROGRESS_JSON}',
+            stages=['stage_1', 'stage_2', 'stage_3'])
+
+    def tearDown(self):
+        self.tear_down()
+
+    def test_stages(self):
+        self.progress.start(stage='stage_1')
+        self.progress.stop(stage='stage_1')
+        self.progress.start(stage='stage_2')
+
+        data = read_progress(self.outdir)
+        self.assertEqual(1, data['stages_done'])
+        self.assertEqual(3, data['stages_total'])
+        self.assertListEqual(['done', 'running', 'pending'], [s['status'] for s in data['stages']])
+        self.assertIsNone(data['eta_seconds'])
+
+    def test_eta_from_estimates(self):
+        self.progress.set_estimates({'stage_1': 10., 'stage_2': 100., 'stage_3': 1000.})
+        self.assertEqual(1110., read_progress(self.outdir)['eta_seconds'])
+
+        self.progress.start(stage='stage_1')
+        self.progress.stop(stage='stage_1')
+        self.progress.start(stage='stage_2')
+        eta = read_progress(self.outdir)['eta_seconds']
+        self.assertGreater(eta, 1090.)
+        self.assertLessEqual(eta, 1100.)
+
+    def test_items(self):
+        self.progress.set_estimates({'stage_1': 10., 'stage_2': 100., 'stage_3': 1000.})
+        self.progress.start(stage='stage_1')
+        self.progress.start_items(total=4, label='samples')
+        for _ in range(4):
+            self.progress.advance()
+
+        data = read_progress(self.outdir)  # the last item is always written
+        self.assertDictEqual({'label': 'samples', 'done': 4, 'total': 4}, data['stages'][0]['items'])
+        self.assertAlmostEqual(1100., data['eta_seconds'], delta=0.1)
+
+        self.progress.stop(stage='stage_1')
+        self.assertNotIn('items', read_progress(self.outdir)['stages'][0])
+
+    def test_items_outside_stage(self):
+        self.progress.start_items(total=2, label='samples')
+        self.progress.advance()
+        self.assertIsNone(self.progress.items)
+
+    def test_fan_out_reports_items(self):
+        self.settings.progress = self.progress
+        self.progress.start(stage='stage_1')
+        ret = Processor(self.settings).fan_out(EchoItems, [{'x': 1}, {'x': 2}, {'x': 3}])
+        self.assertListEqual([1, 2, 3], ret)
+        self.assertDictEqual(
+            {'label': 'EchoItems', 'done': 3, 'total': 3},
+            read_progress(self.outdir)['stages'][0]['items'])
+
+    def test_display(self):
+        self.progress.display = io.StringIO()
+        self.progress.set_estimates({'stage_1': 3600., 'stage_2': 0., 'stage_3': 0.})
+        self.progress.start(stage='stage_1')
+        self.progress.start_items(total=2, label='samples')
+        self.progress.advance(n=2)
+        last_line = self.progress.display.getvalue().splitlines()[-1]
+        self.assertTrue(last_line.startswith('[##########'))
+        self.assertIn('0/3 stage_1 samples 2/2', last_line)
+        self.assertIn('ETA 0:00:00', last_line)
+
+    def test_format_progress_line(self):
+        data = {
+            'elapsed_seconds': 65.,
+            'eta_seconds': 3725.,
+            'stages_done': 1,
+            'stages_total': 2,
+            'stages': [
+                {'stage': 'stage_1', 'status': 'done', 'seconds': 65.},
+                {'stage': 'stage_2', 'status': 'running', 'seconds': None},
+            ],
+        }
+        self.assertEqual(
+            '[#####-----] 1/2 stage_2 | elapsed 0:01:05 | ETA 1:02:05',
+            format_progress_line(data=data, bar_width=10))
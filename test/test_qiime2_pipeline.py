@@ -18,9 +18,12 @@ class TestQiime2Pipeline(TestCase):
             fq2_suffix='_L001_R2_001.fastq.gz',
             sequencing_platform='illumina',
             paired_end_mode='pool',
-            otu_identity=0.97,
+            reverse_complement_r2=False,
+            otu_identities=[0.97],
+            otu_clustering='de_novo',
             skip_otu=False,
             dna_concentration_column='DNA conc. (ng/µL)',
+            negative_control_column=None,
             decontam_threshold=0.1,
             feature_classifier='nb',
             nb_classifier_qza=f'{self.indir}/gg-13-8-99-515-806-nb-classifier.qza',
@@ -32,6 +35,10 @@ class TestQiime2Pipeline(TestCase):
             clip_r1_5_prime=17,
             clip_r2_5_prime=0,
             max_expected_error_bases=2.0,
+            feature_store=None,
+            max_reads_per_sample=0,
+            pilot_fraction=1.0,
+            subsample_seed=0,
             heatmap_read_fraction=0.99,
             n_taxa_barplot=20,
             beta_diversity_feature_level='feature',
@@ -50,9 +57,12 @@ class TestQiime2Pipeline(TestCase):
             fq2_suffix=None,
             sequencing_platform='illumina',
             paired_end_mode='pool',
-            otu_identity=0.97,
+            reverse_complement_r2=False,
+            otu_identities=[0.97],
+            otu_clustering='de_novo',
             skip_otu=False,
             dna_concentration_column='DNA conc. (ng/µL)',
+            negative_control_column=None,
             decontam_threshold=0.1,
             feature_classifier='nb',
             nb_classifier_qza=f'{self.indir}/gg-13-8-99-515-806-nb-classifier.qza',
@@ -64,6 +74,10 @@ class TestQiime2Pipeline(TestCase):
             clip_r1_5_prime=17,
             clip_r2_5_prime=0,
             max_expected_error_bases=2.0,
+            feature_store=None,
+            max_reads_per_sample=0,
+            pilot_fraction=1.0,
+            subsample_seed=0,
             heatmap_read_fraction=0.99,
             n_taxa_barplot=20,
             beta_diversity_feature_level='feature',
@@ -82,9 +96,12 @@ class TestQiime2Pipeline(TestCase):
             fq2_suffix='_L001_R2_001.fastq.gz',
             sequencing_platform='illumina',
             paired_end_mode='pool',
-            otu_identity=0.97,
+            reverse_complement_r2=False,
+            otu_identities=[0.97],
+            otu_clustering='de_novo',
             skip_otu=True,
             dna_concentration_column=None,
+            negative_control_column=None,
             decontam_threshold=0.1,
             feature_classifier='nb',
             nb_classifier_qza=f'{self.indir}/unite_ver8_dynamic_10.05.2021-Q2-2022.8.qza',
@@ -96,6 +113,10 @@ class TestQiime2Pipeline(TestCase):
             clip_r1_5_prime=17,
             clip_r2_5_prime=0,
             max_expected_error_bases=2.0,
+            feature_store=None,
+            max_reads_per_sample=0,
+            pilot_fraction=1.0,
+            subsample_seed=0,
             heatmap_read_fraction=0.99,
             n_taxa_barplot=20,
             beta_diversity_feature_level='species',
@@ -114,9 +135,12 @@ class TestQiime2Pipeline(TestCase):
             fq2_suffix=None,
             sequencing_platform='pacbio',
             paired_end_mode='merge',
-            otu_identity=0.97,
+            reverse_complement_r2=False,
+            otu_identities=[0.97],
+            otu_clustering='de_novo',
             skip_otu=False,
             dna_concentration_column='DNA conc. (ng/µL)',
+            negative_control_column=None,
             decontam_threshold=0.1,
             feature_classifier='nb',
             nb_classifier_qza=f'{self.indir}/gg-13-8-99-nb-classifier.qza',
@@ -128,6 +152,10 @@ class TestQiime2Pipeline(TestCase):
             clip_r1_5_prime=0,
             clip_r2_5_prime=0,
             max_expected_error_bases=8.0,
+            feature_store=None,
+            max_reads_per_sample=0,
+            pilot_fraction=1.0,
+            subsample_seed=0,
             heatmap_read_fraction=0.99,
             n_taxa_barplot=20,
             beta_diversity_feature_level='feature',
@@ -147,9 +175,12 @@ class TestQiime2Pipeline(TestCase):
             fq2_suffix=None,
             sequencing_platform='nanopore',
             paired_end_mode='merge',
-            otu_identity=0.97,
+            reverse_complement_r2=False,
+            otu_identities=[0.97],
+            otu_clustering='de_novo',
             skip_otu=False,
             dna_concentration_column=None,
+            negative_control_column=None,
             decontam_threshold=0.0,
             feature_classifier='nb',
             nb_classifier_qza=f'{self.indir}/gg-13-8-99-nb-classifier.qza',
@@ -161,6 +192,10 @@ class TestQiime2Pipeline(TestCase):
             clip_r1_5_prime=0,
             clip_r2_5_prime=0,
             max_expected_error_bases=8.0,
+            feature_store=None,
+            max_reads_per_sample=0,
+            pilot_fraction=1.0,
+            subsample_seed=0,
             heatmap_read_fraction=0.99,
             n_taxa_barplot=20,
             beta_diversity_feature_level='feature',
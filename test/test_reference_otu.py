@@ -0,0 +1,109 @@
+import zipfile
+from .setup import TestCase
+from qiime2_pipeline.fasta import FastaParser
+from qiime2_pipeline.utils import get_artifact_uuid
+from qiime2_pipeline.reference_otu import ReferenceOTU, split_fasta, write_sized_fasta, read_uc_hits, read_uc_clusters
+
+
+def write_fa(fa: str, records):
+    with open(fa, 'w') as fh:
+        for header, seq in records:
+            fh.write(f'>{header}\n{seq}\n')
+
+
+def read_fa(fa: str):
+    with FastaParser(fa) as parser:
+        return [r for r in parser]
+
+
+class TestReferenceOTU(TestCase):
+
+    def setUp(self):
+        self.set_up(py_path=__file__)
+        self.settings.reference_cache_dir = f'{self.workdir}/reference_cache'
+
+    def tearDown(self):
+        self.tear_down()
+
+    def test_closed_reference(self):
+        clustered_table_qza, clustered_sequence_qza = ReferenceOTU(self.settings).main(
+            feature_table_qza=f'{self.indir}/dada2-feature-table.qza',
+            feature_sequence_qza=f'{self.indir}/dada2-feature-sequence.qza',
+            reference_sequence_qza=f'{self.indir}/24_0918_qiime2_silva_reference_sequences.qza',
+            identity=0.97,
+            open_reference=False
+        )
+        for expected, actual in [
+            (f'{self.workdir}/otu-feature-table.qza', clustered_table_qza),
+            (f'{self.workdir}/otu-feature-sequence.qza', clustered_sequence_qza),
+        ]:
+            self.assertFileExists(expected, actual)
+
+    def test_open_reference(self):
+        clustered_table_qza, clustered_sequence_qza = ReferenceOTU(self.settings).main(
+            feature_table_qza=f'{self.indir}/dada2-feature-table.qza',
+            feature_sequence_qza=f'{self.indir}/dada2-feature-sequence.qza',
+            reference_sequence_qza=f'{self.indir}/24_0918_qiime2_silva_reference_sequences.qza',
+            identity=0.97,
+            open_reference=True
+        )
+        for expected, actual in [
+            (f'{self.workdir}/otu-feature-table.qza', clustered_table_qza),
+            (f'{self.workdir}/otu-feature-sequence.qza', clustered_sequence_qza),
+        ]:
+            self.assertFileExists(expected, actual)
+
+
+class TestFunctions(TestCase):
+
+    def setUp(self):
+        self.set_up(py_path=__file__)
+
+    def tearDown(self):
+        self.tear_down()
+
+    def test_get_artifact_uuid(self):
+        qza = f'{self.workdir}/reference.qza'
+        with zipfile.ZipFile(qza, 'w') as z:
+            z.writestr('0b5a7c1e-uuid/metadata.yaml', 'uuid: 0b5a7c1e-uuid\n')
+            z.writestr('0b5a7c1e-uuid/data/dna-sequences.fasta', '>r1\nACGT\n')
+        self.assertEqual('0b5a7c1e-uuid', get_artifact_uuid(qza))
+
+    def test_split_fasta(self):
+        fa = f'{self.workdir}/query.fa'
+        records = [(f'f{i}', 'ACGT') for i in range(5)]
+        write_fa(fa, records)
+        dsts = [f'{self.workdir}/chunk-{i}.fa' for i in range(2)]
+
+        split_fasta(fa=fa, dsts=dsts)
+
+        self.assertListEqual(records[:3], read_fa(dsts[0]))
+        self.assertListEqual(records[3:], read_fa(dsts[1]))
+
+    def test_write_sized_fasta(self):
+        src = f'{self.workdir}/query.fa'
+        dst = f'{self.workdir}/sized.fa'
+        write_fa(src, [('f1', 'AAAA'), ('f2', 'CCCC'), ('f3', 'GGGG')])
+
+        write_sized_fasta(src=src, dst=dst, sizes={'f3': 10, 'f1': 2})
+
+        self.assertListEqual([('f3;size=10', 'GGGG'), ('f1;size=2', 'AAAA')], read_fa(dst))
+
+    def test_read_uc_hits(self):
+        uc = f'{self.workdir}/hits.uc'
+        with open(uc, 'w') as fh:
+            fh.write('H\t0\t250\t98.8\t+\t0\t0\t250M\tf1\tr7\n')
+            fh.write('N\t*\t250\t*\t*\t*\t*\t*\tf2\t*\n')
+            fh.write('H\t0\t250\t97.2\t+\t0\t0\t250M\tf3 extra\tr9 description\n')
+
+        self.assertDictEqual({'f1': 'r7', 'f3': 'r9'}, read_uc_hits(uc))
+
+    def test_read_uc_clusters(self):
+        uc = f'{self.workdir}/clusters.uc'
+        with open(uc, 'w') as fh:
+            fh.write('S\t0\t250\t*\t*\t*\t*\t*\tf2;size=10\t*\n')
+            fh.write('H\t0\t250\t99.2\t+\t0\t0\t250M\tf4;size=3\tf2;size=10\n')
+            fh.write('S\t1\t250\t*\t*\t*\t*\t*\tf5;size=1\t*\n')
+            fh.write('C\t0\t2\t*\t*\t*\t*\t*\tf2;size=10\t*\n')
+
+        self.assertDictEqual({'f2': 'f2', 'f4': 'f2', 'f5': 'f5'}, read_uc_clusters(uc))
@@ -0,0 +1,106 @@
+import os
+import time
+from .setup import TestCase
+from qiime2_pipeline.thread_budget import ThreadBudget
+from qiime2_pipeline.runner import CommandRunner, CommandFailed, parse_command, classify, \
+    OK, TIMEOUT, OOM_KILL, SIGNAL, NON_ZERO_EXIT, TRANSIENT_IO, LAUNCH_ERROR
+
+
+class TestParseCommand(TestCase):
+
+    def setUp(self):
+        self.set_up(py_path=__file__)
+
+    def tearDown(self):
+        self.tear_down()
+
+    def test_processor_style_command(self):
+        cmd = ' \\\n  '.join([
+            'qiime tools import',
+            '--type "FeatureData[Sequence]"',
+            '--input-path "my dir/seq.fa"',
+            '1>> "out dir/log.log"',
+            '2>> "out dir/log.log"',
+        ])
+        command = parse_command(cmd)
+        self.assertFalse(command.shell)
+        self.assertListEqual(
+            ['qiime', 'tools', 'import', '--type', 'FeatureData[Sequence]', '--input-path', 'my dir/seq.fa'],
+            command.args)
+        self.assertEqual('out dir/log.log', command.stdout)
+        self.assertEqual('out dir/log.log', command.stderr)
+
+    def test_shell_fallback(self):
+        for cmd in [
+            'mv "outdir"/*.log "outdir"/log/',
+            'cat a.fq.gz b.fq.gz > c.fq.gz',
+            'echo $HOME',
+            'a | b',
+        ]:
+            self.assertTrue(parse_command(cmd).shell, cmd)
+
+    def test_classify(self):
+        self.assertEqual(OK, classify(returncode=0, shell=False, stderr_tail=b''))
+        self.assertEqual(NON_ZERO_EXIT, classify(returncode=1, shell=False, stderr_tail=b'Plugin error'))
+        self.assertEqual(OOM_KILL, classify(returncode=-9, shell=False, stderr_tail=b''))
+        self.assertEqual(OOM_KILL, classify(returncode=137, shell=True, stderr_tail=b''))
+        self.assertEqual(OOM_KILL, classify(returncode=1, shell=False, stderr_tail=b'MemoryError'))
+        self.assertEqual(SIGNAL, classify(returncode=-15, shell=False, stderr_tail=b''))
+        self.assertEqual(TRANSIENT_IO, classify(returncode=1, shell=False, stderr_tail=b'Stale file handle'))
+
+
+class TestCommandRunner(TestCase):
+
+    def setUp(self):
+        self.set_up(py_path=__file__)
+        self.runner = CommandRunner(max_try=3, backoff_seconds=0.01, thread_budget=ThreadBudget(total=2))
+
+    def tearDown(self):
+        self.tear_down()
+
+    def test_stream_to_log(self):
+        log = f'{self.outdir}/log.log'
+        cmd = f'python -c "import sys; print(\'out\'); print(\'err\', file=sys.stderr)" 1>> "{log}" 2>> "{log}"'
+        self.runner.run(commands=[parse_command(cmd)], threads=1)
+        with open(log) as fh:
+            self.assertSetEqual({'out', 'err'}, set(fh.read().split()))
+
+    def test_non_zero_exit_not_retried(self):
+        counter = f'{self.outdir}/counter.txt'
+        cmd = f'python -c "open(\'{counter}\', \'a\').write(\'x\'); raise SystemExit(1)"'
+        with self.assertRaises(CommandFailed) as context:
+            self.runner.run(commands=[parse_command(cmd)], threads=1)
+        self.assertEqual(NON_ZERO_EXIT, context.exception.failure)
+        with open(counter) as fh:
+            self.assertEqual('x', fh.read())
+
+    def test_timeout_retried(self):
+        counter = f'{self.outdir}/counter.txt'
+        cmd = f'python -c "open(\'{counter}\', \'a\').write(\'x\'); import time; time.sleep(10)"'
+        start = time.time()
+        with self.assertRaises(CommandFailed) as context:
+            self.runner.run(commands=[parse_command(cmd)], threads=1, timeout=0.5)
+        self.assertEqual(TIMEOUT, context.exception.failure)
+        self.assertLess(time.time() - start, 10)
+        with open(counter) as fh:
+            self.assertEqual('xxx', fh.read())
+
+    def test_launch_error(self):
+        with self.assertRaises(CommandFailed) as context:
+            self.runner.run(commands=[parse_command('command-that-does-not-exist --help')], threads=1)
+        self.assertEqual(LAUNCH_ERROR, context.exception.failure)
+
+    def test_concurrent_commands(self):
+        cmds = [f'python -c "import time; time.sleep(0.5)" 1>> "{self.outdir}/{i}.log"' for i in range(4)]
+        start = time.time()
+        self.runner.run(commands=[parse_command(c) for c in cmds], threads=1)
+        seconds = time.time() - start
+        self.assertLess(seconds, 1.9)  # 2 at a time within the budget of 2 threads
+        self.assertGreater(seconds, 0.9)
+        for i in range(4):
+            self.assertTrue(os.path.exists(f'{self.outdir}/{i}.log'))
+
+    def test_shell_command(self):
+        self.runner.run(commands=[parse_command(f'echo abc > "{self.outdir}/a.txt"')], threads=1)
+        with open(f'{self.outdir}/a.txt') as fh:
+            self.assertEqual('abc\n', fh.read())
@@ -0,0 +1,151 @@
+import os
+import json
+import time
+import threading
+from urllib import request
+from urllib.error import HTTPError
+from .setup import TestCase
+from qiime2_pipeline.service import PipelineService, JobStore, create_server, QUEUED, RUNNING, DONE, FAILED, CANCELLED
+
+
+def fake_pipeline(kwargs):
+    os.makedirs(kwargs['outdir'], exist_ok=True)
+    if kwargs['seconds'] < 0:
+        raise ValueError('negative seconds')
+    time.sleep(kwargs['seconds'])
+    with open(f'{kwargs["outdir"]}/result.txt', 'w') as fh:
+        fh.write('done')
+
+
+def parse_config(config):
+    assert 'outdir' in config
+    return {'outdir': config['outdir'], 'seconds': config.get('seconds', 0)}
+
+
+class TestPipelineService(TestCase):
+
+    def setUp(self):
+        self.set_up(py_path=__file__)
+        self.service = PipelineService(
+            state_dir=f'{self.workdir}/state',
+            max_concurrent_jobs=1,
+            job_target=fake_pipeline)
+        self.service.POLL_SECONDS = 0.05
+        self.service.CANCEL_GRACE_SECONDS = 1
+        self.server = create_server(service=self.service, parse_config=parse_config, host='127.0.0.1', port=0)
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}'
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.service.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.service.stop()
+        self.tear_down()
+
+    def http(self, method: str, path: str, data=None):
+        body = None if data is None else json.dumps(data).encode()
+        req = request.Request(f'{self.url}{path}', data=body, method=method)
+        with request.urlopen(req) as response:
+            return json.loads(response.read())
+
+    def wait_for(self, job_id: str, statuses, timeout: float = 60):
+        start = time.time()
+        while time.time() - start < timeout:
+            job = self.http('GET', f'/jobs/{job_id}')
+            if job['status'] in statuses:
+                return job
+            time.sleep(0.05)
+        self.fail(f'Job {job_id} did not reach {statuses}')
+
+    def test_submit_status_outputs(self):
+        job = self.http('POST', '/jobs', {'outdir': f'{self.outdir}/a', 'seconds': 0.1})
+        self.assertEqual(QUEUED, job['status'])
+
+        job = self.wait_for(job['id'], [DONE, FAILED])
+        self.assertEqual(DONE, job['status'])
+        outputs = self.http('GET', f'/jobs/{job["id"]}/outputs')
+        self.assertListEqual([{'path': 'result.txt', 'bytes': 4}], outputs)
+        self.assertEqual(1, len(self.http('GET', '/jobs')))
+
+    def test_queue_and_cancel(self):
+        running = self.http('POST', '/jobs', {'outdir': f'{self.outdir}/a', 'seconds': 60})
+        queued = self.http('POST', '/jobs', {'outdir': f'{self.outdir}/b', 'seconds': 0})
+        self.wait_for(running['id'], [RUNNING])
+        self.assertEqual(QUEUED, self.http('GET', f'/jobs/{queued["id"]}')['status'])  # concurrency limit of 1
+
+        self.http('POST', f'/jobs/{queued["id"]}/cancel')
+        self.http('POST', f'/jobs/{running["id"]}/cancel')
+        job = self.wait_for(running['id'], [CANCELLED], timeout=10)
+        while job['finished'] is None:  # reaped by the scheduler after the process exits
+            time.sleep(0.05)
+            job = self.http('GET', f'/jobs/{running["id"]}')
+        self.assertLess(job['finished'] - job['started'], 30)
+        self.assertEqual(CANCELLED, self.http('GET', f'/jobs/{queued["id"]}')['status'])
+
+    def test_cancel_while_staging(self):
+        staged = threading.Event()
+        stage = self.service.stage
+
+        def slow_stage(kwargs):
+            staged.wait()
+            return stage(kwargs)
+
+        self.service.stage = slow_stage
+
+        job = self.http('POST', '/jobs', {'outdir': f'{self.outdir}/a', 'seconds': 0})
+        self.wait_for(job['id'], [RUNNING])
+        self.http('POST', f'/jobs/{job["id"]}/cancel')
+        staged.set()
+
+        job = self.wait_for(job['id'], [CANCELLED])
+        while job['finished'] is None:  # dropped by the scheduler after staging
+            time.sleep(0.05)
+            job = self.http('GET', f'/jobs/{job["id"]}')
+        self.assertEqual(CANCELLED, job['status'])
+        self.assertIsNone(job['pid'])
+        self.assertFalse(os.path.exists(f'{self.outdir}/a/result.txt'))
+
+    def test_failed_job(self):
+        job = self.http('POST', '/jobs', {'outdir': f'{self.outdir}/a', 'seconds': -1})
+        job = self.wait_for(job['id'], [DONE, FAILED])
+        self.assertEqual(FAILED, job['status'])
+        self.assertIn('negative seconds', job['error'])
+
+    def test_invalid_config(self):
+        with self.assertRaises(HTTPError) as context:
+            self.http('POST', '/jobs', {'seconds': 1})
+        self.assertEqual(400, context.exception.code)
+
+    def test_unknown_job(self):
+        with self.assertRaises(HTTPError) as context:
+            self.http('GET', '/jobs/unknown')
+        self.assertEqual(404, context.exception.code)
+
+
+class TestJobStore(TestCase):
+
+    def setUp(self):
+        self.set_up(py_path=__file__)
+
+    def tearDown(self):
+        self.tear_down()
+
+    def test_persist_across_restart(self):
+        state_dir = f'{self.workdir}/state'
+        store = JobStore(state_dir=state_dir)
+        a = store.add(kwargs={'outdir': 'a'}, config={})
+        b = store.add(kwargs={'outdir': 'b'}, config={})
+        store.update(a['id'], status=RUNNING, pid=123)
+
+        store = JobStore(state_dir=state_dir)  # restart
+        self.assertEqual(QUEUED, store.get(a['id'])['status'])  # interrupted, so queued again
+        self.assertIsNone(store.get(a['id'])['pid'])
+        self.assertEqual(QUEUED, store.get(b['id'])['status'])
+
+    def test_transition(self):
+        store = JobStore(state_dir=f'{self.workdir}/state')
+        job = store.add(kwargs={'outdir': 'a'}, config={})
+        self.assertTrue(store.transition(job['id'], expected=QUEUED, status=RUNNING))
+        self.assertFalse(store.transition(job['id'], expected=QUEUED, status=CANCELLED))
+        self.assertEqual(RUNNING, store.get(job['id'])['status'])
@@ -0,0 +1,50 @@
+import pandas as pd
+from .setup import TestCase
+from qiime2_pipeline.sharding import ShardedDada2, get_shards
+from qiime2_pipeline.generate_asv import Dada2SingleEnd
+
+
+class TestShardedDada2(TestCase):
+
+    def setUp(self):
+        self.set_up(py_path=__file__)
+        self.sample_sheet = f'{self.workdir}/sample-sheet.csv'
+        pd.DataFrame({
+            'Sample': ['S1', 'S2', 'S3'],
+            'Run': ['run1', 'run2', 'run1'],
+        }).to_csv(self.sample_sheet, index=False)
+
+    def tearDown(self):
+        self.tear_down()
+
+    def test_mock(self):
+        self.settings.mock = True
+        self.settings.dada2_shard_column = 'Run'
+        feature_table_qza, feature_sequence_qza = ShardedDada2(self.settings).main(
+            dada2=Dada2SingleEnd,
+            demultiplexed_seq_qza=f'{self.workdir}/single-end-demultiplexed.qza',
+            max_expected_error_bases=2.,
+            sample_sheet=self.sample_sheet)
+
+        self.assertEqual(f'{self.workdir}/dada2-feature-table.qza', feature_table_qza)
+        self.assertEqual(f'{self.workdir}/dada2-feature-sequence.qza', feature_sequence_qza)
+        with open(f'{self.workdir}/dada2-shard-1-samples.tsv') as fh:
+            self.assertEqual('sample-id\nS1\nS3\n', fh.read())
+
+
+class TestFunctions(TestCase):
+
+    def test_get_shards(self):
+        df = pd.DataFrame({'Run': ['a', 'b', 'a', 'a', 'b']}, index=['S1', 'S2', 'S3', 'S4', 'S5'])
+        self.assertListEqual(
+            [['S1', 'S2', 'S3', 'S4', 'S5']],
+            get_shards(df=df, column=None, size=0))
+        self.assertListEqual(
+            [['S1', 'S2'], ['S3', 'S4'], ['S5']],
+            get_shards(df=df, column=None, size=2))
+        self.assertListEqual(
+            [['S1', 'S3', 'S4'], ['S2', 'S5']],
+            get_shards(df=df, column='Run', size=0))
+        self.assertListEqual(
+            [['S1', 'S3'], ['S4'], ['S2', 'S5']],
+            get_shards(df=df, column='Run', size=2))
@@ -0,0 +1,52 @@
+import os
+from .setup import TestCase
+from qiime2_pipeline.staging import InputStager, copy_atomically
+
+
+class TestInputStager(TestCase):
+
+    def setUp(self):
+        self.set_up(py_path=__file__)
+
+    def tearDown(self):
+        self.tear_down()
+
+    def write_file(self, fname: str, n_bytes: int) -> str:
+        path = f'{self.workdir}/{fname}'
+        with open(path, 'wb') as fh:
+            fh.write(b'A' * n_bytes)
+        return path
+
+    def test_stage_and_wait(self):
+        srcs = [self.write_file(f'sample_{i}_R1.fastq.gz', n_bytes=1000 * (i + 1)) for i in range(5)]
+        dstdir = f'{self.outdir}/staged'
+
+        stager = InputStager(dstdir=dstdir, max_workers=2)
+        stager.start(srcs=srcs)
+        for i, src in enumerate(srcs):
+            dst = f'{dstdir}/sample_{i}_R1.fastq.gz'
+            stager.wait(dst)
+            self.assertEqual(os.path.getsize(src), os.path.getsize(dst))
+        stager.shutdown()
+
+        self.assertListEqual([], [f for f in os.listdir(dstdir) if f.endswith('.staging')])
+
+    def test_wait_unstaged_path(self):
+        stager = InputStager(dstdir=f'{self.outdir}/staged', max_workers=1)
+        stager.start(srcs=[])
+        stager.wait(f'{self.workdir}/not_staged.fastq.gz')  # returns immediately
+        stager.shutdown()
+
+    def test_wait_raises_copy_error(self):
+        stager = InputStager(dstdir=f'{self.outdir}/staged', max_workers=1)
+        stager.start(srcs=[f'{self.workdir}/missing.fastq.gz'])
+        with self.assertRaises(FileNotFoundError):
+            stager.wait(f'{self.outdir}/staged/missing.fastq.gz')
+        stager.shutdown()
+
+    def test_copy_atomically(self):
+        src = self.write_file('a.fastq', n_bytes=10)
+        dst = f'{self.outdir}/a.fastq'
+        copy_atomically(src, dst)
+        self.assertEqual(10, os.path.getsize(dst))
+        self.assertFalse(os.path.exists(f'{dst}.staging'))
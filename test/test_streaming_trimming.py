@@ -0,0 +1,84 @@
+import gzip
+from .setup import TestCase
+from qiime2_pipeline.streaming_trimming import trim_one_sample, quality_trim_index, adapter_trim_index, \
+    compile_adapter_regex, n_trim_indices, ILLUMINA_ADAPTER
+from qiime2_pipeline.pooling import reverse_complement
+
+
+INSERT = b'ACGTTGCAACGTTGCAACGTTGCAACGT'  # 28 bp
+
+
+def write_fq(fq: str, records):
+    with gzip.open(fq, 'wb') as fh:
+        for header, seq in records:
+            fh.write(b'@%s\n%s\n+\n%s\n' % (header, seq, b'I' * len(seq)))
+
+
+def read_fq(fq: str):
+    with gzip.open(fq, 'rb') as fh:
+        lines = fh.read().splitlines()
+    return [(lines[i], lines[i + 1]) for i in range(0, len(lines), 4)]
+
+
+class TestTrimOneSample(TestCase):
+
+    def setUp(self):
+        self.set_up(py_path=__file__)
+        self.fq1 = f'{self.workdir}/S1_R1.fastq.gz'
+        self.fq2 = f'{self.workdir}/S1_R2.fastq.gz'
+        write_fq(self.fq1, [
+            (b'read1/1', INSERT + ILLUMINA_ADAPTER + b'ACGT'),
+            (b'read2/1', INSERT[:10] + ILLUMINA_ADAPTER),  # too short after adapter trimming
+            (b'read3/1', INSERT),
+        ])
+        write_fq(self.fq2, [
+            (b'read1/2', INSERT),
+            (b'read2/2', INSERT),
+            (b'read3/2', INSERT[:14] + b'N' + INSERT[15:]),  # an N in the middle
+        ])
+
+    def tearDown(self):
+        self.tear_down()
+
+    def test_paired_end(self):
+        dsts = [f'{self.workdir}/S1_S1_L001_R1_001.fastq.gz', f'{self.workdir}/S1_S1_L001_R2_001.fastq.gz']
+        stats = trim_one_sample(fqs=[self.fq1, self.fq2], dsts=dsts, clip_5_primes=[2, 0], reverse_complement_r2=False, gzip_level=1)
+
+        self.assertDictEqual(
+            {'Input': 3, 'Adapter Trimmed': 2, 'Too Short': 1, 'Too Many N': 1, 'Written': 1},
+            stats)
+        self.assertListEqual([(b'@read1/1', INSERT[2:])], read_fq(dsts[0]))
+        self.assertListEqual([(b'@read1/2', INSERT)], read_fq(dsts[1]))
+
+    def test_pool(self):
+        dst = f'{self.workdir}/S1_S1_L001_R1_001.fastq.gz'
+        stats = trim_one_sample(
+            fqs=[self.fq1, self.fq2], dsts=[dst], clip_5_primes=[0, 0], reverse_complement_r2=False, gzip_level=1)
+        self.assertEqual(1, stats['Written'])
+        self.assertListEqual([(b'@read1/1', INSERT), (b'@read1/2', INSERT)], read_fq(dst))
+
+    def test_pool_reverse_complement_r2(self):
+        dst = f'{self.workdir}/S1_S1_L001_R1_001.fastq.gz'
+        trim_one_sample(
+            fqs=[self.fq1, self.fq2], dsts=[dst], clip_5_primes=[0, 0], reverse_complement_r2=True, gzip_level=1)
+        self.assertListEqual([(b'@read1/1', INSERT), (b'@read1/2', reverse_complement(INSERT))], read_fq(dst))
+
+
+class TestFunctions(TestCase):
+
+    def test_quality_trim_index(self):
+        qual = b'IIIIIIIIII' + b'####'  # Q40 then Q2
+        self.assertEqual(10, quality_trim_index(qual=qual, cutoff=20))
+        self.assertEqual(14, quality_trim_index(qual=b'I' * 14, cutoff=20))
+
+    def test_adapter_trim_index(self):
+        regex = compile_adapter_regex(ILLUMINA_ADAPTER)
+        self.assertEqual(28, adapter_trim_index(seq=INSERT + ILLUMINA_ADAPTER, adapter=ILLUMINA_ADAPTER, adapter_regex=regex))
+        one_mismatch = b'AGATCGGTAGAGC'
+        self.assertEqual(28, adapter_trim_index(seq=INSERT + one_mismatch, adapter=ILLUMINA_ADAPTER, adapter_regex=regex))
+        self.assertEqual(28, adapter_trim_index(seq=INSERT + b'AGATC', adapter=ILLUMINA_ADAPTER, adapter_regex=regex))
+        self.assertEqual(4, adapter_trim_index(seq=b'CCCC', adapter=ILLUMINA_ADAPTER, adapter_regex=regex))
+
+    def test_n_trim_indices(self):
+        self.assertTupleEqual((2, 5), n_trim_indices(b'NNACGNN'))
+        self.assertTupleEqual((0, 0), n_trim_indices(b'NNNN'))
@@ -0,0 +1,81 @@
+import os
+import gzip
+import pandas as pd
+from .setup import TestCase
+from qiime2_pipeline.subsampling import SubsampleReads
+
+
+def write_fq(fq: str, n_reads: int, mate: int):
+    with gzip.open(fq, 'wt') as fh:
+        for i in range(n_reads):
+            fh.write(f'@read{i}/{mate}\nACGTACGTAC\n+\nIIIIIIIIII\n')
+
+
+def read_ids(fq: str):
+    with gzip.open(fq, 'rt') as fh:
+        return [line.strip()[1:-2] for i, line in enumerate(fh) if i % 4 == 0]
+
+
+class TestSubsampleReads(TestCase):
+
+    def setUp(self):
+        self.set_up(py_path=__file__)
+        self.sample_sheet = f'{self.workdir}/sample-sheet.csv'
+        pd.DataFrame({'Sample': ['deep', 'shallow'], 'Group': ['A', 'A']}).to_csv(self.sample_sheet, index=False)
+
+        self.fq_dir = f'{self.workdir}/fq_dir'
+        os.makedirs(self.fq_dir)
+        counts = {'deep': 500, 'shallow': 20}
+        for name, n in counts.items():
+            write_fq(f'{self.fq_dir}/{name}_R1.fastq.gz', n_reads=n, mate=1)
+            write_fq(f'{self.fq_dir}/{name}_R2.fastq.gz', n_reads=n, mate=2)
+        pd.DataFrame({
+            'Sample ID': list(counts.keys()),
+            'Count (R1)': list(counts.values()),
+            'Count (R2)': list(counts.values()),
+        }).to_csv(f'{self.outdir}/raw-read-counts.csv', index=False)
+
+    def tearDown(self):
+        self.tear_down()
+
+    def subsample(self, max_reads_per_sample: int, pilot_fraction: float, seed: int = 0) -> str:
+        return SubsampleReads(self.settings).main(
+            sample_sheet=self.sample_sheet,
+            fq_dir=self.fq_dir,
+            fq1_suffix='_R1.fastq.gz',
+            fq2_suffix='_R2.fastq.gz',
+            max_reads_per_sample=max_reads_per_sample,
+            pilot_fraction=pilot_fraction,
+            seed=seed)
+
+    def test_max_reads_per_sample(self):
+        out_fq_dir = self.subsample(max_reads_per_sample=100, pilot_fraction=1.0)
+
+        r1 = read_ids(f'{out_fq_dir}/deep_R1.fastq.gz')
+        r2 = read_ids(f'{out_fq_dir}/deep_R2.fastq.gz')
+        self.assertEqual(100, len(r1))
+        self.assertListEqual(r1, r2)  # pairs in sync
+        self.assertTrue(os.path.islink(f'{out_fq_dir}/shallow_R1.fastq.gz'))  # below the cap
+
+        df = pd.read_csv(f'{self.outdir}/subsampled-read-counts.csv')
+        self.assertListEqual([500, 20], df['Raw'].tolist())
+        self.assertListEqual([100, 20], df['Retained'].tolist())
+
+    def test_pilot_fraction(self):
+        self.subsample(max_reads_per_sample=0, pilot_fraction=0.1)
+        df = pd.read_csv(f'{self.outdir}/subsampled-read-counts.csv')
+        self.assertListEqual([50, 2], df['Retained'].tolist())
+
+    def test_seeded(self):
+        out_fq_dir = self.subsample(max_reads_per_sample=100, pilot_fraction=1.0, seed=1)
+        first = read_ids(f'{out_fq_dir}/deep_R1.fastq.gz')
+        for f in os.listdir(out_fq_dir):
+            os.remove(f'{out_fq_dir}/{f}')
+
+        self.subsample(max_reads_per_sample=100, pilot_fraction=1.0, seed=1)
+        self.assertListEqual(first, read_ids(f'{out_fq_dir}/deep_R1.fastq.gz'))
+
+        for f in os.listdir(out_fq_dir):
+            os.remove(f'{out_fq_dir}/{f}')
+        self.subsample(max_reads_per_sample=100, pilot_fraction=1.0, seed=2)
+        self.assertNotEqual(first, read_ids(f'{out_fq_dir}/deep_R1.fastq.gz'))
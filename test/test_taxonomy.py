@@ -1,3 +1,4 @@
+import pandas as pd
 from .setup import TestCase
 from qiime2_pipeline.taxonomy import Taxonomy, MergeForwardReverseTaxonomy
 
@@ -36,6 +37,23 @@ class TestTaxonomy(TestCase):
         expected = f'{self.workdir}/taxonomy-vsearch.qza'
         self.assertFileExists(expected, actual)
 
+    def test_vsearch_with_cache(self):
+        self.settings.taxonomy_cache = f'{self.workdir}/taxonomy-cache.sqlite'
+        for _ in range(2):  # the second run is all cached
+            actual = Taxonomy(self.settings).main(
+                representative_seq_qza=f'{self.indir}/dada2-feature-sequence.qza',
+                feature_classifier='vsearch',
+                nb_classifier_qza=None,
+                classifier_reads_per_batch=0,
+                reference_sequence_qza=f'{self.indir}/24_0918_qiime2_silva_reference_sequences.qza',
+                reference_taxonomy_qza=f'{self.indir}/24_0918_qiime2_silva_reference_taxonomy.qza',
+                vsearch_classifier_max_hits=5,
+            )
+        expected = f'{self.workdir}/taxonomy-cached.qza'
+        self.assertFileExists(expected, actual)
+        df = pd.read_csv(f'{self.outdir}/taxonomy-cache-hits.csv')
+        self.assertEqual(1.0, df.loc[0, 'Hit Rate'])
+
 
 class TestMergeForwardReverseTaxonomy(TestCase):
 
@@ -0,0 +1,48 @@
+import time
+from .setup import TestCase
+from qiime2_pipeline.taxonomy_cache import TaxonomyCache, get_classifier_key, hash_sequence
+
+
+class TestTaxonomyCache(TestCase):
+
+    def setUp(self):
+        self.set_up(py_path=__file__)
+        self.db = f'{self.workdir}/taxonomy-cache.sqlite'
+
+    def tearDown(self):
+        self.tear_down()
+
+    def test_get_put(self):
+        cache = TaxonomyCache(path=self.db, max_entries=10)
+        cache.put(entries={'h1': ('k__Bacteria', '0.99'), 'h2': ('k__Archaea', '0.8')}, classifier_key='nb')
+        cache.close()
+
+        cache = TaxonomyCache(path=self.db, max_entries=10)  # persistent
+        self.assertDictEqual({'h1': ('k__Bacteria', '0.99')}, cache.get(sequence_hashes=['h1', 'h3'], classifier_key='nb'))
+        self.assertDictEqual({}, cache.get(sequence_hashes=['h1', 'h2'], classifier_key='vsearch'))
+        cache.close()
+
+    def test_evict_least_recently_used(self):
+        cache = TaxonomyCache(path=self.db, max_entries=2)
+        for h in ['h1', 'h2', 'h3']:
+            cache.put(entries={h: ('k__Bacteria', '1.0')}, classifier_key='nb')
+            time.sleep(0.01)
+        cache.get(sequence_hashes=['h1'], classifier_key='nb')
+
+        self.assertEqual(1, cache.evict())
+        self.assertListEqual(['h1', 'h3'], sorted(cache.get(sequence_hashes=['h1', 'h2', 'h3'], classifier_key='nb')))
+        self.assertEqual(0, cache.evict())
+        cache.close()
+
+
+class TestFunctions(TestCase):
+
+    def test_get_classifier_key(self):
+        key = get_classifier_key(classifier='nb', artifact_uuids=['uuid-1'], parameters={'confidence': 0})
+        self.assertEqual(key, get_classifier_key(classifier='nb', artifact_uuids=['uuid-1'], parameters={'confidence': 0}))
+        self.assertNotEqual(key, get_classifier_key(classifier='nb', artifact_uuids=['uuid-2'], parameters={'confidence': 0}))
+        self.assertNotEqual(key, get_classifier_key(classifier='nb', artifact_uuids=['uuid-1'], parameters={'confidence': 0.7}))
+
+    def test_hash_sequence(self):
+        self.assertEqual(hash_sequence('ACGT'), hash_sequence('acgt'))
+        self.assertNotEqual(hash_sequence('ACGT'), hash_sequence('ACGA'))
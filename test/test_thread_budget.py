@@ -0,0 +1,52 @@
+import os
+import time
+import threading
+from .setup import TestCase
+from qiime2_pipeline.thread_budget import ThreadBudget, thread_limit_env, THREAD_LIMIT_ENV_VARS
+
+
+class TestThreadBudget(TestCase):
+
+    def setUp(self):
+        self.set_up(py_path=__file__)
+
+    def tearDown(self):
+        self.tear_down()
+
+    def test_concurrent_leases_within_total(self):
+        budget = ThreadBudget(total=4)
+        peak = []
+
+        def work():
+            with budget.lease(threads=3) as n:
+                self.assertEqual(3, n)
+                peak.append(budget.total - budget.available)
+                time.sleep(0.05)
+
+        threads = [threading.Thread(target=work) for _ in range(3)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(3, max(peak))  # two leases of 3 never overlap within 4 cores
+        self.assertEqual(4, budget.available)
+
+    def test_lease_clamped_to_total(self):
+        budget = ThreadBudget(total=2)
+        with budget.lease(threads=8) as n:
+            self.assertEqual(2, n)
+            self.assertEqual(0, budget.available)
+        self.assertEqual(2, budget.available)
+
+    def test_share(self):
+        budget = ThreadBudget(total=8)
+        self.assertEqual(2, budget.share(n_tasks=4))
+        self.assertEqual(1, budget.share(n_tasks=16))
+        self.assertEqual(8, budget.share(n_tasks=0))
+
+    def test_thread_limit_env(self):
+        env = thread_limit_env(threads=3)
+        for var in THREAD_LIMIT_ENV_VARS:
+            self.assertEqual('3', env[var])
+        self.assertEqual(os.environ.get('PATH'), env.get('PATH'))
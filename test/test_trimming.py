@@ -1,6 +1,7 @@
+import os
 from .setup import TestCase
 from qiime2_pipeline.trimming import TrimGalorePairedEnd, BatchTrimGalorePairedEnd, \
-    TrimGaloreSingleEnd, BatchTrimGaloreSingleEnd
+    TrimGaloreSingleEnd, BatchTrimGaloreSingleEnd, CutadaptPairedEnd, CutadaptSingleEnd, CUTADAPT
 
 
 class TestTrimGalorePairedEnd(TestCase):
@@ -81,3 +82,69 @@ class TestBatchTrimGaloreSingleEnd(TestCase):
         expected = f'{self.workdir}/trimmed_fastqs'
         self.assertFileExists(expected, fq_dir)
         self.assertEqual('.fastq.gz', fq_suffix)
+
+
+class TestCutadaptPairedEnd(TestCase):
+
+    def setUp(self):
+        self.set_up(py_path=__file__)
+
+    def tearDown(self):
+        self.tear_down()
+
+    def test_main(self):
+        CutadaptPairedEnd(self.settings).main(
+            fq1=f'{self.indir}/R1.fastq.gz',
+            fq2=f'{self.indir}/R2.fastq.gz',
+            clip_r1_5_prime=17,
+            clip_r2_5_prime=0,
+            dst1=f'{self.workdir}/R1.fastq.gz',
+            dst2=f'{self.workdir}/R2.fastq.gz',
+            report_json=f'{self.outdir}/R.json')
+        for f in [
+            f'{self.workdir}/R1.fastq.gz',
+            f'{self.workdir}/R2.fastq.gz',
+            f'{self.outdir}/R.json',
+        ]:
+            self.assertTrue(os.path.exists(f))
+
+
+class TestBatchCutadaptPairedEnd(TestCase):
+
+    def setUp(self):
+        self.set_up(py_path=__file__)
+        self.settings.trimming_engine = CUTADAPT
+
+    def tearDown(self):
+        self.tear_down()
+
+    def test_main(self):
+        fq_dir, fq1_suffix, fq2_suffix = BatchTrimGalorePairedEnd(self.settings).main(
+            sample_sheet=f'{self.indir}/sample-sheet.csv',
+            fq_dir=f'{self.indir}/fq_dir',
+            fq1_suffix='_L001_R1_001.fastq.gz',
+            fq2_suffix='_L001_R2_001.fastq.gz',
+            clip_r1_5_prime=17,
+            clip_r2_5_prime=0,
+        )
+        self.assertFileExists(f'{self.workdir}/trimmed_fastqs', fq_dir)
+        self.assertEqual('_R1.fastq.gz', fq1_suffix)
+        self.assertTrue(len(os.listdir(f'{self.outdir}/cutadapt')) > 0)
+
+
+class TestCutadaptSingleEnd(TestCase):
+
+    def setUp(self):
+        self.set_up(py_path=__file__)
+
+    def tearDown(self):
+        self.tear_down()
+
+    def test_main(self):
+        CutadaptSingleEnd(self.settings).main(
+            fq=f'{self.indir}/R1.fastq.gz',
+            clip_5_prime=17,
+            dst=f'{self.workdir}/R1.fastq.gz',
+            report_json=f'{self.outdir}/R1.json')
+        self.assertTrue(os.path.exists(f'{self.workdir}/R1.fastq.gz'))
+        self.assertTrue(os.path.exists(f'{self.outdir}/R1.json'))
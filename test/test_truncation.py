@@ -0,0 +1,92 @@
+import gzip
+import json
+import random
+import zipfile
+import pandas as pd
+from .setup import TestCase
+from qiime2_pipeline.pooling import reverse_complement
+from qiime2_pipeline.truncation import AutoTruncation, get_quality_profile, get_passing_length, \
+    estimate_amplicon_length, parse_truncate_lengths
+
+
+def fastq_gz(seqs, n_high_quality: int) -> bytes:
+    lines = []
+    for i, seq in enumerate(seqs):
+        qual = b'I' * n_high_quality + b'#' * (len(seq) - n_high_quality)
+        lines += [b'@r%d' % i, seq, b'+', qual]
+    return gzip.compress(b'\n'.join(lines) + b'\n')
+
+
+class TestAutoTruncation(TestCase):
+
+    def setUp(self):
+        self.set_up(py_path=__file__)
+        rng = random.Random(0)
+        amplicons = [bytes(rng.choice(b'ACGT') for _ in range(300)) for _ in range(50)]
+
+        self.qza = f'{self.workdir}/paired-end-demultiplexed.qza'
+        with zipfile.ZipFile(self.qza, 'w') as qza:
+            for name in ['S1', 'S2']:
+                qza.writestr(
+                    f'uuid/data/{name}_0_L001_R1_001.fastq.gz',
+                    fastq_gz([a[:200] for a in amplicons], n_high_quality=150))
+                qza.writestr(
+                    f'uuid/data/{name}_1_L001_R2_001.fastq.gz',
+                    fastq_gz([reverse_complement(a)[:200] for a in amplicons], n_high_quality=120))
+            qza.writestr('uuid/data/MANIFEST', 'sample-id,filename,direction\n')
+
+    def tearDown(self):
+        self.tear_down()
+
+    def test_paired(self):
+        truncate_lengths = AutoTruncation(self.settings).main(
+            demultiplexed_seq_qza=self.qza,
+            paired=True,
+            min_overlap=12)
+
+        # 150 + 120 good quality bases extended to 300 + 12, R1 first as the qualities tie
+        self.assertTupleEqual((192, 120), truncate_lengths)
+        with open(f'{self.outdir}/dada2-truncation.json') as fh:
+            decision = json.load(fh)
+        self.assertEqual(300, decision['amplicon_length'])
+        self.assertListEqual([150, 120], decision['quality_lengths'])
+        df = pd.read_csv(f'{self.outdir}/dada2-truncation-profile.csv')
+        self.assertEqual(200, len(df))
+
+    def test_single(self):
+        truncate_lengths = AutoTruncation(self.settings).main(
+            demultiplexed_seq_qza=self.qza,
+            paired=False,
+            min_overlap=0)
+        self.assertTupleEqual((150, 0), truncate_lengths)
+
+    def test_single_low_quality(self):
+        qza = f'{self.workdir}/single-end-demultiplexed.qza'
+        with zipfile.ZipFile(qza, 'w') as fh:
+            fh.writestr('uuid/data/S1_0_L001_R1_001.fastq.gz', fastq_gz([b'A' * 200] * 10, n_high_quality=0))
+        truncate_lengths = AutoTruncation(self.settings).main(
+            demultiplexed_seq_qza=qza,
+            paired=False,
+            min_overlap=0)
+        self.assertTupleEqual((100, 0), truncate_lengths)
+
+
+class TestFunctions(TestCase):
+
+    def test_get_passing_length(self):
+        profile = get_quality_profile(quals=[b'IIII#', b'III', b'IIII#'])
+        self.assertListEqual([40, 40, 40, 40, 2], profile['Median Quality'].tolist())
+        self.assertEqual(4, get_passing_length(profile=profile, min_median_quality=25, min_read_fraction=0.5))
+        self.assertEqual(3, get_passing_length(profile=profile, min_median_quality=25, min_read_fraction=0.9))
+
+    def test_estimate_amplicon_length(self):
+        amplicon = b'ACGTTGCAAGGCTTAACCGGTATCGATCGGATCCAGT'
+        self.assertEqual(len(amplicon), estimate_amplicon_length(
+            seq1=amplicon[:25], seq2=reverse_complement(amplicon)[:20], k=8))
+        self.assertIsNone(estimate_amplicon_length(
+            seq1=amplicon[:10], seq2=reverse_complement(amplicon)[:10], k=8))
+
+    def test_parse_truncate_lengths(self):
+        self.assertIsNone(parse_truncate_lengths('auto'))
+        self.assertTupleEqual((0, 0), parse_truncate_lengths('0'))
+        self.assertTupleEqual((250, 200), parse_truncate_lengths('250,200'))